@@ -1,25 +1,146 @@
+from __future__ import annotations
+import asyncio
+from functools import lru_cache
+from hashlib import sha256
 from typing import Optional
+
+import httpx
+
+from app.core.cache import AsyncCache, get_async_cache
 from app.core.config import get_settings
+from app.core.logging import get_logger
+from app.core.metrics import counter
+from app.integrations.http_pool import get_http_client
+
+log = get_logger(__name__)
+
+GROQ_SUMMARIES_TOTAL = counter(
+    "groq_summaries_total",
+    "Summaries by how they were served",
+    ["outcome"],  # llm | cached | coalesced | fallback | mock
+)
+
+SYSTEM_PROMPT = (
+    "You summarize liquidity forecasts for mobile-money operators. "
+    "Answer with one short, factual sentence."
+)
+COMPLETIONS_PATH = "/openai/v1/chat/completions"
+
+
+def mock_summary(text: str) -> str:
+    """Deterministic offline summary, also the fallback when Groq is slow or failing."""
+    return f"[mock-summary:{min(32, len(text))}]{text[:32]}"
 
 
 class GroqClient:
-    """Lightweight wrapper; returns mocked text if no API key set."""
+    """Async Groq chat-completions client for short summaries.
+
+    Without an API key every summary is the deterministic mock. With one, calls go
+    through the process-wide pooled "groq" HTTP client, and:
+    - responses are cached in the async cache under a hash of (model, prompt) for
+      `cache_ttl` seconds;
+    - identical prompts already in flight share that one upstream call;
+    - at most `max_concurrency` calls are upstream at once;
+    - a call that fails, or is not answered within `timeout` (waiting for a slot
+      included), returns the mock summary instead. Fallbacks are not cached.
+    """
 
     _SENTINEL = object()
 
-    def __init__(self, api_key: Optional[str] | object = _SENTINEL):
+    def __init__(
+        self,
+        api_key: Optional[str] | object = _SENTINEL,
+        base_url: str | None = None,
+        model: str | None = None,
+        timeout: float | None = None,
+        max_concurrency: int | None = None,
+        cache_ttl: int | None = None,
+        cache: AsyncCache | None = None,
+    ):
+        s = get_settings()
         # If api_key is explicitly None, force mock branch. If omitted, read from settings.
-        if api_key is self._SENTINEL:
-            self.api_key = get_settings().GROQ_API_KEY
-        else:
-            self.api_key = api_key  # may be None
+        self.api_key = s.GROQ_API_KEY if api_key is self._SENTINEL else api_key
+        self.model = model or s.GROQ_MODEL
+        self.timeout = timeout or s.GROQ_TIMEOUT
+        self.max_concurrency = max_concurrency or s.GROQ_MAX_CONCURRENCY
+        self.cache_ttl = cache_ttl or s.GROQ_CACHE_TTL
+        self.http = get_http_client("groq", base_url or s.GROQ_BASE_URL)
+        self._cache = cache
+        # Futures and semaphores belong to one event loop; a new loop starts afresh
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._inflight: dict[str, asyncio.Task[str]] = {}
+        self._slots = asyncio.Semaphore(self.max_concurrency)
 
-    def summarize(self, text: str) -> str:
+    @property
+    def cache(self) -> AsyncCache:
+        return self._cache or get_async_cache()
+
+    def key(self, text: str) -> str:
+        return "groq:" + sha256(f"{self.model}\n{text}".encode()).hexdigest()
+
+    async def summarize(self, text: str) -> str:
         if not text:
             raise ValueError("text must be non-empty")
         if not self.api_key:
-            # Offline deterministic summary
-            return f"[mock-summary:{min(32, len(text))}]{text[:32]}"
-        # In real integration: call Groq API here.
-        # We intentionally avoid network calls in this scaffold.
-        return f"[would-call-groq]{text[:32]}"  # pragma: no cover
\ No newline at end of file
+            GROQ_SUMMARIES_TOTAL.labels(outcome="mock").inc()
+            return mock_summary(text)
+        key = self.key(text)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            GROQ_SUMMARIES_TOTAL.labels(outcome="cached").inc()
+            return cached
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._inflight = loop, {}
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        task = self._inflight.get(key)
+        if task is None:
+            inflight = self._inflight
+            task = inflight[key] = loop.create_task(self._fetch(key, text))
+            task.add_done_callback(lambda _: inflight.pop(key, None))
+        else:
+            GROQ_SUMMARIES_TOTAL.labels(outcome="coalesced").inc()
+        # Shielded: one caller going away must not cancel the call the others wait on
+        return await asyncio.shield(task)
+
+    async def summarize_many(self, texts: list[str]) -> list[str]:
+        """Summaries for a batch, fetched concurrently (duplicates share one call)."""
+        return list(await asyncio.gather(*(self.summarize(t) for t in texts)))
+
+    async def _fetch(self, key: str, text: str) -> str:
+        try:
+            summary = await asyncio.wait_for(self._complete(text), self.timeout)
+        except (asyncio.TimeoutError, httpx.HTTPError, LookupError, TypeError, ValueError) as e:
+            log.warning(f"groq summary failed, using mock: {e!r}")
+            GROQ_SUMMARIES_TOTAL.labels(outcome="fallback").inc()
+            return mock_summary(text)
+        await self.cache.set(key, summary, ex=self.cache_ttl)
+        GROQ_SUMMARIES_TOTAL.labels(outcome="llm").inc()
+        return summary
+
+    async def _complete(self, text: str) -> str:
+        async with self._slots:
+            resp = await self.http.post(
+                COMPLETIONS_PATH,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                json={
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": text},
+                    ],
+                    "temperature": 0,
+                    "max_tokens": 120,
+                },
+            )
+        resp.raise_for_status()
+        summary = resp.json()["choices"][0]["message"]["content"]
+        if not isinstance(summary, str) or not summary.strip():
+            raise ValueError("empty completion")
+        return summary.strip()
+
+
+@lru_cache(maxsize=1)
+def get_groq_client() -> GroqClient:
+    """Process-wide client, so the cache, coalescing and concurrency cap are shared."""
+    return GroqClient()
@@ -1,66 +1,150 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import json
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import get_async_session
+from app.core.idempotency import idempotent
 from app.models.schemas import (
     USSDSessionRequest,
     USSDSessionResponse,
     ConvertRequest,
     ConvertResponse,
+    ConversionStatus,
     RebalanceRequest,
     RebalanceResponse,
+    LiquidityPlanRequest,
+    LiquidityPlanResponse,
     KYCRequest,
     KYCResponse,
     DarajaDebitRequest,
     DarajaDebitResponse,
+    DarajaCallbackAck,
+    DisbursementJobStatus,
+    DisbursementRowsPage,
     ForecastRequest,
     ForecastResponse,
+    ForecastBatchRequest,
+    ForecastBatchResponse,
     OperatorSummaryResponse,
+    StatementPage,
 )
-from app.services.wallet import WalletService
+from app.services.conversion import get_conversion_pipeline, status_of
+from app.services.daraja_callbacks import CallbackBusy, SIGNATURE_HEADER, get_callback_ingestor
+from app.services.disbursement import FORMATS, get_disbursement_service
+from app.services.ussd import get_ussd_service
 from app.services.liquidity import LiquidityService
+from app.services.rebalance_plan import RebalancePlanner
 from app.services.auth import AuthService
 from app.integrations.integration_factory import get_daraja_client
 from app.services.forecast import ForecastService
+from app.services.summaries import get_summary_scheduler
+from app.services.statement import StatementService, export_csv, export_ndjson, stream_entries
 
 router = APIRouter()
 
 
 @router.post("/ussd/session", response_model=USSDSessionResponse)
 async def ussd_session(req: USSDSessionRequest):
-    # Simulate state progression
-    next_state = (req.menuState or "start") + ":next"
-    prompt = f"Received input '{req.input}' from {req.phone}."
-    return USSDSessionResponse(prompt=prompt, nextMenuState=next_state, actions=["confirm"]) 
+    hop = await get_ussd_service().hop(req.sessionId, req.phone, req.input)
+    return USSDSessionResponse(
+        prompt=hop.prompt,
+        nextMenuState=hop.state,
+        actions=hop.actions,
+        end=hop.end,
+        data=hop.data,
+    )
 
 
 @router.post("/convert", response_model=ConvertResponse)
-async def convert(req: ConvertRequest):
-    try:
-        tx_id = WalletService().convert(
-            user_id=req.userId,
-            from_rail=req.from_.rail,
-            from_operator=req.from_.operator,
-            amount=req.from_.amount,
-            to_token=req.to.token,
-            to_chain=req.to.chain,
-            mode=req.mode,
+async def convert(
+    req: ConvertRequest,
+    response: Response,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+):
+    async def run() -> ConvertResponse:
+        pipeline = get_conversion_pipeline()
+        try:
+            tx_id = await pipeline.submit(
+                user_id=req.userId,
+                from_rail=req.from_.rail,
+                from_operator=req.from_.operator,
+                amount=req.from_.amount,
+                to_token=req.to.token,
+                to_chain=req.to.chain,
+                mode=req.mode,
+                phone=req.from_.phone,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return ConvertResponse(
+            status="submitted",
+            txId=tx_id,
+            estimatedCompletion=pipeline.estimated_completion(),
+            fees=0.05,
         )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    return ConvertResponse(status="submitted", txId=tx_id, estimatedCompletion="~15s", fees=0.05)
+
+    return await idempotent("convert", idempotency_key, req, response, ConvertResponse, run)
+
+
+@router.get("/convert/{tx_id}", response_model=ConversionStatus)
+async def convert_status(tx_id: str):
+    conv = await get_conversion_pipeline().get(tx_id)
+    if conv is None:
+        raise HTTPException(status_code=404, detail="conversion not found")
+    return ConversionStatus(
+        txId=conv.tx_id,
+        status=status_of(conv.state),
+        state=conv.state,
+        attempts=conv.attempts,
+        lastError=conv.last_error,
+        steps=json.loads(conv.steps),
+        createdAt=conv.created_at,
+        updatedAt=conv.updated_at,
+    )
 
 
 @router.post("/liquidity/rebalance", response_model=RebalanceResponse)
-async def liquidity_rebalance(req: RebalanceRequest):
+async def liquidity_rebalance(
+    req: RebalanceRequest,
+    response: Response,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+):
+    async def run() -> RebalanceResponse:
+        try:
+            # Journals the transfer when the engine holds both pools; keep it off the loop
+            order_id, status = await asyncio.to_thread(
+                LiquidityService().rebalance,
+                source_pool=req.sourcePool,
+                dest_pool=req.destPool,
+                amount=req.amount,
+                reason=req.reason,
+                window=req.predictedDemandWindow,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return RebalanceResponse(orderId=order_id, status=status)
+
+    return await idempotent(
+        "rebalance", idempotency_key, req, response, RebalanceResponse, run
+    )
+
+
+@router.post("/liquidity/plan", response_model=LiquidityPlanResponse)
+async def liquidity_plan(req: LiquidityPlanRequest):
     try:
-        order_id, status = LiquidityService().rebalance(
-            source_pool=req.sourcePool,
-            dest_pool=req.destPool,
-            amount=req.amount,
-            reason=req.reason,
-            window=req.predictedDemandWindow,
+        plan = await RebalancePlanner().plan(
+            window=req.window,
+            balances=[p.model_dump() for p in req.pools] if req.pools is not None else None,
+            routes=[r.model_dump() for r in req.routes] if req.routes is not None else None,
+            min_balance=req.minBalance,
         )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    return RebalanceResponse(orderId=order_id, status=status)
+    return LiquidityPlanResponse(**plan)
 
 
 @router.post("/kyc/verify", response_model=KYCResponse)
@@ -73,28 +157,133 @@ async def kyc_verify(req: KYCRequest):
 
 
 @router.post("/daraja/debit", response_model=DarajaDebitResponse)
-async def daraja_debit(req: DarajaDebitRequest):
+async def daraja_debit(
+    req: DarajaDebitRequest,
+    response: Response,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+):
+    async def run() -> DarajaDebitResponse:
+        try:
+            client = get_daraja_client()
+            res = client.simulate_debit(req.phone, req.amount)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return DarajaDebitResponse(**res)
+
+    return await idempotent(
+        "daraja-debit", idempotency_key, req, response, DarajaDebitResponse, run
+    )
+
+
+@router.post("/daraja/callbacks/{kind}", response_model=DarajaCallbackAck)
+async def daraja_callback(
+    kind: Literal["stk", "c2b", "b2c"],
+    request: Request,
+    signature: str | None = Header(None, alias=SIGNATURE_HEADER),
+):
+    # Raw body: the signature covers the exact bytes, and parsing skips model validation
+    body = await request.body()
+    try:
+        outcome = await get_callback_ingestor().ingest(kind, body, signature)
+    except PermissionError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except CallbackBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return DarajaCallbackAck(ResultDesc="Duplicate" if outcome == "duplicate" else "Accepted")
+
+
+@router.post("/daraja/disbursements", response_model=DisbursementJobStatus, status_code=202)
+async def daraja_disbursements(
+    request: Request, pool: str | None = Query(None, min_length=1, max_length=64)
+):
+    # Body is a CSV file or NDJSON, parsed and stored as it streams in; `pool` is the
+    # operator float to pay out of (default DISBURSEMENT_POOL)
+    fmt = FORMATS.get(request.headers.get("content-type", "").split(";")[0].strip())
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="send text/csv or application/x-ndjson")
     try:
-        client = get_daraja_client()
-        res = client.simulate_debit(req.phone, req.amount)
+        return await get_disbursement_service().submit(request.stream(), fmt, pool)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    return DarajaDebitResponse(**res)
+
+
+@router.get("/daraja/disbursements/{job_id}", response_model=DisbursementJobStatus)
+async def disbursement_status(job_id: str):
+    status = await get_disbursement_service().get(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="disbursement job not found")
+    return status
+
+
+@router.get("/daraja/disbursements/{job_id}/rows", response_model=DisbursementRowsPage)
+async def disbursement_rows(
+    job_id: str,
+    status: Literal["pending", "invalid", "sending", "sent", "failed"] | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: int = Query(0, ge=0),
+):
+    rows, next_cursor = await get_disbursement_service().rows(job_id, status, limit, cursor)
+    return DisbursementRowsPage(jobId=job_id, rows=rows, nextCursor=next_cursor)
 
 
 @router.post("/forecast", response_model=ForecastResponse)
 async def forecast(req: ForecastRequest):
     try:
-        predicted = ForecastService().predict(operator=req.operator, window=req.window)
+        predicted = await ForecastService().predict(operator=req.operator, window=req.window)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     return ForecastResponse(operator=req.operator, window=req.window, predictedNetFlow=predicted)
 
 
+@router.post("/forecast/batch", response_model=ForecastBatchResponse)
+async def forecast_batch(req: ForecastBatchRequest):
+    try:
+        grid = await ForecastService().predict_many(
+            operators=req.operators, windows=req.windows
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ForecastBatchResponse(
+        operators=req.operators, windows=req.windows, predictedNetFlow=grid
+    )
+
+
 @router.get("/operators/{operator}/summary", response_model=OperatorSummaryResponse)
-async def operator_summary(operator: str, window: str = "4h"):
+async def operator_summary(operator: str, response: Response, window: str = "4h"):
+    # Precomputed by the summary scheduler; computed here only for operators it has not
+    # reached yet. `Age` tells how many seconds old the summary is.
+    scheduler = get_summary_scheduler()
     try:
-        summary = ForecastService().operator_summary(operator=operator, window=window)
+        entry = await scheduler.get(operator, window) or await scheduler.refresh(operator, window)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    summary, computed_at = entry
+    response.headers["Age"] = str(max(0, int(scheduler.clock() - computed_at)))
     return OperatorSummaryResponse(operator=operator, summary=summary)
+
+
+@router.get("/wallets/{wallet_id}/statement", response_model=StatementPage)
+async def wallet_statement(
+    wallet_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: str | None = None,
+    format: Literal["json", "ndjson", "csv"] = "json",
+    session: AsyncSession = Depends(get_async_session),
+):
+    if format == "ndjson":
+        return StreamingResponse(
+            export_ndjson(stream_entries(wallet_id)), media_type="application/x-ndjson"
+        )
+    if format == "csv":
+        return StreamingResponse(
+            export_csv(stream_entries(wallet_id)),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{wallet_id}-statement.csv"'},
+        )
+    try:
+        entries, next_cursor = await StatementService(session).page(wallet_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StatementPage(walletId=wallet_id, entries=entries, nextCursor=next_cursor)
@@ -1,15 +1,280 @@
 from __future__ import annotations
 import os
-from typing import Any
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, Callable, Iterator, Mapping, Sequence, Union
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from app.core.config import get_settings
 
 try:
     import redis  # type: ignore
+    import redis.asyncio as aioredis  # type: ignore
 except Exception:  # pragma: no cover - import guarded
     redis = None  # type: ignore
+    aioredis = None  # type: ignore
+
+
+# A single TTL for every key, or per-key TTLs (keys missing from the mapping never expire)
+TTL = Union[int, float, Mapping[str, Union[int, float, None]], None]
+
+
+
+def _px(ex: int | float | None) -> int | None:
+    """TTL seconds as Redis PX milliseconds: redis-py rejects a float EX, and fractional
+    TTLs (lease renewals, tests) must not be rounded away. At least 1 ms, as PX 0 is an
+    error."""
+    return None if ex is None else max(1, int(ex * 1000))
+
+
+# Compare-and-delete / compare-and-expire: only the holder of a lock's token may release
+# or renew it
+DELETE_IF_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+EXPIRE_IF_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('PEXPIRE', KEYS[1], ARGV[2]) end
+return 0
+"""
+
+
+class MemoryStore:
+    """Bounded in-process key/value store used when Redis is not configured.
+
+    - LRU eviction once either the entry or the (approximate) byte budget is exceeded.
+    - Per-key TTLs, checked lazily on access and swept periodically on writes.
+    - Thread-safe; all operations take a single lock.
+    - Lists (`push`/`pop`) are kept apart from the budgets; give them a TTL.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        max_bytes: int = 16 * 1024 * 1024,
+        sweep_interval: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if max_entries <= 0 or max_bytes <= 0:
+            raise ValueError("cache budgets must be positive")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._pushed = threading.Condition(self._lock)
+        self._data: OrderedDict[str, str] = OrderedDict()
+        self._lists: dict[str, deque[str]] = {}
+        self._list_expires: dict[str, float] = {}
+        self._expires: dict[str, float] = {}
+        self._bytes = 0
+        self._last_sweep = clock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    @staticmethod
+    def _size(key: str, value: str) -> int:
+        return len(key) + len(value)
+
+    def _remove(self, key: str) -> None:
+        value = self._data.pop(key)
+        self._expires.pop(key, None)
+        self._bytes -= self._size(key, value)
+
+    def _live(self, key: str, now: float) -> bool:
+        # Lazy expiry: drop the key if its deadline has passed
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= now:
+            self._remove(key)
+            self.expirations += 1
+            return False
+        return key in self._data
+
+    def _maybe_sweep(self, now: float) -> None:
+        if now - self._last_sweep >= self.sweep_interval:
+            self._sweep(now)
+
+    def _sweep(self, now: float) -> int:
+        self._last_sweep = now
+        expired = [k for k, deadline in self._expires.items() if deadline <= now]
+        for k in expired:
+            self._remove(k)
+        lists = [k for k, deadline in self._list_expires.items() if deadline <= now]
+        for k in lists:
+            self._drop_list(k)
+        self.expirations += len(expired) + len(lists)
+        return len(expired) + len(lists)
+
+    def _drop_list(self, key: str) -> None:
+        self._lists.pop(key, None)
+        self._list_expires.pop(key, None)
+
+    def _list(self, key: str, now: float) -> deque[str] | None:
+        deadline = self._list_expires.get(key)
+        if deadline is not None and deadline <= now:
+            self._drop_list(key)
+            self.expirations += 1
+        return self._lists.get(key)
+
+    def _evict(self) -> None:
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def _put(self, key: str, value: str, deadline: float | None) -> None:
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = value
+        self._bytes += self._size(key, value)
+        if deadline is not None:
+            self._expires[key] = deadline
+        self._evict()
+
+    def _get(self, key: str) -> str | None:
+        if not self._live(key, self._clock()):
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return self._data[key]
+
+    def _incr(self, key: str) -> int:
+        now = self._clock()
+        self._maybe_sweep(now)
+        # Like Redis INCR, an existing TTL is preserved
+        live = self._live(key, now)
+        v = int(self._data[key]) + 1 if live else 1
+        self._put(key, str(v), self._expires.get(key) if live else None)
+        return v
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key: str, value: str, ex: int | float | None = None) -> None:
+        with self._lock:
+            now = self._clock()
+            self._maybe_sweep(now)
+            self._put(key, value, now + ex if ex is not None else None)
+
+    def add(self, key: str, value: str, ex: int | float | None = None) -> bool:
+        """Set only if the key is absent (SET NX); returns whether it was set."""
+        with self._lock:
+            now = self._clock()
+            if self._live(key, now):
+                return False
+            self._put(key, value, now + ex if ex is not None else None)
+            return True
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            return self._incr(key)
+
+    def mget(self, keys: Sequence[str]) -> list[str | None]:
+        with self._lock:
+            return [self._get(k) for k in keys]
+
+    def mset(self, mapping: Mapping[str, str], ex: TTL = None) -> None:
+        """Set many keys atomically; `ex` is one TTL for all keys or a per-key mapping."""
+        with self._lock:
+            now = self._clock()
+            self._maybe_sweep(now)
+            for k, v in mapping.items():
+                ttl = ex.get(k) if isinstance(ex, Mapping) else ex
+                self._put(k, v, now + ttl if ttl is not None else None)
+
+    def incr_many(self, keys: Sequence[str]) -> list[int]:
+        with self._lock:
+            return [self._incr(k) for k in keys]
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            now = self._clock()
+            removed = 0
+            for k in keys:
+                if self._live(k, now):
+                    self._remove(k)
+                    removed += 1
+            return removed
+
+    def delete_if(self, key: str, value: str) -> bool:
+        """Delete `key` only while it still holds `value` (releasing a lock you own)."""
+        with self._lock:
+            if self._live(key, self._clock()) and self._data[key] == value:
+                self._remove(key)
+                return True
+            return False
+
+    def expire_if(self, key: str, value: str, ex: int | float) -> bool:
+        """Restart `key`'s TTL only while it still holds `value` (renewing a lock you own)."""
+        with self._lock:
+            now = self._clock()
+            if self._live(key, now) and self._data[key] == value:
+                self._expires[key] = now + ex
+                return True
+            return False
+
+    def push(self, key: str, value: str, ex: int | float | None = None) -> None:
+        """Append to the list at `key` (RPUSH), restarting its TTL; wakes waiting `pop`s."""
+        with self._pushed:
+            now = self._clock()
+            self._maybe_sweep(now)
+            items = self._list(key, now)
+            if items is None:
+                items = self._lists[key] = deque()
+            items.append(value)
+            if ex is not None:
+                self._list_expires[key] = now + ex
+            else:
+                self._list_expires.pop(key, None)
+            self._pushed.notify_all()
+
+    def pop(self, key: str, timeout: float) -> str | None:
+        """Take the first item of the list at `key` (BLPOP), waiting up to `timeout`
+        seconds for one; None if none arrived."""
+        give_up = time.monotonic() + timeout
+        with self._pushed:
+            while True:
+                items = self._list(key, self._clock())
+                if items:
+                    value = items.popleft()
+                    if not items:
+                        self._drop_list(key)
+                    return value
+                remaining = give_up - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._pushed.wait(remaining)
+
+    def sweep(self) -> int:
+        """Remove all expired keys now; returns how many were dropped."""
+        with self._lock:
+            return self._sweep(self._clock())
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
 
 
 class Cache:
-    def __init__(self, url: str | None = None):
+    def __init__(
+        self,
+        url: str | None = None,
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        sweep_interval: float | None = None,
+    ):
         self.url = url or os.getenv("REDIS_URL")
         self._client = None
         if self.url and redis is not None:  # pragma: no cover - external service
@@ -17,14 +282,19 @@ class Cache:
                 self._client = redis.from_url(self.url, decode_responses=True)  # pragma: no cover
             except Exception:  # pragma: no cover - external service
                 self._client = None
-        # fallback simple dict
-        self._store: dict[str, str] = {}
+        # fallback bounded in-memory store
+        s = get_settings()
+        self._store = MemoryStore(
+            max_entries=max_entries or s.CACHE_MAX_ENTRIES,
+            max_bytes=max_bytes or s.CACHE_MAX_BYTES,
+            sweep_interval=sweep_interval if sweep_interval is not None else s.CACHE_SWEEP_INTERVAL,
+        )
 
-    def set(self, key: str, value: str, ex: int | None = None) -> None:
+    def set(self, key: str, value: str, ex: int | float | None = None) -> None:
         if self._client is not None:  # pragma: no cover - external service
-            self._client.set(key, value, ex=ex)  # pragma: no cover
+            self._client.set(key, value, px=_px(ex))  # pragma: no cover
         else:
-            self._store[key] = value
+            self._store.set(key, value, ex=ex)
 
     def get(self, key: str) -> str | None:
         if self._client is not None:  # pragma: no cover - external service
@@ -32,9 +302,270 @@ class Cache:
             return val  # pragma: no cover
         return self._store.get(key)
 
+    def add(self, key: str, value: str, ex: int | float | None = None) -> bool:
+        """Set only if absent (SET NX); usable as a short-lived lock with `ex`."""
+        if self._client is not None:  # pragma: no cover - external service
+            return bool(self._client.set(key, value, px=_px(ex), nx=True))  # pragma: no cover
+        return self._store.add(key, value, ex=ex)
+
     def incr(self, key: str) -> int:
         if self._client is not None:  # pragma: no cover - external service
             return int(self._client.incr(key))  # pragma: no cover
-        v = int(self._store.get(key, "0")) + 1
-        self._store[key] = str(v)
-        return v
+        return self._store.incr(key)
+
+    def mget(self, keys: Sequence[str]) -> list[str | None]:
+        """Fetch many keys in one round-trip (MGET on Redis)."""
+        if not keys:
+            return []
+        if self._client is not None:  # pragma: no cover - external service
+            return list(self._client.mget(keys))  # pragma: no cover
+        return self._store.mget(keys)
+
+    def mset(self, mapping: Mapping[str, str], ex: TTL = None) -> None:
+        """Set many keys in one round-trip; `ex` is a shared TTL or a per-key mapping."""
+        if not mapping:
+            return
+        if self._client is not None:  # pragma: no cover - external service
+            pipe = self._client.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipe.set(k, v, px=_px(ex.get(k) if isinstance(ex, Mapping) else ex))
+            pipe.execute()
+            return
+        self._store.mset(mapping, ex=ex)
+
+    def incr_many(self, keys: Sequence[str]) -> list[int]:
+        """Increment many counters in one round-trip."""
+        if not keys:
+            return []
+        if self._client is not None:  # pragma: no cover - external service
+            pipe = self._client.pipeline(transaction=False)
+            for k in keys:
+                pipe.incr(k)
+            return [int(v) for v in pipe.execute()]
+        return self._store.incr_many(keys)
+
+    def delete(self, *keys: str) -> int:
+        if not keys:
+            return 0
+        if self._client is not None:  # pragma: no cover - external service
+            return int(self._client.delete(*keys))  # pragma: no cover
+        return self._store.delete(*keys)
+
+    def delete_if(self, key: str, value: str) -> bool:
+        """Delete `key` only if it still holds `value` (atomic on Redis via Lua)."""
+        if self._client is not None:  # pragma: no cover - external service
+            return bool(self._client.eval(DELETE_IF_LUA, 1, key, value))
+        return self._store.delete_if(key, value)
+
+    def expire_if(self, key: str, value: str, ex: int | float) -> bool:
+        """Restart `key`'s TTL only if it still holds `value` (atomic on Redis via Lua)."""
+        if self._client is not None:  # pragma: no cover - external service
+            return bool(self._client.eval(EXPIRE_IF_LUA, 1, key, value, _px(ex)))
+        return self._store.expire_if(key, value, ex)
+
+    def push(self, key: str, value: str, ex: int | float | None = None) -> None:
+        """Append to the list at `key` (RPUSH), restarting its TTL; a queue between
+        processes when Redis is configured."""
+        if self._client is not None:  # pragma: no cover - external service
+            pipe = self._client.pipeline(transaction=True)
+            pipe.rpush(key, value)
+            if ex is not None:
+                pipe.pexpire(key, _px(ex))
+            pipe.execute()
+            return
+        self._store.push(key, value, ex=ex)
+
+    def pop(self, key: str, timeout: float) -> str | None:
+        """Take the first item of the list at `key`, blocking up to `timeout` seconds
+        (BLPOP); None if none arrived."""
+        if self._client is not None:  # pragma: no cover - external service
+            item = self._client.blpop([key], timeout=timeout)
+            return item[1] if item else None
+        return self._store.pop(key, timeout)
+
+    def stats(self) -> dict[str, Any]:
+        """Size and eviction counters, from Redis INFO or the in-memory store."""
+        if self._client is not None:  # pragma: no cover - external service
+            info = self._client.info()
+            return {
+                "backend": "redis",
+                "entries": int(self._client.dbsize()),
+                "bytes": int(info.get("used_memory", 0)),
+                "max_entries": 0,
+                "max_bytes": int(info.get("maxmemory", 0)),
+                "hits": int(info.get("keyspace_hits", 0)),
+                "misses": int(info.get("keyspace_misses", 0)),
+                "evictions": int(info.get("evicted_keys", 0)),
+                "expirations": int(info.get("expired_keys", 0)),
+            }
+        return {"backend": "memory", **self._store.stats()}
+
+
+@lru_cache(maxsize=1)
+def get_cache() -> Cache:
+    """Process-wide cache shared by services (Redis when REDIS_URL is set)."""
+    return Cache(get_settings().REDIS_URL)
+
+
+class AsyncCache:
+    """Event-loop friendly counterpart of `Cache`.
+
+    Uses `redis.asyncio` over a shared, size-limited connection pool when a Redis URL is
+    configured; otherwise wraps a `MemoryStore` with the same semantics as `Cache`.
+    """
+
+    def __init__(
+        self,
+        url: str | None = None,
+        max_connections: int | None = None,
+        store: MemoryStore | None = None,
+    ):
+        s = get_settings()
+        self.url = url or os.getenv("REDIS_URL")
+        self._pool = None
+        self._client = None
+        if self.url and aioredis is not None:  # pragma: no cover - external service
+            # Blocking pool: callers wait for a free connection instead of failing at the cap
+            self._pool = aioredis.BlockingConnectionPool.from_url(
+                self.url,
+                max_connections=max_connections or s.REDIS_MAX_CONNECTIONS,
+                timeout=s.REDIS_POOL_TIMEOUT,
+                decode_responses=True,
+            )
+            self._client = aioredis.Redis(connection_pool=self._pool)
+        self._store = store or MemoryStore(
+            max_entries=s.CACHE_MAX_ENTRIES,
+            max_bytes=s.CACHE_MAX_BYTES,
+            sweep_interval=s.CACHE_SWEEP_INTERVAL,
+        )
+
+    @property
+    def redis(self) -> Any:
+        """The `redis.asyncio` client (for scripts), or None on the in-memory fallback."""
+        return self._client
+
+    async def set(self, key: str, value: str, ex: int | float | None = None) -> None:
+        if self._client is not None:  # pragma: no cover - external service
+            await self._client.set(key, value, px=_px(ex))
+        else:
+            self._store.set(key, value, ex=ex)
+
+    async def get(self, key: str) -> str | None:
+        if self._client is not None:  # pragma: no cover - external service
+            return await self._client.get(key)
+        return self._store.get(key)
+
+    async def add(self, key: str, value: str, ex: int | float | None = None) -> bool:
+        if self._client is not None:  # pragma: no cover - external service
+            return bool(await self._client.set(key, value, px=_px(ex), nx=True))
+        return self._store.add(key, value, ex=ex)
+
+    async def incr(self, key: str) -> int:
+        if self._client is not None:  # pragma: no cover - external service
+            return int(await self._client.incr(key))
+        return self._store.incr(key)
+
+    async def delete(self, *keys: str) -> int:
+        if not keys:
+            return 0
+        if self._client is not None:  # pragma: no cover - external service
+            return int(await self._client.delete(*keys))
+        return self._store.delete(*keys)
+
+    async def delete_if(self, key: str, value: str) -> bool:
+        if self._client is not None:  # pragma: no cover - external service
+            return bool(await self._client.eval(DELETE_IF_LUA, 1, key, value))
+        return self._store.delete_if(key, value)
+
+    async def expire_if(self, key: str, value: str, ex: int | float) -> bool:
+        if self._client is not None:  # pragma: no cover - external service
+            return bool(await self._client.eval(EXPIRE_IF_LUA, 1, key, value, _px(ex)))
+        return self._store.expire_if(key, value, ex)
+
+    async def mget(self, keys: Sequence[str]) -> list[str | None]:
+        if not keys:
+            return []
+        if self._client is not None:  # pragma: no cover - external service
+            return list(await self._client.mget(keys))
+        return self._store.mget(keys)
+
+    async def mset(self, mapping: Mapping[str, str], ex: TTL = None) -> None:
+        if not mapping:
+            return
+        if self._client is not None:  # pragma: no cover - external service
+            pipe = self._client.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipe.set(k, v, px=_px(ex.get(k) if isinstance(ex, Mapping) else ex))
+            await pipe.execute()
+            return
+        self._store.mset(mapping, ex=ex)
+
+    async def incr_many(self, keys: Sequence[str]) -> list[int]:
+        if not keys:
+            return []
+        if self._client is not None:  # pragma: no cover - external service
+            pipe = self._client.pipeline(transaction=False)
+            for k in keys:
+                pipe.incr(k)
+            return [int(v) for v in await pipe.execute()]
+        return self._store.incr_many(keys)
+
+    async def aclose(self) -> None:
+        if self._client is not None:  # pragma: no cover - external service
+            await self._client.aclose()
+            await self._pool.disconnect()
+            self._client = self._pool = None
+
+
+_async_cache: AsyncCache | None = None
+
+
+def get_async_cache() -> AsyncCache:
+    """Process-wide AsyncCache; without Redis it shares `get_cache()`'s in-memory store."""
+    global _async_cache
+    if _async_cache is None:
+        url = get_settings().REDIS_URL
+        _async_cache = AsyncCache(url, store=None if url else get_cache()._store)
+    return _async_cache
+
+
+async def init_async_cache() -> AsyncCache:
+    """Create the shared pool at application startup."""
+    return get_async_cache()
+
+
+async def close_async_cache() -> None:
+    """Release pooled connections at application shutdown."""
+    global _async_cache
+    if _async_cache is not None:
+        await _async_cache.aclose()
+        _async_cache = None
+
+
+class CacheStatsCollector:
+    """Prometheus collector exporting `Cache.stats()` at scrape time."""
+
+    _GAUGES = ("entries", "bytes", "max_entries", "max_bytes")
+    _COUNTERS = ("hits", "misses", "evictions", "expirations")
+
+    def __init__(self, cache_getter: Callable[[], Cache] = get_cache):
+        self.cache_getter = cache_getter
+
+    def describe(self) -> Iterator[Any]:
+        # Names only; lets the registry detect duplicates without scraping the cache
+        for name in self._GAUGES:
+            yield GaugeMetricFamily(f"cache_{name}", f"Cache {name}")
+        for name in self._COUNTERS:
+            yield CounterMetricFamily(f"cache_{name}", f"Cache {name}")
+
+    def collect(self) -> Iterator[Any]:
+        stats = self.cache_getter().stats()
+        backend = str(stats["backend"])
+        for name in self._GAUGES:
+            g = GaugeMetricFamily(f"cache_{name}", f"Cache {name}", labels=["backend"])
+            g.add_metric([backend], stats[name])
+            yield g
+        for name in self._COUNTERS:
+            c = CounterMetricFamily(f"cache_{name}", f"Cache {name}", labels=["backend"])
+            c.add_metric([backend], stats[name])
+            yield c
@@ -9,15 +9,162 @@ load_dotenv()
 
 class Settings(BaseSettings):
     GROQ_API_KEY: str | None = None
+    # Groq summaries: API base URL and model, per-call timeout (seconds, then the mock
+    # summary is used), max concurrent upstream calls and response cache TTL (seconds)
+    GROQ_BASE_URL: str = "https://api.groq.com"
+    GROQ_MODEL: str = "llama-3.1-8b-instant"
+    GROQ_TIMEOUT: float = 5.0
+    GROQ_MAX_CONCURRENCY: int = 8
+    GROQ_CACHE_TTL: int = 3600
     ENV: str = "development"
     DATABASE_URL: str | None = None
+    # SQL connection pool (ignored for SQLite)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
     REDIS_URL: str | None = None
+    # Shared async Redis pool: max connections per process and wait timeout (seconds)
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: float = 5.0
     # Comma-separated list of allowed origins for CORS, e.g. "http://localhost:5173,https://app.example.com"
     ALLOWED_ORIGINS: str | None = None
     # Integration feature flags: default to stubs for demo/test friendliness
     USE_STUB_DARAJA: bool = True
     USE_STUB_CCTP: bool = True
     USE_STUB_HEDERA: bool = True
+    # In-memory cache fallback budgets (used when REDIS_URL is unset)
+    CACHE_MAX_ENTRIES: int = 10_000
+    CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    CACHE_SWEEP_INTERVAL: float = 30.0
+    # Ledger: entries per account/asset between balance snapshots
+    LEDGER_SNAPSHOT_EVERY: int = 1000
+    # Conversion rates per destination token (token units per unit of local currency);
+    # conversions to any other token are rejected
+    FX_USDC_PER_LOCAL: float = 0.0077
+    FX_CNGN_PER_LOCAL: float = 11.9
+    FX_XAUT_PER_LOCAL: float = 0.0000029
+    # Idempotency-Key handling: replay window, in-flight lock TTL and max wait (seconds)
+    IDEMPOTENCY_TTL: int = 86400
+    IDEMPOTENCY_LOCK_TTL: int = 30
+    IDEMPOTENCY_WAIT: float = 10.0
+    # Forecast cache TTLs in seconds, per window: short windows go stale sooner
+    FORECAST_TTL_1H: int = 60
+    FORECAST_TTL_4H: int = 300
+    FORECAST_TTL_24H: int = 1800
+    # Forecast backend: persistence | seasonal_naive | smoothing (hour-of-week seasonality)
+    FORECAST_MODEL: str = "smoothing"
+    # Seconds between refreshes of the precomputed operator summaries (work is spread
+    # evenly over the interval)
+    SUMMARY_REFRESH_INTERVAL: float = 300.0
+    # Preferred transaction ID worker number (0-1023). Each process leases a free id
+    # through the cache starting here (or at a hostname/pid hash when unset), so processes
+    # sharing a WORKER_ID still get distinct ids; the lease is renewed every third of its TTL
+    WORKER_ID: int | None = None
+    WORKER_ID_LEASE_TTL: float = 60.0
+    # Conversion pipeline: worker tasks, per-step retry policy and per-integration
+    # concurrency limits (in-flight calls to each external API)
+    CONVERSION_WORKERS: int = 8
+    CONVERSION_MAX_ATTEMPTS: int = 5
+    CONVERSION_RETRY_BASE: float = 1.0
+    CONVERSION_RETRY_MAX: float = 60.0
+    CONVERSION_ESTIMATE_SECONDS: float = 15.0  # prior for the completion estimate
+    # Seconds a pipeline instance owns the conversions it runs without renewing (every
+    # third of it); conversions of an instance that died are taken over after this
+    CONVERSION_LEASE_TTL: float = 30.0
+    # Seconds a conversion waits for the payer's STK result before it fails
+    CONVERSION_PAYMENT_TIMEOUT: float = 300.0
+    CCTP_SOURCE_CHAIN: str = "ethereum"  # chain the treasury burns USDC on
+    # Circle attestation service and poller backoff (seconds); a burn still unattested
+    # after CCTP_ATTESTATION_TIMEOUT fails its conversion step
+    CCTP_ATTESTATION_URL: str = "https://iris-api-sandbox.circle.com"
+    CCTP_POLL_MIN_DELAY: float = 2.0
+    CCTP_POLL_MAX_DELAY: float = 60.0
+    CCTP_POLL_BATCH: int = 100
+    CCTP_ATTESTATION_TIMEOUT: float = 3600.0
+    DARAJA_CONCURRENCY: int = 10
+    CCTP_CONCURRENCY: int = 5
+    HEDERA_CONCURRENCY: int = 10
+    # Live integrations: one pooled HTTP client per upstream. Timeouts and backoff are in
+    # seconds; retries apply to idempotent requests only. BREAKER_FAILURE_THRESHOLD
+    # consecutive failures fail calls fast for BREAKER_RESET_SECONDS
+    DARAJA_BASE_URL: str = "https://sandbox.safaricom.co.ke"
+    HEDERA_MIRROR_URL: str = "https://testnet.mirrornode.hedera.com"
+    HTTP_TIMEOUT: float = 10.0
+    HTTP_MAX_CONNECTIONS: int = 50
+    HTTP_MAX_KEEPALIVE: int = 20
+    HTTP_RETRIES: int = 2
+    HTTP_RETRY_BACKOFF: float = 0.2
+    BREAKER_FAILURE_THRESHOLD: int = 5
+    BREAKER_RESET_SECONDS: float = 30.0
+    # Daraja OAuth app credentials and STK push (Lipa na M-Pesa Online) settings
+    DARAJA_CONSUMER_KEY: str = ""
+    DARAJA_CONSUMER_SECRET: str = ""
+    DARAJA_SHORTCODE: str = "174379"
+    DARAJA_PASSKEY: str = ""
+    DARAJA_CALLBACK_URL: str = ""
+    # Access tokens: refresh this many seconds before expiry; refresh lock TTL and how long
+    # other workers wait for the lock holder's token (seconds)
+    DARAJA_TOKEN_REFRESH_MARGIN: float = 300.0
+    DARAJA_TOKEN_LOCK_TTL: int = 30
+    DARAJA_TOKEN_WAIT: float = 10.0
+    # Daraja callback ingestion: HMAC-SHA256 secret for X-Callback-Signature (required
+    # unless ENV=development, where empty turns checking off), queue bound, ledger batch
+    # size, how long a callback may wait for queue space before a 503 (seconds), how long
+    # references are remembered for dedupe, and the age (and interval, seconds) at which
+    # stored callbacks that were never booked are replayed into the ledger
+    DARAJA_CALLBACK_SECRET: str = ""
+    DARAJA_CALLBACK_QUEUE_SIZE: int = 10_000
+    DARAJA_CALLBACK_BATCH: int = 500
+    DARAJA_CALLBACK_ENQUEUE_TIMEOUT: float = 2.0
+    DARAJA_CALLBACK_DEDUPE_TTL: int = 7 * 86400
+    DARAJA_CALLBACK_REPLAY_AFTER: float = 60.0
+    # USSD sessions are kept in the cache this long after the last hop (seconds); gateways
+    # drop a session after about three minutes
+    USSD_SESSION_TTL: int = 180
+    # Bulk B2C disbursements: initiator credentials and result URL for B2C payments, send
+    # rate and burst (per second; match the app's Daraja quota), in-flight sends, rows per
+    # parse/insert chunk and per dispatch page, and the accepted amount range (shillings)
+    DARAJA_INITIATOR_NAME: str = ""
+    DARAJA_SECURITY_CREDENTIAL: str = ""
+    DARAJA_RESULT_URL: str = ""
+    DISBURSEMENT_RATE: float = 20.0
+    DISBURSEMENT_BURST: int = 20
+    DISBURSEMENT_CONCURRENCY: int = 10
+    DISBURSEMENT_CHUNK: int = 1000
+    DISBURSEMENT_PAGE: int = 500
+    DISBURSEMENT_MIN_AMOUNT: float = 10.0
+    DISBURSEMENT_MAX_AMOUNT: float = 250_000.0
+    # Seconds a service instance owns the bulk jobs it dispatches without renewing (every
+    # third of it); jobs of an instance that died are taken over after this
+    DISBURSEMENT_LEASE_TTL: float = 30.0
+    # Operator pool bulk payouts draw on when the upload does not name one
+    DISBURSEMENT_POOL: str = "safaricom"
+    # Liquidity pools: seconds between write-backs of the pool journal to liquidity_pools
+    POOL_FLUSH_INTERVAL: float = 1.0
+    # Seconds the PoolEngine's claim on the pools lasts without a journal write or
+    # write-back renewing it; another instance may take the pools over after this
+    POOL_LEASE_TTL: float = 30.0
+    # Seconds an instance that does not own the pools waits for the owner to answer a
+    # forwarded operation (through the cache; several workers need REDIS_URL)
+    POOL_FORWARD_TIMEOUT: float = 5.0
+    # Rebalancing planner: fee (basis points) assumed for routes the caller does not list
+    LIQUIDITY_PLAN_FEE_BPS: int = 10
+    # Operator flow store: hours of hourly in/outflow buckets kept per operator
+    FLOW_HISTORY_HOURS: int = 672
+    # Seconds between reads of newly committed pool postings from ledger_entries, and how
+    # long an id skipped by a read is re-checked (a transaction committing out of order)
+    FLOW_SYNC_INTERVAL: float = 2.0
+    FLOW_SYNC_GAP_GRACE: float = 60.0
+    # Rate limits (GCRA): requests per RATE_LIMIT_PERIOD seconds for each phone number,
+    # operator and X-API-Key, taken as one burst or spread out; 0 turns a limit off.
+    # Over the limit requests get 429 with Retry-After. Shared through Redis when set
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_PERIOD: float = 60.0
+    RATE_LIMIT_PHONE: int = 30
+    RATE_LIMIT_OPERATOR: int = 3000
+    RATE_LIMIT_API_KEY: int = 1200
 
     model_config = SettingsConfigDict(env_file=".env", env_ignore_empty=True, extra="ignore")
 
@@ -1,15 +1,77 @@
 from __future__ import annotations
 import os
 from contextlib import contextmanager
-from typing import Generator
+from typing import Any, AsyncGenerator, Generator
 from sqlalchemy import create_engine
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, SingletonThreadPool
+
+from app.core.config import get_settings
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+pysqlite:///:memory:")
 
-# echo off by default to keep tests clean
-engine = create_engine(DATABASE_URL, echo=False, future=True)
+# Async drivers for the sync URLs we accept in DATABASE_URL
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def _is_memory_sqlite(url: URL) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def sync_url(raw: str) -> URL:
+    url = make_url(raw)
+    if _is_memory_sqlite(url):
+        # A named shared-cache memory DB, so the sync and async engines (and every
+        # thread) see the same tables instead of one private DB per connection
+        url = url.set(
+            database="file:juapesa", query={"mode": "memory", "cache": "shared", "uri": "true"}
+        )
+    return url
+
+
+def async_url(raw: str) -> URL:
+    url = sync_url(raw)
+    return url.set(drivername=_ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def _engine_kwargs(url: URL, async_: bool) -> dict[str, Any]:
+    if url.get_backend_name() == "sqlite":
+        if url.query.get("mode") != "memory":
+            return {}
+        # Keep a connection open for the lifetime of the engine or the memory DB vanishes.
+        # Async sessions get one connection, checked out by one session at a time: shared
+        # between concurrent sessions, one session's rollback would undo another's writes
+        if async_:
+            return {
+                "poolclass": AsyncAdaptedQueuePool,
+                "pool_size": 1,
+                "max_overflow": 0,
+                "pool_timeout": get_settings().DB_POOL_TIMEOUT,
+            }
+        return {"poolclass": SingletonThreadPool}
+    s = get_settings()
+    return {
+        "pool_size": s.DB_POOL_SIZE,
+        "max_overflow": s.DB_MAX_OVERFLOW,
+        "pool_timeout": s.DB_POOL_TIMEOUT,
+        "pool_recycle": s.DB_POOL_RECYCLE,
+        "pool_pre_ping": s.DB_POOL_PRE_PING,
+    }
+
+
+def _make_engines(raw: str):
+    s_url, a_url = sync_url(raw), async_url(raw)
+    # echo off by default to keep tests clean
+    sync_engine = create_engine(s_url, echo=False, future=True, **_engine_kwargs(s_url, False))
+    async_engine_ = create_async_engine(a_url, echo=False, **_engine_kwargs(a_url, True))
+    return sync_engine, async_engine_
+
+
+engine, async_engine = _make_engines(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 
 
 @contextmanager
@@ -23,3 +85,20 @@ def get_session() -> Generator:
         raise
     finally:
         session.close()
+
+
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    """FastAPI dependency: one AsyncSession per request, committed on success."""
+    async with AsyncSessionLocal() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+
+async def check_database() -> None:
+    """Non-blocking connectivity probe used by /readyz."""
+    async with async_engine.connect() as conn:
+        await conn.exec_driver_sql("SELECT 1")
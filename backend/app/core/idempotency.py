@@ -0,0 +1,186 @@
+from __future__ import annotations
+import asyncio
+import json
+import time
+import uuid
+from datetime import timedelta
+from hashlib import sha256
+from typing import Any, Awaitable, Callable, TypeVar
+
+from fastapi import HTTPException, Response
+from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import AsyncCache, get_async_cache
+from app.core.config import get_settings
+from app.core.db import AsyncSessionLocal
+from app.core.logging import get_logger
+from app.models.db_models import IdempotencyRecord, utcnow
+
+log = get_logger(__name__)
+
+M = TypeVar("M", bound=BaseModel)
+
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used with a different request payload."""
+
+
+class IdempotencyInFlight(Exception):
+    """Another request with the same key did not finish within the wait timeout."""
+
+
+def fingerprint(payload: BaseModel) -> str:
+    return sha256(payload.model_dump_json(by_alias=True).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Stores the first response per (scope, Idempotency-Key) and replays it on retries.
+
+    The cache is the fast path (record + short-lived lock via SET NX); the database keeps
+    a durable copy so replays survive cache eviction and restarts. Concurrent duplicates
+    wait for the in-flight request's result instead of executing again. The lock holds a
+    per-request token: it is renewed while the handler runs and only deleted by its
+    holder, and the first stored response is never overwritten.
+    """
+
+    def __init__(
+        self,
+        cache: AsyncCache | None = None,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+        ttl: int | None = None,
+        lock_ttl: int | None = None,
+        wait_timeout: float | None = None,
+        poll_interval: float = 0.05,
+    ):
+        s = get_settings()
+        self.cache = cache if cache is not None else get_async_cache()
+        self.session_factory = session_factory
+        self.ttl = ttl or s.IDEMPOTENCY_TTL
+        self.lock_ttl = lock_ttl or s.IDEMPOTENCY_LOCK_TTL
+        self.wait_timeout = wait_timeout if wait_timeout is not None else s.IDEMPOTENCY_WAIT
+        self.poll_interval = poll_interval
+
+    async def _load(self, key: str) -> dict[str, Any] | None:
+        raw = await self.cache.get(f"idem:{key}")
+        if raw is not None:
+            return json.loads(raw)
+        async with self.session_factory() as session:
+            rec = await session.get(IdempotencyRecord, key)
+        if rec is None:
+            return None
+        created = rec.created_at.replace(tzinfo=utcnow().tzinfo)
+        if utcnow() - created > timedelta(seconds=self.ttl):
+            return None
+        stored = {"hash": rec.request_hash, "body": json.loads(rec.response_body)}
+        # Re-warm the cache so the next retry does not touch the database
+        await self.cache.set(f"idem:{key}", json.dumps(stored), ex=self.ttl)
+        return stored
+
+    async def _save(self, key: str, request_hash: str, body: dict[str, Any]) -> None:
+        async with self.session_factory() as session:
+            session.add(
+                IdempotencyRecord(
+                    key=key, request_hash=request_hash, response_body=json.dumps(body)
+                )
+            )
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Insert-or-ignore: a live record was stored first and stays authoritative;
+                # only one past the replay window is replaced
+                await session.rollback()
+                rec = await session.get(IdempotencyRecord, key)
+                created = rec.created_at.replace(tzinfo=utcnow().tzinfo)
+                if utcnow() - created > timedelta(seconds=self.ttl):
+                    rec.request_hash, rec.response_body = request_hash, json.dumps(body)
+                    rec.created_at = utcnow()
+                    await session.commit()
+                else:
+                    request_hash, body = rec.request_hash, json.loads(rec.response_body)
+        stored = {"hash": request_hash, "body": body}
+        await self.cache.set(f"idem:{key}", json.dumps(stored), ex=self.ttl)
+
+    async def _keep_locked(self, lock_key: str, token: str) -> None:
+        # Renew well before expiry so a slow handler never lets a duplicate in
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+            if not await self.cache.expire_if(lock_key, token, self.lock_ttl):
+                log.warning(f"idempotency lock {lock_key} was lost while its handler ran")
+                return
+
+    @staticmethod
+    def _check(stored: dict[str, Any], request_hash: str) -> dict[str, Any]:
+        if stored["hash"] != request_hash:
+            raise IdempotencyConflict("Idempotency-Key reused with a different request")
+        return stored["body"]
+
+    async def run(
+        self,
+        key: str,
+        request_hash: str,
+        handler: Callable[[], Awaitable[dict[str, Any]]],
+    ) -> tuple[dict[str, Any], bool]:
+        """Return (response body, replayed)."""
+        deadline = time.monotonic() + self.wait_timeout
+        lock_key, token = f"idem:{key}:lock", uuid.uuid4().hex
+        while True:
+            stored = await self._load(key)
+            if stored is not None:
+                return self._check(stored, request_hash), True
+            if await self.cache.add(lock_key, token, ex=self.lock_ttl):
+                break
+            if time.monotonic() >= deadline:
+                raise IdempotencyInFlight("a request with this Idempotency-Key is in progress")
+            await asyncio.sleep(self.poll_interval)
+        keeper = asyncio.create_task(self._keep_locked(lock_key, token))
+        try:
+            body = await handler()
+            await self._save(key, request_hash, body)
+            return body, False
+        finally:
+            keeper.cancel()
+            # Compare-and-delete: never release a lock another request now holds
+            await self.cache.delete_if(lock_key, token)
+
+
+_store: IdempotencyStore | None = None
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    global _store
+    if _store is None:
+        _store = IdempotencyStore()
+    return _store
+
+
+async def idempotent(
+    scope: str,
+    key: str | None,
+    request: BaseModel,
+    response: Response,
+    model: type[M],
+    handler: Callable[[], Awaitable[M]],
+) -> M:
+    """Run `handler` at most once per Idempotency-Key and replay its response on retries."""
+    if key is None:
+        return await handler()
+    if not 0 < len(key) <= 128:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1-128 characters")
+
+    async def run() -> dict[str, Any]:
+        return (await handler()).model_dump(mode="json")
+
+    store = get_idempotency_store()
+    try:
+        body, replayed = await store.run(f"{scope}:{key}", fingerprint(request), run)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInFlight as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if replayed:
+        response.headers[REPLAY_HEADER] = "true"
+    return model.model_validate(body)
@@ -0,0 +1,29 @@
+from __future__ import annotations
+from typing import Sequence
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+
+
+def _existing(name: str):
+    # Best-effort: reuse a collector already registered under this name (module reloads in tests)
+    try:
+        return REGISTRY._names_to_collectors.get(name)  # type: ignore[attr-defined]
+    except Exception:  # pragma: no cover - internal API may change
+        return None
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return _existing(name) or Counter(name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return _existing(name) or Gauge(name, documentation, labelnames)
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = Histogram.DEFAULT_BUCKETS,
+) -> Histogram:
+    return _existing(name) or Histogram(name, documentation, labelnames, buckets=buckets)
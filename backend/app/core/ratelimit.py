@@ -0,0 +1,320 @@
+from __future__ import annotations
+import json
+import math
+import re
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from hashlib import sha256
+from typing import Any, Awaitable, Callable, MutableMapping, Sequence
+
+from starlette.responses import JSONResponse
+
+from app.core.cache import AsyncCache, get_async_cache
+from app.core.config import get_settings
+from app.core.logging import get_logger
+from app.core.metrics import counter
+
+log = get_logger(__name__)
+
+RATE_LIMITED_TOTAL = counter(
+    "rate_limited_total", "Requests refused with 429", ["scope"]  # phone | operator | api_key
+)
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+# JSON bodies up to this size are read to find the phone/operator; larger ones are not
+JSON_BODY_LIMIT = 64 * 1024
+OPERATOR_PATH = "/api/operators/"
+# Float slack so exactly `count` back-to-back requests fit in the burst
+_SLACK = 1e-9
+
+# KEYS: one per limit. ARGV: interval and period (seconds) for each key, in order.
+# Admits the request only if every key has room, then advances all of them; returns
+# {seconds to wait, 1-based index of the key that refused} or {"0", 0}.
+GCRA_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local tats = {}
+local wait, refused = 0, 0
+for i, key in ipairs(KEYS) do
+  local tat = tonumber(redis.call('GET', key) or 0)
+  if tat < now then tat = now end
+  tats[i] = tat + tonumber(ARGV[2 * i - 1])
+  local over = tats[i] - now - tonumber(ARGV[2 * i]) - 1e-6
+  if over > wait then wait, refused = over, i end
+end
+if refused > 0 then return {string.format('%.6f', wait), refused} end
+for i, key in ipairs(KEYS) do
+  local ttl = math.ceil((tats[i] - now) * 1000)
+  redis.call('SET', key, string.format('%.6f', tats[i]), 'PX', ttl)
+end
+return {'0', 0}
+"""
+
+
+@dataclass(frozen=True)
+class Limit:
+    """`count` requests per `period` seconds: all at once as a burst, or spread out."""
+
+    scope: str
+    count: int
+    period: float
+    interval: float = field(init=False)  # seconds one request adds to a key's TAT
+
+    def __post_init__(self) -> None:
+        if self.count < 1 or self.period <= 0:
+            raise ValueError("count must be at least 1 and period positive")
+        object.__setattr__(self, "interval", self.period / self.count)
+
+
+Check = tuple[str, Limit]
+
+
+class MemoryGCRA:
+    """In-process GCRA state: key -> theoretical arrival time (TAT).
+
+    A key admits a request while its TAT is at most one `period` ahead of now; each
+    admitted request pushes the TAT one `interval` further. There are no locks: `hit`
+    reads and writes the dict without awaiting, so on the event loop no other request
+    can interleave with it. Keys whose TAT has passed hold no state and are swept once
+    the dict has doubled since the last sweep.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, min_sweep: int = 10_000):
+        self.clock = clock
+        self._tats: dict[str, float] = {}
+        self._min_sweep = self._sweep_at = min_sweep
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+    def hit(self, checks: Sequence[Check]) -> tuple[float, str | None]:
+        """Admit one request against every (key, limit): (0.0, None) if admitted, else
+        (seconds until it would be, scope of the limit that refused). A refused request
+        counts against no key."""
+        now = self.clock()
+        tats = self._tats
+        wait, refused = 0.0, None
+        advanced = []
+        for key, limit in checks:
+            tat = tats.get(key, now)
+            tat = (tat if tat > now else now) + limit.interval
+            over = tat - now - limit.period - _SLACK
+            if over > wait:
+                wait, refused = over, limit.scope
+            advanced.append(tat)
+        if refused is not None:
+            return wait, refused
+        for (key, _), tat in zip(checks, advanced):
+            tats[key] = tat
+        if len(tats) >= self._sweep_at:
+            self._sweep(now)
+        return 0.0, None
+
+    def _sweep(self, now: float) -> None:
+        self._tats = {k: t for k, t in self._tats.items() if t > now}
+        self._sweep_at = max(self._min_sweep, 2 * len(self._tats))
+
+
+def _limit(scope: str, count: int, period: float) -> Limit | None:
+    return Limit(scope, count, period) if count > 0 else None
+
+
+class RateLimiter:
+    """Per-phone, per-operator and per-API-key GCRA limits, checked together.
+
+    A request carrying several identities must be within every one of their limits.
+    With Redis the state is shared by all replicas: one Lua script checks and advances
+    all of a request's keys atomically. Otherwise it is kept in process by `MemoryGCRA`.
+    Limits default to settings; a count of 0 turns that limit off.
+    """
+
+    def __init__(
+        self,
+        phone: int | None = None,
+        operator: int | None = None,
+        api_key: int | None = None,
+        period: float | None = None,
+        enabled: bool | None = None,
+        cache: AsyncCache | None = None,
+        memory: MemoryGCRA | None = None,
+    ):
+        s = get_settings()
+        period = period or s.RATE_LIMIT_PERIOD
+        on = s.RATE_LIMIT_ENABLED if enabled is None else enabled
+        counts = [
+            s.RATE_LIMIT_PHONE if phone is None else phone,
+            s.RATE_LIMIT_OPERATOR if operator is None else operator,
+            s.RATE_LIMIT_API_KEY if api_key is None else api_key,
+        ]
+        self.phone, self.operator, self.api_key = (
+            _limit(scope, count if on else 0, period)
+            for scope, count in zip(("phone", "operator", "api_key"), counts)
+        )
+        self._cache = cache
+        self.memory = memory or MemoryGCRA()
+        self._script: Any = None
+
+    @property
+    def cache(self) -> AsyncCache:
+        return self._cache or get_async_cache()
+
+    @property
+    def active(self) -> bool:
+        return bool(self.phone or self.operator or self.api_key)
+
+    @property
+    def reads_body(self) -> bool:
+        return bool(self.phone or self.operator)
+
+    def checks(
+        self, phone: str | None = None, operator: str | None = None, api_key: str | None = None
+    ) -> list[Check]:
+        """Cache keys and limits for a request's identities. Phone numbers are keyed by
+        their last nine digits, so +2547..., 2547... and 07... share one limit; API keys
+        by a hash, so they are not stored in the clear."""
+        checks = []
+        if phone and self.phone:
+            digits = re.sub(r"\D", "", phone)[-9:]
+            if digits:
+                checks.append((f"rl:phone:{digits}", self.phone))
+        if operator and self.operator:
+            checks.append((f"rl:operator:{operator.lower()}", self.operator))
+        if api_key and self.api_key:
+            digest = sha256(api_key.encode()).hexdigest()[:32]
+            checks.append((f"rl:key:{digest}", self.api_key))
+        return checks
+
+    async def hit(
+        self, phone: str | None = None, operator: str | None = None, api_key: str | None = None
+    ) -> tuple[float, str | None]:
+        """(0.0, None) if the request is admitted (and counted), else (seconds to wait,
+        scope of the limit that refused it)."""
+        checks = self.checks(phone, operator, api_key)
+        if not checks:
+            return 0.0, None
+        client = self.cache.redis
+        if client is not None:  # pragma: no cover - external service
+            wait, refused = await self._hit_redis(client, checks)
+        else:
+            wait, refused = self.memory.hit(checks)
+        if refused is not None:
+            RATE_LIMITED_TOTAL.labels(scope=refused).inc()
+        return wait, refused
+
+    async def _hit_redis(
+        self, client: Any, checks: list[Check]
+    ) -> tuple[float, str | None]:  # pragma: no cover - external service
+        if self._script is None or self._script.registered_client is not client:
+            self._script = client.register_script(GCRA_LUA)
+        args = [x for _, limit in checks for x in (limit.interval, limit.period)]
+        try:
+            wait, refused = await self._script(keys=[key for key, _ in checks], args=args)
+        except Exception as e:
+            # Fail open: an unreachable Redis must not take the API down with it
+            log.warning(f"rate limit check failed, admitting: {e!r}")
+            return 0.0, None
+        refused = int(refused)
+        return (float(wait), checks[refused - 1][1].scope) if refused else (0.0, None)
+
+
+@lru_cache(maxsize=1)
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide limiter, so every request shares the in-memory state."""
+    return RateLimiter()
+
+
+def identify(body: bytes) -> tuple[str | None, str | None]:
+    """(phone, operator) named in a JSON request body: `phone` and `operator` at the top
+    level or in a conversion's `from` leg."""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None, None
+    if not isinstance(data, dict):
+        return None, None
+    phone, operator = data.get("phone"), data.get("operator")
+    leg = data.get("from")
+    if isinstance(leg, dict):
+        phone = phone if phone is not None else leg.get("phone")
+        operator = operator if operator is not None else leg.get("operator")
+    return (
+        phone if isinstance(phone, str) else None,
+        operator if isinstance(operator, str) else None,
+    )
+
+
+async def _read_json(receive: Receive) -> tuple[bytes | None, Receive]:
+    """Buffers the request body while it is within JSON_BODY_LIMIT. Returns the body
+    (None if larger or cut short) and a receive that replays what was read."""
+    messages: list[Message] = []
+    size, more = 0, True
+    while more and size <= JSON_BODY_LIMIT:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            break
+        size += len(message.get("body", b""))
+        more = message.get("more_body", False)
+    body = None
+    if not more and size <= JSON_BODY_LIMIT:
+        body = b"".join(m.get("body", b"") for m in messages)
+
+    async def replay() -> Message:
+        return messages.pop(0) if messages else await receive()
+
+    return body, replay
+
+
+class RateLimitMiddleware:
+    """ASGI middleware answering 429 with Retry-After to callers over their limit.
+
+    Callers are identified by the `X-API-Key` header, the operator in the path
+    (`/api/operators/{operator}/...`) or JSON body, and the phone number in a JSON body
+    (USSD hops, Daraja debits, KYC). JSON bodies are read here and replayed to the app;
+    other bodies (CSV/NDJSON uploads) stream through untouched.
+    """
+
+    def __init__(self, app: Callable[..., Awaitable[None]], limiter: RateLimiter | None = None):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        limiter = self.limiter or get_rate_limiter()
+        if scope["type"] != "http" or not limiter.active:
+            await self.app(scope, receive, send)
+            return
+        api_key = content_type = None
+        for name, value in scope["headers"]:
+            if name == b"x-api-key":
+                api_key = value.decode("latin-1")
+            elif name == b"content-type":
+                content_type = value
+        phone = operator = None
+        path = scope["path"]
+        if path.startswith(OPERATOR_PATH):
+            operator = path[len(OPERATOR_PATH):].split("/", 1)[0]
+        if (
+            limiter.reads_body
+            and content_type is not None
+            and content_type.startswith(b"application/json")
+            and scope["method"] in ("POST", "PUT", "PATCH")
+        ):
+            body, receive = await _read_json(receive)
+            if body:
+                phone, named = identify(body)
+                operator = operator or named
+        wait, refused = await limiter.hit(phone, operator, api_key)
+        if refused is None:
+            await self.app(scope, receive, send)
+            return
+        response = JSONResponse(
+            {"detail": f"Too many requests for this {refused}"},
+            status_code=429,
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+        await response(scope, receive, send)
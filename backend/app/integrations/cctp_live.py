@@ -1,23 +1,68 @@
 from __future__ import annotations
-from typing import Any
+import asyncio
+from typing import Any, Optional
+
+import httpx
+
+from app.core.config import get_settings
+from app.integrations.http_pool import get_http_client
+
+
+def _attestation_of(resp: httpx.Response) -> Optional[str]:
+    # Circle answers 404 until it has seen the burn, then "pending_confirmations"
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    body = resp.json()
+    return body.get("attestation") if body.get("status") == "complete" else None
+
 
 class CCTPClient:
-    """Placeholder for real Circle CCTP client.
+    """Circle CCTP client.
 
-    Expected to implement cross-chain flows:
+    Attestations come from Circle's attestation service (`GET /v1/attestations/{hash}`,
+    keyed by the burn's message hash) over the process-wide pooled "cctp" HTTP client,
+    so lookups reuse connections and fail fast while Circle's circuit is open. Burn and
+    mint still need chain signers and are not implemented in this scaffold:
     - initiate_burn(chain, amount)
-    - fetch_attestation(burn_tx)
     - mint_on_destination(chain, attestation)
     """
 
-    def __init__(self, network: str = "mainnet"):
+    def __init__(
+        self,
+        network: str = "mainnet",
+        attestation_url: Optional[str] = None,
+        timeout: float = 10.0,
+    ):
         self.network = network
+        self.attestation_url = attestation_url or get_settings().CCTP_ATTESTATION_URL
+        self.timeout = timeout
+        self.http = get_http_client("cctp", self.attestation_url)
 
     def initiate_burn(self, chain: str, amount: float) -> dict[str, Any]:
         raise NotImplementedError("CCTP live client not implemented in this scaffold")
 
-    def fetch_attestation(self, burn_tx: str) -> dict[str, Any]:
-        raise NotImplementedError("CCTP live client not implemented in this scaffold")
+    async def fetch_attestation(self, burn_tx: str) -> dict[str, Any]:
+        resp = await self.http.get(f"/v1/attestations/{burn_tx}", timeout=self.timeout)
+        attestation = _attestation_of(resp)
+        status = "attested" if attestation is not None else "pending"
+        return {"status": status, "burn_tx": burn_tx, "attestation": attestation}
+
+    async def fetch_attestations(self, burn_txs: list[str]) -> dict[str, Optional[str]]:
+        """Look up a batch of burns concurrently; unattested or failed lookups map to None."""
+        responses = await asyncio.gather(
+            *(self.http.get(f"/v1/attestations/{tx}", timeout=self.timeout) for tx in burn_txs),
+            return_exceptions=True,
+        )
+        found: dict[str, Optional[str]] = {}
+        for tx, resp in zip(burn_txs, responses):
+            try:
+                if isinstance(resp, BaseException):
+                    raise resp
+                found[tx] = _attestation_of(resp)
+            except (httpx.HTTPError, ValueError):
+                found[tx] = None  # polled again after backoff
+        return found
 
     def mint_on_destination(self, chain: str, attestation: str) -> dict[str, Any]:
         raise NotImplementedError("CCTP live client not implemented in this scaffold")
@@ -1,4 +1,5 @@
 from __future__ import annotations
+import uuid
 from typing import Any, Optional
 
 class DarajaClient:
@@ -14,3 +15,30 @@ class DarajaClient:
         if amount <= 0:
             raise ValueError("amount must be positive")
         return {"status": "queued", "ref": f"daraja-{phone[-4:]}-{int(amount)}"}
+
+    async def stk_push(
+        self, phone: str, amount: float, reference: str = "JuaPesa", description: str = "Debit"
+    ) -> dict[str, Any]:
+        if amount <= 0:
+            raise ValueError("amount must be positive")
+        if not float(amount).is_integer():
+            raise ValueError("amount must be whole shillings")
+        return {
+            "MerchantRequestID": f"stub-{reference}",
+            "CheckoutRequestID": f"ws_CO_stub_{phone[-4:]}_{uuid.uuid4().hex[:12]}",
+            "ResponseCode": "0",
+            "ResponseDescription": "Success. Request accepted for processing",
+        }
+
+    async def b2c_payment(
+        self, phone: str, amount: float, reference: str = "", originator_id: Optional[str] = None
+    ) -> dict[str, Any]:
+        if amount <= 0:
+            raise ValueError("amount must be positive")
+        originator = originator_id or f"b2c-{phone[-4:]}-{int(amount)}"
+        return {
+            "ConversationID": f"AG_stub_{originator}",
+            "OriginatorConversationID": originator,
+            "ResponseCode": "0",
+            "ResponseDescription": "Accept the service request successfully.",
+        }
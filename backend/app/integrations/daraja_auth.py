@@ -0,0 +1,140 @@
+from __future__ import annotations
+import asyncio
+import json
+import time
+import uuid
+from hashlib import sha256
+from typing import Callable
+
+from app.core.cache import AsyncCache, get_async_cache
+from app.core.config import get_settings
+from app.core.logging import get_logger
+from app.core.metrics import counter
+from app.integrations.http_pool import ResilientClient
+
+log = get_logger(__name__)
+
+DARAJA_TOKEN_FETCHES_TOTAL = counter(
+    "daraja_token_fetches_total", "OAuth token fetches from Daraja", ["outcome"]
+)
+
+
+class DarajaTokenManager:
+    """Caches Daraja OAuth access tokens for one credential set.
+
+    Calls are served from this process's copy while it is valid. Inside the last
+    `refresh_margin` seconds before expiry the current token is still returned and a
+    refresh runs in the background; only an expired (or missing) token makes callers
+    wait. Refreshes are single-flight: one task per process, and across workers a short
+    `Cache.add` lock lets one worker fetch while the others pick its token up from the
+    cache.
+    """
+
+    def __init__(
+        self,
+        http: ResilientClient,
+        consumer_key: str,
+        consumer_secret: str,
+        cache: AsyncCache | None = None,
+        refresh_margin: float | None = None,
+        lock_ttl: int | None = None,
+        wait_timeout: float | None = None,
+        poll_interval: float = 0.05,
+        clock: Callable[[], float] = time.time,
+    ):
+        s = get_settings()
+        self.http = http
+        self.auth = (consumer_key, consumer_secret)
+        self.cache = cache if cache is not None else get_async_cache()
+        self.refresh_margin = (
+            refresh_margin if refresh_margin is not None else s.DARAJA_TOKEN_REFRESH_MARGIN
+        )
+        self.lock_ttl = lock_ttl or s.DARAJA_TOKEN_LOCK_TTL
+        self.wait_timeout = wait_timeout if wait_timeout is not None else s.DARAJA_TOKEN_WAIT
+        self.poll_interval = poll_interval
+        self.clock = clock  # wall clock: expiry times are shared between workers
+        # Keyed by a digest of the credentials so secrets never appear in the cache
+        digest = sha256(f"{http.base_url}|{consumer_key}:{consumer_secret}".encode())
+        self.cache_key = f"daraja:token:{digest.hexdigest()[:32]}"
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._revoked: str | None = None
+        self._refresh: asyncio.Task | None = None
+
+    async def token(self) -> str:
+        now = self.clock()
+        if self._token is not None and now < self._expires_at:
+            if now >= self._expires_at - self.refresh_margin and self._refresh is None:
+                self._start_refresh().add_done_callback(self._log_failure)
+            return self._token
+        return await asyncio.shield(self._refresh or self._start_refresh())
+
+    def invalidate(self) -> None:
+        """Drop the current token, e.g. after Daraja rejected it with 401; the next call
+        fetches a new one rather than reusing the cached copy."""
+        self._revoked = self._token
+        self._token = None
+        self._expires_at = 0.0
+
+    def _start_refresh(self) -> asyncio.Task:
+        self._refresh = asyncio.create_task(self._refreshed())
+        return self._refresh
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            log.warning(f"background Daraja token refresh failed: {task.exception()}")
+
+    def _fresh(self, expires_at: float) -> bool:
+        return self.clock() < expires_at - self.refresh_margin
+
+    async def _refreshed(self) -> str:
+        try:
+            token, expires_at = await self._coordinated()
+            self._token, self._expires_at = token, expires_at
+            return token
+        finally:
+            self._refresh = None
+
+    async def _coordinated(self) -> tuple[str, float]:
+        lock_key = f"{self.cache_key}:lock"
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            raw = await self.cache.get(self.cache_key)
+            if raw is not None:
+                cached = json.loads(raw)
+                if self._fresh(cached["expires_at"]) and cached["token"] != self._revoked:
+                    # another worker already refreshed
+                    DARAJA_TOKEN_FETCHES_TOTAL.labels(outcome="shared").inc()
+                    return cached["token"], cached["expires_at"]
+            if await self.cache.add(lock_key, owner, ex=self.lock_ttl):
+                break
+            if time.monotonic() >= deadline:
+                # The lock holder went quiet (it expires after lock_ttl): fetch ourselves
+                return await self._fetch()
+            await asyncio.sleep(self.poll_interval)
+        try:
+            token, expires_at = await self._fetch()
+            ttl = max(1, int(expires_at - self.clock()))
+            await self.cache.set(
+                self.cache_key, json.dumps({"token": token, "expires_at": expires_at}), ex=ttl
+            )
+            return token, expires_at
+        finally:
+            # A fetch slower than lock_ttl may find the lock re-taken; leave that one be
+            await self.cache.delete_if(lock_key, owner)
+
+    async def _fetch(self) -> tuple[str, float]:
+        try:
+            resp = await self.http.get(
+                "/oauth/v1/generate", params={"grant_type": "client_credentials"}, auth=self.auth
+            )
+            resp.raise_for_status()
+            body = resp.json()
+        except Exception:
+            DARAJA_TOKEN_FETCHES_TOTAL.labels(outcome="error").inc()
+            raise
+        DARAJA_TOKEN_FETCHES_TOTAL.labels(outcome="fetched").inc()
+        # Daraja sends expires_in as a string, e.g. "3599"
+        return body["access_token"], self.clock() + float(body["expires_in"])
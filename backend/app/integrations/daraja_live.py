@@ -1,18 +1,112 @@
 from __future__ import annotations
+import base64
+import uuid
+from datetime import datetime, timedelta, timezone
 from typing import Any, Optional
 
+from app.core.config import get_settings
+from app.integrations.daraja_auth import DarajaTokenManager
+from app.integrations.http_pool import get_http_client
+
+EAT = timezone(timedelta(hours=3))  # Daraja timestamps are Nairobi local time
+
+
 class DarajaClient:
-    """Placeholder for real Daraja client.
+    """Daraja (M-Pesa) client.
 
-    Expected to implement:
-    - OAuth/token management
-    - STK push and C2B/B2C operations
-    - Callback validation and idempotency
+    Requests go through the process-wide pooled "daraja" HTTP client (keep-alive,
+    retries, circuit breaker) and carry an OAuth token from a shared
+    DarajaTokenManager. Results of STK pushes and B2C payments arrive on the callback
+    URLs (see app.services.daraja_callbacks).
     """
 
-    def __init__(self, base_url: str = "https://api.safaricom.co.ke", api_key: Optional[str] = None):
-        self.base_url = base_url
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        consumer_key: Optional[str] = None,
+        consumer_secret: Optional[str] = None,
+        tokens: Optional[DarajaTokenManager] = None,
+    ):
+        s = get_settings()
+        self.base_url = base_url or s.DARAJA_BASE_URL
         self.api_key = api_key
+        self.http = get_http_client("daraja", self.base_url)
+        self.tokens = tokens or DarajaTokenManager(
+            self.http,
+            consumer_key or s.DARAJA_CONSUMER_KEY,
+            consumer_secret or s.DARAJA_CONSUMER_SECRET,
+        )
 
     def simulate_debit(self, phone: str, amount: float) -> dict[str, Any]:
         raise NotImplementedError("Daraja live client not implemented in this scaffold")
+
+    async def auth_headers(self) -> dict[str, str]:
+        return {"Authorization": f"Bearer {await self.tokens.token()}"}
+
+    async def stk_push(
+        self, phone: str, amount: float, reference: str = "JuaPesa", description: str = "Debit"
+    ) -> dict[str, Any]:
+        """Ask the customer to approve a debit on their phone (Lipa na M-Pesa Online).
+
+        Daraja answers once the prompt is queued; the outcome arrives on the callback URL.
+        M-Pesa only moves whole shillings, so fractional amounts are rejected.
+        """
+        if amount <= 0:
+            raise ValueError("amount must be positive")
+        if not float(amount).is_integer():
+            raise ValueError("amount must be whole shillings")
+        s = get_settings()
+        timestamp = datetime.now(EAT).strftime("%Y%m%d%H%M%S")
+        password = base64.b64encode(
+            f"{s.DARAJA_SHORTCODE}{s.DARAJA_PASSKEY}{timestamp}".encode()
+        ).decode()
+        msisdn = phone.lstrip("+")
+        payload = {
+            "BusinessShortCode": s.DARAJA_SHORTCODE,
+            "Password": password,
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": int(amount),
+            "PartyA": msisdn,
+            "PartyB": s.DARAJA_SHORTCODE,
+            "PhoneNumber": msisdn,
+            "CallBackURL": s.DARAJA_CALLBACK_URL,
+            "AccountReference": reference,
+            "TransactionDesc": description,
+        }
+        return await self._post("/mpesa/stkpush/v1/processrequest", payload)
+
+    async def b2c_payment(
+        self, phone: str, amount: float, reference: str = "", originator_id: Optional[str] = None
+    ) -> dict[str, Any]:
+        """Pay `amount` whole shillings from the business shortcode to `phone`.
+
+        Daraja answers once the payment is queued; the result arrives on DARAJA_RESULT_URL.
+        """
+        if amount <= 0:
+            raise ValueError("amount must be positive")
+        s = get_settings()
+        payload = {
+            "OriginatorConversationID": originator_id or uuid.uuid4().hex,
+            "InitiatorName": s.DARAJA_INITIATOR_NAME,
+            "SecurityCredential": s.DARAJA_SECURITY_CREDENTIAL,
+            "CommandID": "BusinessPayment",
+            "Amount": int(amount),
+            "PartyA": s.DARAJA_SHORTCODE,
+            "PartyB": phone.lstrip("+"),
+            "Remarks": reference or "JuaPesa payout",
+            "QueueTimeOutURL": s.DARAJA_RESULT_URL,
+            "ResultURL": s.DARAJA_RESULT_URL,
+            "Occasion": reference,
+        }
+        return await self._post("/mpesa/b2c/v3/paymentrequest", payload)
+
+    async def _post(self, path: str, payload: dict[str, Any]) -> dict[str, Any]:
+        resp = await self.http.post(path, json=payload, headers=await self.auth_headers())
+        if resp.status_code == 401:
+            # Token revoked before its advertised expiry: fetch a new one and retry once
+            self.tokens.invalidate()
+            resp = await self.http.post(path, json=payload, headers=await self.auth_headers())
+        resp.raise_for_status()
+        return resp.json()
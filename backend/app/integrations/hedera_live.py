@@ -1,5 +1,9 @@
 from __future__ import annotations
-from typing import Any
+from typing import Any, Optional
+
+from app.core.config import get_settings
+from app.integrations.http_pool import get_http_client
+
 
 class HederaClient:
     """Placeholder for real Hedera client using HTS/EVM SDK.
@@ -8,13 +12,28 @@ class HederaClient:
     - mint(token, amount)
     - burn(token, amount)
     - transfer(token, to, amount) [optional]
+
+    Receipts are read from the mirror node over the process-wide pooled "hedera" HTTP
+    client.
     """
 
-    def __init__(self, network: str = "mainnet"):
+    def __init__(self, network: str = "mainnet", mirror_url: Optional[str] = None):
         self.network = network
+        self.mirror_url = mirror_url or get_settings().HEDERA_MIRROR_URL
+        self.http = get_http_client("hedera", self.mirror_url)
 
     def mint(self, token: str, amount: float) -> dict[str, Any]:
         raise NotImplementedError("Hedera live client not implemented in this scaffold")
 
     def burn(self, token: str, amount: float) -> dict[str, Any]:
         raise NotImplementedError("Hedera live client not implemented in this scaffold")
+
+    async def transaction_result(self, transaction_id: str) -> Optional[str]:
+        """Consensus result of a transaction (e.g. "SUCCESS"), or None until the mirror
+        node has it."""
+        resp = await self.http.get(f"/api/v1/transactions/{transaction_id}")
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        transactions = resp.json().get("transactions") or [{}]
+        return transactions[0].get("result")
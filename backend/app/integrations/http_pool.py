@@ -0,0 +1,229 @@
+from __future__ import annotations
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Callable
+
+import httpx
+
+from app.core.config import get_settings
+from app.core.logging import get_logger
+from app.core.metrics import counter, gauge
+
+log = get_logger(__name__)
+
+INTEGRATION_REQUESTS_TOTAL = counter(
+    "integration_requests_total",
+    "Upstream HTTP attempts by integration and outcome",
+    ["integration", "outcome"],  # ok | error | retry | rejected
+)
+CIRCUIT_STATE = gauge(
+    "integration_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+    ["integration"],
+)
+
+try:  # HTTP/2 needs the optional h2 package (httpx[http2])
+    import h2  # noqa: F401
+
+    HTTP2 = True
+except ImportError:  # pragma: no cover - depends on installed extras
+    HTTP2 = False
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: `failure_threshold` failures open it for
+    `reset_timeout` seconds, after which a single probe is let through (half-open).
+    The probe closing or re-opening the circuit decides what happens to later calls.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = self.CLOSED
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.labels(integration=name).set(0)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def _set(self, state: str) -> None:
+        if state != self._state:
+            log.warning(f"circuit {self.name}: {self._state} -> {state}")
+        self._state = state
+        CIRCUIT_STATE.labels(integration=self.name).set(self._GAUGE[state])
+
+    def allow(self) -> bool:
+        """Raise CircuitOpenError unless a call may go upstream now; True if the caller
+        is the half-open probe, which must then report an outcome whatever happens."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return False
+            if self._state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self._set(self.HALF_OPEN)  # this caller is the probe
+                return True
+        raise CircuitOpenError(f"{self.name} circuit is {self._state}")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._set(self.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                self._set(self.OPEN)
+
+
+class ResilientClient:
+    """Shared `httpx.AsyncClient` for one upstream with retries and a circuit breaker.
+
+    Connections are pooled and kept alive across calls (HTTP/2 when `h2` is installed),
+    capped by `max_connections`. Transport errors and 5xx responses count against the
+    breaker and are retried with jittered exponential backoff when the request is safe
+    to repeat; once the breaker opens, calls fail fast with CircuitOpenError instead of
+    queueing on a dead upstream.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        timeout: float | None = None,
+        max_connections: int | None = None,
+        max_keepalive: int | None = None,
+        retries: int | None = None,
+        retry_backoff: float | None = None,
+        breaker: CircuitBreaker | None = None,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        s = get_settings()
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout or s.HTTP_TIMEOUT
+        self.limits = httpx.Limits(
+            max_connections=max_connections or s.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=max_keepalive or s.HTTP_MAX_KEEPALIVE,
+        )
+        self.retries = retries if retries is not None else s.HTTP_RETRIES
+        self.retry_backoff = retry_backoff if retry_backoff is not None else s.HTTP_RETRY_BACKOFF
+        self.breaker = breaker or CircuitBreaker(
+            name, s.BREAKER_FAILURE_THRESHOLD, s.BREAKER_RESET_SECONDS
+        )
+        self._transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Pooled connections belong to the event loop that opened them; a new loop (e.g.
+        # a test's asyncio.run) gets its own pool
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=HTTP2,
+                transport=self._transport,
+            )
+            self._loop = loop
+        return self._client
+
+    async def request(
+        self, method: str, url: str, *, idempotent: bool | None = None, **kwargs: Any
+    ) -> httpx.Response:
+        """Send a request; returns the last response (which may be a 5xx) or raises the
+        last transport error / CircuitOpenError."""
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempts = 1 + (self.retries if idempotent else 0)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                probe = self.breaker.allow()
+            except CircuitOpenError:
+                self._count("rejected")
+                raise
+            try:
+                resp = await self.client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                self.breaker.record_failure()
+                if attempt == attempts:
+                    self._count("error")
+                    raise
+            except BaseException:
+                # Cancelled (or an unexpected error) mid-call: a probe that never reports
+                # back would leave the circuit half-open, rejecting every call for good
+                if probe:
+                    self.breaker.record_failure()
+                raise
+            else:
+                if resp.status_code < 500:
+                    self.breaker.record_success()
+                    self._count("ok")
+                    return resp
+                self.breaker.record_failure()
+                if attempt == attempts:
+                    self._count("error")
+                    return resp
+            self._count("retry")
+            delay = self.retry_backoff * 2 ** (attempt - 1)
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+
+    def _count(self, outcome: str) -> None:
+        INTEGRATION_REQUESTS_TOTAL.labels(integration=self.name, outcome=outcome).inc()
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self) -> None:
+        # A pool opened on another (finished) loop can't be closed from this one
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = self._loop = None
+
+
+_clients: dict[str, ResilientClient] = {}
+
+
+def get_http_client(name: str, base_url: str) -> ResilientClient:
+    """Process-wide client for integration `name`, shared by every live client object."""
+    client = _clients.get(name)
+    if client is None or client.base_url != base_url:
+        client = _clients[name] = ResilientClient(name, base_url)
+    return client
+
+
+async def close_http_clients() -> None:
+    """Release pooled upstream connections at application shutdown."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
@@ -1,4 +1,6 @@
 from __future__ import annotations
+from functools import lru_cache
+
 from app.core.config import get_settings
 from app.integrations.daraja import DarajaClient as DarajaStub
 from app.integrations.cctp import CCTPClient as CCTPStub
@@ -21,6 +23,9 @@ except Exception:  # pragma: no cover
     HederaLive = None  # type: ignore
 
 
+# Process-wide singletons: live clients share one pooled HTTP client per upstream, so
+# building one per request would only churn objects. cache_clear() after changing flags.
+@lru_cache(maxsize=1)
 def get_daraja_client():
     s = get_settings()
     if getattr(s, "USE_STUB_DARAJA", True) or DarajaLive is None:
@@ -28,6 +33,7 @@ def get_daraja_client():
     return DarajaLive()
 
 
+@lru_cache(maxsize=1)
 def get_cctp_client():
     s = get_settings()
     if getattr(s, "USE_STUB_CCTP", True) or CCTPLive is None:
@@ -35,6 +41,7 @@ def get_cctp_client():
     return CCTPLive()
 
 
+@lru_cache(maxsize=1)
 def get_hedera_client():
     s = get_settings()
     if getattr(s, "USE_STUB_HEDERA", True) or HederaLive is None:
@@ -15,8 +15,18 @@ from app.core.logging import setup_logging, get_logger
 
 from app.api.routes import router as api_router
 from app.models.db_models import Base
-from app.core.db import engine
+from app.core.db import engine, async_engine, check_database
 from app.core.config import get_settings, Info
+from app.core.cache import CacheStatsCollector, init_async_cache, close_async_cache
+from app.core.ratelimit import RateLimitMiddleware
+from app.services.conversion import get_conversion_pipeline
+from app.services.daraja_callbacks import get_callback_ingestor
+from app.services.disbursement import get_disbursement_service
+from app.services.flows import get_flow_store
+from app.services.pools import get_pool_engine
+from app.services.summaries import get_summary_scheduler
+from app.services.ussd import get_ussd_menu
+from app.integrations.http_pool import close_http_clients
 
 app = FastAPI(title="Jua Pesa Backend", version="0.1.0")
 
@@ -52,11 +62,47 @@ if not _metric_exists("http_request_latency_seconds"):
 else:  # pragma: no cover - only hit in reload scenarios
     HTTP_REQUEST_LATENCY_SECONDS = REGISTRY._names_to_collectors["http_request_latency_seconds"]  # type: ignore[index]
 
+if not _metric_exists("cache_entries"):
+    # Exports Cache.stats() (size, hits/misses, evictions, expirations) on /metrics
+    REGISTRY.register(CacheStatsCollector())
+
 
 @app.on_event("startup")
 async def on_startup() -> None:
     # Create tables if they don't exist
     Base.metadata.create_all(bind=engine)
+    # Shared async cache/connection pool for request handlers
+    await init_async_cache()
+    # Compile the USSD menu into its transition table before the first session arrives
+    get_ussd_menu()
+    # Pool balances from liquidity_pools plus the journal; periodic write-back
+    await get_pool_engine().start()
+    # Conversion workers; resumes conversions left unfinished by the last shutdown
+    await get_conversion_pipeline().start()
+    # Daraja callbacks: bounded queue drained by one batching ledger writer
+    await get_callback_ingestor().start()
+    # Bulk B2C payouts; resumes jobs that were still sending
+    await get_disbursement_service().start()
+    # Flow history for forecasts: backfilled from the ledger, then kept following it
+    await get_flow_store().start()
+    # Operator summaries precomputed into the cache on a staggered cadence
+    await get_summary_scheduler().start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    await get_summary_scheduler().stop()
+    await get_flow_store().stop()
+    await get_disbursement_service().stop()
+    await get_callback_ingestor().stop()
+    await get_conversion_pipeline().stop()
+    await get_pool_engine().stop()
+    await close_http_clients()
+    await close_async_cache()
+    await async_engine.dispose()
+
+# Per-phone/operator/API-key limits; added before CORS so 429s still carry CORS headers
+app.add_middleware(RateLimitMiddleware)
 
 # Configure CORS
 _settings = get_settings()
@@ -130,9 +176,8 @@ async def metrics() -> Response:
 async def readyz() -> JSONResponse:
     """Readiness probe that checks DB connectivity."""
     try:
-        # simple connection test
-        with engine.connect() as conn:
-            conn.exec_driver_sql("SELECT 1")
+        # simple connection test on the async engine; never blocks the event loop
+        await check_database()
         return JSONResponse({"ready": True})
     except Exception as e:  # pragma: no cover - only hit on infra error
         return JSONResponse({"ready": False, "error": str(e)}, status_code=503)
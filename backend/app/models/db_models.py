@@ -1,7 +1,12 @@
 from __future__ import annotations
+from datetime import datetime, timezone
 from typing import Optional
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import String, Integer, Float, ForeignKey
+from sqlalchemy import BigInteger, DateTime, String, Integer, Float, ForeignKey, Index, Text, func
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
 
 
 class Base(DeclarativeBase):
@@ -21,7 +26,8 @@ class User(Base):
 class Wallet(Base):
     __tablename__ = "wallets"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    # One wallet per user (User.wallet is one-to-one)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), unique=True, index=True)
     balance_local: Mapped[float] = mapped_column(Float, default=0.0)
     balance_usdc: Mapped[float] = mapped_column(Float, default=0.0)
 
@@ -29,16 +35,190 @@ class Wallet(Base):
 
 
 class LedgerEntry(Base):
+    """One side of a double-entry posting; the postings of a tx_id sum to zero per asset."""
+
     __tablename__ = "ledger_entries"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    wallet_id: Mapped[int] = mapped_column(ForeignKey("wallets.id"))
-    amount: Mapped[float] = mapped_column(Float)
+    __table_args__ = (
+        Index("ix_ledger_entries_account_asset_id", "account", "asset", "id"),
+        # History/statement paging: WHERE account|wallet_id = ? ORDER BY created_at, id
+        Index("ix_ledger_entries_account_created", "account", "created_at", "id"),
+        Index("ix_ledger_entries_wallet_created", "wallet_id", "created_at"),
+        Index("ix_ledger_entries_tx_id", "tx_id"),
+    )
+    # BIGINT like the partitioned Postgres table; SQLite only autoincrements INTEGER keys
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True
+    )
+    tx_id: Mapped[str] = mapped_column(String(64))
+    account: Mapped[str] = mapped_column(String(64))  # e.g., wallet:<user>, pool:<name>
+    wallet_id: Mapped[Optional[int]] = mapped_column(ForeignKey("wallets.id"), nullable=True)
+    amount_minor: Mapped[int] = mapped_column(BigInteger)  # signed, in the asset's minor units
     asset: Mapped[str] = mapped_column(String(16))  # e.g., LOCAL, USDC
     note: Mapped[str] = mapped_column(String(255), default="")
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, server_default=func.now()
+    )
+
+
+class BalanceSnapshot(Base):
+    """Balance of an account/asset as of (and including) ledger entry `last_entry_id`."""
+
+    __tablename__ = "balance_snapshots"
+    __table_args__ = (
+        Index("ix_balance_snapshots_account_asset_entry", "account", "asset", "last_entry_id"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    account: Mapped[str] = mapped_column(String(64))
+    asset: Mapped[str] = mapped_column(String(16))
+    balance_minor: Mapped[int] = mapped_column(BigInteger)
+    last_entry_id: Mapped[int] = mapped_column(BigInteger)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, server_default=func.now()
+    )
+
+
+class Conversion(Base):
+    """Persisted state of one conversion as it moves through the integration pipeline."""
+
+    __tablename__ = "conversions"
+    __table_args__ = (
+        # Resume on startup: WHERE state NOT IN (terminal states)
+        Index("ix_conversions_state", "state"),
+        # STK results find the conversion they pay for
+        Index("ix_conversions_checkout_id", "checkout_id"),
+    )
+    tx_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    user_id: Mapped[str] = mapped_column(String(64))
+    phone: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)  # payer's MSISDN
+    from_rail: Mapped[str] = mapped_column(String(32))
+    from_operator: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    amount: Mapped[float] = mapped_column(Float)
+    to_token: Mapped[str] = mapped_column(String(16))
+    to_chain: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    mode: Mapped[str] = mapped_column(String(16))
+    state: Mapped[str] = mapped_column(String(16), default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)  # failed attempts of the current step
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    steps: Mapped[str] = mapped_column(Text, default="{}")  # JSON: step name -> client result
+    checkout_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # STK push
+    # Pipeline instance running the conversion; others take over once the lease lapses
+    owner: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    lease_until: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, server_default=func.now()
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, onupdate=utcnow, server_default=func.now()
+    )
+
+
+class DisbursementJob(Base):
+    """One bulk B2C payout batch; per-row progress lives in DisbursementRow."""
+
+    __tablename__ = "disbursement_jobs"
+    # Resume on startup: WHERE status IN ('queued', 'running')
+    __table_args__ = (Index("ix_disbursement_jobs_status", "status"),)
+    id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    status: Mapped[str] = mapped_column(String(16), default="queued")
+    total: Mapped[int] = mapped_column(Integer, default=0)  # rows received
+    invalid: Mapped[int] = mapped_column(Integer, default=0)  # rows rejected by validation
+    # Operator float the payouts draw on: B2C results post from ledger account pool:<pool>
+    pool: Mapped[str] = mapped_column(String(64), default="safaricom", server_default="safaricom")
+    # Service instance dispatching the job; others take over once the lease lapses
+    owner: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    lease_until: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, server_default=func.now()
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, onupdate=utcnow, server_default=func.now()
+    )
+
+
+class DisbursementRow(Base):
+    __tablename__ = "disbursement_rows"
+    __table_args__ = (
+        # Dispatch pages and progress counts: WHERE job_id = ? AND status = ? ORDER BY id
+        Index("ix_disbursement_rows_job_status_id", "job_id", "status", "id"),
+        Index("ix_disbursement_rows_job_row", "job_id", "row_no", unique=True),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    job_id: Mapped[str] = mapped_column(ForeignKey("disbursement_jobs.id"))
+    row_no: Mapped[int] = mapped_column(Integer)  # 1-based position in the upload
+    phone: Mapped[str] = mapped_column(String(32))  # normalised MSISDN, or as uploaded if invalid
+    amount: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    reference: Mapped[str] = mapped_column(String(64), default="")
+    # pending | invalid | sending (B2C call made, no answer recorded) | sent | failed
+    status: Mapped[str] = mapped_column(String(16))
+    error: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    conversation_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
 
 
 class LiquidityPoolRecord(Base):
+    """Pool balances as of journal entry `applied_seq` (written behind by PoolEngine)."""
+
     __tablename__ = "liquidity_pools"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String(64), unique=True)
-    balance: Mapped[float] = mapped_column(Float, default=0.0)
+    balance: Mapped[float] = mapped_column(Float, default=0.0)  # major units, for display
+    asset: Mapped[str] = mapped_column(String(16), default="LOCAL", server_default="LOCAL")
+    balance_minor: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
+    reserved_minor: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
+    applied_seq: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
+
+
+class PoolJournalEntry(Base):
+    """Append-only log of pool operations; replayed past `applied_seq` on startup."""
+
+    __tablename__ = "pool_journal"
+    __table_args__ = (Index("ix_pool_journal_pool_id", "pool", "id"),)
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    pool: Mapped[str] = mapped_column(String(64))
+    op: Mapped[str] = mapped_column(String(16))  # credit | debit | reserve | commit | release
+    reservation_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    amount_minor: Mapped[int] = mapped_column(BigInteger)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, server_default=func.now()
+    )
+
+
+class ServiceLease(Base):
+    """Exclusive, expiring claim on a singleton (e.g. the PoolEngine owning the pools)."""
+
+    __tablename__ = "service_leases"
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    owner: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    lease_until: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class DarajaCallbackRecord(Base):
+    """Raw Daraja callback, stored before it is acknowledged and replayed on startup
+    until its ledger posting is written (`booked_at`)."""
+
+    __tablename__ = "daraja_callbacks"
+    __table_args__ = (
+        # Durable dedupe of redeliveries (the cache only remembers them for a while)
+        Index("ix_daraja_callbacks_kind_ref", "kind", "ref", unique=True),
+        # Replay on startup: WHERE booked_at IS NULL
+        Index("ix_daraja_callbacks_booked", "booked_at"),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(8))  # stk | c2b | b2c
+    ref: Mapped[str] = mapped_column(String(64))
+    body: Mapped[str] = mapped_column(Text)
+    booked_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, server_default=func.now()
+    )
+
+
+class IdempotencyRecord(Base):
+    """Durable copy of the first response for an Idempotency-Key (cache is the fast path)."""
+
+    __tablename__ = "idempotency_records"
+    key: Mapped[str] = mapped_column(String(200), primary_key=True)  # <scope>:<client key>
+    request_hash: Mapped[str] = mapped_column(String(64))
+    response_body: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=utcnow, server_default=func.now()
+    )
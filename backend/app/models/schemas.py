@@ -1,24 +1,28 @@
+from datetime import datetime
 from pydantic import BaseModel, Field
-from typing import Literal, Optional
+from typing import Any, Literal, Optional
 
 
 class USSDSessionRequest(BaseModel):
     sessionId: str
     phone: str
-    input: str
-    menuState: Optional[str] = None
+    input: str  # this hop's input only; empty when the user first dials in
+    menuState: Optional[str] = None  # ignored: the server keeps the session's state
 
 
 class USSDSessionResponse(BaseModel):
     prompt: str
     nextMenuState: str
     actions: list[Literal["debit", "credit", "convert", "confirm"]] = Field(default_factory=list)
+    end: bool = False  # last screen: the gateway should close the session
+    data: dict[str, str] = Field(default_factory=dict)  # inputs collected so far
 
 
 class ConvertLeg(BaseModel):
     rail: str
     operator: Optional[str] = None
     amount: float
+    phone: Optional[str] = None  # payer's M-Pesa number; defaults to the user's registered one
 
 
 class ConvertDest(BaseModel):
@@ -43,6 +47,17 @@ class ConvertResponse(BaseModel):
     fees: float
 
 
+class ConversionStatus(BaseModel):
+    txId: str
+    status: Literal["submitted", "failed", "completed"]
+    state: str  # pipeline step reached, e.g. pending, burned, minted
+    attempts: int
+    lastError: Optional[str] = None
+    steps: dict[str, Any]
+    createdAt: datetime
+    updatedAt: datetime
+
+
 class RebalanceRequest(BaseModel):
     sourcePool: str
     destPool: str
@@ -56,6 +71,53 @@ class RebalanceResponse(BaseModel):
     status: Literal["placed", "failed", "executed"]
 
 
+class PlanPool(BaseModel):
+    name: str
+    balance: float = Field(ge=0)  # free liquidity now, major units
+    asset: str = "LOCAL"
+    minBalance: Optional[float] = Field(default=None, ge=0)  # overrides the request's
+
+
+class PlanRoute(BaseModel):
+    source: str
+    dest: str
+    feeBps: int = Field(ge=0)
+    capacity: Optional[float] = Field(default=None, gt=0)
+
+
+class LiquidityPlanRequest(BaseModel):
+    window: Literal["1h", "4h", "24h"] = "4h"
+    # Omitted: every pool held by the pool engine, at its available balance
+    pools: Optional[list[PlanPool]] = Field(default=None, min_length=1)
+    # Omitted: any surplus pool can send to any deficit pool of the same asset
+    routes: Optional[list[PlanRoute]] = None
+    minBalance: float = Field(default=0.0, ge=0)
+
+
+class PlannedTransfer(BaseModel):
+    sourcePool: str
+    destPool: str
+    asset: str
+    amount: float
+    fee: float
+
+
+class PoolProjection(BaseModel):
+    pool: str
+    asset: str
+    balance: float
+    predictedNetFlow: float
+    projected: float
+    deficit: float
+    unmet: float  # part of the deficit the plan cannot cover
+
+
+class LiquidityPlanResponse(BaseModel):
+    window: str
+    transfers: list[PlannedTransfer]
+    pools: list[PoolProjection]
+
+
 class KYCRequest(BaseModel):
     phone: str
     idNumber: str
@@ -77,6 +139,42 @@ class DarajaDebitResponse(BaseModel):
     ref: str
 
 
+class DarajaCallbackAck(BaseModel):
+    # Daraja's expected acknowledgement shape
+    ResultCode: int = 0
+    ResultDesc: str = "Accepted"
+
+
+class DisbursementJobStatus(BaseModel):
+    jobId: str
+    status: Literal["receiving", "queued", "running", "completed", "aborted"]
+    pool: str  # operator float the payouts draw on
+    total: int  # rows received
+    invalid: int
+    pending: int
+    sending: int  # B2C call made, answer not recorded; settled by the B2C callback
+    sent: int  # accepted by Daraja (or confirmed by its B2C callback)
+    failed: int
+    createdAt: datetime
+    updatedAt: datetime
+
+
+class DisbursementRowStatus(BaseModel):
+    row: int
+    phone: str
+    amount: Optional[float] = None
+    reference: str
+    status: Literal["pending", "invalid", "sending", "sent", "failed"]
+    error: Optional[str] = None
+    conversationId: Optional[str] = None
+
+
+class DisbursementRowsPage(BaseModel):
+    jobId: str
+    rows: list[DisbursementRowStatus]
+    nextCursor: Optional[int] = None
+
+
 class ForecastRequest(BaseModel):
     operator: str
     window: Literal["1h", "4h", "24h"] = "4h"
@@ -88,6 +186,37 @@ class ForecastResponse(BaseModel):
     predictedNetFlow: float
 
 
+class ForecastBatchRequest(BaseModel):
+    operators: list[str] = Field(min_length=1)
+    windows: list[Literal["1h", "4h", "24h"]] = Field(
+        default_factory=lambda: ["1h", "4h", "24h"], min_length=1
+    )
+
+
+class ForecastBatchResponse(BaseModel):
+    """Columnar grid: predictedNetFlow[i][j] is operators[i] over windows[j]."""
+
+    operators: list[str]
+    windows: list[str]
+    predictedNetFlow: list[list[float]]
+
+
 class OperatorSummaryResponse(BaseModel):
     operator: str
     summary: str
+
+
+class StatementEntry(BaseModel):
+    id: int
+    txId: str
+    asset: str
+    amount: float
+    amountMinor: int
+    note: str
+    createdAt: str
+
+
+class StatementPage(BaseModel):
+    walletId: int
+    entries: list[StatementEntry]
+    nextCursor: Optional[str] = None
@@ -0,0 +1,204 @@
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import random
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from app.core.config import get_settings
+from app.core.logging import get_logger
+from app.core.metrics import counter, gauge, histogram
+from app.integrations.integration_factory import get_cctp_client
+
+log = get_logger(__name__)
+
+ATTESTATIONS_OUTSTANDING = gauge(
+    "cctp_attestations_outstanding", "Burns waiting for a CCTP attestation"
+)
+ATTESTATION_WAIT_SECONDS = histogram(
+    "cctp_attestation_wait_seconds",
+    "Time from watching a burn to its attestation",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600),
+)
+ATTESTATION_POLLS_TOTAL = counter(
+    "cctp_attestation_polls_total", "Attestation lookups by outcome", ["outcome"]
+)
+
+# burn txs -> attestation per burn (None while still pending)
+Fetch = Callable[[list[str]], Awaitable[dict[str, Optional[str]]]]
+
+
+def client_fetcher(client: Any) -> Fetch:
+    """Batch lookup for a CCTP client: its own `fetch_attestations` if it has one,
+    otherwise concurrent `fetch_attestation` calls in worker threads."""
+    batch = getattr(client, "fetch_attestations", None)
+    if batch is not None:
+        return batch
+
+    async def one(burn_tx: str) -> Optional[str]:
+        try:
+            res = await asyncio.to_thread(client.fetch_attestation, burn_tx)
+        except Exception as e:
+            log.warning(f"attestation lookup failed burn_tx={burn_tx}: {e}")
+            return None
+        return res.get("attestation") if res.get("status") == "attested" else None
+
+    async def fetch(burn_txs: list[str]) -> dict[str, Optional[str]]:
+        return dict(zip(burn_txs, await asyncio.gather(*(one(tx) for tx in burn_txs))))
+
+    return fetch
+
+
+@dataclass
+class _Watch:
+    future: asyncio.Future
+    since: float
+    delay: float = 0.0
+    polls: int = 0
+
+
+class AttestationPoller:
+    """Polls Circle for many outstanding burns from a single task.
+
+    Burns sit in a heap ordered by next-poll time; each round takes up to `batch_size`
+    due burns and looks them up in one batch, with at most `concurrency` batches in
+    flight. Unattested burns back off exponentially, with jitter, from `min_delay` to
+    `max_delay`, and the first re-poll waits for most of the recently observed
+    attestation latency instead of polling a burn that cannot be ready yet. `watch`
+    returns a future resolved with the attestation, or failed with TimeoutError after
+    `timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        fetch: Fetch | None = None,
+        client: Any = None,
+        batch_size: int | None = None,
+        min_delay: float | None = None,
+        max_delay: float | None = None,
+        timeout: float | None = None,
+        concurrency: int | None = None,
+    ):
+        s = get_settings()
+        self.fetch = fetch or client_fetcher(client or get_cctp_client())
+        self.batch_size = batch_size or s.CCTP_POLL_BATCH
+        self.min_delay = min_delay if min_delay is not None else s.CCTP_POLL_MIN_DELAY
+        self.max_delay = max_delay if max_delay is not None else s.CCTP_POLL_MAX_DELAY
+        self.timeout = timeout or s.CCTP_ATTESTATION_TIMEOUT
+        self.concurrency = concurrency or s.CCTP_CONCURRENCY
+        self.expected_latency: float | None = None  # EWMA of watch -> attestation
+        self._heap: list[tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._watches: dict[str, _Watch] = {}
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._polls: set[asyncio.Task] = set()
+
+    def outstanding(self) -> int:
+        return len(self._watches)
+
+    def watch(self, burn_tx: str) -> asyncio.Future:
+        """Future for `burn_tx`'s attestation; the first lookup happens right away."""
+        w = self._watches.get(burn_tx)
+        if w is None:
+            loop = asyncio.get_running_loop()
+            w = _Watch(loop.create_future(), loop.time())
+            self._watches[burn_tx] = w
+            ATTESTATIONS_OUTSTANDING.inc()
+            self._ensure_running()
+            self._schedule(burn_tx, 0.0)
+        return w.future
+
+    async def wait(self, burn_tx: str) -> str:
+        # Shielded: a cancelled waiter must not cancel the future other waiters share
+        return await asyncio.shield(self.watch(burn_tx))
+
+    async def stop(self) -> None:
+        tasks = [t for t in (self._task, *self._polls) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for w in self._watches.values():
+            w.future.cancel()
+        ATTESTATIONS_OUTSTANDING.dec(len(self._watches))
+        self._watches.clear()
+        self._heap.clear()
+        self._polls.clear()
+        self._task = self._wakeup = None
+
+    def _ensure_running(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def _schedule(self, burn_tx: str, delay: float) -> None:
+        due = asyncio.get_running_loop().time() + delay
+        if not self._heap or due < self._heap[0][0]:
+            assert self._wakeup is not None
+            self._wakeup.set()  # new earliest deadline: re-arm the scheduler's sleep
+        heapq.heappush(self._heap, (due, next(self._seq), burn_tx))
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            batch: list[str] = []
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                batch.append(heapq.heappop(self._heap)[2])
+            if batch:
+                await slots.acquire()
+                task = asyncio.create_task(self._poll(batch))
+                self._polls.add(task)
+                task.add_done_callback(self._polls.discard)
+                task.add_done_callback(lambda _: slots.release())
+                continue
+            sleep = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), sleep)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, batch: list[str]) -> None:
+        try:
+            found = await self.fetch(batch)
+        except Exception as e:
+            log.warning(f"attestation batch of {len(batch)} failed: {e}")
+            ATTESTATION_POLLS_TOTAL.labels(outcome="error").inc(len(batch))
+            found = {}
+        now = asyncio.get_running_loop().time()
+        for burn_tx in batch:
+            w = self._watches[burn_tx]
+            attestation = found.get(burn_tx)
+            if attestation is not None:
+                ATTESTATION_POLLS_TOTAL.labels(outcome="attested").inc()
+                self._watches.pop(burn_tx)
+                ATTESTATIONS_OUTSTANDING.dec()
+                w.future.set_result(attestation)
+                waited = now - w.since
+                ATTESTATION_WAIT_SECONDS.observe(waited)
+                self.expected_latency = (
+                    waited
+                    if self.expected_latency is None
+                    else 0.8 * self.expected_latency + 0.2 * waited
+                )
+            elif now - w.since >= self.timeout:
+                self._watches.pop(burn_tx)
+                ATTESTATIONS_OUTSTANDING.dec()
+                w.future.set_exception(TimeoutError(f"no attestation for {burn_tx}"))
+            else:
+                if burn_tx in found:
+                    ATTESTATION_POLLS_TOTAL.labels(outcome="pending").inc()
+                self._schedule(burn_tx, self._next_delay(w, now))
+
+    def _next_delay(self, w: _Watch, now: float) -> float:
+        w.polls += 1
+        if w.polls == 1 and self.expected_latency is not None:
+            # Attestations usually land after about the observed latency: wait for most
+            # of it rather than re-polling a burn that cannot be attested yet
+            return max(self.min_delay, 0.8 * self.expected_latency - (now - w.since))
+        w.delay = min(self.max_delay, max(self.min_delay, w.delay * 2))
+        return random.uniform(w.delay / 2, w.delay)
@@ -0,0 +1,561 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+import json
+import math
+import random
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Callable, Sequence
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.core.db import AsyncSessionLocal
+from app.core.logging import get_logger
+from app.core.metrics import counter
+from app.integrations.integration_factory import (
+    get_cctp_client,
+    get_daraja_client,
+    get_hedera_client,
+)
+from app.models.db_models import Conversion, DarajaCallbackRecord, User, utcnow
+from app.services.attestation import AttestationPoller
+from app.services.daraja_callbacks import DarajaCallback, get_callback_ingestor, parse_callback
+from app.services.pools import PoolEngine, get_pool_engine
+from app.services.wallet import WalletService
+from app.utils.ids import new_tx_id
+
+log = get_logger(__name__)
+
+CONVERSION_STEPS_TOTAL = counter(
+    "conversion_steps_total", "Conversion pipeline step attempts", ["step", "outcome"]
+)
+
+TERMINAL_STATES = ("completed", "failed")
+# The payer has been prompted; the STK callback moves the conversion on (or fails it)
+AWAITING_PAYMENT = "awaiting_payment"
+
+
+@dataclass(frozen=True)
+class Step:
+    name: str  # key of the step's result in Conversion.steps
+    integration: str  # client whose concurrency limit applies ("ledger" is unlimited)
+    next_state: str
+
+
+# state -> step that moves a conversion out of it; AWAITING_PAYMENT has none
+STEPS: dict[str, Step] = {
+    "pending": Step("debit", "daraja", AWAITING_PAYMENT),
+    "debited": Step("burn", "cctp", "burned"),
+    "burned": Step("attestation", "cctp", "attested"),
+    "attested": Step("bridge", "cctp", "bridged"),
+    "bridged": Step("mint", "hedera", "minted"),
+    "minted": Step("settle", "ledger", "completed"),
+}
+
+
+class _Parked(Exception):
+    """The step is waiting on an event that will re-queue the conversion."""
+
+
+def status_of(state: str) -> str:
+    return state if state in TERMINAL_STATES else "submitted"
+
+
+class ConversionPipeline:
+    """Runs conversions as a persisted state machine:
+    Daraja debit -> STK result -> CCTP burn -> attestation -> CCTP mint -> Hedera mint
+    -> ledger.
+
+    Every step's result and the next state are committed before the following step
+    starts, so a failed call or a restart resumes from the last completed step. Each
+    instance leases the conversions it runs (`owner`, `lease_until`) and renews the
+    leases every third of `lease_ttl`; the same loop picks up unfinished conversions
+    whose lease is free or has lapsed, so several processes share the backlog and a
+    dead one's conversions are taken over instead of being run twice. Failed steps
+    retry with jittered exponential backoff up to `max_attempts`. Worker count and
+    per-integration concurrency are independent: a slow CCTP cannot take every
+    worker's slot at Daraja or Hedera.
+    Conversions waiting for an attestation hold no worker at all (see `_attestation`).
+    Nor do those waiting for the payer: after the STK push a conversion is parked in
+    AWAITING_PAYMENT on its CheckoutRequestID, unowned, and `reconcile` (a
+    CallbackIngestor observer) resumes or fails it from the STK result on whichever
+    instance books the callback. The lease loop also picks up results that were stored
+    but never reconciled, and fails conversions left waiting past `payment_timeout`.
+    Submitting reserves the token amount in the destination token's liquidity pool;
+    settling commits the reservation and failing releases it.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+        clients: dict[str, Any] | None = None,
+        wallet: WalletService | None = None,
+        workers: int | None = None,
+        max_attempts: int | None = None,
+        retry_base: float | None = None,
+        retry_max: float | None = None,
+        limits: dict[str, int] | None = None,
+        poller: AttestationPoller | None = None,
+        pools: PoolEngine | None = None,
+        lease_ttl: float | None = None,
+        payment_timeout: float | None = None,
+    ):
+        s = get_settings()
+        self.session_factory = session_factory
+        self.clients = clients or {
+            "daraja": get_daraja_client(),
+            "cctp": get_cctp_client(),
+            "hedera": get_hedera_client(),
+        }
+        self.poller = poller or AttestationPoller(client=self.clients["cctp"])
+        self.wallet = wallet
+        self.pools = pools or get_pool_engine()
+        self.workers = workers or s.CONVERSION_WORKERS
+        self.max_attempts = max_attempts or s.CONVERSION_MAX_ATTEMPTS
+        self.retry_base = retry_base if retry_base is not None else s.CONVERSION_RETRY_BASE
+        self.retry_max = retry_max if retry_max is not None else s.CONVERSION_RETRY_MAX
+        self.limits = limits or {
+            "daraja": s.DARAJA_CONCURRENCY,
+            "cctp": s.CCTP_CONCURRENCY,
+            "hedera": s.HEDERA_CONCURRENCY,
+        }
+        self.source_chain = s.CCTP_SOURCE_CHAIN
+        self.avg_seconds = s.CONVERSION_ESTIMATE_SECONDS  # EWMA of a full run
+        self.lease_ttl = lease_ttl if lease_ttl is not None else s.CONVERSION_LEASE_TTL
+        self.payment_timeout = (
+            payment_timeout if payment_timeout is not None else s.CONVERSION_PAYMENT_TIMEOUT
+        )
+        self.owner = uuid.uuid4().hex
+        self._lease_task: asyncio.Task | None = None
+        self._queue: asyncio.Queue[str | None] | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._timers: set[asyncio.TimerHandle] = set()
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._running: set[str] = set()
+        self._wakeups: set[str] = set()
+        self._crashes: Counter[str] = Counter()
+        self._parked: dict[str, asyncio.Future] = {}  # tx_id -> attestation future
+        self._submitted: dict[str, float] = {}  # tx_id -> monotonic submit time
+
+    async def start(self) -> None:
+        """Start the workers and queue unfinished conversions no live instance holds."""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._semaphores = {name: asyncio.Semaphore(n) for name, n in self.limits.items()}
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        await self._claim_orphans()
+        self._lease_task = asyncio.create_task(self._lease_loop())
+
+    async def stop(self) -> None:
+        for timer in self._timers:
+            timer.cancel()
+        lease_task, self._lease_task = self._lease_task, None
+        if lease_task is not None:
+            lease_task.cancel()  # the loop also exits if the DB driver swallows this
+            await asyncio.gather(lease_task, return_exceptions=True)
+        for task in self._tasks:
+            task.cancel()
+        if self._queue is not None:
+            # The DB driver can swallow a cancellation that lands during session cleanup;
+            # a sentinel per worker still ends those loops
+            for _ in self._tasks:
+                self._queue.put_nowait(None)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._timers.clear()
+        self._tasks = []
+        self._queue = None
+        self._semaphores = {}
+        await self.poller.stop()
+        self._parked.clear()
+        self._submitted.clear()
+        # Hand the unfinished conversions over now rather than when the leases lapse
+        async with self.session_factory() as session:
+            await session.execute(
+                update(Conversion)
+                .where(Conversion.owner == self.owner, Conversion.state.not_in(TERMINAL_STATES))
+                .values(owner=None, lease_until=None)
+            )
+            await session.commit()
+
+    async def _lease_loop(self) -> None:
+        while self._lease_task is not None:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self._renew_leases()
+                await self._claim_orphans()
+                await self._collect_payments()
+            except Exception:
+                log.exception("conversion lease renewal failed")
+
+    async def _renew_leases(self) -> None:
+        async with self.session_factory() as session:
+            await session.execute(
+                update(Conversion)
+                .where(Conversion.owner == self.owner, Conversion.state.not_in(TERMINAL_STATES))
+                .values(lease_until=self._lease_deadline())
+            )
+            await session.commit()
+
+    async def _claim_orphans(self) -> None:
+        """Queue unfinished conversions that are unowned or whose owner's lease lapsed;
+        the claim itself happens in `_advance`, so instances racing here run each once."""
+        async with self.session_factory() as session:
+            orphans = await session.scalars(
+                select(Conversion.tx_id)
+                .where(Conversion.state.in_(tuple(STEPS)), self._claimable())
+                .order_by(Conversion.created_at)
+            )
+            for tx_id in orphans:
+                if tx_id not in self._running:
+                    self._enqueue(tx_id)
+
+    def _lease_deadline(self):
+        return utcnow() + timedelta(seconds=self.lease_ttl)
+
+    def _claimable(self):
+        return or_(
+            Conversion.owner.is_(None),
+            Conversion.owner == self.owner,
+            Conversion.lease_until < utcnow(),
+        )
+
+    async def _registered_phone(self, user_id: str) -> str | None:
+        if not user_id.isdigit():
+            return None
+        async with self.session_factory() as session:
+            user = await session.get(User, int(user_id))
+            return user.phone if user is not None else None
+
+    async def submit(
+        self,
+        user_id: str,
+        from_rail: str,
+        from_operator: str | None,
+        amount: float,
+        to_token: str,
+        to_chain: str | None,
+        mode: str,
+        phone: str | None = None,
+    ) -> str:
+        """Persist a new conversion and queue it; returns its tx id immediately.
+
+        `phone` is the payer's M-Pesa number; it defaults to the registered user's.
+        """
+        if amount <= 0:
+            raise ValueError("amount must be positive")
+        if not float(amount).is_integer():
+            raise ValueError("amount must be whole shillings")  # what an STK push can debit
+        phone = phone or await self._registered_phone(user_id)
+        if not phone:
+            raise ValueError("payer phone is required")
+        tx_id = new_tx_id(prefix="cv")
+        # The liquidity check: raises InsufficientLiquidity (a ValueError) if the
+        # destination token's pool cannot cover the conversion
+        token_amount = WalletService.token_amount(amount, to_token)
+        held = await asyncio.to_thread(self.pools.reserve, to_token.upper(), token_amount, tx_id)
+        try:
+            async with self.session_factory() as session:
+                session.add(
+                    Conversion(
+                        tx_id=tx_id,
+                        user_id=user_id,
+                        phone=phone,
+                        from_rail=from_rail,
+                        from_operator=from_operator,
+                        amount=amount,
+                        to_token=to_token,
+                        to_chain=to_chain,
+                        mode=mode,
+                        state="pending",
+                        attempts=0,
+                        steps="{}",
+                        owner=self.owner,
+                        lease_until=self._lease_deadline(),
+                    )
+                )
+                await session.commit()
+        except Exception:
+            if held:
+                await asyncio.to_thread(self.pools.release, tx_id)
+            raise
+        self._submitted[tx_id] = time.monotonic()
+        self._enqueue(tx_id)
+        return tx_id
+
+    async def get(self, tx_id: str) -> Conversion | None:
+        async with self.session_factory() as session:
+            return await session.get(Conversion, tx_id)
+
+    def queue_depth(self) -> int:
+        """Conversions waiting for a worker plus those being processed."""
+        return (self._queue.qsize() if self._queue is not None else 0) + len(self._running)
+
+    def estimated_completion(self) -> str:
+        # Each worker finishes one conversion per `avg_seconds`; the newest submission
+        # waits for the ones queued ahead of it
+        rounds = max(1, math.ceil(self.queue_depth() / self.workers))
+        return f"~{math.ceil(rounds * self.avg_seconds)}s"
+
+    def _enqueue(self, tx_id: str) -> None:
+        if self._queue is not None:
+            self._queue.put_nowait(tx_id)
+
+    def _retry_later(self, tx_id: str, attempts: int) -> None:
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        delay *= random.uniform(0.5, 1.0)
+
+        def fire() -> None:
+            self._timers.discard(handle)
+            self._enqueue(tx_id)
+
+        handle = asyncio.get_running_loop().call_later(delay, fire)
+        self._timers.add(handle)
+
+    async def _worker(self) -> None:
+        queue = self._queue
+        assert queue is not None
+        while True:
+            tx_id = await queue.get()
+            if tx_id is None:
+                return
+            try:
+                if tx_id in self._running:
+                    self._wakeups.add(tx_id)  # run it again once the current run ends
+                else:
+                    await self.advance(tx_id)
+                    self._crashes.pop(tx_id, None)
+            except KeyError:
+                log.warning(f"conversion {tx_id} not found")
+            except Exception:
+                # e.g. the database was unavailable: the conversion is still in its last
+                # committed state, so retry it like a failed step
+                log.exception(f"conversion {tx_id} crashed")
+                self._crashes[tx_id] += 1
+                self._retry_later(tx_id, self._crashes[tx_id])
+            finally:
+                queue.task_done()
+
+    async def advance(self, tx_id: str) -> str:
+        """Run the remaining steps of `tx_id`; returns the state it stopped in."""
+        self._running.add(tx_id)
+        try:
+            conv = await self._advance(tx_id)
+            if conv.state == AWAITING_PAYMENT:
+                # The STK result may have been stored before the wait was committed
+                await self._collect_payments([tx_id])
+        finally:
+            self._running.discard(tx_id)
+        if tx_id in self._wakeups:
+            # Re-queued while this run was in progress, e.g. its attestation landed
+            self._wakeups.discard(tx_id)
+            self._enqueue(tx_id)
+        elif conv.state in STEPS and conv.owner == self.owner and tx_id not in self._parked:
+            # A step failed with attempts left; re-queue only once this run has let go
+            self._retry_later(tx_id, conv.attempts)
+        return conv.state
+
+    async def _advance(self, tx_id: str) -> Conversion:
+        async with self.session_factory() as session:
+            claimed = await session.execute(
+                update(Conversion)
+                .where(
+                    Conversion.tx_id == tx_id,
+                    Conversion.state.in_(tuple(STEPS)),
+                    self._claimable(),
+                )
+                .values(owner=self.owner, lease_until=self._lease_deadline())
+            )
+            conv = await session.get(Conversion, tx_id)
+            # Committing after the read hands the connection back before the first step
+            await session.commit()
+            if conv is None:
+                raise KeyError(tx_id)
+            if not claimed.rowcount and conv.state in STEPS:
+                log.info(f"conversion {tx_id} is leased by another instance")
+                return conv
+            while conv.state in STEPS:
+                step = STEPS[conv.state]
+                results = json.loads(conv.steps)
+                try:
+                    results[step.name] = await self._run_step(step, conv, results)
+                except _Parked:
+                    return conv
+                except Exception as e:
+                    CONVERSION_STEPS_TOTAL.labels(step=step.name, outcome="error").inc()
+                    conv.attempts += 1
+                    conv.last_error = f"{step.name}: {e}"
+                    if conv.attempts >= self.max_attempts:
+                        conv.state = "failed"
+                    await session.commit()
+                    if conv.state == "failed":
+                        await asyncio.to_thread(self.pools.release, tx_id)
+                    return conv
+                CONVERSION_STEPS_TOTAL.labels(step=step.name, outcome="ok").inc()
+                conv.steps = json.dumps(results)
+                conv.state = step.next_state
+                conv.attempts = 0
+                conv.last_error = None
+                if conv.state == AWAITING_PAYMENT:
+                    # Let go: the instance that books the STK callback resumes it
+                    conv.owner = conv.lease_until = None
+                await session.commit()
+            started = self._submitted.pop(tx_id, None) if conv.state == "completed" else None
+            if started is not None:
+                # Submit to settlement, including time parked on the attestation
+                elapsed = time.monotonic() - started
+                self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * elapsed
+            return conv
+
+    async def _run_step(
+        self, step: Step, conv: Conversion, results: dict[str, Any]
+    ) -> dict[str, Any]:
+        sem = self._semaphores.get(step.integration)
+        async with sem if sem is not None else contextlib.nullcontext():
+            run = getattr(self, f"_{step.name}")
+            if asyncio.iscoroutinefunction(run):
+                return await run(conv, results)
+            # Clients (and the ledger) are blocking; keep them off the event loop
+            return await asyncio.to_thread(run, conv, results)
+
+    # One method per step (blocking ones run in a worker thread); each returns the
+    # client's result
+
+    async def _debit(self, conv: Conversion, results: dict[str, Any]) -> dict[str, Any]:
+        # Prompts the payer on their phone; the confirmed pay-in is booked when the STK
+        # callback arrives (app.services.daraja_callbacks), which also resumes the
+        # conversion (`reconcile`)
+        result = await self.clients["daraja"].stk_push(conv.phone, conv.amount)
+        conv.checkout_id = result["CheckoutRequestID"]
+        return result
+
+    def _burn(self, conv: Conversion, results: dict[str, Any]) -> dict[str, Any]:
+        amount = float(WalletService.token_amount(conv.amount, conv.to_token))
+        return self.clients["cctp"].initiate_burn(self.source_chain, amount)
+
+    async def _attestation(self, conv: Conversion, results: dict[str, Any]) -> dict[str, Any]:
+        # Waiting for Circle can take minutes: park the conversion instead of holding a
+        # worker, and let the poller re-queue it once the attestation lands (or times out)
+        burn_tx = results["burn"]["tx"]
+        future = self._parked.pop(conv.tx_id, None) or self.poller.watch(burn_tx)
+        if not future.done():
+            self._parked[conv.tx_id] = future
+            future.add_done_callback(lambda _: self._enqueue(conv.tx_id))
+            raise _Parked
+        return {"status": "attested", "burn_tx": burn_tx, "attestation": future.result()}
+
+    def _bridge(self, conv: Conversion, results: dict[str, Any]) -> dict[str, Any]:
+        attestation = results["attestation"]["attestation"]
+        return self.clients["cctp"].mint_on_destination(conv.to_chain or "hedera", attestation)
+
+    def _mint(self, conv: Conversion, results: dict[str, Any]) -> dict[str, Any]:
+        amount = float(WalletService.token_amount(conv.amount, conv.to_token))
+        return self.clients["hedera"].mint(conv.to_token.upper(), amount)
+
+    def _settle(self, conv: Conversion, results: dict[str, Any]) -> dict[str, Any]:
+        wallet = self.wallet or WalletService()
+        if not wallet.ledger.posted(conv.tx_id):
+            wallet.convert(
+                conv.user_id,
+                conv.from_rail,
+                conv.from_operator,
+                conv.amount,
+                conv.to_token,
+                conv.to_chain,
+                conv.mode,
+                tx_id=conv.tx_id,
+            )
+        self.pools.commit(conv.tx_id)  # no-op on a retry after it already went through
+        return {"status": "posted", "tx_id": conv.tx_id}
+
+    async def reconcile(self, callbacks: Sequence[DarajaCallback]) -> None:
+        """Resume or fail conversions waiting for the payer from STK results (a
+        CallbackIngestor observer): a confirmed payment moves one on to the burn, a
+        declined or cancelled prompt fails it with Daraja's reason."""
+        outcomes = {cb.ref: cb for cb in callbacks if cb.kind == "stk"}
+        if not outcomes:
+            return
+        resumed, failed = [], []
+        async with self.session_factory() as session:
+            # Every state: a result for a conversion that moved on is dropped below
+            waiting = await session.execute(
+                select(Conversion.tx_id, Conversion.checkout_id, Conversion.steps).where(
+                    Conversion.checkout_id.in_(list(outcomes))
+                )
+            )
+            for tx_id, checkout_id, steps in waiting.all():
+                cb = outcomes[checkout_id]
+                if cb.ok:
+                    paid = {"status": "paid", "receipt": cb.receipt, "amount": cb.amount}
+                    values = {
+                        "state": "debited",
+                        "steps": json.dumps({**json.loads(steps), "payment": paid}),
+                    }
+                else:
+                    values = {
+                        "state": "failed",
+                        "last_error": f"payment: {cb.desc or 'STK push was not completed'}",
+                    }
+                # Compare-and-set: a result applies once, however many instances see it
+                matched = await session.execute(
+                    update(Conversion)
+                    .where(Conversion.tx_id == tx_id, Conversion.state == AWAITING_PAYMENT)
+                    .values(**values)
+                )
+                if matched.rowcount:
+                    (resumed if cb.ok else failed).append(tx_id)
+            await session.commit()
+        for tx_id in resumed:
+            CONVERSION_STEPS_TOTAL.labels(step="payment", outcome="ok").inc()
+            self._enqueue(tx_id)
+        for tx_id in failed:
+            CONVERSION_STEPS_TOTAL.labels(step="payment", outcome="error").inc()
+            await asyncio.to_thread(self.pools.release, tx_id)
+
+    async def _collect_payments(self, tx_ids: list[str] | None = None) -> None:
+        """Reconcile waiting conversions (all, or `tx_ids`) from STK results already
+        stored, e.g. one that arrived before the wait was committed, and fail those
+        still without one after `payment_timeout`."""
+        # Waiting rows are unowned, so nothing touches updated_at after the STK push
+        cutoff = utcnow() - timedelta(seconds=self.payment_timeout)
+        async with self.session_factory() as session:
+            query = select(Conversion.checkout_id, Conversion.updated_at < cutoff).where(
+                Conversion.state == AWAITING_PAYMENT
+            )
+            if tx_ids is not None:
+                query = query.where(Conversion.tx_id.in_(tx_ids))
+            waiting = dict((await session.execute(query)).all())
+            if not waiting:
+                return
+            stored = await session.scalars(
+                select(DarajaCallbackRecord.body).where(
+                    DarajaCallbackRecord.kind == "stk",
+                    DarajaCallbackRecord.ref.in_(list(waiting)),
+                )
+            )
+            callbacks = [parse_callback("stk", json.loads(body)) for body in stored]
+        answered = {cb.ref for cb in callbacks}
+        desc = f"no STK result after {self.payment_timeout:g}s"
+        callbacks += [
+            DarajaCallback("stk", ref, False, desc=desc)
+            for ref, expired in waiting.items()
+            if expired and ref not in answered
+        ]
+        await self.reconcile(callbacks)
+
+
+_pipeline: ConversionPipeline | None = None
+
+
+def get_conversion_pipeline() -> ConversionPipeline:
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = ConversionPipeline()
+        get_callback_ingestor().observers.append(_pipeline.reconcile)
+    return _pipeline
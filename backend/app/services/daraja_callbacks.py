@@ -0,0 +1,407 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import hmac
+import json
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Sequence, TypeVar
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import AsyncCache, get_async_cache
+from app.core.config import get_settings
+from app.core.db import AsyncSessionLocal
+from app.core.logging import get_logger
+from app.core.metrics import counter, gauge, histogram
+from app.models.db_models import DarajaCallbackRecord, DisbursementJob, utcnow
+from app.services.disbursement import get_disbursement_service, payout_row
+from app.services.ledger import LedgerEngine, LedgerTransaction, Posting, get_ledger
+from app.services.wallet import LOCAL_ASSET
+from app.utils.money import to_minor
+
+log = get_logger(__name__)
+
+T = TypeVar("T")
+
+CALLBACKS_TOTAL = counter(
+    "daraja_callbacks_total",
+    "Daraja callbacks by kind and outcome",
+    ["kind", "outcome"],  # accepted | duplicate | invalid | unauthorized | busy
+)
+CALLBACK_QUEUE_DEPTH = gauge("daraja_callback_queue_depth", "Callbacks waiting for the ledger")
+CALLBACK_BATCH_SIZE = histogram(
+    "daraja_callback_batch_size",
+    "Callbacks written per ledger batch",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500),
+)
+
+SIGNATURE_HEADER = "X-Callback-Signature"
+
+
+class CallbackBusy(Exception):
+    """The callback could not be queued or stored; the caller should retry later."""
+
+
+@dataclass(frozen=True)
+class DarajaCallback:
+    kind: str
+    ref: str  # CheckoutRequestID (STK), TransID (C2B) or ConversationID (B2C)
+    ok: bool
+    amount: float | None = None
+    receipt: str | None = None
+    phone: str | None = None
+    originator: str | None = None  # B2C: the OriginatorConversationID we sent
+    desc: str | None = None  # Daraja's ResultDesc
+
+    def ledger_tx(self, pool: str | None = None) -> LedgerTransaction:
+        """Money confirmed by M-Pesa: pay-ins land in the rail's clearing account (the
+        conversion then moves them to the operator pool); B2C payouts leave `pool`, the
+        one their disbursement job pays out of (default DISBURSEMENT_POOL)."""
+        assert self.amount is not None
+        minor = to_minor(self.amount, LOCAL_ASSET)
+        if self.kind == "b2c":
+            src = f"pool:{pool or get_settings().DISBURSEMENT_POOL}"
+            dst, note = "external:m-pesa", "m-pesa payout"
+        else:
+            src, dst, note = "external:m-pesa", "clearing:m-pesa", "m-pesa pay-in"
+        return LedgerTransaction(
+            tx_id=f"mpesa-{self.receipt or self.ref}",
+            note=f"{note} {self.ref}",
+            postings=[
+                Posting(src, LOCAL_ASSET, -minor),
+                Posting(dst, LOCAL_ASSET, minor),
+            ],
+        )
+
+
+def _items(entries: list[dict[str, Any]], key: str) -> dict[str, Any]:
+    return {e[key]: e.get("Value") for e in entries if key in e}
+
+
+def parse_callback(kind: str, payload: dict[str, Any]) -> DarajaCallback:
+    """Normalise an STK, C2B confirmation or B2C result payload; ValueError if malformed."""
+    try:
+        if kind == "stk":
+            cb = payload["Body"]["stkCallback"]
+            ok = int(cb["ResultCode"]) == 0
+            meta = _items(cb.get("CallbackMetadata", {}).get("Item", []), "Name")
+            return DarajaCallback(
+                kind,
+                cb["CheckoutRequestID"],
+                ok,
+                float(meta["Amount"]) if ok else None,
+                meta.get("MpesaReceiptNumber"),
+                str(meta["PhoneNumber"]) if "PhoneNumber" in meta else None,
+                desc=cb.get("ResultDesc"),
+            )
+        if kind == "c2b":
+            return DarajaCallback(
+                kind,
+                payload["TransID"],
+                True,
+                float(payload["TransAmount"]),
+                payload["TransID"],
+                payload.get("MSISDN"),
+            )
+        if kind == "b2c":
+            result = payload["Result"]
+            ok = int(result["ResultCode"]) == 0
+            params = _items(
+                result.get("ResultParameters", {}).get("ResultParameter", []), "Key"
+            )
+            return DarajaCallback(
+                kind,
+                result["ConversationID"],
+                ok,
+                float(params["TransactionAmount"]) if ok else None,
+                result.get("TransactionID"),
+                originator=result.get("OriginatorConversationID"),
+                desc=result.get("ResultDesc"),
+            )
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"malformed {kind} callback: {e!r}") from None
+    raise ValueError(f"unknown callback kind {kind!r}")
+
+
+def sign(secret: str, body: bytes) -> str:
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class CallbackIngestor:
+    """Accepts Daraja callbacks fast and books them in the ledger in batches.
+
+    `ingest` checks the HMAC signature, parses the payload, claims its reference in the
+    cache (so redelivered callbacks are acknowledged but dropped), stores the raw
+    callback (`daraja_callbacks`, unique per reference) and enqueues it; only then is it
+    acknowledged. A single writer drains the bounded queue, booking every callback
+    waiting at that moment in one DB transaction, so a burst becomes a few large ledger
+    writes: each stored record is marked booked with a compare-and-set UPDATE and only
+    the records this writer claimed are posted, so a batch racing a replay is booked
+    once. Callbacks left unbooked (the writer gave up, or the process died) are
+    replayed by whichever instance holds the replay lock, once they are `replay_after`
+    seconds old. When the queue stays full for `enqueue_timeout` seconds, `ingest`
+    raises CallbackBusy and forgets the callback so the redelivery is not mistaken for
+    a duplicate; the same happens when the callback cannot be stored. Coroutines in
+    `observers` get each batch before it is booked (e.g. the DisbursementService
+    settling B2C rows) and must be idempotent: a failing observer means a replay.
+    """
+
+    def __init__(
+        self,
+        ledger: LedgerEngine | None = None,
+        cache: AsyncCache | None = None,
+        secret: str | None = None,
+        queue_size: int | None = None,
+        batch_size: int | None = None,
+        enqueue_timeout: float | None = None,
+        dedupe_ttl: int | None = None,
+        write_attempts: int = 3,
+        replay_after: float | None = None,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+    ):
+        s = get_settings()
+        self.ledger = ledger if ledger is not None else get_ledger()
+        self.cache = cache if cache is not None else get_async_cache()
+        self.session_factory = session_factory
+        self.secret = secret if secret is not None else s.DARAJA_CALLBACK_SECRET
+        self.env = s.ENV
+        self.queue_size = queue_size or s.DARAJA_CALLBACK_QUEUE_SIZE
+        self.batch_size = batch_size or s.DARAJA_CALLBACK_BATCH
+        self.enqueue_timeout = (
+            enqueue_timeout if enqueue_timeout is not None else s.DARAJA_CALLBACK_ENQUEUE_TIMEOUT
+        )
+        self.dedupe_ttl = dedupe_ttl or s.DARAJA_CALLBACK_DEDUPE_TTL
+        self.write_attempts = write_attempts
+        self.replay_after = (
+            replay_after if replay_after is not None else s.DARAJA_CALLBACK_REPLAY_AFTER
+        )
+        self.max_depth = 0  # high-water mark of the queue
+        self._queue: asyncio.Queue[tuple[int, DarajaCallback]] | None = None
+        self._writer: asyncio.Task | None = None
+        self._replayer: asyncio.Task | None = None
+        self.observers: list[Callable[[Sequence[DarajaCallback]], Awaitable[None]]] = []
+
+    def verify(self, body: bytes, signature: str | None) -> bool:
+        if not self.secret:
+            return self.env == "development"  # signing disabled only for local development
+        return signature is not None and hmac.compare_digest(sign(self.secret, body), signature)
+
+    async def start(self) -> None:
+        if self._queue is None:
+            if not self.secret and self.env != "development":
+                raise RuntimeError("DARAJA_CALLBACK_SECRET must be set outside development")
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._writer = asyncio.create_task(self._write_loop())
+            self._replayer = asyncio.create_task(self._replay_loop())
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Flush what is queued (up to `timeout` seconds), then stop the writer."""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.error(f"{self._queue.qsize()} queued Daraja callbacks left for replay")
+        assert self._writer is not None and self._replayer is not None
+        tasks = (self._writer, self._replayer)
+        self._replayer = None  # ends the replay loop even if the DB driver eats the cancel
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._queue = self._writer = None
+        CALLBACK_QUEUE_DEPTH.set(0)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def ingest(self, kind: str, body: bytes, signature: str | None) -> str:
+        """Returns "accepted" or "duplicate"; raises PermissionError (bad signature),
+        ValueError (malformed) or CallbackBusy."""
+        if not self.verify(body, signature):
+            CALLBACKS_TOTAL.labels(kind=kind, outcome="unauthorized").inc()
+            raise PermissionError("invalid callback signature")
+        try:
+            payload = json.loads(body)
+            cb = parse_callback(kind, payload)
+        except ValueError:  # includes JSONDecodeError
+            CALLBACKS_TOTAL.labels(kind=kind, outcome="invalid").inc()
+            raise
+        key = f"daraja:cb:{kind}:{cb.ref}"
+        if not await self.cache.add(key, "1", ex=self.dedupe_ttl):
+            CALLBACKS_TOTAL.labels(kind=kind, outcome="duplicate").inc()
+            return "duplicate"
+        try:
+            record_id = await self._retrying(lambda: self._store(cb, payload))
+        except Exception as e:
+            await self.cache.delete(key)  # not stored: the redelivery must not be a duplicate
+            CALLBACKS_TOTAL.labels(kind=kind, outcome="busy").inc()
+            raise CallbackBusy(f"callback could not be stored: {e}") from e
+        if record_id is None:  # stored before, and the cache has since forgotten it
+            CALLBACKS_TOTAL.labels(kind=kind, outcome="duplicate").inc()
+            return "duplicate"
+        if self._queue is None:
+            # Not started (scripts, tests without app startup): book it inline
+            CALLBACKS_TOTAL.labels(kind=kind, outcome="accepted").inc()
+            await self._flush([(record_id, cb)])
+            return "accepted"
+        try:
+            await asyncio.wait_for(self._queue.put((record_id, cb)), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            async with self.session_factory() as session:
+                await session.execute(
+                    delete(DarajaCallbackRecord).where(DarajaCallbackRecord.id == record_id)
+                )
+                await session.commit()
+            await self.cache.delete(key)
+            CALLBACKS_TOTAL.labels(kind=kind, outcome="busy").inc()
+            raise CallbackBusy("callback queue is full") from None
+        depth = self._queue.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        CALLBACK_QUEUE_DEPTH.set(depth)
+        CALLBACKS_TOTAL.labels(kind=kind, outcome="accepted").inc()
+        return "accepted"
+
+    async def _write_loop(self) -> None:
+        queue = self._queue
+        assert queue is not None
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            CALLBACK_QUEUE_DEPTH.set(queue.qsize())
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _retrying(self, op: Callable[[], Awaitable[T]]) -> T:
+        """Run `op`, retrying with backoff; the last failure is raised."""
+        attempt = 1
+        while True:
+            try:
+                return await op()
+            except Exception:
+                if attempt >= self.write_attempts:
+                    raise
+                await asyncio.sleep(0.1 * 2 ** (attempt - 1))
+                attempt += 1
+
+    async def _store(self, cb: DarajaCallback, payload: dict[str, Any]) -> int | None:
+        """Persist the raw callback; None if its reference was stored already."""
+        record = DarajaCallbackRecord(kind=cb.kind, ref=cb.ref, body=json.dumps(payload))
+        async with self.session_factory() as session:
+            session.add(record)
+            try:
+                await session.commit()
+            except IntegrityError:
+                return None
+        return record.id
+
+    async def _flush(self, batch: list[tuple[int, DarajaCallback]]) -> None:
+        CALLBACK_BATCH_SIZE.observe(len(batch))
+        callbacks = [cb for _, cb in batch]
+        try:
+            for observer in self.observers:
+                await observer(callbacks)
+            pools = await self._payout_pools(callbacks)
+            await self._retrying(lambda: asyncio.to_thread(self._book, batch, pools))
+        except Exception as e:
+            refs = ", ".join(cb.ref for _, cb in batch)
+            log.error(f"failed to book Daraja callbacks [{refs}], will replay: {e}")
+
+    async def _payout_pools(self, callbacks: list[DarajaCallback]) -> dict[str, str]:
+        """The pool each B2C result's disbursement job pays out of, by originator."""
+        jobs = {
+            cb.originator: row[0]
+            for cb in callbacks
+            if cb.kind == "b2c" and (row := payout_row(cb.originator)) is not None
+        }
+        if not jobs:
+            return {}
+        async with self.session_factory() as session:
+            pools = dict(
+                (
+                    await session.execute(
+                        select(DisbursementJob.id, DisbursementJob.pool).where(
+                            DisbursementJob.id.in_(set(jobs.values()))
+                        )
+                    )
+                ).all()
+            )
+        return {originator: pools[job] for originator, job in jobs.items() if job in pools}
+
+    def _book(self, batch: list[tuple[int, DarajaCallback]], pools: dict[str, str]) -> None:
+        with self.ledger.session_factory() as session, session.begin():
+            claimed = [
+                cb
+                for record_id, cb in batch
+                if session.execute(
+                    update(DarajaCallbackRecord)
+                    .where(
+                        DarajaCallbackRecord.id == record_id,
+                        DarajaCallbackRecord.booked_at.is_(None),
+                    )
+                    .values(booked_at=utcnow())
+                ).rowcount
+            ]
+            txs = [cb.ledger_tx(pools.get(cb.originator or "")) for cb in claimed if cb.ok]
+            if txs:
+                self.ledger.post_in(session, txs)
+        if txs:
+            self.ledger.committed(txs)
+
+    async def _replay_loop(self) -> None:
+        while self._replayer is not None:
+            try:
+                await self.replay()
+            except Exception:
+                log.exception("Daraja callback replay failed")
+            await asyncio.sleep(self.replay_after)
+
+    async def replay(self) -> int:
+        """Book stored callbacks still unbooked `replay_after` seconds after arriving;
+        one instance at a time (cache lock). Returns how many were replayed."""
+        lock_key, token = "daraja:cb:replay", uuid.uuid4().hex
+        if not await self.cache.add(lock_key, token, ex=max(1, int(self.replay_after))):
+            return 0
+        try:
+            async with self.session_factory() as session:
+                rows = (
+                    await session.execute(
+                        select(
+                            DarajaCallbackRecord.id,
+                            DarajaCallbackRecord.kind,
+                            DarajaCallbackRecord.body,
+                        )
+                        .where(
+                            DarajaCallbackRecord.booked_at.is_(None),
+                            DarajaCallbackRecord.created_at
+                            < utcnow() - timedelta(seconds=self.replay_after),
+                        )
+                        .order_by(DarajaCallbackRecord.id)
+                    )
+                ).all()
+            if rows:
+                log.warning(f"replaying {len(rows)} unbooked Daraja callbacks")
+            items = [(r.id, parse_callback(r.kind, json.loads(r.body))) for r in rows]
+            for i in range(0, len(items), self.batch_size):
+                await self._flush(items[i : i + self.batch_size])
+            return len(items)
+        finally:
+            await self.cache.delete_if(lock_key, token)
+
+
+_ingestor: CallbackIngestor | None = None
+
+
+def get_callback_ingestor() -> CallbackIngestor:
+    global _ingestor
+    if _ingestor is None:
+        _ingestor = CallbackIngestor()
+        _ingestor.observers.append(get_disbursement_service().reconcile)
+    return _ingestor
@@ -0,0 +1,577 @@
+from __future__ import annotations
+import asyncio
+import codecs
+import csv
+import json
+import math
+import re
+import time
+import uuid
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Sequence
+
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.core.db import AsyncSessionLocal
+from app.core.logging import get_logger
+from app.core.metrics import counter
+from app.integrations.integration_factory import get_daraja_client
+from app.models.db_models import DisbursementJob, DisbursementRow, utcnow
+from app.utils.ids import new_tx_id
+
+if TYPE_CHECKING:
+    from app.services.daraja_callbacks import DarajaCallback
+
+log = get_logger(__name__)
+
+DISBURSEMENT_ROWS_TOTAL = counter(
+    "disbursement_rows_total",
+    "Bulk B2C rows by outcome",
+    ["outcome"],  # invalid | sent | failed | paid | declined
+)
+
+FORMATS = {"text/csv": "csv", "application/x-ndjson": "ndjson"}
+ACTIVE_STATES = ("queued", "running")
+LEASED_STATES = ("receiving", *ACTIVE_STATES)
+IN_FLIGHT = ("sending", "sent")  # rows whose B2C result may still arrive
+
+# Safaricom MSISDN as 2547XXXXXXXX / 2541XXXXXXXX, with or without +254 or a leading 0
+_MSISDN = re.compile(r"(?:\+?254|0)?([17]\d{8})")
+
+
+class TokenBucket:
+    """Paces callers to `rate` per second with bursts of up to `burst`.
+
+    `acquire` reserves the next slot and sleeps until it is due, so waiters are served
+    in call order without polling, however many are queued.
+    """
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    async def acquire(self) -> None:
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[list[str]]:
+    """Split a byte stream into lines, yielding the complete lines of each chunk."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    async for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split("\n")
+        tail = lines.pop()
+        if lines:
+            yield lines
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield [tail]
+
+
+async def read_rows(
+    chunks: AsyncIterator[bytes], fmt: str, chunk_size: int
+) -> AsyncIterator[list[dict[str, Any]]]:
+    """Parse an upload into batches of at most `chunk_size` raw rows as they arrive.
+
+    CSV needs a header with `phone` and `amount` (optionally `reference`); NDJSON lines
+    are objects with the same keys. A malformed line becomes a row that fails validation.
+    """
+    header: list[str] | None = None
+    batch: list[dict[str, Any]] = []
+    async for lines in iter_lines(chunks):
+        lines = [line.rstrip("\r") for line in lines if line.strip()]
+        if fmt == "csv":
+            try:
+                records = csv.reader(lines)
+                if header is None:
+                    header = [h.strip().lower() for h in next(records, [])]
+                    if not {"phone", "amount"} <= set(header):
+                        raise ValueError("CSV header must include phone and amount")
+                batch.extend(dict(zip(header, r)) for r in records)
+            except csv.Error as e:
+                raise ValueError(f"unreadable CSV: {e}") from None
+        else:
+            batch.extend(map(_json_row, lines))
+        while len(batch) >= chunk_size:
+            yield batch[:chunk_size]
+            batch = batch[chunk_size:]
+    if batch:
+        yield batch
+
+
+def _json_row(line: str) -> dict[str, Any]:
+    try:
+        row = json.loads(line)
+    except ValueError:
+        return {"phone": line[:32], "error": "malformed JSON"}
+    return row if isinstance(row, dict) else {"phone": line[:32], "error": "not an object"}
+
+
+def _msisdn(value: Any) -> str | None:
+    m = _MSISDN.fullmatch(str(value).strip().replace(" ", ""))
+    return f"254{m.group(1)}" if m else None
+
+
+def _amount(value: Any) -> float | None:
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        return None
+    return amount if math.isfinite(amount) else None
+
+
+def validate_rows(
+    rows: list[dict[str, Any]], first_row_no: int, min_amount: float, max_amount: float
+) -> list[dict[str, Any]]:
+    """Validate a batch column by column and return insertable DisbursementRow values."""
+    phones = [_msisdn(r.get("phone")) for r in rows]
+    amounts = [_amount(r.get("amount")) for r in rows]
+    parse_errors = [r.get("error") for r in rows]
+    out = []
+    for i, (row, phone, amount, error) in enumerate(zip(rows, phones, amounts, parse_errors)):
+        if error is None:
+            if phone is None:
+                error = "invalid phone number"
+            elif amount is None:
+                error = "invalid amount"
+            elif amount != int(amount):
+                error = "amount must be whole shillings"
+            elif not min_amount <= amount <= max_amount:
+                error = f"amount must be between {min_amount:g} and {max_amount:g}"
+        out.append(
+            {
+                "row_no": first_row_no + i,
+                "phone": phone or str(row.get("phone", ""))[:32],
+                "amount": amount,
+                "reference": str(row.get("reference") or "")[:64],
+                "status": "invalid" if error else "pending",
+                "error": error,
+            }
+        )
+    return out
+
+
+def payout_row(originator: str | None) -> tuple[str, int] | None:
+    """(job id, row number) from a B2C OriginatorConversationID `<job>-<row>` we sent;
+    None for payouts that did not come from a bulk job."""
+    job_id, _, row_no = (originator or "").rpartition("-")
+    if not job_id.startswith("bd-") or not row_no.isdigit():
+        return None
+    return job_id, int(row_no)
+
+
+def job_status(job: DisbursementJob, counts: dict[str, int]) -> dict[str, Any]:
+    return {
+        "jobId": job.id,
+        "status": job.status,
+        "pool": job.pool,
+        "total": job.total,
+        "invalid": job.invalid,
+        **{state: counts.get(state, 0) for state in ("pending", "sending", "sent", "failed")},
+        "createdAt": job.created_at,
+        "updatedAt": job.updated_at,
+    }
+
+
+class DisbursementService:
+    """Bulk B2C payouts: streamed intake, persisted rows, rate-limited fan-out.
+
+    `submit` parses the upload as it arrives, validating and inserting `chunk_size` rows
+    at a time, so a 100k-row batch is never held in memory. Dispatch runs in the
+    background, one task per job, reading `page_size` pending rows at a time and pacing
+    every Daraja call through one token bucket shared by all jobs (Daraja quotas are per
+    app, not per batch). Each row is committed as "sending" just before its B2C call and
+    its outcome is committed per page; a row left "sending" by a process that stopped
+    is never sent again, but settled by its B2C result callback (`reconcile`, matched
+    on the OriginatorConversationID `<job>-<row>`). Each instance leases the jobs it
+    receives and dispatches (`owner`, `lease_until`) and renews the leases every third
+    of `lease_ttl`; the same loop picks up unfinished jobs whose lease is free or has
+    lapsed, so only one instance works on a job at a time, and aborts uploads left
+    "receiving" by an instance that died (a partial batch is never paid out).
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+        client: Any | None = None,
+        rate: float | None = None,
+        burst: int | None = None,
+        concurrency: int | None = None,
+        chunk_size: int | None = None,
+        page_size: int | None = None,
+        lease_ttl: float | None = None,
+    ):
+        s = get_settings()
+        self.session_factory = session_factory
+        self.client = client or get_daraja_client()
+        self.bucket = TokenBucket(rate or s.DISBURSEMENT_RATE, burst or s.DISBURSEMENT_BURST)
+        self.concurrency = concurrency or s.DISBURSEMENT_CONCURRENCY
+        self.chunk_size = chunk_size or s.DISBURSEMENT_CHUNK
+        self.page_size = page_size or s.DISBURSEMENT_PAGE
+        self.min_amount = s.DISBURSEMENT_MIN_AMOUNT
+        self.max_amount = s.DISBURSEMENT_MAX_AMOUNT
+        self.pool = s.DISBURSEMENT_POOL
+        self.lease_ttl = lease_ttl if lease_ttl is not None else s.DISBURSEMENT_LEASE_TTL
+        self.owner = uuid.uuid4().hex
+        self._lease_task: asyncio.Task | None = None
+        self._started = False
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._paying: set[asyncio.Task] = set()  # B2C calls that outlive a cancelled job
+        self._semaphore: asyncio.Semaphore | None = None
+
+    async def start(self) -> None:
+        """Start dispatching, resuming unfinished jobs no live instance holds."""
+        if self._started:
+            return
+        self._started = True
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        await self._claim_orphans()
+        self._lease_task = asyncio.create_task(self._lease_loop())
+
+    async def stop(self) -> None:
+        lease_task, self._lease_task = self._lease_task, None
+        if lease_task is not None:
+            lease_task.cancel()  # the loop also exits if the DB driver swallows this
+            await asyncio.gather(lease_task, return_exceptions=True)
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*list(self._paying), return_exceptions=True)
+        self._tasks.clear()
+        self._started = False
+        self._semaphore = None
+        # Hand the unfinished jobs over now rather than when the leases lapse
+        async with self.session_factory() as session:
+            await session.execute(
+                update(DisbursementJob)
+                .where(DisbursementJob.owner == self.owner)
+                .values(owner=None, lease_until=None)
+            )
+            await session.commit()
+
+    async def _lease_loop(self) -> None:
+        while self._lease_task is not None:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self._renew_leases()
+                await self._claim_orphans()
+            except Exception:
+                log.exception("disbursement lease renewal failed")
+
+    async def _renew_leases(self) -> None:
+        async with self.session_factory() as session:
+            await session.execute(
+                update(DisbursementJob)
+                .where(
+                    DisbursementJob.owner == self.owner,
+                    DisbursementJob.status.in_(LEASED_STATES),
+                )
+                .values(lease_until=self._lease_deadline())
+            )
+            await session.commit()
+
+    async def _claim_orphans(self) -> None:
+        """Abort uploads whose receiving instance is gone, then dispatch unfinished jobs
+        that are unowned or whose owner's lease lapsed; the claim itself happens in
+        `_run`, so instances racing here run each job once."""
+        async with self.session_factory() as session:
+            aborted = await session.execute(
+                update(DisbursementJob)
+                .where(
+                    DisbursementJob.status == "receiving",
+                    # Our own uploads are still streaming in, however slowly
+                    or_(
+                        DisbursementJob.owner.is_(None),
+                        and_(
+                            DisbursementJob.owner != self.owner,
+                            DisbursementJob.lease_until < utcnow(),
+                        ),
+                    ),
+                )
+                .values(status="aborted", owner=None, lease_until=None)
+            )
+            await session.commit()
+            if aborted.rowcount:
+                log.warning(f"aborted {aborted.rowcount} disbursement uploads left receiving")
+            orphans = await session.scalars(
+                select(DisbursementJob.id)
+                .where(DisbursementJob.status.in_(ACTIVE_STATES), self._claimable())
+                .order_by(DisbursementJob.created_at)
+            )
+            for job_id in orphans:
+                self._dispatch(job_id)
+
+    def _lease_deadline(self):
+        return utcnow() + timedelta(seconds=self.lease_ttl)
+
+    def _claimable(self):
+        return or_(
+            DisbursementJob.owner.is_(None),
+            DisbursementJob.owner == self.owner,
+            DisbursementJob.lease_until < utcnow(),
+        )
+
+    async def submit(
+        self, chunks: AsyncIterator[bytes], fmt: str, pool: str | None = None
+    ) -> dict[str, Any]:
+        """Store an uploaded batch paid out of operator `pool` (default
+        DISBURSEMENT_POOL) and queue it; returns the job's status.
+
+        Raises ValueError if the upload has no rows or a CSV lacks the required columns.
+        """
+        batches = read_rows(chunks, fmt, self.chunk_size)
+        first = await anext(batches, None)
+        if first is None:
+            raise ValueError("no disbursement rows in upload")
+        job_id = new_tx_id(prefix="bd")
+        async with self.session_factory() as session:
+            # Leased while it streams in: renewed per chunk and by the lease loop
+            job = DisbursementJob(
+                id=job_id,
+                status="receiving",
+                total=0,
+                invalid=0,
+                pool=pool or self.pool,
+                owner=self.owner,
+                lease_until=self._lease_deadline(),
+            )
+            session.add(job)
+            await session.commit()
+            try:
+                batch: list[dict[str, Any]] | None = first
+                while batch is not None:
+                    rows = validate_rows(
+                        batch, job.total + 1, self.min_amount, self.max_amount
+                    )
+                    invalid = sum(r["status"] == "invalid" for r in rows)
+                    await session.execute(
+                        insert(DisbursementRow.__table__),
+                        [{"job_id": job_id, **r} for r in rows],
+                    )
+                    job.total += len(rows)
+                    job.invalid += invalid
+                    job.lease_until = self._lease_deadline()
+                    await session.commit()
+                    DISBURSEMENT_ROWS_TOTAL.labels(outcome="invalid").inc(invalid)
+                    batch = await anext(batches, None)
+            except BaseException:
+                # Client went away or a late chunk was unreadable: keep what arrived
+                # for inspection, but never pay out a partial batch
+                await session.rollback()
+                job.status = "aborted"
+                job.owner = job.lease_until = None
+                await session.commit()
+                raise
+            job.status = "queued" if job.invalid < job.total else "completed"
+            job.owner = job.lease_until = None  # claimed again by whoever dispatches it
+            await session.commit()
+        if job.status == "queued":
+            self._dispatch(job_id)
+        status = await self.get(job_id)
+        assert status is not None
+        return status
+
+    async def get(self, job_id: str) -> dict[str, Any] | None:
+        async with self.session_factory() as session:
+            job = await session.get(DisbursementJob, job_id)
+            if job is None:
+                return None
+            counts = await session.execute(
+                select(DisbursementRow.status, func.count())
+                .where(DisbursementRow.job_id == job_id)
+                .group_by(DisbursementRow.status)
+            )
+            return job_status(job, dict(counts.all()))
+
+    async def rows(
+        self, job_id: str, status: str | None = None, limit: int = 100, after: int = 0
+    ) -> tuple[list[dict[str, Any]], int | None]:
+        """Page through a job's rows in upload order; the cursor is the last row number."""
+        q = select(DisbursementRow).where(
+            DisbursementRow.job_id == job_id, DisbursementRow.row_no > after
+        )
+        if status is not None:
+            q = q.where(DisbursementRow.status == status)
+        async with self.session_factory() as session:
+            page = list(await session.scalars(q.order_by(DisbursementRow.row_no).limit(limit + 1)))
+        next_cursor = page[limit - 1].row_no if len(page) > limit else None
+        return [
+            {
+                "row": r.row_no,
+                "phone": r.phone,
+                "amount": r.amount,
+                "reference": r.reference,
+                "status": r.status,
+                "error": r.error,
+                "conversationId": r.conversation_id,
+            }
+            for r in page[:limit]
+        ], next_cursor
+
+    def _dispatch(self, job_id: str) -> None:
+        if self._started and job_id not in self._tasks:
+            task = asyncio.create_task(self._run(job_id))
+            self._tasks[job_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _run(self, job_id: str) -> None:
+        try:
+            if not await self._claim(job_id):
+                log.info(f"disbursement job {job_id} is leased by another instance")
+                return
+            last_id = 0
+            while True:
+                async with self.session_factory() as session:
+                    page = (
+                        await session.execute(
+                            select(
+                                DisbursementRow.id,
+                                DisbursementRow.row_no,
+                                DisbursementRow.phone,
+                                DisbursementRow.amount,
+                                DisbursementRow.reference,
+                            )
+                            .where(
+                                DisbursementRow.job_id == job_id,
+                                DisbursementRow.status == "pending",
+                                DisbursementRow.id > last_id,
+                            )
+                            .order_by(DisbursementRow.id)
+                            .limit(self.page_size)
+                        )
+                    ).all()
+                if not page:
+                    break
+                sent = await asyncio.gather(*(self._send(job_id, row) for row in page))
+                results = [r for r in sent if r is not None]
+                if results:
+                    # Only rows still "sending": a B2C result may have settled one already
+                    async with self.session_factory() as session:
+                        await session.execute(
+                            update(DisbursementRow).where(DisbursementRow.status == "sending"),
+                            results,
+                            execution_options={"synchronize_session": None},
+                        )
+                        await session.commit()
+                last_id = page[-1].id
+            await self._set_status(job_id, "completed")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # e.g. the database was unavailable: the job stays "running" and resumes
+            # from its pending rows once this instance's lease or the next start claims it
+            log.exception(f"disbursement job {job_id} stopped")
+
+    async def _claim(self, job_id: str) -> bool:
+        async with self.session_factory() as session:
+            claimed = await session.execute(
+                update(DisbursementJob)
+                .where(
+                    DisbursementJob.id == job_id,
+                    DisbursementJob.status.in_(ACTIVE_STATES),
+                    self._claimable(),
+                )
+                .values(status="running", owner=self.owner, lease_until=self._lease_deadline())
+            )
+            await session.commit()
+        return bool(claimed.rowcount)
+
+    async def _send(self, job_id: str, row: Any) -> dict[str, Any] | None:
+        """Pay out one row; None if another instance had already marked it "sending"."""
+        await self.bucket.acquire()
+        assert self._semaphore is not None
+        async with self._semaphore:
+            # Once marked "sending" the call must go out even if the job is cancelled:
+            # a marked row is only ever settled by its B2C result
+            pay = asyncio.create_task(self._pay(job_id, row))
+            self._paying.add(pay)
+            pay.add_done_callback(self._paying.discard)
+            return await asyncio.shield(pay)
+
+    async def _pay(self, job_id: str, row: Any) -> dict[str, Any] | None:
+        async with self.session_factory() as session:
+            marked = await session.execute(
+                update(DisbursementRow)
+                .where(DisbursementRow.id == row.id, DisbursementRow.status == "pending")
+                .values(status="sending")
+            )
+            await session.commit()
+        if not marked.rowcount:
+            return None
+        args = (row.phone, row.amount, row.reference, f"{job_id}-{row.row_no}")
+        try:
+            res = await self.client.b2c_payment(*args)
+        except Exception as e:
+            DISBURSEMENT_ROWS_TOTAL.labels(outcome="failed").inc()
+            return {
+                "id": row.id, "status": "failed", "error": str(e)[:255], "conversation_id": None
+            }
+        DISBURSEMENT_ROWS_TOTAL.labels(outcome="sent").inc()
+        return {
+            "id": row.id, "status": "sent", "error": None,
+            "conversation_id": res.get("ConversationID"),
+        }
+
+    async def reconcile(self, callbacks: Sequence[DarajaCallback]) -> None:
+        """Settle in-flight rows from B2C results (a CallbackIngestor observer): a result
+        confirms the row as "sent" or marks it "failed" with Daraja's reason."""
+        settled = []
+        for cb in callbacks:
+            row = payout_row(cb.originator) if cb.kind == "b2c" else None
+            if row is not None:
+                settled.append((*row, cb))
+        if not settled:
+            return
+        outcomes = []
+        async with self.session_factory() as session:
+            for job_id, row_no, cb in settled:
+                matched = await session.execute(
+                    update(DisbursementRow)
+                    .where(
+                        DisbursementRow.job_id == job_id,
+                        DisbursementRow.row_no == row_no,
+                        DisbursementRow.status.in_(IN_FLIGHT),
+                    )
+                    .values(
+                        status="sent" if cb.ok else "failed",
+                        error=None if cb.ok else (cb.desc or "B2C payment failed")[:255],
+                        conversation_id=cb.ref,
+                    )
+                )
+                if matched.rowcount:
+                    outcomes.append("paid" if cb.ok else "declined")
+            await session.commit()
+        for outcome in outcomes:
+            DISBURSEMENT_ROWS_TOTAL.labels(outcome=outcome).inc()
+
+    async def _set_status(self, job_id: str, status: str) -> None:
+        async with self.session_factory() as session:
+            await session.execute(
+                update(DisbursementJob)
+                .where(DisbursementJob.id == job_id)
+                .values(status=status)
+            )
+            await session.commit()
+
+
+_service: DisbursementService | None = None
+
+
+def get_disbursement_service() -> DisbursementService:
+    global _service
+    if _service is None:
+        _service = DisbursementService()
+    return _service
@@ -0,0 +1,417 @@
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Iterable, Sequence
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.core.db import SessionLocal
+from app.core.logging import get_logger
+from app.core.metrics import counter
+from app.models.db_models import LedgerEntry
+from app.services.forecast_cache import get_model_cache
+
+if TYPE_CHECKING:
+    from app.services.ledger import LedgerTransaction
+
+log = get_logger(__name__)
+
+FLOW_EVENTS_TOTAL = counter(
+    "flow_events_total", "Pool flow events recorded", ["outcome"]  # recorded | too_old
+)
+
+# Rolling windows kept up to date on every event, in hours
+WINDOW_HOURS: dict[str, int] = {"1h": 1, "4h": 4, "24h": 24}
+FLOW_ASSET = "LOCAL"  # operator float accounts are kept in local currency; token pools are not
+POOL_PREFIX = "pool:"
+SYNC_BATCH = 5000  # ledger rows read per query when following the ledger
+
+
+class FlowStore:
+    """Per-pool inflow/outflow history in hourly buckets, with rolling window totals.
+
+    Series are the ledger's `pool:<name>` accounts (operator floats and token pools) and
+    keep the asset of their first flow; "operator" below means any of them. Each is a
+    row of two int64 ring buffers (minor units, `history_hours` columns, column = epoch
+    hour % history_hours) plus one running total per window in WINDOW_HOURS. Recording
+    an event touches its bucket and the totals of the windows that contain it: O(1),
+    whatever the history length. When the clock enters a new hour, the buckets leaving
+    each window are subtracted for every operator at once and the bucket being reused
+    is cleared, so window queries never rescan raw events.
+    Events older than the history are dropped; late events within it still count.
+
+    In the app the store follows ledger_entries (`sync`, on a loop from `start`), so every
+    worker sees every worker's postings: the first read backfills the kept history, later
+    ones take the entries after the last id read. Ids skipped by a read may belong to a
+    transaction that commits later, so they are looked up again for `gap_grace` seconds.
+    Coroutines in `observers` get the operators each sync changed (e.g. to invalidate
+    their cached forecasts).
+    """
+
+    def __init__(
+        self,
+        history_hours: int | None = None,
+        clock: Callable[[], float] = time.time,
+        session_factory: Callable[[], Session] = SessionLocal,
+        sync_interval: float | None = None,
+        gap_grace: float | None = None,
+    ):
+        settings = get_settings()
+        self.hours = history_hours or settings.FLOW_HISTORY_HOURS
+        if self.hours <= max(WINDOW_HOURS.values()):
+            raise ValueError("history must be longer than the longest window")
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._rows: dict[str, int] = {}
+        self._names: list[str] = []
+        self._assets: dict[str, str] = {}
+        self._spans = np.array(list(WINDOW_HOURS.values()))
+        self._inflow = np.zeros((8, self.hours), np.int64)
+        self._outflow = np.zeros((8, self.hours), np.int64)
+        self._win_in = np.zeros((8, len(WINDOW_HOURS)), np.int64)
+        self._win_out = np.zeros((8, len(WINDOW_HOURS)), np.int64)
+        self._head = int(clock() // 3600)  # epoch hour of the newest bucket
+        self.session_factory = session_factory
+        self.sync_interval = sync_interval or settings.FLOW_SYNC_INTERVAL
+        self.gap_grace = gap_grace if gap_grace is not None else settings.FLOW_SYNC_GAP_GRACE
+        self._sync_lock = threading.Lock()
+        self._synced: int | None = None  # last ledger entry id read; None before the backfill
+        self._gaps: dict[int, float] = {}  # skipped id -> clock time it was first skipped
+        self._changed: set[str] = set()  # operators synced since observers last ran
+        self.observers: list[Callable[[list[str]], Awaitable[Any]]] = []
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def operators(self) -> list[str]:
+        return list(self._names)
+
+    def asset(self, operator: str) -> str:
+        """Asset of the operator's amounts (FLOW_ASSET for one with no flows yet)."""
+        return self._assets.get(operator, FLOW_ASSET)
+
+    @property
+    def hour(self) -> int:
+        """Current epoch hour, i.e. the open bucket."""
+        with self._lock:
+            self._advance(int(self._clock() // 3600))
+            return self._head
+
+    # -- ingestion ----------------------------------------------------------------
+
+    def record(
+        self, operator: str, amount_minor: int, at: float | None = None, asset: str = FLOW_ASSET
+    ) -> bool:
+        """Add one flow (positive into the operator's pool, negative out of it).
+
+        Returns False if `at` is older than the kept history.
+        """
+        hour = int((self._clock() if at is None else at) // 3600)
+        with self._lock:
+            self._advance(hour)
+            age = self._head - hour
+            if age >= self.hours:
+                FLOW_EVENTS_TOTAL.labels(outcome="too_old").inc()
+                return False
+            row = self._row(operator, asset)
+            buckets, totals = (
+                (self._inflow, self._win_in) if amount_minor > 0 else (self._outflow, self._win_out)
+            )
+            amount = abs(amount_minor)
+            buckets[row, hour % self.hours] += amount
+            for k, span in enumerate(WINDOW_HOURS.values()):
+                if age < span:
+                    totals[row, k] += amount
+        FLOW_EVENTS_TOTAL.labels(outcome="recorded").inc()
+        return True
+
+    def record_many(
+        self,
+        operators: Sequence[str],
+        amounts_minor: Sequence[int] | np.ndarray,
+        at: Sequence[float] | np.ndarray | None = None,
+        assets: Sequence[str] | None = None,
+    ) -> int:
+        """Vectorised `record` for a batch; returns how many events were kept.
+
+        `assets` gives each event's asset (default FLOW_ASSET for all).
+        """
+        if not len(operators):
+            return 0
+        amounts = np.asarray(amounts_minor, np.int64)
+        now = self._clock()
+        stamps = np.full(len(amounts), now) if at is None else np.asarray(at, np.float64)
+        hours = (stamps // 3600).astype(np.int64)
+        with self._lock:
+            # Move to the newest hour first; everything else is then a late event
+            self._advance(int(hours.max()))
+            ages = self._head - hours
+            keep = ages < self.hours
+            if assets is None:
+                assets = [FLOW_ASSET] * len(operators)
+            rows = np.fromiter(
+                (self._row(op, a) for op, a in zip(operators, assets)), np.int64, len(operators)
+            )
+            rows, amounts, hours, ages = rows[keep], amounts[keep], hours[keep], ages[keep]
+            cols = hours % self.hours
+            for sign, buckets, totals in (
+                (amounts > 0, self._inflow, self._win_in),
+                (amounts < 0, self._outflow, self._win_out),
+            ):
+                r, a, c, age = rows[sign], np.abs(amounts[sign]), cols[sign], ages[sign]
+                np.add.at(buckets, (r, c), a)
+                for k, span in enumerate(WINDOW_HOURS.values()):
+                    inside = age < span
+                    np.add.at(totals[:, k], r[inside], a[inside])
+        kept = int(keep.sum())
+        FLOW_EVENTS_TOTAL.labels(outcome="recorded").inc(kept)
+        if kept < len(keep):
+            FLOW_EVENTS_TOTAL.labels(outcome="too_old").inc(len(keep) - kept)
+        return kept
+
+    def record_transactions(self, txs: Iterable[LedgerTransaction]) -> None:
+        """Ledger observer: postings on pool accounts (`pool:<name>`), as of now."""
+        now = self._clock()
+        self._record_postings(
+            (p.account, p.asset, p.amount_minor, now) for tx in txs for p in tx.postings
+        )
+
+    def _record_postings(self, postings: Iterable[tuple[str, str, int, float]]) -> list[str]:
+        """(account, asset, amount_minor, at) for any accounts; keeps those on pools and
+        returns their operators.
+
+        A posting in another asset than the pool's first flow is skipped: the two
+        cannot share one series.
+        """
+        operators, amounts, at, assets = [], [], [], []
+        seen = dict(self._assets)
+        for account, asset, amount, when in postings:
+            if not account.startswith(POOL_PREFIX):
+                continue
+            name = account[len(POOL_PREFIX):]
+            if seen.setdefault(name, asset) == asset:
+                operators.append(name)
+                amounts.append(amount)
+                at.append(when)
+                assets.append(asset)
+        self.record_many(operators, amounts, at, assets)
+        return operators
+
+    # -- following the ledger -----------------------------------------------------
+
+    def sync(self) -> int:
+        """Record the pool postings committed since the last call; returns how many rows
+        were read. The first call backfills the kept history."""
+        with self._sync_lock:
+            if self._synced is None:
+                return self._backfill()
+            return self._follow()
+
+    def _backfill(self) -> int:
+        since = datetime.fromtimestamp((self.hour - self.hours + 1) * 3600, timezone.utc)
+        read = 0
+        with self.session_factory() as session:
+            last = session.scalar(select(func.coalesce(func.max(LedgerEntry.id), 0)))
+            stmt = self._entries().where(
+                LedgerEntry.account.startswith(POOL_PREFIX, autoescape=True),
+                LedgerEntry.created_at >= since,
+                LedgerEntry.id <= last,
+            )
+            for rows in session.execute(stmt.execution_options(yield_per=SYNC_BATCH)).partitions():
+                self._ingest(rows)
+                read += len(rows)
+        self._synced = last
+        return read
+
+    def _follow(self) -> int:
+        now = self._clock()
+        self._gaps = {i: t for i, t in self._gaps.items() if now - t < self.gap_grace}
+        read = 0
+        with self.session_factory() as session:
+            if self._gaps:
+                rows = session.execute(
+                    self._entries().where(LedgerEntry.id.in_(list(self._gaps)))
+                ).all()
+                for row in rows:
+                    del self._gaps[row.id]
+                self._ingest(rows)
+                read += len(rows)
+            while True:
+                rows = session.execute(
+                    self._entries()
+                    .where(LedgerEntry.id > self._synced)
+                    .order_by(LedgerEntry.id)
+                    .limit(SYNC_BATCH)
+                ).all()
+                previous = self._synced
+                for row in rows:
+                    self._gaps.update(dict.fromkeys(range(previous + 1, row.id), now))
+                    previous = row.id
+                self._ingest(rows)
+                read += len(rows)
+                if rows:
+                    self._synced = rows[-1].id
+                if len(rows) < SYNC_BATCH:
+                    return read
+
+    @staticmethod
+    def _entries():
+        return select(
+            LedgerEntry.id,
+            LedgerEntry.account,
+            LedgerEntry.asset,
+            LedgerEntry.amount_minor,
+            LedgerEntry.created_at,
+        )
+
+    def _ingest(self, rows: Sequence[Any]) -> None:
+        self._changed.update(self._record_postings(
+            (r.account, r.asset, r.amount_minor, _epoch(r.created_at)) for r in rows
+        ))
+
+    async def refresh(self) -> int:
+        """`sync` on a worker thread, then tell the observers which operators changed."""
+        read = await asyncio.to_thread(self.sync)
+        changed, self._changed = sorted(self._changed), set()
+        if changed:
+            for observer in self.observers:
+                try:
+                    await observer(changed)
+                except Exception:
+                    log.exception(f"flow store observer {observer!r} failed")
+        return read
+
+    async def start(self) -> None:
+        """Backfill from the ledger, then keep following it every `sync_interval`."""
+        if self._task is None:
+            try:
+                await self.refresh()
+            except Exception:
+                log.exception("flow store backfill failed; retrying on the sync loop")
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                log.exception("flow store sync failed")
+
+    def _row(self, operator: str, asset: str = FLOW_ASSET) -> int:
+        row = self._rows.get(operator)
+        if row is None:
+            row = self._rows[operator] = len(self._names)
+            self._names.append(operator)
+            self._assets[operator] = asset
+            if row == len(self._inflow):
+                grow = len(self._inflow)  # double the capacity
+                self._inflow = np.pad(self._inflow, ((0, grow), (0, 0)))
+                self._outflow = np.pad(self._outflow, ((0, grow), (0, 0)))
+                self._win_in = np.pad(self._win_in, ((0, grow), (0, 0)))
+                self._win_out = np.pad(self._win_out, ((0, grow), (0, 0)))
+        return row
+
+    def _advance(self, hour: int) -> None:
+        if hour <= self._head:
+            return
+        if hour - self._head >= self.hours:
+            for a in (self._inflow, self._outflow, self._win_in, self._win_out):
+                a.fill(0)
+        else:
+            n = len(self._names)
+            for h in range(self._head + 1, hour + 1):
+                # Hour h - span leaves each window; the bucket for h last held h - hours
+                leaving = (h - self._spans) % self.hours
+                self._win_in[:n] -= self._inflow[:n, leaving]
+                self._win_out[:n] -= self._outflow[:n, leaving]
+                self._inflow[:, h % self.hours] = 0
+                self._outflow[:, h % self.hours] = 0
+        self._head = hour
+
+    # -- queries ------------------------------------------------------------------
+
+    def totals(
+        self, operators: Sequence[str], windows: Sequence[str]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """(inflow, outflow) over each window, shape (operators, windows), minor units.
+
+        Unknown operators have no flows.
+        """
+        cols = [list(WINDOW_HOURS).index(w) for w in windows]
+        with self._lock:
+            self._advance(int(self._clock() // 3600))
+            rows = self._lookup(operators)
+            return self._gather(self._win_in, rows, cols), self._gather(self._win_out, rows, cols)
+
+    def net(self, operators: Sequence[str], windows: Sequence[str]) -> np.ndarray:
+        inflow, outflow = self.totals(operators, windows)
+        return inflow - outflow
+
+    def history(
+        self, operators: Sequence[str], hours: int, step: int = 1
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """(inflow, outflow) per `step`-hour bucket over the last `hours`, oldest first.
+
+        Shape (operators, hours // step); the last bucket ends with the current hour.
+        """
+        if not 0 < hours <= self.hours or hours % step:
+            raise ValueError(f"hours must be a multiple of {step} up to {self.hours}")
+        with self._lock:
+            self._advance(int(self._clock() // 3600))
+            rows = self._lookup(operators)
+            cols = np.arange(self._head - hours + 1, self._head + 1) % self.hours
+            inflow = self._gather(self._inflow, rows, cols)
+            outflow = self._gather(self._outflow, rows, cols)
+        shape = (len(rows), hours // step, step)
+        return inflow.reshape(shape).sum(axis=2), outflow.reshape(shape).sum(axis=2)
+
+    def closed(self, operators: Sequence[str], since: int) -> tuple[int, np.ndarray]:
+        """Net flow per completed hour from epoch hour `since` (or the oldest kept), oldest first.
+
+        Returns (current epoch hour, array of shape (operators, hours)); the current hour
+        is still open and is left out.
+        """
+        with self._lock:
+            self._advance(int(self._clock() // 3600))
+            start = min(max(since, self._head - self.hours + 1), self._head)
+            rows = self._lookup(operators)
+            cols = np.arange(start, self._head) % self.hours
+            net = self._gather(self._inflow, rows, cols) - self._gather(self._outflow, rows, cols)
+            return self._head, net
+
+    def _lookup(self, operators: Sequence[str]) -> np.ndarray:
+        return np.fromiter((self._rows.get(op, -1) for op in operators), np.int64, len(operators))
+
+    @staticmethod
+    def _gather(a: np.ndarray, rows: np.ndarray, cols) -> np.ndarray:
+        out = a[rows][:, cols]  # copies, so callers can use it outside the lock
+        out[rows < 0] = 0
+        return out
+
+
+def _epoch(at: datetime) -> float:
+    # SQLite hands back naive datetimes; they are stored in UTC
+    return (at if at.tzinfo else at.replace(tzinfo=timezone.utc)).timestamp()
+
+
+_store: FlowStore | None = None
+
+
+def get_flow_store() -> FlowStore:
+    global _store
+    if _store is None:
+        _store = FlowStore()
+        # New flows change the forecasts: drop the cached ones for those operators
+        _store.observers.append(get_model_cache().invalidate)
+    return _store
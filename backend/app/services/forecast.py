@@ -1,26 +1,94 @@
 from __future__ import annotations
-from typing import Literal
-from hashlib import sha256
-from app.ai.groq_client import GroqClient
+import asyncio
+from typing import Literal, Sequence
+from app.ai.groq_client import get_groq_client
+from app.core.config import get_settings
+from app.services.flows import FlowStore, get_flow_store
+from app.services.forecast_engine import get_forecast_engine
+from app.services.forecast_cache import ForecastCache, get_model_cache
+from app.utils.money import from_minor
 
 Window = Literal["1h", "4h", "24h"]
+WINDOWS: tuple[Window, ...] = ("1h", "4h", "24h")
 
 
 class ForecastService:
-    def __init__(self):
-        self.ai = GroqClient()
+    """Net-flow forecasts per operator (or token pool) from the FlowStore's hourly history.
 
-    def predict(self, operator: str, window: Window) -> float:
+    `model` (default FORECAST_MODEL) picks the backend: "persistence" predicts each
+    window's net flow to match the last one's, straight from the store's rolling
+    totals; the others ("seasonal_naive", "smoothing") are ForecastEngine models fitted
+    to every operator at once. Operators with no recorded flows predict 0. Forecasts
+    are in major units of the series' asset (see FlowStore.asset).
+    """
+
+    def __init__(
+        self,
+        cache: ForecastCache | None = None,
+        flows: FlowStore | None = None,
+        model: str | None = None,
+    ):
+        self.ai = get_groq_client()
+        self.model = model or get_settings().FORECAST_MODEL
+        self.cache = cache if cache is not None else get_model_cache(self.model)
+        self.flows = flows or get_flow_store()
+        self.engine = (
+            None if self.model == "persistence" else get_forecast_engine(self.model, self.flows)
+        )
+
+    def _forecast(self, operators: Sequence[str], windows: Sequence[Window]) -> list[list[float]]:
+        if self.engine is None:
+            net = self.flows.net(operators, windows)
+        else:
+            net = self.engine.predict(operators, windows).round()
+        return [
+            [float(from_minor(int(v), self.flows.asset(op))) for v in row]
+            for op, row in zip(operators, net)
+        ]
+
+    async def predict(self, operator: str, window: Window) -> float:
         if not operator:
             raise ValueError("operator required")
-        if window not in ("1h", "4h", "24h"):
+        if window not in WINDOWS:
+            raise ValueError("invalid window")
+        return await self.cache.get_or_compute(
+            "predict", operator, window, lambda: self._forecast([operator], [window])[0][0]
+        )
+
+    async def predict_many(
+        self, operators: Sequence[str], windows: Sequence[Window] = WINDOWS
+    ) -> list[list[float]]:
+        """Forecast the full operator x window grid in a single pass.
+
+        Returns one row per operator with one column per window, in input order.
+        Inputs are validated once up front, cached cells are reused and only the
+        distinct missing cells are computed, on a worker thread (and then cached).
+        """
+        if not operators or not all(operators):
+            raise ValueError("operator required")
+        if not windows or any(w not in WINDOWS for w in windows):
             raise ValueError("invalid window")
-        # Produce deterministic pseudo-forecast based on hash to keep tests hermetic
-        seed = int(sha256(f"{operator}-{window}".encode()).hexdigest(), 16)
-        # Map to range [-1000, 1000]
-        return ((seed % 200000) / 100.0) - 1000.0
+        cells = [(op, w) for op in dict.fromkeys(operators) for w in windows]
+        values = dict(zip(cells, await self.cache.lookup_many("predict", cells)))
+        todo = [cell for cell, v in values.items() if v is None]
+        if todo:
+            ops = list(dict.fromkeys(op for op, _ in todo))
+            computed = dict(zip(ops, await asyncio.to_thread(self._forecast, ops, windows)))
+            missing = {(op, w): computed[op][windows.index(w)] for op, w in todo}
+            await self.cache.store_many("predict", missing)
+            values.update(missing)
+        rows = {op: [values[(op, w)] for w in windows] for op in dict.fromkeys(operators)}
+        return [rows[op] for op in operators]
 
-    def operator_summary(self, operator: str, window: str = "4h") -> str:
-        predicted = self.predict(operator, window)  # will validate inputs
+    async def operator_summary(
+        self, operator: str, window: str = "4h", refresh: bool = False
+    ) -> str:
+        """One-sentence summary of the forecast; `refresh` skips the cached summary."""
+        predicted = await self.predict(operator, window)  # will validate inputs
+        cached = None if refresh else await self.cache.lookup("summary", operator, window)
+        if cached is not None:
+            return cached
         text = f"Operator {operator} predicted net flow {predicted:.2f} over {window}."
-        return self.ai.summarize(text)
+        summary = await self.ai.summarize(text)
+        await self.cache.store("summary", operator, window, summary)
+        return summary
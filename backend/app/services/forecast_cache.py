@@ -0,0 +1,136 @@
+from __future__ import annotations
+import asyncio
+import json
+from functools import lru_cache
+from typing import Any, Callable, Iterable, Sequence, TypeVar
+
+from app.core.cache import AsyncCache, get_async_cache
+from app.core.config import get_settings
+from app.core.metrics import counter
+
+T = TypeVar("T")
+
+MODEL_VERSION = "flows-v2"  # bump when forecasts change meaning: old cached values go stale
+
+FORECAST_CACHE_HITS = counter(
+    "forecast_cache_hits_total", "Forecast cache hits", ["kind"]
+)
+FORECAST_CACHE_MISSES = counter(
+    "forecast_cache_misses_total", "Forecast cache misses", ["kind"]
+)
+FORECAST_CACHE_EVICTIONS = counter(
+    "forecast_cache_evictions_total", "Forecast cache entries explicitly invalidated", ["kind"]
+)
+
+
+class ForecastCache:
+    """Memoizes forecast results in `AsyncCache`, keyed by (kind, operator, window, model
+    version).
+
+    - Each window has its own TTL so short-horizon forecasts refresh more often.
+    - Concurrent misses on the same key are de-duplicated: one task computes (on a worker
+      thread, off the event loop), the rest await its result instead of stampeding the
+      model.
+    """
+
+    def __init__(
+        self,
+        cache: AsyncCache | None = None,
+        ttls: dict[str, int] | None = None,
+        model_version: str = "v1",
+    ):
+        s = get_settings()
+        self._cache = cache
+        self.ttls = ttls or {
+            "1h": s.FORECAST_TTL_1H,
+            "4h": s.FORECAST_TTL_4H,
+            "24h": s.FORECAST_TTL_24H,
+        }
+        self.model_version = model_version
+        # Tasks belong to one event loop; a new loop starts afresh
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._flights: dict[str, asyncio.Task[Any]] = {}
+
+    @property
+    def cache(self) -> AsyncCache:
+        return self._cache or get_async_cache()
+
+    def key(self, kind: str, operator: str, window: str) -> str:
+        return f"forecast:{self.model_version}:{kind}:{window}:{operator}"
+
+    async def lookup(self, kind: str, operator: str, window: str) -> Any | None:
+        raw = await self.cache.get(self.key(kind, operator, window))
+        if raw is None:
+            FORECAST_CACHE_MISSES.labels(kind=kind).inc()
+            return None
+        FORECAST_CACHE_HITS.labels(kind=kind).inc()
+        return json.loads(raw)
+
+    async def store(self, kind: str, operator: str, window: str, value: Any) -> None:
+        key = self.key(kind, operator, window)
+        await self.cache.set(key, json.dumps(value), ex=self.ttls.get(window))
+
+    async def lookup_many(self, kind: str, cells: Sequence[tuple[str, str]]) -> list[Any | None]:
+        """Batch lookup of (operator, window) cells in one cache round-trip."""
+        raws = await self.cache.mget([self.key(kind, op, w) for op, w in cells])
+        hits = sum(1 for raw in raws if raw is not None)
+        FORECAST_CACHE_HITS.labels(kind=kind).inc(hits)
+        FORECAST_CACHE_MISSES.labels(kind=kind).inc(len(raws) - hits)
+        return [json.loads(raw) if raw is not None else None for raw in raws]
+
+    async def store_many(self, kind: str, values: dict[tuple[str, str], Any]) -> None:
+        keys = {self.key(kind, op, w): (w, v) for (op, w), v in values.items()}
+        await self.cache.mset(
+            {k: json.dumps(v) for k, (_, v) in keys.items()},
+            ex={k: self.ttls.get(w) for k, (w, _) in keys.items()},
+        )
+
+    async def get_or_compute(
+        self, kind: str, operator: str, window: str, compute: Callable[[], T]
+    ) -> T:
+        cached = await self.lookup(kind, operator, window)
+        if cached is not None:
+            return cached
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._flights = loop, {}
+        key = self.key(kind, operator, window)
+        flight = self._flights.get(key)
+        if flight is None:
+            flights = self._flights
+            flight = flights[key] = loop.create_task(self._compute(kind, operator, window, compute))
+            flight.add_done_callback(lambda _: flights.pop(key, None))
+        # Shielded: one caller going away must not cancel the computation others await
+        return await asyncio.shield(flight)
+
+    async def _compute(self, kind: str, operator: str, window: str, compute: Callable[[], T]) -> T:
+        value = await asyncio.to_thread(compute)
+        await self.store(kind, operator, window, value)
+        return value
+
+    async def invalidate(
+        self,
+        operators: Iterable[str],
+        windows: Iterable[str] | None = None,
+        kinds: Iterable[str] = ("predict", "summary"),
+    ) -> int:
+        """Drop cached entries for the given operators (optionally only some windows)."""
+        operators = list(operators)  # iterated once per kind: a generator would run dry
+        windows = list(windows) if windows is not None else list(self.ttls)
+        removed = 0
+        for kind in kinds:
+            keys = [self.key(kind, op, w) for op in operators for w in windows]
+            n = await self.cache.delete(*keys)
+            FORECAST_CACHE_EVICTIONS.labels(kind=kind).inc(n)
+            removed += n
+        return removed
+
+
+@lru_cache(maxsize=None)
+def get_forecast_cache(model_version: str = "v1") -> ForecastCache:
+    return ForecastCache(model_version=model_version)
+
+
+def get_model_cache(model: str | None = None) -> ForecastCache:
+    """The cache ForecastService uses for `model` (default FORECAST_MODEL)."""
+    return get_forecast_cache(f"{MODEL_VERSION}:{model or get_settings().FORECAST_MODEL}")
@@ -0,0 +1,176 @@
+from __future__ import annotations
+import threading
+import time
+from functools import lru_cache
+from typing import Protocol, Sequence
+
+import numpy as np
+
+from app.core.metrics import histogram
+from app.services.flows import WINDOW_HOURS, FlowStore, get_flow_store
+
+FORECAST_FIT_SECONDS = histogram(
+    "forecast_fit_seconds",
+    "Time to fit (all operators) or update the forecasting model",
+    ["mode"],  # fit | update
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+HOURS_PER_WEEK = 168
+
+
+class ForecastModel(Protocol):
+    """Hourly net-flow model over every operator at once.
+
+    Series are rows of a matrix (one per operator, one column per hour, oldest first);
+    `end_hour` is the epoch hour right after the last column, i.e. the first hour to
+    forecast. Seasonal state is indexed by epoch hour % season, so an hour-of-week
+    season stays aligned however much history was seen.
+    """
+
+    season: int
+
+    def fit(self, history: np.ndarray, end_hour: int) -> None:
+        ...
+
+    def update(self, buckets: np.ndarray, end_hour: int) -> None:
+        ...
+
+    def forecast(self, horizon: int) -> np.ndarray:
+        ...
+
+
+class SeasonalNaive:
+    """Each hour repeats the same hour one season ago."""
+
+    def __init__(self, season: int = HOURS_PER_WEEK):
+        self.season = season
+        self._last = np.zeros((0, season))
+        self._end = 0
+
+    def fit(self, history: np.ndarray, end_hour: int) -> None:
+        self._last = np.zeros((len(history), self.season))
+        self._feed(history, end_hour)
+
+    def update(self, buckets: np.ndarray, end_hour: int) -> None:
+        self._feed(buckets, end_hour)
+
+    def _feed(self, buckets: np.ndarray, end_hour: int) -> None:
+        recent = buckets[:, -self.season:]
+        self._last[:, np.arange(end_hour - recent.shape[1], end_hour) % self.season] = recent
+        self._end = end_hour
+
+    def forecast(self, horizon: int) -> np.ndarray:
+        return self._last[:, np.arange(self._end, self._end + horizon) % self.season]
+
+
+class ExponentialSmoothing:
+    """Additive exponential smoothing with a seasonal component (Holt-Winters, no trend).
+
+    level <- alpha (x - s) + (1 - alpha) level;  s <- gamma (x - level) + (1 - gamma) s.
+    Initialised from the first season of history (level = its mean, seasonal terms =
+    deviations from it); each step is one vector operation across all operators.
+    """
+
+    def __init__(self, season: int = HOURS_PER_WEEK, alpha: float = 0.2, gamma: float = 0.1):
+        self.season = season
+        self.alpha = alpha
+        self.gamma = gamma
+        self._level = np.zeros(0)
+        self._seasonal = np.zeros((season, 0))  # season x operators: rows updated in place
+        self._end = 0
+
+    def fit(self, history: np.ndarray, end_hour: int) -> None:
+        if history.shape[1] < self.season:
+            raise ValueError(f"need at least {self.season} hours of history")
+        first = history[:, : self.season].T.astype(float)
+        start = end_hour - history.shape[1]
+        self._level = first.mean(axis=0)
+        self._seasonal = np.empty((self.season, len(history)))
+        self._seasonal[np.arange(start, start + self.season) % self.season] = first - self._level
+        self._feed(history[:, self.season:], end_hour)
+
+    def update(self, buckets: np.ndarray, end_hour: int) -> None:
+        self._feed(buckets, end_hour)
+
+    def _feed(self, buckets: np.ndarray, end_hour: int) -> None:
+        a, g = self.alpha, self.gamma
+        level, seasonal = self._level, self._seasonal
+        start = end_hour - buckets.shape[1]
+        for j, x in enumerate(np.ascontiguousarray(buckets.T, dtype=float)):
+            s = seasonal[(start + j) % self.season]
+            level = a * (x - s) + (1 - a) * level
+            s *= 1 - g
+            s += g * (x - level)
+        self._level = level
+        self._end = end_hour
+
+    def forecast(self, horizon: int) -> np.ndarray:
+        k = np.arange(self._end, self._end + horizon) % self.season
+        return self._level[:, None] + self._seasonal[k].T
+
+
+MODELS: dict[str, type] = {
+    "seasonal_naive": SeasonalNaive,
+    "smoothing": ExponentialSmoothing,
+}
+
+
+class ForecastEngine:
+    """Keeps a ForecastModel fitted to every operator in a FlowStore.
+
+    The first query fits all operators from their closed hourly buckets in one batch;
+    later queries feed only the hours closed since (incremental update). A new operator
+    or a gap longer than the kept history triggers a full refit. Predictions cover the
+    hours from the current (open) one onwards, summed per window, in minor units.
+    """
+
+    def __init__(self, model: ForecastModel, store: FlowStore | None = None):
+        self.model = model
+        self.store = store or get_flow_store()
+        if self.store.hours <= model.season:
+            raise ValueError("flow history is shorter than the model's season")
+        self._lock = threading.Lock()
+        self._operators: dict[str, int] = {}
+        self._end: int | None = None  # first hour not yet fed to the model
+
+    def refresh(self) -> None:
+        with self._lock:
+            operators = self.store.operators
+            hour = self.store.hour
+            if self._end == hour and len(operators) == len(self._operators):
+                return
+            started = time.perf_counter()
+            if (
+                self._end is None
+                or len(operators) != len(self._operators)
+                or hour - self._end >= self.store.hours
+            ):
+                hour, history = self.store.closed(operators, since=hour - self.store.hours)
+                self.model.fit(history, hour)
+                self._operators = {op: i for i, op in enumerate(operators)}
+                mode = "fit"
+            else:
+                hour, buckets = self.store.closed(operators, since=self._end)
+                self.model.update(buckets, hour)
+                mode = "update"
+            self._end = hour
+            FORECAST_FIT_SECONDS.labels(mode=mode).observe(time.perf_counter() - started)
+
+    def predict(self, operators: Sequence[str], windows: Sequence[str]) -> np.ndarray:
+        """Predicted net flow, shape (operators, windows); unknown operators get 0."""
+        spans = [WINDOW_HOURS[w] for w in windows]
+        self.refresh()
+        with self._lock:
+            ahead = np.cumsum(self.model.forecast(max(spans)), axis=1)
+            unknown = len(self._operators)  # the zero row appended below
+            rows = [self._operators.get(op, unknown) for op in operators]
+        ahead = np.vstack([ahead, np.zeros((1, ahead.shape[1]))])
+        return ahead[rows][:, [s - 1 for s in spans]]
+
+
+@lru_cache(maxsize=None)
+def get_forecast_engine(model: str, store: FlowStore | None = None) -> ForecastEngine:
+    if model not in MODELS:
+        raise ValueError(f"unknown forecast model {model!r}")
+    return ForecastEngine(MODELS[model](), store)
@@ -0,0 +1,225 @@
+from __future__ import annotations
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Iterable, Sequence
+
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.core.db import SessionLocal
+from app.core.logging import get_logger
+from app.models.db_models import BalanceSnapshot, LedgerEntry
+
+log = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class Posting:
+    account: str
+    asset: str
+    amount_minor: int
+    wallet_id: int | None = None
+
+
+@dataclass
+class LedgerTransaction:
+    tx_id: str
+    postings: list[Posting]
+    note: str = ""
+
+    def validate(self) -> None:
+        if len(self.postings) < 2:
+            raise ValueError("transaction needs at least two postings")
+        totals: Counter[str] = Counter()
+        for p in self.postings:
+            totals[p.asset] += p.amount_minor
+        if any(totals.values()):
+            raise ValueError(f"unbalanced transaction {self.tx_id}")
+
+
+@dataclass
+class _Ticket:
+    txs: Sequence[LedgerTransaction]
+    done: bool = False
+    error: BaseException | None = None
+
+
+class LedgerEngine:
+    """Double-entry ledger with group commit and periodic balance snapshots.
+
+    Callers that post concurrently are coalesced: whoever holds the commit lock writes
+    every pending transaction in one DB transaction with a bulk INSERT, and the others
+    return once their postings are durable (or re-raise the batch's error).
+    Balances are the latest snapshot plus the entries after it; a new snapshot is
+    written, after the batch commits, once an account/asset has accumulated
+    `snapshot_every` entries.
+    Callables in `observers` get each batch once it is durable.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        snapshot_every: int | None = None,
+    ):
+        self.session_factory = session_factory
+        self.snapshot_every = snapshot_every or get_settings().LEDGER_SNAPSHOT_EVERY
+        self._pending: list[_Ticket] = []
+        self._pending_lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._since_snapshot: Counter[tuple[str, str]] = Counter()
+        self.observers: list[Callable[[Sequence[LedgerTransaction]], None]] = []
+
+    def post(self, tx: LedgerTransaction) -> None:
+        self.post_many([tx])
+
+    def post_many(self, txs: Sequence[LedgerTransaction]) -> None:
+        for tx in txs:
+            tx.validate()
+        ticket = _Ticket(txs)
+        with self._pending_lock:
+            self._pending.append(ticket)
+        with self._commit_lock:
+            if not ticket.done:
+                # Leader: take everything queued so far, including other callers' postings
+                with self._pending_lock:
+                    batch, self._pending = self._pending, []
+                written = [tx for t in batch for tx in t.txs]
+                try:
+                    self._write(written)
+                except Exception as e:
+                    for t in batch:
+                        t.error = e
+                else:
+                    self._notify(written)
+                for t in batch:
+                    t.done = True
+        if ticket.error is not None:
+            raise ticket.error
+
+    def _notify(self, txs: list[LedgerTransaction]) -> None:
+        # The postings are already committed: an observer failing must not fail them
+        for observer in self.observers:
+            try:
+                observer(txs)
+            except Exception:
+                log.exception(f"ledger observer {observer!r} failed")
+
+    def post_in(self, session: Session, txs: Sequence[LedgerTransaction]) -> None:
+        """Write `txs` in the caller's open transaction, so they commit or roll back with
+        its other changes (e.g. marking what they settle); call `committed` after it
+        commits. Bypasses the group commit."""
+        for tx in txs:
+            tx.validate()
+        self._insert(session, txs)
+
+    def committed(self, txs: Sequence[LedgerTransaction]) -> None:
+        """Snapshot bookkeeping and observers for postings committed via `post_in`."""
+        with self._commit_lock:
+            self._count(txs)
+        self._notify(list(txs))
+
+    def _write(self, txs: list[LedgerTransaction]) -> None:
+        with self.session_factory() as session, session.begin():
+            self._insert(session, txs)
+        self._count(txs)
+
+    def _insert(self, session: Session, txs: Sequence[LedgerTransaction]) -> None:
+        rows = [
+            {
+                "tx_id": tx.tx_id,
+                "account": p.account,
+                "wallet_id": p.wallet_id,
+                "amount_minor": p.amount_minor,
+                "asset": p.asset,
+                "note": tx.note,
+            }
+            for tx in txs
+            for p in tx.postings
+        ]
+        self._lock_accounts(session, {(r["account"], r["asset"]) for r in rows}, shared=True)
+        session.execute(insert(LedgerEntry), rows)
+
+    def _count(self, txs: Sequence[LedgerTransaction]) -> None:
+        touched = Counter((p.account, p.asset) for tx in txs for p in tx.postings)
+        due = [k for k, n in touched.items() if self._since_snapshot[k] + n >= self.snapshot_every]
+        self._since_snapshot.update(touched)
+        if due:
+            # The postings are committed; a failed snapshot is retried on the next batch
+            try:
+                self.snapshot(due)
+            except Exception:
+                log.exception(f"balance snapshot failed for {due!r}")
+
+    @staticmethod
+    def _lock_accounts(session: Session, keys: Iterable[tuple[str, str]], shared: bool) -> None:
+        """Postgres: one advisory lock per account/asset, held shared by writers until they
+        commit and exclusively by a snapshot. Sequence ids are handed out before commit,
+        not in commit order, so this keeps a snapshot from taking max(id) as its
+        watermark while a lower id for the same account is still in flight. SQLite
+        commits one writer at a time and needs none."""
+        if session.get_bind().dialect.name == "postgresql":  # pragma: no cover - postgres only
+            lock = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+            # Sorted, so writers and snapshots always queue for keys in the same order
+            for account, asset in sorted(keys):
+                session.execute(
+                    text(f"SELECT {lock}(hashtextextended(:key, 0))"),
+                    {"key": f"ledger:{account}:{asset}"},
+                )
+
+    def _latest_snapshot(self, session: Session, account: str, asset: str) -> tuple[int, int]:
+        snap = session.execute(
+            select(BalanceSnapshot.balance_minor, BalanceSnapshot.last_entry_id)
+            .where(BalanceSnapshot.account == account, BalanceSnapshot.asset == asset)
+            .order_by(BalanceSnapshot.last_entry_id.desc())
+            .limit(1)
+        ).first()
+        return (snap[0], snap[1]) if snap else (0, 0)
+
+    def _balance(self, session: Session, account: str, asset: str) -> tuple[int, int]:
+        base, after = self._latest_snapshot(session, account, asset)
+        delta, last_id = session.execute(
+            select(func.coalesce(func.sum(LedgerEntry.amount_minor), 0), func.max(LedgerEntry.id))
+            .where(
+                LedgerEntry.account == account,
+                LedgerEntry.asset == asset,
+                LedgerEntry.id > after,
+            )
+        ).one()
+        return base + int(delta), last_id or after
+
+    def _snapshot(self, session: Session, account: str, asset: str) -> None:
+        balance, last_id = self._balance(session, account, asset)
+        session.add(
+            BalanceSnapshot(
+                account=account, asset=asset, balance_minor=balance, last_entry_id=last_id
+            )
+        )
+
+    def snapshot(self, accounts: Iterable[tuple[str, str]]) -> None:
+        """Force snapshots for (account, asset) pairs, e.g. from a periodic job."""
+        keys = list(accounts)
+        with self.session_factory() as session, session.begin():
+            self._lock_accounts(session, keys, shared=False)
+            for account, asset in keys:
+                self._snapshot(session, account, asset)
+        for key in keys:
+            self._since_snapshot[key] = 0
+
+    def posted(self, tx_id: str) -> bool:
+        """Whether `tx_id` already has entries (lets retried callers avoid double posting)."""
+        with self.session_factory() as session:
+            stmt = select(LedgerEntry.id).where(LedgerEntry.tx_id == tx_id).limit(1)
+            return session.scalar(stmt) is not None
+
+    def balance(self, account: str, asset: str) -> int:
+        """Current balance in minor units: latest snapshot plus later entries."""
+        with self.session_factory() as session:
+            return self._balance(session, account, asset)[0]
+
+
+@lru_cache(maxsize=1)
+def get_ledger() -> LedgerEngine:
+    return LedgerEngine()
@@ -1,10 +1,18 @@
+from app.services.pools import PoolEngine, get_pool_engine
 from app.utils.ids import new_tx_id
 
 
 class LiquidityService:
+    def __init__(self, pools: PoolEngine | None = None):
+        self.pools = pools or get_pool_engine()
+
     def rebalance(self, source_pool: str, dest_pool: str, amount: float, reason: str | None, window: str | None):
         if amount <= 0:
             raise ValueError("amount must be positive")
         order_id = new_tx_id(prefix="rb")
         status = "placed"
+        # Pools held by the engine move at once; others are left to the order's executor
+        if self.pools.tracked(source_pool) and self.pools.tracked(dest_pool):
+            self.pools.transfer(source_pool, dest_pool, amount)
+            status = "executed"
         return order_id, status
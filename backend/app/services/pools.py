@@ -0,0 +1,626 @@
+from __future__ import annotations
+import asyncio
+import json
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Callable, Sequence
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.cache import Cache, get_cache
+from app.core.config import get_settings
+from app.core.db import SessionLocal
+from app.core.logging import get_logger
+from app.core.metrics import counter, gauge
+from app.models.db_models import LiquidityPoolRecord, PoolJournalEntry, ServiceLease, utcnow
+from app.utils.money import from_minor, to_minor
+
+log = get_logger(__name__)
+
+POOL_OPS_TOTAL = counter(
+    "pool_operations_total", "Liquidity pool operations", ["op", "outcome"]
+)
+POOL_JOURNAL_LAG = gauge(
+    "pool_journal_unflushed", "Journal entries not yet written back to liquidity_pools"
+)
+
+# op -> (balance delta, reserved delta) per unit of amount
+_EFFECTS: dict[str, tuple[int, int]] = {
+    "credit": (1, 0),
+    "debit": (-1, 0),
+    "reserve": (0, 1),
+    "commit": (-1, -1),  # reserved liquidity leaves the pool
+    "release": (0, -1),
+}
+
+
+LEASE_NAME = "liquidity-pools"
+FORWARD_KEY = "pools:forwarded"  # operations followers hand to the owning engine
+
+
+class InsufficientLiquidity(ValueError):
+    """The pool's unreserved balance does not cover the request."""
+
+
+class PoolsLeased(RuntimeError):
+    """Another PoolEngine owns the liquidity pools (or this one lost its claim)."""
+
+
+# Operations a follower forwards, and the errors it re-raises as such
+_FORWARDED_OPS = frozenset(
+    {
+        "create_pool", "credit", "reserve", "commit", "release", "transfer",
+        "tracked", "snapshot", "snapshots",
+    }
+)
+_FORWARDED_ERRORS: dict[str, type[Exception]] = {
+    "InsufficientLiquidity": InsufficientLiquidity,
+    "PoolsLeased": PoolsLeased,
+    "KeyError": KeyError,
+    "ValueError": ValueError,
+}
+
+
+def _decimals(snapshot: dict[str, Any]) -> dict[str, Any]:
+    """A forwarded `snapshot` with its amounts back as Decimals."""
+    return {
+        k: Decimal(v) if k in ("balance", "reserved", "available") else v
+        for k, v in snapshot.items()
+    }
+
+
+@dataclass
+class _Pool:
+    name: str
+    asset: str
+    balance: int  # minor units
+    reserved: int
+
+    @property
+    def available(self) -> int:
+        return self.balance - self.reserved
+
+
+@dataclass
+class _Op:
+    pool: str
+    op: str
+    amount: int
+    reservation_id: str | None = None
+    seq: int = 0
+
+
+@dataclass
+class _Ticket:
+    ops: list[_Op]
+    done: bool = False
+    error: BaseException | None = None
+
+
+class PoolEngine:
+    """Hot liquidity pool balances with atomic reserve/commit/release.
+
+    Balances and open reservations live in memory; every change is checked and applied
+    under one lock, so a liquidity check costs no database round trip or row lock.
+    Before an operation returns it is appended to `pool_journal`: concurrent callers
+    are group-committed (one INSERT for everyone waiting), and a failed append undoes
+    the in-memory change. `flush` writes the journal's net effect back to
+    `liquidity_pools` in one transaction, advancing each row's `applied_seq`, and drops
+    journal entries that no longer matter. On startup the rows are loaded and entries
+    past `applied_seq` replayed, so a crash loses nothing that was acknowledged.
+
+    Pools are tracked once they have a `liquidity_pools` row (see `credit`); holds on
+    any other pool are not limited, so unfunded demo setups keep working.
+
+    One engine owns the pools at a time, since balances are checked in its memory and
+    journal ids assigned in its process: loading claims the `liquidity-pools` row of
+    `service_leases` and raises PoolsLeased while another engine's claim is live. Every
+    journal append and write-back renews the claim in its own transaction, so an engine
+    whose claim lapsed and was taken over cannot write; it drops its state and reloads
+    (re-claiming) on the next operation. `stop` hands the claim back.
+
+    The other engines (further API workers) run as followers: each operation is pushed
+    onto the `pools:forwarded` list of the shared cache and answered by the owner's
+    `start`ed engine, which runs it like a local call. A follower tries the claim again
+    on every write-back tick and when the owner leaves a request unanswered for
+    `forward_timeout` seconds, so it takes over once the owner is gone.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        flush_interval: float | None = None,
+        lease_ttl: float | None = None,
+        cache: Cache | None = None,
+        forward_timeout: float | None = None,
+    ):
+        s = get_settings()
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval or s.POOL_FLUSH_INTERVAL
+        self.lease_ttl = lease_ttl if lease_ttl is not None else s.POOL_LEASE_TTL
+        self.cache = cache or get_cache()
+        self.forward_timeout = forward_timeout or s.POOL_FORWARD_TIMEOUT
+        self.owner = uuid.uuid4().hex
+        self._renew_at = 0.0  # monotonic time the claim is next renewed
+        self._claim_at = 0.0  # monotonic time a follower next tries to claim the pools
+        self._lock = threading.RLock()  # pool state
+        self._commit_lock = threading.Lock()  # journal appends and flushes
+        self._pending_lock = threading.Lock()
+        self._pending: list[_Ticket] = []
+        self._pools: dict[str, _Pool] = {}
+        self._reservations: dict[str, tuple[str, int]] = {}  # id -> (pool, amount)
+        self._durable: list[_Op] = []  # journaled, not yet written back
+        self._seq = 0
+        self._loaded = False
+        self._flusher: asyncio.Task | None = None
+        self._server: asyncio.Task | None = None
+        self._answering: set[asyncio.Task] = set()
+
+    # -- recovery -------------------------------------------------------------------
+
+    def load(self) -> None:
+        """Claim the pools, load their rows and replay the journal past each row's
+        watermark. Raises PoolsLeased if another engine owns them."""
+        with self._lock, self._commit_lock:
+            if self._loaded:
+                return
+            self._acquire()
+            self._reservations, self._durable = {}, []
+            with self.session_factory() as session:
+                rows = session.scalars(select(LiquidityPoolRecord)).all()
+                self._pools = {
+                    r.name: _Pool(r.name, r.asset, r.balance_minor, r.reserved_minor) for r in rows
+                }
+                applied = {r.name: r.applied_seq for r in rows}
+                # Compaction may have deleted the newest entries: never reuse an applied id
+                last = session.scalar(select(func.max(PoolJournalEntry.id))) or 0
+                self._seq = max([last, *applied.values()])
+                entries = session.scalars(
+                    select(PoolJournalEntry).order_by(PoolJournalEntry.id)
+                ).all()
+            closed = {e.reservation_id for e in entries if e.op in ("commit", "release")}
+            for e in entries:
+                if e.op == "reserve" and e.reservation_id not in closed:
+                    self._reservations[e.reservation_id] = (e.pool, e.amount_minor)
+                if e.id > applied[e.pool]:
+                    self._apply(self._pools[e.pool], e.op, e.amount_minor)
+                    self._durable.append(_Op(e.pool, e.op, e.amount_minor, e.reservation_id, e.id))
+            POOL_JOURNAL_LAG.set(len(self._durable))
+            self._loaded = True
+
+    def _owns(self) -> bool:
+        """Load the pools unless another engine owns them; False means forward."""
+        if not self._loaded and time.monotonic() >= self._claim_at:
+            try:
+                self.load()
+            except PoolsLeased:
+                # A follower; the write-back tick tries the claim again
+                self._claim_at = time.monotonic() + self.flush_interval
+        return self._loaded
+
+    def _forget(self) -> None:
+        # The claim was lost: memory may be stale, so reload before the next operation
+        log.error("lost the claim on the liquidity pools; reloading before the next operation")
+        self._loaded = False
+
+    # -- ownership --------------------------------------------------------------------
+
+    def _lease_deadline(self):
+        return utcnow() + timedelta(seconds=self.lease_ttl)
+
+    def _acquire(self) -> None:
+        with self.session_factory() as session, session.begin():
+            if self._renew(session, take_over=True):
+                return
+        try:
+            with self.session_factory() as session, session.begin():
+                session.add(
+                    ServiceLease(
+                        name=LEASE_NAME, owner=self.owner, lease_until=self._lease_deadline()
+                    )
+                )
+        except IntegrityError:
+            raise PoolsLeased("the liquidity pools are owned by another instance") from None
+
+    def _renew(self, session: Session, take_over: bool = False) -> bool:
+        """Extend this engine's claim in `session`'s transaction; with `take_over`, also
+        take a claim that is free or has lapsed. False if the claim is not (now) ours."""
+        held = ServiceLease.owner == self.owner
+        if take_over:
+            held = or_(held, ServiceLease.owner.is_(None), ServiceLease.lease_until < utcnow())
+        renewed = session.execute(
+            update(ServiceLease)
+            .where(ServiceLease.name == LEASE_NAME, held)
+            .values(owner=self.owner, lease_until=self._lease_deadline())
+        )
+        if renewed.rowcount:
+            self._renew_at = time.monotonic() + self.lease_ttl / 3
+        return bool(renewed.rowcount)
+
+    def _fence(self, session: Session) -> None:
+        """Check, in the caller's write transaction, that the pools are still ours. The
+        claim row is locked for share (a takeover waits for this commit) and renewed
+        only every third of the TTL, which keeps the check off the hot path's writes."""
+        if time.monotonic() >= self._renew_at:
+            held = self._renew(session)
+        else:
+            owner = session.scalar(
+                select(ServiceLease.owner)
+                .where(ServiceLease.name == LEASE_NAME)
+                .with_for_update(read=True)
+            )
+            held = owner == self.owner
+        if not held:
+            raise PoolsLeased("the claim on the liquidity pools was taken over")
+
+    def relinquish(self) -> None:
+        """Hand the pools back (after a final write-back) so another engine may load them."""
+        with self._lock, self._commit_lock:
+            with self.session_factory() as session, session.begin():
+                session.execute(
+                    update(ServiceLease)
+                    .where(ServiceLease.name == LEASE_NAME, ServiceLease.owner == self.owner)
+                    .values(owner=None, lease_until=None)
+                )
+            self._loaded = False
+
+    @staticmethod
+    def _apply(pool: _Pool, op: str, amount: int, sign: int = 1) -> None:
+        dbal, dres = _EFFECTS[op]
+        pool.balance += sign * dbal * amount
+        pool.reserved += sign * dres * amount
+
+    # -- operations -----------------------------------------------------------------
+
+    def create_pool(self, name: str, asset: str) -> None:
+        """Start tracking `name` (idempotent); its balance starts at zero."""
+        if not self._owns():
+            return self._forward("create_pool", name, asset)
+        with self._lock:
+            if name in self._pools:
+                return
+            with self.session_factory() as session, session.begin():
+                session.add(LiquidityPoolRecord(name=name, asset=asset.upper(), balance=0.0))
+            self._pools[name] = _Pool(name, asset.upper(), 0, 0)
+
+    def credit(self, pool: str, amount: Decimal | float | str, asset: str = "LOCAL") -> None:
+        """Add liquidity, creating the pool if needed (e.g. a treasury top-up)."""
+        if not self._owns():
+            return self._forward("credit", pool, str(amount), asset)
+        self.create_pool(pool, asset)
+        with self._lock:
+            ops = self._apply_all([self._op(pool, "credit", amount)])
+        self._journal(ops)
+
+    def reserve(self, pool: str, amount: Decimal | float | str, reservation_id: str) -> bool:
+        """Hold `amount` of the pool's free balance for `reservation_id`.
+
+        Returns False if the pool is not tracked (nothing held) and True once the hold
+        is journaled; repeating a reservation id is a no-op. Raises InsufficientLiquidity.
+        """
+        if not self._owns():
+            return self._forward("reserve", pool, str(amount), reservation_id)
+        with self._lock:
+            if reservation_id in self._reservations:
+                return True
+            if pool not in self._pools:
+                POOL_OPS_TOTAL.labels(op="reserve", outcome="untracked").inc()
+                return False
+            ops = self._apply_all([self._op(pool, "reserve", amount, reservation_id)])
+        self._journal(ops)
+        return True
+
+    def commit(self, reservation_id: str) -> bool:
+        """Spend a reservation; False if there is no such open reservation."""
+        return self._close(reservation_id, "commit")
+
+    def release(self, reservation_id: str) -> bool:
+        """Return a reservation's liquidity to the pool; False if there is none."""
+        return self._close(reservation_id, "release")
+
+    def transfer(self, source: str, dest: str, amount: Decimal | float | str) -> None:
+        """Move liquidity between two tracked pools of the same asset, atomically."""
+        if not self._owns():
+            return self._forward("transfer", source, dest, str(amount))
+        with self._lock:
+            src, dst = self._pools.get(source), self._pools.get(dest)
+            if src is None or dst is None:
+                raise KeyError(source if src is None else dest)
+            if src.asset != dst.asset:
+                raise ValueError(f"cannot move {src.asset} into a {dst.asset} pool")
+            ops = self._apply_all(
+                [self._op(dest, "credit", amount), self._op(source, "debit", amount)]
+            )
+        self._journal(ops)
+
+    def tracked(self, pool: str) -> bool:
+        if not self._owns():
+            return self._forward("tracked", pool)
+        return pool in self._pools
+
+    def snapshot(self, pool: str) -> dict[str, Any]:
+        """Current balance, reserved and available amounts (major units)."""
+        if not self._owns():
+            return _decimals(self._forward("snapshot", pool))
+        with self._lock:
+            p = self._pools[pool]
+            return {
+                "pool": p.name,
+                "asset": p.asset,
+                "balance": from_minor(p.balance, p.asset),
+                "reserved": from_minor(p.reserved, p.asset),
+                "available": from_minor(p.available, p.asset),
+            }
+
+    def snapshots(self) -> list[dict[str, Any]]:
+        """`snapshot` of every tracked pool."""
+        if not self._owns():
+            return [_decimals(snap) for snap in self._forward("snapshots")]
+        with self._lock:
+            return [self.snapshot(name) for name in self._pools]
+
+    def _op(self, pool: str, op: str, amount: Any, reservation_id: str | None = None) -> _Op:
+        minor = to_minor(amount, self._pools[pool].asset)
+        if minor <= 0:
+            raise ValueError("amount must be positive")
+        return _Op(pool, op, minor, reservation_id)
+
+    def _close(self, reservation_id: str, op: str) -> bool:
+        if not self._owns():
+            return self._forward(op, reservation_id)
+        with self._lock:
+            held = self._reservations.get(reservation_id)
+            if held is None:
+                return False
+            ops = self._apply_all([_Op(held[0], op, held[1], reservation_id)])
+        self._journal(ops)
+        return True
+
+    def _apply_all(self, ops: list[_Op]) -> list[_Op]:
+        """Check and apply `ops` to memory, all or none; the caller holds the lock."""
+        for i, o in enumerate(ops):
+            pool = self._pools[o.pool]
+            if o.op in ("debit", "reserve") and pool.available < o.amount:
+                for done in reversed(ops[:i]):
+                    self._undo(done)
+                POOL_OPS_TOTAL.labels(op=o.op, outcome="insufficient").inc()
+                available = from_minor(pool.available, pool.asset)
+                raise InsufficientLiquidity(
+                    f"pool {o.pool} has {available} {pool.asset} available"
+                )
+            self._apply(pool, o.op, o.amount)
+            if o.op == "reserve":
+                self._reservations[o.reservation_id] = (o.pool, o.amount)  # type: ignore[index]
+            elif o.reservation_id is not None:
+                del self._reservations[o.reservation_id]
+        return ops
+
+    def _undo(self, o: _Op) -> None:
+        self._apply(self._pools[o.pool], o.op, o.amount, sign=-1)
+        if o.op == "reserve":
+            del self._reservations[o.reservation_id]  # type: ignore[arg-type]
+        elif o.reservation_id is not None:
+            self._reservations[o.reservation_id] = (o.pool, o.amount)
+
+    def _journal(self, ops: list[_Op]) -> None:
+        # Memory already reflects `ops`; they are acknowledged only once journaled
+        try:
+            self._append(ops)
+        except PoolsLeased:
+            self._forget()
+            for o in ops:
+                POOL_OPS_TOTAL.labels(op=o.op, outcome="error").inc()
+            raise
+        except Exception:
+            with self._lock:
+                for o in reversed(ops):
+                    self._undo(o)
+            for o in ops:
+                POOL_OPS_TOTAL.labels(op=o.op, outcome="error").inc()
+            raise
+        for o in ops:
+            POOL_OPS_TOTAL.labels(op=o.op, outcome="ok").inc()
+
+    # -- journal ----------------------------------------------------------------------
+
+    def _append(self, ops: Sequence[_Op]) -> None:
+        # Group commit, as in LedgerEngine: whoever holds the lock writes every queued op
+        ticket = _Ticket(list(ops))
+        with self._pending_lock:
+            self._pending.append(ticket)
+        with self._commit_lock:
+            if not ticket.done:
+                with self._pending_lock:
+                    batch, self._pending = self._pending, []
+                try:
+                    self._write([o for t in batch for o in t.ops])
+                except Exception as e:
+                    for t in batch:
+                        t.error = e
+                for t in batch:
+                    t.done = True
+        if ticket.error is not None:
+            raise ticket.error
+
+    def _write(self, ops: list[_Op]) -> None:
+        first = self._seq + 1
+        rows = [
+            {
+                "id": first + i,
+                "pool": o.pool,
+                "op": o.op,
+                "reservation_id": o.reservation_id,
+                "amount_minor": o.amount,
+            }
+            for i, o in enumerate(ops)
+        ]
+        with self.session_factory() as session, session.begin():
+            self._fence(session)
+            session.execute(PoolJournalEntry.__table__.insert(), rows)
+        self._seq += len(ops)
+        for i, o in enumerate(ops):
+            o.seq = first + i
+        self._durable.extend(ops)
+        POOL_JOURNAL_LAG.set(len(self._durable))
+
+    # -- write-behind -----------------------------------------------------------------
+
+    def flush(self) -> int:
+        """Write journaled changes back to `liquidity_pools` (renewing the claim on the
+        pools even when there are none); returns entries applied. A follower tries to
+        claim the pools instead."""
+        if not self._owns():
+            return 0
+        try:
+            return self._write_back()
+        except PoolsLeased:
+            self._forget()
+            raise
+
+    def _write_back(self) -> int:
+        with self._commit_lock:  # appends wait, so no entry lands past the watermark
+            ops = self._durable
+            if not ops:
+                with self.session_factory() as session, session.begin():
+                    self._fence(session)
+                return 0
+            last_seq = ops[-1].seq
+            deltas: dict[str, list[int]] = {}  # pool -> [balance, reserved]
+            for o in ops:
+                dbal, dres = _EFFECTS[o.op]
+                d = deltas.setdefault(o.pool, [0, 0])
+                d[0] += dbal * o.amount
+                d[1] += dres * o.amount
+            closed = [o.reservation_id for o in ops if o.op in ("commit", "release")]
+            with self.session_factory() as session, session.begin():
+                self._fence(session)
+                rows = session.scalars(
+                    select(LiquidityPoolRecord).where(LiquidityPoolRecord.name.in_(deltas))
+                )
+                for row in rows:
+                    dbal, dres = deltas[row.name]
+                    row.balance_minor += dbal
+                    row.reserved_minor += dres
+                    row.balance = float(from_minor(row.balance_minor, row.asset))
+                    row.applied_seq = last_seq
+                # Applied entries are only kept to rebuild still-open reservations
+                applied = PoolJournalEntry.id <= last_seq
+                session.execute(
+                    delete(PoolJournalEntry).where(
+                        applied, PoolJournalEntry.op.in_(("credit", "debit"))
+                    )
+                )
+                for i in range(0, len(closed), 500):
+                    session.execute(
+                        delete(PoolJournalEntry).where(
+                            applied, PoolJournalEntry.reservation_id.in_(closed[i : i + 500])
+                        )
+                    )
+            self._durable = []
+            POOL_JOURNAL_LAG.set(0)
+            return len(ops)
+
+    async def start(self) -> None:
+        """Load state (or follow the owning engine) and start the periodic write-behind
+        task and the server answering followers."""
+        await asyncio.to_thread(self._owns)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+            self._server = asyncio.create_task(self._serve_loop())
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            server, self._server = self._server, None
+            assert server is not None
+            # Wakes a pop waiting in the server's thread; whoever takes it ignores it
+            await asyncio.to_thread(self.cache.push, FORWARD_KEY, "", self.forward_timeout)
+            for task in (self._flusher, server):
+                task.cancel()
+            await asyncio.gather(self._flusher, server, return_exceptions=True)
+            await asyncio.gather(*list(self._answering), return_exceptions=True)
+            self._flusher = None
+        await asyncio.to_thread(self.flush)
+        await asyncio.to_thread(self.relinquish)
+
+    # -- forwarding -------------------------------------------------------------------
+
+    def _forward(self, op: str, *args: Any) -> Any:
+        """Run `op` on the engine owning the pools and return its result. If the owner
+        leaves it unanswered, try to take the pools over and run it here."""
+        reply_key = f"{FORWARD_KEY}:{uuid.uuid4().hex}"
+        request = {
+            "op": op,
+            "args": args,
+            "reply": reply_key,
+            "until": time.time() + self.forward_timeout,  # the owner skips it after this
+        }
+        self.cache.push(FORWARD_KEY, json.dumps(request), ex=self.forward_timeout)
+        answer = self.cache.pop(reply_key, self.forward_timeout)
+        if answer is None:
+            POOL_OPS_TOTAL.labels(op=op, outcome="unanswered").inc()
+            self._claim_at = 0.0
+            if self._owns():
+                return getattr(self, op)(*args)
+            raise PoolsLeased(
+                f"the engine owning the liquidity pools did not answer {op} "
+                f"within {self.forward_timeout:g}s"
+            )
+        reply = json.loads(answer)
+        if "error" in reply:
+            raise _FORWARDED_ERRORS.get(reply["error"], RuntimeError)(reply["message"])
+        return reply["result"]
+
+    def _answer(self, message: str) -> None:
+        request = json.loads(message)
+        if request["until"] < time.time():
+            return  # the follower gave up on it
+        try:
+            if request["op"] not in _FORWARDED_OPS:
+                raise ValueError(f"{request['op']} cannot be forwarded")
+            reply = {"result": getattr(self, request["op"])(*request["args"])}
+        except Exception as e:
+            reply = {"error": type(e).__name__, "message": str(e.args[0]) if e.args else ""}
+        self.cache.push(request["reply"], json.dumps(reply, default=str), self.forward_timeout)
+
+    async def _serve_loop(self) -> None:
+        while self._server is not None:
+            if not self._loaded:  # a follower: the owner answers
+                await asyncio.sleep(self.flush_interval)
+                continue
+            try:
+                message = await asyncio.to_thread(
+                    self.cache.pop, FORWARD_KEY, self.flush_interval
+                )
+            except Exception:
+                log.exception("could not read forwarded pool operations; will retry")
+                await asyncio.sleep(self.flush_interval)
+                continue
+            if message:
+                # Answered concurrently, so forwarded operations share group commits
+                task = asyncio.create_task(asyncio.to_thread(self._answer, message))
+                self._answering.add(task)
+                task.add_done_callback(self._answering.discard)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                log.exception("pool write-behind failed; will retry")
+
+
+_engine: PoolEngine | None = None
+
+
+def get_pool_engine() -> PoolEngine:
+    global _engine
+    if _engine is None:
+        _engine = PoolEngine()
+    return _engine
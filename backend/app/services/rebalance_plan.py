@@ -0,0 +1,286 @@
+from __future__ import annotations
+import time
+from dataclasses import dataclass
+from heapq import heappop, heappush
+from typing import Any, Sequence
+
+from app.core.config import get_settings
+from app.core.metrics import histogram
+from app.services.forecast import ForecastService, Window
+from app.services.pools import PoolEngine, get_pool_engine
+from app.utils.money import from_minor, to_minor
+
+PLAN_SOLVE_SECONDS = histogram(
+    "liquidity_plan_solve_seconds",
+    "Time to solve one rebalancing plan",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+
+@dataclass(frozen=True)
+class PoolState:
+    name: str
+    asset: str
+    available: int  # minor units, free to move now
+    net_flow: int  # predicted over the window, minor units (negative drains the pool)
+    min_balance: int = 0
+
+    @property
+    def projected(self) -> int:
+        return self.available + self.net_flow
+
+    @property
+    def deficit(self) -> int:
+        return max(0, self.min_balance - self.projected)
+
+    @property
+    def surplus(self) -> int:
+        # Predicted inflows have not arrived yet: only what the pool holds can leave it
+        return max(0, min(self.available, self.projected) - self.min_balance)
+
+
+@dataclass(frozen=True)
+class Route:
+    source: str
+    dest: str
+    fee_bps: int  # cost of moving liquidity along this route, per unit moved
+    capacity: int | None = None  # minor units; None = unlimited
+
+
+def min_cost_flow(n: int, arcs: Sequence[tuple[int, int, int, int]], s: int, t: int) -> list[int]:
+    """Minimum-cost maximum flow from `s` to `t`; returns the flow on each arc.
+
+    `arcs` are (tail, head, capacity, cost) with integer capacities and non-negative
+    integer costs. Primal-dual: Dijkstra on reduced costs updates the node potentials,
+    then flow is pushed along every path of zero reduced cost (i.e. every currently
+    cheapest path) before the next Dijkstra. With fees in whole basis points many paths
+    tie, so a plan takes a few dozen phases rather than one per path.
+    """
+    head: list[int] = []
+    cap: list[int] = []
+    cost: list[int] = []
+    adj: list[list[int]] = [[] for _ in range(n)]
+    for u, v, c, w in arcs:
+        adj[u].append(len(head))
+        head.append(v)
+        cap.append(c)
+        cost.append(w)
+        adj[v].append(len(head))  # residual arc: id ^ 1
+        head.append(u)
+        cap.append(0)
+        cost.append(-w)
+    pot = [0] * n
+    inf = float("inf")
+    while True:
+        dist: list[float] = [inf] * n
+        dist[s] = 0
+        heap = [(0, s)]
+        while heap:
+            d, u = heappop(heap)
+            if d > dist[u]:
+                continue  # stale entry
+            if u == t:
+                break
+            pu = pot[u] + d
+            for e in adj[u]:
+                if cap[e]:
+                    v = head[e]
+                    nd = pu + cost[e] - pot[v]
+                    if nd < dist[v]:
+                        dist[v] = nd
+                        heappush(heap, (nd, v))
+        if dist[t] == inf:
+            break
+        # Nodes not settled before t are at least dist[t] away; capping keeps every
+        # residual arc's reduced cost non-negative
+        dt = dist[t]
+        pot = [p + int(min(d, dt)) for p, d in zip(pot, dist)]
+        _saturate(s, t, adj, head, cap, cost, pot)
+    return [cap[2 * i + 1] for i in range(len(arcs))]
+
+
+def _saturate(s: int, t: int, adj, head, cap, cost, pot) -> None:
+    # Push flow along s-t paths of admissible arcs until none is left. Each node keeps
+    # a current arc, so an arc is passed over at most once per phase: saturated, a dead
+    # end, or closing a cycle. A path missed that way is found in the next phase at the
+    # same cost, since the potentials stay valid.
+    n = len(adj)
+    # Admissible arcs (zero reduced cost) are exactly those on cheapest paths; their
+    # residual twins are admissible too, so flow pushed now can still be rerouted.
+    # Listed on first visit: most nodes are never reached in a phase.
+    zero: list[list[int] | None] = [None] * n
+    nxt = [0] * n
+    on_path = [False] * n
+    path: list[int] = []
+    u = s
+    on_path[s] = True
+    while True:
+        if u == t:
+            pushed = min(cap[e] for e in path)
+            for e in path:
+                cap[e] -= pushed
+                cap[e ^ 1] += pushed
+            for e in path:
+                on_path[head[e]] = False
+            path.clear()
+            u = s
+            continue
+        arcs = zero[u]
+        if arcs is None:
+            pu = pot[u]
+            arcs = zero[u] = [e for e in adj[u] if cost[e] + pu == pot[head[e]]]
+        i, end = nxt[u], len(arcs)
+        while i < end and (not cap[arcs[i]] or on_path[head[arcs[i]]]):
+            i += 1
+        nxt[u] = i
+        if i < end:
+            e = arcs[i]
+            path.append(e)
+            u = head[e]
+            on_path[u] = True
+        elif u == s:
+            return
+        else:
+            # Dead end for the rest of the phase: leave it and skip the arc into it
+            on_path[u] = False
+            u = head[path.pop() ^ 1]
+            nxt[u] += 1
+
+
+def solve(pools: Sequence[PoolState], routes: Sequence[Route] | None, fee_bps: int) -> dict:
+    """Cheapest set of transfers covering every pool's predicted deficit.
+
+    Flow may pass through intermediate pools when that is cheaper than a direct route.
+    Without `routes`, every surplus pool can send to every deficit pool of the same
+    asset at `fee_bps`. When surpluses (or routes) cannot cover all deficits, as much as
+    possible is covered and the rest is reported per pool as `unmet`.
+    """
+    index = {p.name: i for i, p in enumerate(pools)}
+    if len(index) != len(pools):
+        raise ValueError("duplicate pool names")
+    if routes is None:
+        routes = [
+            Route(a.name, b.name, fee_bps)
+            for a in pools
+            if a.surplus
+            for b in pools
+            if b.deficit and b.asset == a.asset
+        ]
+    n = len(pools)
+    s, t = n, n + 1
+    unlimited = sum(p.surplus for p in pools)
+    arcs: list[tuple[int, int, int, int]] = []
+    for r in routes:
+        if r.source not in index or r.dest not in index:
+            raise ValueError(f"route {r.source} -> {r.dest} names an unknown pool")
+        a, b = pools[index[r.source]], pools[index[r.dest]]
+        if a.asset != b.asset:
+            raise ValueError(f"route {r.source} -> {r.dest} crosses assets")
+        capacity = unlimited if r.capacity is None else r.capacity
+        arcs.append((index[r.source], index[r.dest], capacity, r.fee_bps))
+    routed = len(arcs)
+    arcs += [(s, i, p.surplus, 0) for i, p in enumerate(pools) if p.surplus]
+    sinks = [(i, len(arcs) + k) for k, i in enumerate(i for i, p in enumerate(pools) if p.deficit)]
+    arcs += [(i, t, pools[i].deficit, 0) for i, _ in sinks]
+    flows = min_cost_flow(n + 2, arcs, s, t)
+    covered = {i: flows[arc] for i, arc in sinks}
+    transfers = []
+    for (u, v, _, fee), flow in zip(arcs[:routed], flows[:routed]):
+        if flow:
+            transfers.append({"source": pools[u].name, "dest": pools[v].name,
+                              "asset": pools[u].asset, "amount": flow, "fee_bps": fee})
+    return {
+        "transfers": transfers,
+        "unmet": {pools[i].name: pools[i].deficit - covered.get(i, 0) for i in covered},
+    }
+
+
+class RebalancePlanner:
+    """Plans transfers between liquidity pools ahead of predicted demand.
+
+    Balances are the pools' free liquidity in the PoolEngine (or given by the caller),
+    net flows come from ForecastService for the requested window, and the transfers
+    are a minimum-cost flow from projected surpluses to projected shortfalls.
+    """
+
+    def __init__(self, pools: PoolEngine | None = None, forecast: ForecastService | None = None):
+        self.pools = pools or get_pool_engine()
+        self.forecast = forecast or ForecastService()
+
+    async def plan(
+        self,
+        window: Window,
+        balances: Sequence[dict[str, Any]] | None = None,
+        routes: Sequence[dict[str, Any]] | None = None,
+        min_balance: float = 0.0,
+    ) -> dict[str, Any]:
+        """`balances`: {name, balance, asset?, minBalance?} per pool, major units;
+        `routes`: {source, dest, feeBps, capacity?}. Amounts in the result are major units."""
+        if balances is None:
+            balances = [
+                {"name": p["pool"], "balance": p["available"], "asset": p["asset"]}
+                for p in self.pools.snapshots()
+            ]
+        if not balances:
+            raise ValueError("no pools to plan")
+        flows = await self.forecast.predict_many([b["name"] for b in balances], [window])
+        states = []
+        for b, (flow,) in zip(balances, flows):
+            asset = (b.get("asset") or "LOCAL").upper()
+            floor = b.get("minBalance")
+            states.append(
+                PoolState(
+                    name=b["name"],
+                    asset=asset,
+                    available=to_minor(b["balance"], asset),
+                    net_flow=to_minor(flow, asset),
+                    min_balance=to_minor(min_balance if floor is None else floor, asset),
+                )
+            )
+        assets = {p.name: p.asset for p in states}
+        plan_routes = None
+        if routes is not None:
+            plan_routes = [
+                Route(
+                    r["source"],
+                    r["dest"],
+                    r["feeBps"],
+                    None
+                    if r.get("capacity") is None
+                    else to_minor(r["capacity"], assets.get(r["source"], "LOCAL")),
+                )
+                for r in routes
+            ]
+        started = time.perf_counter()
+        result = solve(states, plan_routes, get_settings().LIQUIDITY_PLAN_FEE_BPS)
+        PLAN_SOLVE_SECONDS.observe(time.perf_counter() - started)
+
+        def major(minor: int, asset: str) -> float:
+            return float(from_minor(minor, asset))
+
+        transfers = [
+            {
+                "sourcePool": tr["source"],
+                "destPool": tr["dest"],
+                "asset": tr["asset"],
+                "amount": major(tr["amount"], tr["asset"]),
+                "fee": major(tr["amount"] * tr["fee_bps"] // 10_000, tr["asset"]),
+            }
+            for tr in result["transfers"]
+        ]
+        return {
+            "window": window,
+            "transfers": transfers,
+            "pools": [
+                {
+                    "pool": p.name,
+                    "asset": p.asset,
+                    "balance": major(p.available, p.asset),
+                    "predictedNetFlow": major(p.net_flow, p.asset),
+                    "projected": major(p.projected, p.asset),
+                    "deficit": major(p.deficit, p.asset),
+                    "unmet": major(result["unmet"].get(p.name, 0), p.asset),
+                }
+                for p in states
+            ],
+        }
@@ -0,0 +1,111 @@
+from __future__ import annotations
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable
+
+from sqlalchemy import Select, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import AsyncSessionLocal
+from app.models.db_models import LedgerEntry
+from app.utils.money import from_minor
+
+EXPORT_FIELDS = ["id", "txId", "asset", "amount", "amountMinor", "note", "createdAt"]
+
+
+def encode_cursor(created_at: datetime, entry_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{entry_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, entry_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(entry_id)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+def entry_dict(e: Any) -> dict[str, Any]:
+    return {
+        "id": e.id,
+        "txId": e.tx_id,
+        "asset": e.asset,
+        "amount": float(from_minor(e.amount_minor, e.asset)),
+        "amountMinor": e.amount_minor,
+        "note": e.note,
+        "createdAt": e.created_at.isoformat(),
+    }
+
+
+def _wallet_entries(wallet_id: int) -> Select:
+    return select(
+        LedgerEntry.id,
+        LedgerEntry.tx_id,
+        LedgerEntry.asset,
+        LedgerEntry.amount_minor,
+        LedgerEntry.note,
+        LedgerEntry.created_at,
+    ).where(LedgerEntry.wallet_id == wallet_id)
+
+
+class StatementService:
+    """Wallet history (entries tagged with a Wallet.id) over the (wallet_id, created_at)
+    index.
+
+    Pages are newest-first and use keyset (seek) pagination: the cursor is the last
+    row's (created_at, id), so page N costs the same as page 1. Exports stream the
+    full history oldest-first through a server-side cursor in constant memory.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def page(
+        self, wallet_id: int, limit: int = 50, cursor: str | None = None
+    ) -> tuple[list[dict[str, Any]], str | None]:
+        q = _wallet_entries(wallet_id).order_by(
+            LedgerEntry.created_at.desc(), LedgerEntry.id.desc()
+        )
+        if cursor:
+            q = q.where(tuple_(LedgerEntry.created_at, LedgerEntry.id) < decode_cursor(cursor))
+        # Fetch one extra row to know whether another page exists
+        rows = (await self.session.execute(q.limit(limit + 1))).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+        return [entry_dict(r) for r in rows], next_cursor
+
+
+async def stream_entries(
+    wallet_id: int,
+    chunk_size: int = 1000,
+    session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+) -> AsyncIterator[dict[str, Any]]:
+    q = _wallet_entries(wallet_id).order_by(LedgerEntry.created_at, LedgerEntry.id)
+    async with session_factory() as session:
+        result = await session.stream(q.execution_options(yield_per=chunk_size))
+        async for row in result:
+            yield entry_dict(row)
+
+
+async def export_ndjson(entries: AsyncIterator[dict[str, Any]]) -> AsyncIterator[str]:
+    async for e in entries:
+        yield json.dumps(e) + "\n"
+
+
+async def export_csv(entries: AsyncIterator[dict[str, Any]]) -> AsyncIterator[str]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    yield buf.getvalue()
+    async for e in entries:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(e)
+        yield buf.getvalue()
@@ -0,0 +1,147 @@
+from __future__ import annotations
+import asyncio
+import json
+import math
+import time
+import uuid
+from typing import Callable
+
+from app.core.cache import AsyncCache, get_async_cache
+from app.core.config import get_settings
+from app.core.logging import get_logger
+from app.core.metrics import counter
+from app.services.flows import FlowStore, get_flow_store
+from app.services.forecast import WINDOWS, ForecastService
+
+log = get_logger(__name__)
+
+SUMMARY_REFRESHES_TOTAL = counter(
+    "operator_summary_refreshes_total", "Operator summaries recomputed", ["outcome"]  # ok | error
+)
+
+# Stored summaries outlive a few missed cycles, then operators no longer seen age out
+TTL_INTERVALS = 3
+# One scheduler across the workers runs the cycles: it holds this key, renewed at the
+# start of each cycle, and another takes over once it lapses
+LEADER_KEY = "summary-scheduler:leader"
+LEADER_INTERVALS = 2
+
+
+class SummaryScheduler:
+    """Keeps every known operator's summary precomputed in the cache.
+
+    Each cycle refreshes (operator, window) for every operator in the FlowStore and
+    every forecast window, one at a time and spaced evenly across `interval` seconds,
+    so neither the model nor the LLM sees a burst. Results are stored with the time
+    they were computed, which lets readers report how stale a summary is.
+
+    Every worker starts a scheduler, but only the one holding LEADER_KEY (set with
+    `add`, renewed with `expire_if` each cycle) runs cycles; the others keep trying for
+    the key each interval. With Redis the lease is fleet-wide; the in-memory fallback
+    only covers one process.
+    """
+
+    def __init__(
+        self,
+        interval: float | None = None,
+        flows: FlowStore | None = None,
+        cache: AsyncCache | None = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.interval = interval or get_settings().SUMMARY_REFRESH_INTERVAL
+        self.flows = flows or get_flow_store()
+        self._cache = cache
+        self.clock = clock
+        self.owner = uuid.uuid4().hex
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def cache(self) -> AsyncCache:
+        return self._cache or get_async_cache()
+
+    @staticmethod
+    def key(operator: str, window: str) -> str:
+        return f"summary:{window}:{operator}"
+
+    async def get(self, operator: str, window: str) -> tuple[str, float] | None:
+        """(summary, epoch seconds it was computed at), or None if not precomputed."""
+        raw = await self.cache.get(self.key(operator, window))
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry["summary"], entry["computedAt"]
+
+    async def refresh(self, operator: str, window: str) -> tuple[str, float]:
+        summary = await ForecastService(flows=self.flows).operator_summary(
+            operator, window, refresh=True
+        )
+        computed_at = self.clock()
+        entry = json.dumps({"summary": summary, "computedAt": computed_at})
+        await self.cache.set(
+            self.key(operator, window), entry, ex=int(self.interval * TTL_INTERVALS)
+        )
+        return summary, computed_at
+
+    async def run_cycle(self) -> int:
+        """Refresh every (operator, window) once, spread over the interval; returns how
+        many succeeded."""
+        cells = [(op, w) for op in self.flows.operators for w in WINDOWS]
+        loop = asyncio.get_running_loop()
+        start, spacing = loop.time(), self.interval / max(len(cells), 1)
+        done = 0
+        for i, (operator, window) in enumerate(cells):
+            delay = start + i * spacing - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self.refresh(operator, window)
+            except Exception:
+                SUMMARY_REFRESHES_TOTAL.labels(outcome="error").inc()
+                log.exception(f"summary refresh failed operator={operator} window={window}")
+            else:
+                SUMMARY_REFRESHES_TOTAL.labels(outcome="ok").inc()
+                done += 1
+        return done
+
+    async def lead(self) -> bool:
+        """Renew or take the leader lease; False if another scheduler holds it."""
+        ttl = self.interval * LEADER_INTERVALS
+        try:
+            if await self.cache.expire_if(LEADER_KEY, self.owner, ttl):
+                return True
+            return await self.cache.add(LEADER_KEY, self.owner, ex=math.ceil(ttl))
+        except Exception:
+            log.exception("summary scheduler lease unavailable; skipping this cycle")
+            return False
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            try:  # hand over now rather than when the lease lapses
+                await self.cache.delete_if(LEADER_KEY, self.owner)
+            except Exception:
+                log.exception("summary scheduler lease release failed")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            if await self.lead():
+                await self.run_cycle()
+            await asyncio.sleep(max(0.0, started + self.interval - loop.time()))
+
+
+_scheduler: SummaryScheduler | None = None
+
+
+def get_summary_scheduler() -> SummaryScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = SummaryScheduler()
+    return _scheduler
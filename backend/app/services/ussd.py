@@ -0,0 +1,220 @@
+from __future__ import annotations
+import json
+import re
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable
+
+from app.core.cache import AsyncCache, get_async_cache
+from app.core.config import get_settings
+from app.core.metrics import histogram
+
+USSD_HOP_SECONDS = histogram(
+    "ussd_hop_seconds",
+    "Time to resolve one USSD hop, session load and save included",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+
+START = "start"
+
+# Declarative menu graph. A node either offers numbered `options` (input -> next node),
+# collects one free-text `input` into the session (validated, then `next`), or `end`s
+# the session, optionally with `actions` for the caller to carry out on the collected
+# data. Prompts may reference collected fields, e.g. {amount}.
+MENU: dict[str, dict[str, Any]] = {
+    START: {
+        "prompt": "Welcome to JuaPesa\n1. Convert to USDC\n2. Send money\n3. My balance\n0. Exit",
+        "options": {"1": "convert_amount", "2": "send_phone", "3": "balance", "0": "exit"},
+    },
+    "convert_amount": {
+        "prompt": "Enter amount in KES to convert:",
+        "input": "amount",
+        "next": "convert_confirm",
+    },
+    "convert_confirm": {
+        "prompt": "Convert KES {amount} to USDC?\n1. Confirm\n2. Cancel",
+        "options": {"1": "convert_done", "2": START},
+    },
+    "convert_done": {
+        "prompt": "Conversion of KES {amount} submitted. You will receive an SMS.",
+        "end": True,
+        "actions": ["convert"],
+    },
+    "send_phone": {
+        "prompt": "Enter recipient phone number:",
+        "input": "phone",
+        "next": "send_amount",
+    },
+    "send_amount": {
+        "prompt": "Enter amount in KES to send:",
+        "input": "amount",
+        "next": "send_confirm",
+    },
+    "send_confirm": {
+        "prompt": "Send KES {amount} to {phone}?\n1. Confirm\n2. Cancel",
+        "options": {"1": "send_done", "2": START},
+    },
+    "send_done": {
+        "prompt": "Sending KES {amount} to {phone}. You will receive an SMS.",
+        "end": True,
+        "actions": ["debit", "confirm"],
+    },
+    "balance": {"prompt": "Your balance will be sent by SMS.", "end": True},
+    "exit": {"prompt": "Thank you for using JuaPesa.", "end": True},
+}
+
+_PHONE = re.compile(r"(?:\+?254|0)([17]\d{8})")
+
+
+def _amount(value: str) -> str | None:
+    return value if value.isdigit() and 10 <= int(value) <= 250_000 else None
+
+
+def _phone(value: str) -> str | None:
+    m = _PHONE.fullmatch(value)
+    return f"254{m.group(1)}" if m else None
+
+
+# Free-text input kinds: raw input -> normalised value, or None if invalid
+VALIDATORS: dict[str, Callable[[str], str | None]] = {"amount": _amount, "phone": _phone}
+INVALID = {"options": "Invalid choice.", "amount": "Invalid amount.", "phone": "Invalid number."}
+
+
+@dataclass(frozen=True)
+class Node:
+    name: str
+    prompt: str
+    templated: bool  # prompt has {fields} to fill from the session
+    options: dict[str, int]  # input -> node index
+    field: str | None  # free-text input stored under this key
+    validate: Callable[[str], str | None] | None
+    next: int
+    end: bool
+    actions: tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class Hop:
+    prompt: str
+    state: str
+    end: bool
+    actions: list[str]
+    data: dict[str, str]
+
+
+def compile_menu(spec: dict[str, dict[str, Any]]) -> tuple[Node, ...]:
+    """Resolve node names to indexes once, so each hop is a tuple index plus (for
+    options) one dict lookup. Raises ValueError for dangling targets or unknown inputs."""
+    if START not in spec:
+        raise ValueError(f"menu has no {START!r} node")
+    names = [START, *(n for n in spec if n != START)]
+    index = {name: i for i, name in enumerate(names)}
+
+    def target(name: str, src: str) -> int:
+        if name not in index:
+            raise ValueError(f"menu node {src!r} points to unknown node {name!r}")
+        return index[name]
+
+    nodes = []
+    for name in names:
+        node = spec[name]
+        field = node.get("input")
+        if field is not None and field not in VALIDATORS:
+            raise ValueError(f"menu node {name!r} collects unknown input {field!r}")
+        if not node.get("end") and not node.get("options") and field is None:
+            raise ValueError(f"menu node {name!r} has no way forward")
+        nodes.append(
+            Node(
+                name=name,
+                prompt=node["prompt"],
+                templated="{" in node["prompt"],
+                options={k: target(v, name) for k, v in node.get("options", {}).items()},
+                field=field,
+                validate=VALIDATORS.get(field) if field else None,
+                next=target(node["next"], name) if field else 0,
+                end=bool(node.get("end")),
+                actions=tuple(node.get("actions", ())),
+            )
+        )
+    return tuple(nodes)
+
+
+@lru_cache(maxsize=1)
+def get_ussd_menu() -> tuple[Node, ...]:
+    return compile_menu(MENU)
+
+
+class USSDService:
+    """Drives USSD sessions through the compiled menu.
+
+    Session state (current node and collected fields) lives in the cache under the
+    gateway's sessionId with a TTL, so a hop is one cache read, one write and a table
+    lookup: no database on the hot path. A session ends (and its key is deleted) on an
+    end node; an expired or unknown sessionId starts again at the main menu.
+    """
+
+    def __init__(
+        self,
+        cache: AsyncCache | None = None,
+        menu: tuple[Node, ...] | None = None,
+        ttl: int | None = None,
+    ):
+        self.cache = cache if cache is not None else get_async_cache()
+        self.menu = menu or get_ussd_menu()
+        self.ttl = ttl or get_settings().USSD_SESSION_TTL
+
+    async def hop(self, session_id: str, phone: str, text: str) -> Hop:
+        started = time.perf_counter()
+        key = f"ussd:{session_id}"
+        raw = await self.cache.get(key)
+        session = json.loads(raw) if raw is not None else None
+        if session is None or session["phone"] != phone:
+            # New session: the dial string may already carry a first choice (*384*1#)
+            session = {"phone": phone, "state": 0, "data": {}}
+            if not text:
+                return await self._show(key, session, 0, "", started)
+        node = self.menu[session["state"]]
+        text = text.strip()
+        error = ""
+        if node.field is not None:
+            assert node.validate is not None
+            value = node.validate(text)
+            if value is None:
+                error = INVALID[node.field]
+                nxt = session["state"]
+            else:
+                session["data"][node.field] = value
+                nxt = node.next
+        else:
+            nxt = node.options.get(text, -1)
+            if nxt < 0:
+                error = INVALID["options"]
+                nxt = session["state"]
+        return await self._show(key, session, nxt, error, started)
+
+    async def _show(
+        self, key: str, session: dict[str, Any], state: int, error: str, started: float
+    ) -> Hop:
+        node = self.menu[state]
+        data = session["data"]
+        prompt = node.prompt.format_map(data) if node.templated else node.prompt
+        if error:
+            prompt = f"{error}\n{prompt}"
+        if node.end:
+            await self.cache.delete(key)
+        else:
+            session["state"] = state
+            await self.cache.set(key, json.dumps(session), ex=self.ttl)
+        USSD_HOP_SECONDS.observe(time.perf_counter() - started)
+        return Hop(prompt, node.name, node.end, list(node.actions), data)
+
+
+_service: USSDService | None = None
+
+
+def get_ussd_service() -> USSDService:
+    global _service
+    if _service is None:
+        _service = USSDService()
+    return _service
@@ -1,7 +1,27 @@
+from decimal import Decimal
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import get_settings
+from app.models.db_models import User, Wallet
+from app.services.ledger import LedgerEngine, LedgerTransaction, Posting, get_ledger
 from app.utils.ids import new_tx_id
+from app.utils.money import to_minor
+
+LOCAL_ASSET = "LOCAL"
+# Setting holding each token's rate, in token units per unit of local currency
+FX_RATE_SETTINGS = {
+    "USDC": "FX_USDC_PER_LOCAL",
+    "CNGN": "FX_CNGN_PER_LOCAL",
+    "XAUT": "FX_XAUT_PER_LOCAL",
+}
 
 
 class WalletService:
+    def __init__(self, ledger: LedgerEngine | None = None):
+        self.ledger = ledger if ledger is not None else get_ledger()
+
     def convert(
         self,
         user_id: str,
@@ -11,8 +31,73 @@ class WalletService:
         to_token: str,
         to_chain: str | None,
         mode: str,
+        tx_id: str | None = None,
     ) -> str:
-        # Minimal stub that returns a deterministic ID format
+        """Book a conversion in the ledger (the conversion pipeline's settlement step)."""
         if amount <= 0:
             raise ValueError("amount must be positive")
-        return new_tx_id(prefix="cv")
+        tx_id = tx_id or new_tx_id(prefix="cv")
+        self.ledger.post(
+            self.conversion_postings(
+                tx_id, user_id, from_rail, from_operator, amount, to_token,
+                wallet_id=self.wallet_id(user_id),
+            )
+        )
+        return tx_id
+
+    def wallet_id(self, user_id: str) -> int | None:
+        """Wallet.id for a registered user (user_id is users.id), creating the wallet on
+        first use; None for callers that are not registered users."""
+        if not user_id.isdigit():
+            return None
+        uid = int(user_id)
+        with self.ledger.session_factory() as session:
+            found = session.scalar(select(Wallet.id).where(Wallet.user_id == uid))
+            if found is not None or session.get(User, uid) is None:
+                return found
+            wallet = Wallet(user_id=uid)
+            session.add(wallet)
+            try:
+                session.commit()
+            except IntegrityError:  # pragma: no cover - concurrent insert by another worker
+                session.rollback()
+                return session.scalar(select(Wallet.id).where(Wallet.user_id == uid))
+            return wallet.id
+
+    @staticmethod
+    def fx_rate(token: str) -> Decimal:
+        name = FX_RATE_SETTINGS.get(token.upper())
+        if name is None:
+            raise ValueError(f"unsupported token {token}")
+        return Decimal(str(getattr(get_settings(), name)))
+
+    @staticmethod
+    def token_amount(amount: float, token: str) -> Decimal:
+        return Decimal(str(amount)) * WalletService.fx_rate(token)
+
+    @staticmethod
+    def conversion_postings(
+        tx_id: str,
+        user_id: str,
+        from_rail: str,
+        from_operator: str | None,
+        amount: float,
+        to_token: str,
+        wallet_id: int | None = None,
+    ) -> LedgerTransaction:
+        """Local money arrives from the rail into the operator's float pool; the user's
+        wallet is credited the token out of that token's pool. `wallet_id` tags the
+        wallet posting for the (wallet_id, created_at) history index."""
+        token = to_token.upper()
+        local_minor = to_minor(amount, LOCAL_ASSET)
+        token_minor = to_minor(WalletService.token_amount(amount, token), token)
+        return LedgerTransaction(
+            tx_id=tx_id,
+            note=f"convert {from_rail}->{token}",
+            postings=[
+                Posting(f"clearing:{from_rail}", LOCAL_ASSET, -local_minor),
+                Posting(f"pool:{from_operator or from_rail}", LOCAL_ASSET, local_minor),
+                Posting(f"pool:{token}", token, -token_minor),
+                Posting(f"wallet:{user_id}", token, token_minor, wallet_id),
+            ],
+        )
@@ -1,8 +1,229 @@
+from __future__ import annotations
 import os
+import socket
+import threading
 import time
-import random
+import uuid
+from hashlib import sha256
+from typing import Callable
+
+from app.core.cache import Cache, get_cache
+from app.core.config import get_settings
+from app.core.logging import get_logger
+
+log = get_logger(__name__)
+
+# Snowflake layout (63 bits): 41 bits of ms since EPOCH_MS | 10 bits worker | 12 bits sequence
+EPOCH_MS = 1_704_067_200_000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# Crockford base32: ASCII order matches digit value, so fixed-width encodings sort
+# lexicographically in numeric (i.e. time) order. 13 chars cover the 63-bit value.
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_PAIRS = [a + b for a in _ALPHABET for b in _ALPHABET]  # 10 bits -> 2 chars
+_FROM_CROCKFORD = {c: i for i, c in enumerate(_ALPHABET)}
+
+
+def _encode(v: int) -> str:
+    p = _PAIRS
+    return (
+        p[v >> 55 & 1023] + p[v >> 45 & 1023] + p[v >> 35 & 1023] + p[v >> 25 & 1023]
+        + p[v >> 15 & 1023] + p[v >> 5 & 1023] + _ALPHABET[v & 31]
+    )
+
+
+def _decode(text: str) -> int:
+    value = 0
+    for c in text:
+        value = (value << 5) | _FROM_CROCKFORD[c]
+    return value
+
+
+def _derived_worker_id() -> int:
+    host_pid = f"{socket.gethostname()}:{os.getpid()}".encode()
+    return int.from_bytes(sha256(host_pid).digest()[:4], "big") & MAX_WORKER
+
+
+class WorkerLease:
+    """Exclusive claim on a worker id: a `worker-id:<n>` cache key set with `add` and a TTL.
+
+    Probing starts at the preferred id (WORKER_ID, or the hostname/pid hash) and walks the
+    id space until a free one is found, so uvicorn workers sharing a WORKER_ID, or two
+    processes whose hashes collide, end up on different ids. The holder renews the key
+    every ttl/3; a lease that was lost (expired during a stall) is replaced by a new one.
+    With Redis the claim is fleet-wide; the in-memory fallback only covers one process.
+    If the cache is unreachable the preferred id is used unleased and claiming is retried
+    at the next renewal.
+    """
+
+    def __init__(
+        self,
+        preferred: int | None = None,
+        ttl: float | None = None,
+        cache_getter: Callable[[], Cache] = get_cache,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.preferred = preferred
+        self.ttl = ttl if ttl is not None else get_settings().WORKER_ID_LEASE_TTL
+        self._cache_getter = cache_getter
+        self._clock = clock
+        self._token: str | None = None
+        self.worker_id: int | None = None
+        self.renew_at = 0.0
+
+    @staticmethod
+    def key(worker_id: int) -> str:
+        return f"worker-id:{worker_id}"
+
+    def due(self) -> bool:
+        return self.worker_id is None or self._clock() >= self.renew_at
+
+    def acquire(self) -> int:
+        """Claim the first free id at or after the preferred one."""
+        start = self.preferred if self.preferred is not None else _derived_worker_id()
+        token = uuid.uuid4().hex
+        self.renew_at = self._clock() + self.ttl / 3
+        candidate: int | None = None
+        try:
+            cache = self._cache_getter()
+            for i in range(MAX_WORKER + 1):
+                if cache.add(self.key((start + i) & MAX_WORKER), token, ex=self.ttl):
+                    candidate = (start + i) & MAX_WORKER
+                    break
+        except Exception:
+            log.exception("worker id lease unavailable; using %s unleased", start)
+            self._token, self.worker_id = None, start
+            return start
+        if candidate is None:
+            raise RuntimeError(f"all {MAX_WORKER + 1} worker ids are leased")
+        if candidate != start:
+            log.warning("worker id %s is leased elsewhere; using %s", start, candidate)
+        self._token, self.worker_id = token, candidate
+        return candidate
+
+    def renew(self) -> bool:
+        """Extend the lease; False if it was lost (or never held) and must be re-acquired."""
+        if self._token is None or self.worker_id is None:
+            return False
+        try:
+            held = self._cache_getter().expire_if(self.key(self.worker_id), self._token, self.ttl)
+        except Exception:
+            log.exception("worker id lease renewal failed; keeping %s", self.worker_id)
+            held = True
+        if held:
+            self.renew_at = self._clock() + self.ttl / 3
+        else:
+            log.warning("worker id %s lease was lost; claiming another", self.worker_id)
+        return held
+
+    def forget(self) -> None:
+        """Drop the claim without releasing it (a forked child must not reuse the parent's)."""
+        self._token, self.worker_id = None, None
+
+
+class SnowflakeGenerator:
+    """Time-ordered 63-bit IDs: unique per worker, monotonic within a process.
+
+    With a `lease`, the worker id is claimed through the cache on first use, renewed as
+    IDs are allocated and re-claimed in forked children. Without one, `worker_id` is used
+    as given (or derived from hostname and pid). If the wall clock steps backwards, IDs
+    keep counting from the last timestamp instead of repeating.
+    """
+
+    def __init__(
+        self,
+        worker_id: int | None = None,
+        clock=time.time,
+        lease: WorkerLease | None = None,
+    ):
+        preferred = lease.preferred if lease is not None else None
+        for wid in (worker_id, preferred):
+            if wid is not None and not 0 <= wid <= MAX_WORKER:
+                raise ValueError(f"worker_id must be in [0, {MAX_WORKER}]")
+        self.explicit_worker = worker_id is not None
+        self.lease = lease
+        if lease is not None:
+            self.worker_id = None
+        else:
+            self.worker_id = worker_id if worker_id is not None else _derived_worker_id()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._seq = 0
+
+    def reseed_worker(self) -> None:
+        """After fork: re-claim a leased id, or re-derive one unless it was set explicitly."""
+        if self.lease is not None:
+            self.lease.forget()
+            self.worker_id = None
+        elif not self.explicit_worker:
+            self.worker_id = _derived_worker_id()
+        self._last_ms, self._seq = -1, 0
+
+    def _check_lease(self) -> None:
+        """Renew the lease when due; on a new id, skip a millisecond to stay monotonic."""
+        lease = self.lease
+        if lease is None or not lease.due() or lease.renew():
+            return
+        previous = self.worker_id
+        self.worker_id = lease.acquire()
+        if previous is not None and self.worker_id != previous and self._last_ms >= 0:
+            self._last_ms, self._seq = self._last_ms + 1, 0
+
+    def _reserve(self, n: int) -> tuple[int, int, int]:
+        """Reserve `n` consecutive sequence numbers: returns (ID base, first seq, count).
+
+        The base carries the timestamp and the worker id read under the lock, so a lease
+        moving to a new id mid-call cannot mix the two.
+        """
+        with self._lock:
+            self._check_lease()
+            now = int(self._clock() * 1000) - EPOCH_MS
+            if now > self._last_ms:
+                self._last_ms, self._seq = now, 0
+            elif self._seq > MAX_SEQUENCE:
+                # Sequence exhausted (or clock went backwards): borrow the next millisecond
+                self._last_ms, self._seq = self._last_ms + 1, 0
+            first = self._seq
+            count = min(n, MAX_SEQUENCE + 1 - first)
+            self._seq += count
+            base = (self._last_ms << (WORKER_BITS + SEQUENCE_BITS)) | (
+                self.worker_id << SEQUENCE_BITS
+            )
+            return base, first, count
+
+    def next_int(self) -> int:
+        base, seq, _ = self._reserve(1)
+        return base | seq
+
+    def next_ints(self, n: int) -> list[int]:
+        out: list[int] = []
+        while len(out) < n:
+            base, first, count = self._reserve(n - len(out))
+            out.extend(range(base + first, base + first + count))
+        return out
+
+
+_generator = SnowflakeGenerator(lease=WorkerLease(preferred=get_settings().WORKER_ID))
+if hasattr(os, "register_at_fork"):  # pragma: no branch - POSIX
+    os.register_at_fork(after_in_child=_generator.reseed_worker)
 
 
 def new_tx_id(prefix: str = "tx") -> str:
-    # Simple unique id: prefix-timestamp-rand
-    return f"{prefix}-{int(time.time()*1000)}-{random.randint(1000,9999)}"
+    return f"{prefix}-{_encode(_generator.next_int())}"
+
+
+def new_tx_ids(n: int, prefix: str = "tx") -> list[str]:
+    """Allocate `n` IDs under a single lock acquisition; they sort in allocation order."""
+    return [f"{prefix}-{_encode(v)}" for v in _generator.next_ints(n)]
+
+
+def parse_tx_id(tx_id: str) -> tuple[int, int, int]:
+    """Split an ID into (unix ms, worker id, sequence)."""
+    value = _decode(tx_id.rsplit("-", 1)[-1])
+    seq = value & MAX_SEQUENCE
+    worker = (value >> SEQUENCE_BITS) & MAX_WORKER
+    return (value >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS, worker, seq
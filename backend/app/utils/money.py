@@ -0,0 +1,20 @@
+from __future__ import annotations
+from decimal import Decimal, ROUND_HALF_UP
+
+# Decimal places per asset; amounts are stored as integers in these minor units
+MINOR_UNITS: dict[str, int] = {"LOCAL": 2, "KES": 2, "CNGN": 2, "USDC": 6, "XAUT": 6}
+DEFAULT_MINOR_UNITS = 2
+
+
+def _exponent(asset: str) -> int:
+    return MINOR_UNITS.get(asset.upper(), DEFAULT_MINOR_UNITS)
+
+
+def to_minor(amount: float | int | str | Decimal, asset: str) -> int:
+    """Convert a major-unit amount to integer minor units (half-up rounding)."""
+    scaled = Decimal(str(amount)).scaleb(_exponent(asset))
+    return int(scaled.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(minor: int, asset: str) -> Decimal:
+    return Decimal(minor).scaleb(-_exponent(asset))
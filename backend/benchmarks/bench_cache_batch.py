@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Compare single-key vs batched Cache operations (round-trips and latency).
+
+Usage (from backend/):
+    python -m benchmarks.bench_cache_batch [--keys 8] [--iters 2000] [--rtt-ms 0.5]
+
+With REDIS_URL set the real client is measured; otherwise the in-memory store is
+used and `--rtt-ms` emulates the network round-trip each backend call would cost.
+"""
+from __future__ import annotations
+import argparse
+import os
+import statistics
+import time
+
+from app.core.cache import Cache
+
+
+class RoundTripCounter:
+    """Proxy that counts backend calls (and optionally sleeps to emulate RTT)."""
+
+    BATCHED = {"execute", "mget", "mset", "incr_many"}
+
+    def __init__(self, target, rtt: float):
+        self._target = target
+        self._rtt = rtt
+        self.round_trips = 0
+
+    def _hit(self):
+        self.round_trips += 1
+        if self._rtt:
+            time.sleep(self._rtt)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name == "pipeline":
+            def pipeline(*a, **kw):
+                pipe = attr(*a, **kw)
+                execute = pipe.execute
+
+                def counted_execute():
+                    self._hit()
+                    return execute()
+
+                pipe.execute = counted_execute
+                return pipe
+            return pipeline
+        if name in {"get", "set", "incr", "delete", "mget", "mset", "incr_many"}:
+            def counted(*a, **kw):
+                self._hit()
+                return attr(*a, **kw)
+            return counted
+        return attr
+
+
+def run(label, fn, iters):
+    samples = []
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    p50 = statistics.median(samples) * 1e6
+    p99 = samples[int(len(samples) * 0.99) - 1] * 1e6
+    return label, p50, p99
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--keys", type=int, default=8)
+    ap.add_argument("--iters", type=int, default=2000)
+    ap.add_argument("--rtt-ms", type=float, default=0.0)
+    args = ap.parse_args()
+
+    cache = Cache(os.getenv("REDIS_URL"))
+    attr = "_client" if cache._client is not None else "_store"
+    counter = RoundTripCounter(getattr(cache, attr), args.rtt_ms / 1000.0)
+    setattr(cache, attr, counter)
+    keys = [f"bench:{i}" for i in range(args.keys)]
+    values = {k: "x" * 32 for k in keys}
+
+    cases = [
+        ("set x N", lambda: [cache.set(k, v, ex=60) for k, v in values.items()]),
+        ("mset", lambda: cache.mset(values, ex=60)),
+        ("get x N", lambda: [cache.get(k) for k in keys]),
+        ("mget", lambda: cache.mget(keys)),
+        ("incr x N", lambda: [cache.incr(k + ":n") for k in keys]),
+        ("incr_many", lambda: cache.incr_many([k + ":n" for k in keys])),
+    ]
+    backend = "redis" if attr == "_client" else f"memory (emulated rtt {args.rtt_ms}ms)"
+    print(f"backend={backend} keys/op={args.keys} iters={args.iters}")
+    print(f"{'case':<10} {'round-trips/op':>15} {'p50 us':>10} {'p99 us':>10}")
+    for label, fn in cases:
+        before = counter.round_trips
+        _, p50, p99 = run(label, fn, args.iters)
+        rts = (counter.round_trips - before) / args.iters
+        print(f"{label:<10} {rts:>15.1f} {p50:>10.1f} {p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
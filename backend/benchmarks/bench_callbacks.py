@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Load test for Daraja callback ingestion: sustained rate and queue bound under burst.
+
+Usage (from backend/):
+    python -m benchmarks.bench_callbacks [--callbacks 20000] [--concurrency 200]
+        [--queue 1000] [--batch 500] [--dupes 0.05]
+
+Callbacks are POSTed through the real route (in-process ASGI transport, signed with
+a test secret) while the ingestor's writer books them in the ledger. Reports accepted
+callbacks/s at the edge, end-to-end rate until the ledger has everything, the queue's
+high-water mark against its bound, and how many ledger batches the burst became.
+
+The edge rate is bounded by the in-process client and middleware stack (most of each
+request is spent in the transport handing over the body), not by `ingest` itself; run
+uvicorn with a real load generator for production-like numbers.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import time
+
+
+async def run(args: argparse.Namespace) -> None:
+    import logging
+
+    import httpx
+
+    from app.api import routes
+    from app.core.cache import AsyncCache
+    from app.core.db import engine
+    from app.main import app
+    from app.models.db_models import Base
+    from app.services.daraja_callbacks import CallbackIngestor, sign
+    from app.services.ledger import LedgerEngine
+
+    Base.metadata.create_all(bind=engine)
+    logging.disable(logging.INFO)  # per-request access logs would dominate the timing
+
+    class CountingLedger(LedgerEngine):
+        batches = 0
+
+        def post_in(self, session, txs):
+            CountingLedger.batches += 1
+            super().post_in(session, txs)
+
+    ingestor = CallbackIngestor(
+        ledger=CountingLedger(),
+        cache=AsyncCache(),
+        secret="bench-secret",
+        queue_size=args.queue,
+        batch_size=args.batch,
+    )
+    routes.get_callback_ingestor = lambda: ingestor  # type: ignore[assignment]
+    await ingestor.start()
+
+    n = args.callbacks
+    unique = max(1, int(n * (1 - args.dupes)))
+    bodies = []
+    for i in range(n):
+        ref = f"ws_CO_bench{i % unique}"
+        items = [{"Name": "Amount", "Value": 10}, {"Name": "MpesaReceiptNumber", "Value": ref}]
+        cb = {"CheckoutRequestID": ref, "ResultCode": 0, "CallbackMetadata": {"Item": items}}
+        body = json.dumps({"Body": {"stkCallback": cb}}).encode()
+        bodies.append((body, sign("bench-secret", body)))
+
+    depths: list[int] = []
+
+    async def sample() -> None:
+        while True:
+            depths.append(ingestor.queue_depth())
+            await asyncio.sleep(0.005)
+
+    sampler = asyncio.create_task(sample())
+    sem = asyncio.Semaphore(args.concurrency)
+    statuses: dict[int, int] = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def post(body: bytes, sig: str) -> None:
+            async with sem:
+                r = await client.post(
+                    "/api/daraja/callbacks/stk",
+                    content=body,
+                    headers={"Content-Type": "application/json", "X-Callback-Signature": sig},
+                )
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(post(b, s) for b, s in bodies))
+        edge = time.perf_counter() - t0
+        await ingestor.stop(timeout=600)
+        total = time.perf_counter() - t0
+    sampler.cancel()
+
+    print(f"{n:,} callbacks ({n - unique:,} duplicates), concurrency {args.concurrency}")
+    print(f"  acknowledged: {n / edge:,.0f} callbacks/s  statuses={statuses}")
+    print(f"  booked:       {unique / total:,.0f} callbacks/s end-to-end ({total:.2f}s)")
+    print(f"  queue:        max depth {max(ingestor.max_depth, *depths)} (bound {args.queue})")
+    print(f"  ledger:       {CountingLedger.batches} ledger batches "
+          f"(avg {unique / max(1, CountingLedger.batches):.0f} callbacks each)")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--callbacks", type=int, default=20_000)
+    ap.add_argument("--concurrency", type=int, default=200)
+    ap.add_argument("--queue", type=int, default=1000)
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--dupes", type=float, default=0.05, help="fraction of redeliveries")
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
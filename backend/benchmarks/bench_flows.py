@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Operator flow store: ingest throughput and window queries vs rescanning raw events.
+
+Usage (from backend/):
+    python -m benchmarks.bench_flows [--events 2000000] [--operators 200] [--batch 1000]
+
+Replays `--events` synthetic flows spread over the last three weeks into a FlowStore, in
+ledger-sized batches and (for a sample) one at a time, then times a forecast's worth
+of window queries (every operator x 1h/4h/24h). The baseline keeps the raw events and
+answers the same query by scanning them, vectorised with NumPy, which is the best
+case for a store that does not pre-aggregate. Both answers are checked to match.
+"""
+from __future__ import annotations
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from app.services.flows import WINDOW_HOURS, FlowStore
+
+HOUR = 3600
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=2_000_000)
+    ap.add_argument("--operators", type=int, default=200)
+    ap.add_argument("--batch", type=int, default=1_000)
+    ap.add_argument("--runs", type=int, default=20)
+    args = ap.parse_args()
+
+    now = time.time()
+    rng = np.random.default_rng(7)
+    names = [f"op{i}" for i in range(args.operators)]
+    ops = rng.integers(0, args.operators, args.events)
+    amounts = rng.integers(-500_000, 500_000, args.events)
+    stamps = np.sort(now - rng.uniform(0, 21 * 24 * HOUR, args.events))  # arrive in order
+    labels = [names[i] for i in ops]
+
+    clock = [float(stamps[0])]
+    store = FlowStore(clock=lambda: clock[0])
+    t0 = time.perf_counter()
+    for i in range(0, args.events, args.batch):
+        j = min(i + args.batch, args.events)
+        clock[0] = float(stamps[j - 1])
+        store.record_many(labels[i:j], amounts[i:j], stamps[i:j])
+    batched = time.perf_counter() - t0
+
+    sample = min(args.events, 100_000)
+    single_store = FlowStore(clock=lambda: clock[0])
+    t0 = time.perf_counter()
+    for i in range(sample):
+        single_store.record(labels[i], int(amounts[i]), float(stamps[i]))
+    single = time.perf_counter() - t0
+
+    clock[0] = now
+    windows = list(WINDOW_HOURS)
+    spans = np.array(list(WINDOW_HOURS.values()))
+
+    def rescan() -> np.ndarray:
+        ages = int(now // HOUR) - (stamps // HOUR).astype(np.int64)
+        out = np.zeros((args.operators, len(spans)), np.int64)
+        for k, span in enumerate(spans):
+            inside = ages < span
+            np.add.at(out[:, k], ops[inside], amounts[inside])
+        return out
+
+    def timed(fn) -> tuple[float, np.ndarray]:
+        times, result = [], None
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - t0)
+        return statistics.median(times), result
+
+    store_q, from_store = timed(lambda: store.net(names, windows))
+    scan_q, from_scan = timed(rescan)
+    assert np.array_equal(from_store, from_scan)
+
+    print(f"{args.events:,} events, {args.operators} operators")
+    print(f"  record_many (batches of {args.batch:,}) {args.events / batched:>12,.0f} events/s")
+    print(f"  record (one at a time)       {sample / single:>12,.0f} events/s")
+    print(f"  window query, FlowStore      {store_q * 1e3:>12.3f} ms")
+    print(f"  window query, raw rescan     {scan_q * 1e3:>12.3f} ms ({scan_q / store_q:,.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
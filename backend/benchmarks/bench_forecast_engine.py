@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Forecast engine: fit-all latency against operator count, vs a per-operator Python loop.
+
+Usage (from backend/):
+    python -m benchmarks.bench_forecast_engine [--operators 100 1000 5000] [--loop-max 200]
+
+Each operator gets four weeks of hourly net flows (its own hour-of-week profile plus
+noise). For both models this times a full fit of every operator in one batch, an
+incremental update with one new hourly bucket, and the error of the next day's
+forecast against a last-value baseline. The loop baseline runs the same smoothing
+recursion one operator at a time in plain Python; above `--loop-max` operators it is
+measured on a sample and scaled linearly (marked ~).
+"""
+from __future__ import annotations
+import argparse
+import time
+
+import numpy as np
+
+from app.services.forecast_engine import HOURS_PER_WEEK, MODELS
+
+HISTORY = 4 * HOURS_PER_WEEK - 1  # what a FlowStore with the default history can hand over
+AHEAD = 24
+
+
+def series(operators: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    profile = rng.normal(0, 50_000, (operators, HOURS_PER_WEEK))
+    weeks = HISTORY // HOURS_PER_WEEK + 2
+    clean = np.tile(profile, weeks)[:, : HISTORY + AHEAD]
+    return clean + rng.normal(0, 15_000, clean.shape)
+
+
+def python_loop(history: np.ndarray, alpha: float = 0.2, gamma: float = 0.1) -> None:
+    m = HOURS_PER_WEEK
+    for row in history.tolist():
+        level = sum(row[:m]) / m
+        seasonal = [x - level for x in row[:m]]
+        for j, x in enumerate(row[m:], start=m):
+            s = seasonal[j % m]
+            level = alpha * (x - s) + (1 - alpha) * level
+            seasonal[j % m] = gamma * (x - level) + (1 - gamma) * s
+
+
+def timed(fn, *args) -> float:
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--operators", type=int, nargs="+", default=[100, 1000, 5000])
+    ap.add_argument("--loop-max", type=int, default=200)
+    args = ap.parse_args()
+
+    end = 480_000 + HISTORY  # epoch hour after the last bucket; any value works
+    print(f"{HISTORY} hours of history per operator, forecasting the next {AHEAD}")
+    print(f"{'operators':>9} {'model':>15} {'fit ms':>9} {'update ms':>10} "
+          f"{'MAE vs last value':>18} {'python loop ms':>15}")
+    for n in args.operators:
+        data = series(n, seed=n)
+        history, actual = data[:, :HISTORY], data[:, HISTORY:]
+        sample = min(n, args.loop_max)
+        loop_s = timed(python_loop, history[:sample]) * n / sample
+        loop = f"{'~' if sample < n else ''}{loop_s * 1e3:,.0f}"
+        naive_mae = np.abs(actual - history[:, -1:]).mean()
+        for name, cls in MODELS.items():
+            model = cls()
+            fit = timed(model.fit, history, end)
+            mae = np.abs(model.forecast(AHEAD) - actual).mean()
+            update = timed(model.update, actual[:, :1], end + 1)
+            print(f"{n:>9} {name:>15} {fit * 1e3:>9.1f} {update * 1e3:>10.2f} "
+                  f"{mae / naive_mae:>17.0%} {loop:>15}")
+
+
+if __name__ == "__main__":
+    main()
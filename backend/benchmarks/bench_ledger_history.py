@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Paged ledger history at scale: keyset vs OFFSET paging, with and without indexes.
+
+Usage (from backend/):
+    python -m benchmarks.bench_ledger_history [--rows 10000000] [--accounts 20000]
+
+Uses DATABASE_URL if set (e.g. a scratch Postgres), otherwise a temporary SQLite
+file. The table is created and populated from scratch; point it at a disposable DB.
+"""
+from __future__ import annotations
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, insert, select, text, tuple_
+
+from app.core.db import sync_url
+from app.models.db_models import Base, LedgerEntry
+
+# Dropped for the baseline run so paging has to scan ledger_entries
+ACCOUNT_INDEXES = (
+    "ix_ledger_entries_account_created",
+    "ix_ledger_entries_wallet_created",
+    "ix_ledger_entries_account_asset_id",
+)
+
+
+def populate(engine, rows: int, accounts: int, chunk: int = 50_000) -> None:
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    rnd = random.Random(7)
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        for base in range(0, rows, chunk):
+            n = min(chunk, rows - base)
+            conn.execute(
+                insert(LedgerEntry),
+                [
+                    {
+                        "tx_id": f"tx{base + i}",
+                        "account": f"wallet:{rnd.randrange(accounts)}",
+                        "amount_minor": rnd.randint(-50_000, 50_000),
+                        "asset": "LOCAL",
+                        "note": "",
+                        "created_at": start + timedelta(seconds=base + i),
+                    }
+                    for i in range(n)
+                ],
+            )
+    print(f"populated {rows:,} rows in {time.perf_counter() - t0:.1f}s")
+
+
+def keyset_pages(conn, account: str, pages: int, size: int) -> None:
+    cursor = None
+    for _ in range(pages):
+        q = (
+            select(LedgerEntry.id, LedgerEntry.created_at, LedgerEntry.amount_minor)
+            .where(LedgerEntry.account == account)
+            .order_by(LedgerEntry.created_at.desc(), LedgerEntry.id.desc())
+            .limit(size)
+        )
+        if cursor is not None:
+            q = q.where(tuple_(LedgerEntry.created_at, LedgerEntry.id) < cursor)
+        rows = conn.execute(q).all()
+        if not rows:
+            break
+        cursor = (rows[-1].created_at, rows[-1].id)
+
+
+def offset_pages(conn, account: str, pages: int, size: int) -> None:
+    for page in range(pages):
+        conn.execute(
+            select(LedgerEntry.id, LedgerEntry.created_at, LedgerEntry.amount_minor)
+            .where(LedgerEntry.account == account)
+            .order_by(LedgerEntry.created_at.desc(), LedgerEntry.id.desc())
+            .limit(size)
+            .offset(page * size)
+        ).all()
+
+
+def measure(engine, fn, accounts: int, pages: int, size: int, samples: int = 20):
+    rnd = random.Random(11)
+    times = []
+    with engine.connect() as conn:
+        for _ in range(samples):
+            account = f"wallet:{rnd.randrange(accounts)}"
+            t0 = time.perf_counter()
+            fn(conn, account, pages, size)
+            times.append((time.perf_counter() - t0) * 1000 / pages)
+    times.sort()
+    return statistics.median(times), times[-1]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=10_000_000)
+    ap.add_argument("--accounts", type=int, default=20_000)
+    ap.add_argument("--pages", type=int, default=10)
+    ap.add_argument("--page-size", type=int, default=50)
+    args = ap.parse_args()
+
+    url = os.getenv("DATABASE_URL") or f"sqlite+pysqlite:///{tempfile.mkdtemp()}/ledger_bench.db"
+    engine = create_engine(sync_url(url))
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    populate(engine, args.rows, args.accounts)
+
+    print(
+        f"per-page ms over {args.pages} pages of {args.page_size} "
+        "(median / worst of 20 accounts)"
+    )
+    for label in ("indexed", "unindexed"):
+        for name, fn in (("keyset", keyset_pages), ("offset", offset_pages)):
+            med, worst = measure(engine, fn, args.accounts, args.pages, args.page_size)
+            print(f"  {label:<17} {name:<7} {med:8.2f} / {worst:8.2f}")
+        with engine.begin() as conn:
+            for ix in ACCOUNT_INDEXES:
+                conn.execute(text(f"DROP INDEX IF EXISTS {ix}"))
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
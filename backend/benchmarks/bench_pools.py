@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Liquidity checks per conversion: PoolEngine vs a locked liquidity_pools row.
+
+Usage (from backend/):
+    python -m benchmarks.bench_pools [--conversions 5000] [--threads 8] [--pools 4]
+
+Each conversion reserves an amount from one pool and then commits it, from `--threads`
+concurrent workers. The baseline does both with a conditional UPDATE of the pool's row
+(its own transaction each, as a row lock per conversion would); PoolEngine checks in
+memory and group-commits its journal. Uses DATABASE_URL if set (point it at a scratch
+database), otherwise a temporary SQLite file.
+"""
+from __future__ import annotations
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.core.db import sync_url
+from app.models.db_models import Base
+from app.services.pools import PoolEngine
+
+RESERVE = text(
+    "UPDATE liquidity_pools SET reserved_minor = reserved_minor + :a "
+    "WHERE name = :n AND balance_minor - reserved_minor >= :a"
+)
+COMMIT = text(
+    "UPDATE liquidity_pools SET balance_minor = balance_minor - :a, "
+    "reserved_minor = reserved_minor - :a WHERE name = :n"
+)
+
+
+def timed(label: str, n: int, threads: int, work) -> None:
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as ex:
+        list(ex.map(work, range(n)))
+    elapsed = time.perf_counter() - t0
+    print(f"  {label:<22} {n / elapsed:>10,.0f} conversions/s ({elapsed:.2f}s)")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--conversions", type=int, default=5_000)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--pools", type=int, default=4)
+    args = ap.parse_args()
+
+    url = os.environ.get("DATABASE_URL")
+    tmp = None
+    if url is None:
+        tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        url = f"sqlite:///{tmp.name}"
+    engine = create_engine(sync_url(url), connect_args={"timeout": 60} if tmp else {})
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+
+    names = [f"bench-{i}" for i in range(args.pools)]
+    pools = PoolEngine(session_factory=session_factory)
+    for name in names:
+        pools.credit(name, 10**9)
+    pools.flush()  # both runs start from the same funded rows
+
+    def row_locked(i: int) -> None:
+        params = {"n": names[i % len(names)], "a": 100}
+        with engine.begin() as conn:
+            if conn.execute(RESERVE, params).rowcount != 1:
+                raise RuntimeError("insufficient liquidity")
+        with engine.begin() as conn:
+            conn.execute(COMMIT, params)
+
+    def in_memory(i: int) -> None:
+        pools.reserve(names[i % len(names)], 1, f"cv-{i}")
+        pools.commit(f"cv-{i}")
+
+    print(f"{args.conversions:,} conversions over {args.pools} pools, {args.threads} threads")
+    timed("row lock per step", args.conversions, args.threads, row_locked)
+    timed("PoolEngine", args.conversions, args.threads, in_memory)
+    t0 = time.perf_counter()
+    applied = pools.flush()
+    flushed = (time.perf_counter() - t0) * 1e3
+    print(f"  write-back of {applied:,} journal entries in one transaction: {flushed:.0f} ms")
+
+    engine.dispose()
+    if tmp is not None:
+        os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
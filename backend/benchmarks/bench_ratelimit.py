@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Rate limiting: per-request overhead of the middleware and the in-memory GCRA.
+
+Usage (from backend/):
+    python -m benchmarks.bench_ratelimit [--requests 200000] [--phones 100000]
+
+Drives `RateLimitMiddleware` directly as ASGI around a no-op app, so the numbers are
+the limiter's own cost: for a USSD-style JSON hop (body read, parsed for the phone and
+replayed), for a request identified only by X-API-Key, and for the bare GCRA check on
+phone + operator + API key. Requests cycle through `--phones` subscribers over 20
+operators, with limits high enough that every request is admitted and counted; the
+refusal path is timed separately. Overhead is the time with the middleware minus the
+time calling the app directly.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import time
+
+from app.core.cache import AsyncCache, MemoryStore
+from app.core.ratelimit import Limit, MemoryGCRA, RateLimiter, RateLimitMiddleware
+
+BUDGET_US = 100.0
+
+
+async def noop_app(scope, receive, send) -> None:
+    await receive()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def ignore(message) -> None:
+    pass
+
+
+def requests(n: int, phones: int, api_key: bool):
+    """(scope, body) pairs: USSD hops with a phone in the body, or keyed GETs."""
+    for i in range(n):
+        if api_key:
+            headers = [(b"x-api-key", f"key-{i % 1000}".encode())]
+            yield {"type": "http", "method": "GET", "path": "/api/forecast",
+                   "headers": headers}, b""
+        else:
+            body = json.dumps({"sessionId": f"s{i}", "phone": f"+2547{i % phones:08d}",
+                               "input": "1", "operator": f"op{i % 20}"}).encode()
+            headers = [(b"content-type", b"application/json"),
+                       (b"content-length", str(len(body)).encode())]
+            yield {"type": "http", "method": "POST", "path": "/api/ussd/session",
+                   "headers": headers}, body
+
+
+async def drive(app, reqs) -> float:
+    t0 = time.perf_counter()
+    for scope, body in reqs:
+        async def receive(body=body):
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await app(scope, receive, ignore)
+    return time.perf_counter() - t0
+
+
+def limiter(requests: int) -> RateLimiter:
+    return RateLimiter(
+        phone=requests, operator=requests, api_key=requests, period=60,
+        cache=AsyncCache(url=None, store=MemoryStore()),
+    )
+
+
+async def run(n: int, phones: int) -> None:
+    print(f"{n:,} requests over {phones:,} phones, 20 operators")
+    print(f"{'path':>26} {'us/request':>11} {'within budget':>14}")
+    for label, keyed in (("JSON body (USSD hop)", False), ("X-API-Key header", True)):
+        middleware = RateLimitMiddleware(noop_app, limiter(n))
+        reqs = list(requests(n, phones, keyed))
+        bare = await drive(noop_app, reqs)
+        wrapped = await drive(middleware, reqs)
+        overhead = (wrapped - bare) / n * 1e6
+        print(f"{label:>26} {overhead:>11.1f} {'yes' if overhead < BUDGET_US else 'NO':>14}")
+
+    rl = limiter(n)
+    idents = [(f"+2547{i % phones:08d}", f"op{i % 20}", f"key-{i % 1000}") for i in range(n)]
+    t0 = time.perf_counter()
+    for phone, operator, key in idents:
+        await rl.hit(phone, operator, key)
+    hit = (time.perf_counter() - t0) / n * 1e6
+    print(f"{'limiter.hit (3 limits)':>26} {hit:>11.1f}")
+
+    gcra = MemoryGCRA()
+    checks = [(key, Limit(lim.scope, 1, 60)) for key, lim in rl.checks("0700", "op1", "k")]
+    gcra.hit(checks)  # one per minute: every further call is refused
+    t0 = time.perf_counter()
+    for _ in range(n):
+        gcra.hit(checks)
+    refused = (time.perf_counter() - t0) / n * 1e6
+    print(f"{'GCRA refusal':>26} {refused:>11.2f}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=200_000)
+    ap.add_argument("--phones", type=int, default=100_000)
+    args = ap.parse_args()
+    asyncio.run(run(args.requests, args.phones))
+
+
+if __name__ == "__main__":
+    main()
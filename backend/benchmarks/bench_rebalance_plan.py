@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Rebalancing planner on synthetic pool networks: min-cost flow vs a greedy baseline.
+
+Usage (from backend/):
+    python -m benchmarks.bench_rebalance_plan [--pools 100 300 1000] [--degree 8] [--runs 5]
+
+Each network has `--pools` pools with random balances and forecast net flows (about a
+third end up short) and `--degree` random outgoing routes per pool, fees 1-50 bps and
+some capacity limits. The greedy baseline covers the largest deficit first from the
+cheapest direct route that still has liquidity, which is what an operator would do by
+hand. Reports solve time (median), total fees and deficit left uncovered.
+"""
+from __future__ import annotations
+import argparse
+import random
+import statistics
+import time
+
+from app.services.rebalance_plan import PoolState, Route, solve
+
+
+def network(n: int, degree: int, seed: int) -> tuple[list[PoolState], list[Route]]:
+    rnd = random.Random(seed)
+    pools = [
+        PoolState(
+            name=f"p{i}",
+            asset="USDC",
+            available=rnd.randint(0, 1_000_000) * 100,
+            net_flow=rnd.randint(-700_000, 300_000) * 100,
+            min_balance=100_000 * 100,
+        )
+        for i in range(n)
+    ]
+    routes = {}
+    for i in range(n):
+        for j in rnd.sample(range(n), min(degree, n - 1) + 1):
+            if j != i:
+                cap = None if rnd.random() < 0.7 else rnd.randint(50_000, 500_000) * 100
+                routes[(i, j)] = Route(f"p{i}", f"p{j}", rnd.randint(1, 50), cap)
+    return pools, list(routes.values())
+
+
+def greedy(pools: list[PoolState], routes: list[Route]) -> tuple[int, int]:
+    """(fee in minor units x bps, uncovered minor units) of the largest-deficit-first plan."""
+    surplus = {p.name: p.surplus for p in pools}
+    left = {r: r.capacity for r in routes}
+    inbound: dict[str, list[Route]] = {}
+    for r in sorted(routes, key=lambda r: r.fee_bps):
+        inbound.setdefault(r.dest, []).append(r)
+    cost = uncovered = 0
+    for p in sorted(pools, key=lambda p: -p.deficit):
+        need = p.deficit
+        for r in inbound.get(p.name, ()):
+            if not need:
+                break
+            cap = left[r]
+            amount = min(need, surplus[r.source], need if cap is None else cap)
+            if amount:
+                surplus[r.source] -= amount
+                if cap is not None:
+                    left[r] = cap - amount
+                need -= amount
+                cost += amount * r.fee_bps
+        uncovered += need
+    return cost, uncovered
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pools", type=int, nargs="+", default=[100, 300, 1000])
+    ap.add_argument("--degree", type=int, default=8)
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    print(f"{'pools':>6} {'routes':>7} {'solve ms':>9} {'fees vs greedy':>15} "
+          f"{'uncovered':>10} {'greedy uncovered':>17}")
+    for n in args.pools:
+        pools, routes = network(n, args.degree, seed=n)
+        times = []
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            plan = solve(pools, routes, fee_bps=10)
+            times.append(time.perf_counter() - t0)
+        cost = sum(t["amount"] * t["fee_bps"] for t in plan["transfers"])
+        uncovered = sum(plan["unmet"].values())
+        g_cost, g_uncovered = greedy(pools, routes)
+        deficit = sum(p.deficit for p in pools)
+        # Fees only compare at equal coverage; the planner usually also covers more
+        print(f"{n:>6} {len(routes):>7} {statistics.median(times) * 1e3:>9.1f} "
+              f"{(cost / g_cost - 1) * 100 if g_cost else 0:>+14.1f}% "
+              f"{uncovered / deficit:>10.1%} {g_uncovered / deficit:>17.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Transaction ID throughput and cross-process uniqueness.
+
+Usage (from backend/):
+    python -m benchmarks.bench_tx_ids [--ids 200000] [--procs 8] [--batch 256]
+
+Every process allocates through `new_tx_ids`, i.e. the module generator whose worker id
+is leased from the cache, starting from WORKER_ID (or the hostname/pid hash) as uvicorn
+workers would. All IDs are collected and checked for duplicates and per-process
+ordering. The leases only keep processes apart with REDIS_URL set; the in-memory
+fallback is per-process, so without Redis processes sharing a WORKER_ID collide.
+"""
+from __future__ import annotations
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+
+def _produce(args: tuple[int, int]) -> tuple[list[str], float, set[int]]:
+    count, batch = args
+    from app.utils.ids import new_tx_ids, parse_tx_id
+
+    out: list[str] = []
+    t0 = time.perf_counter()
+    while len(out) < count:
+        out.extend(new_tx_ids(min(batch, count - len(out))))
+    elapsed = time.perf_counter() - t0
+    return out, elapsed, {parse_tx_id(x)[1] for x in out}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ids", type=int, default=200_000, help="IDs per process")
+    ap.add_argument("--procs", type=int, default=8)
+    ap.add_argument("--batch", type=int, default=256)
+    args = ap.parse_args()
+
+    from app.utils.ids import new_tx_id, new_tx_ids
+
+    n = args.ids
+    t0 = time.perf_counter()
+    for _ in range(n):
+        new_tx_id()
+    single = n / (time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    for _ in range(n // args.batch):
+        new_tx_ids(args.batch)
+    bulk = (n // args.batch * args.batch) / (time.perf_counter() - t0)
+    print(f"single-process: new_tx_id {single:,.0f} ids/s, "
+          f"new_tx_ids({args.batch}) {bulk:,.0f} ids/s")
+
+    if not os.getenv("REDIS_URL"):
+        print("REDIS_URL unset: worker id leases are per-process; a shared WORKER_ID collides")
+    # Fresh interpreters, so each process leases its worker id on first use
+    with mp.get_context("spawn").Pool(args.procs) as pool:
+        results = pool.map(_produce, [(n, args.batch)] * args.procs)
+    total = sum(len(r) for r, _, _ in results)
+    unique = len({x for r, _, _ in results for x in r})
+    ordered = all(r == sorted(r) for r, _, _ in results)
+    rate = sum(len(r) / secs for r, secs, _ in results)
+    workers = sorted(w for _, _, ws in results for w in ws)
+    print(f"{args.procs} processes: {total:,} ids, {total - unique} duplicates, "
+          f"ordered={ordered}, aggregate {rate:,.0f} ids/s, worker ids {workers}")
+
+
+if __name__ == "__main__":
+    main()
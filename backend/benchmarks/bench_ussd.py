@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Replay thousands of concurrent USSD sessions and report per-hop latency.
+
+Usage (from backend/):
+    python -m benchmarks.bench_ussd [--sessions 5000] [--http]
+
+Every session dials in and walks a full flow (convert or send money, including one
+invalid input), all sessions interleaved on one event loop, so hops contend for the
+loop and the session store the way gateway traffic does. Latency is per hop: session
+load, transition, prompt rendering and session save. With --http, each hop is also a
+request through the FastAPI app (in-process ASGI transport and middleware included);
+the framework costs milliseconds per request, so with thousands of sessions on one loop
+those numbers are dominated by queueing for the loop rather than by the menu.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import random
+import time
+
+FLOWS = [
+    ["", "1", "abc", "500", "1"],  # convert, with an invalid amount
+    ["", "2", "0722000001", "250", "1"],  # send money
+    ["", "9", "3"],  # invalid choice, then balance
+]
+
+
+def _pct(samples: list[float], p: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * p))] * 1e3
+
+
+async def run(args: argparse.Namespace) -> None:
+    import logging
+
+    import httpx
+
+    from app.core.cache import AsyncCache
+    from app.main import app
+    from app.services import ussd
+
+    logging.disable(logging.INFO)  # per-request access logs would dominate the timing
+    service = ussd.USSDService(cache=AsyncCache())
+    ussd._service = service
+
+    rng = random.Random(7)
+    sessions = [(f"ATUid_{i}", f"+2547{i:08d}", rng.choice(FLOWS)) for i in range(args.sessions)]
+    latencies: list[float] = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def hop(sid: str, phone: str, text: str) -> None:
+            if args.http:
+                body = {"sessionId": sid, "phone": phone, "input": text}
+                r = await client.post("/api/ussd/session", json=body)
+                r.raise_for_status()
+            else:
+                await service.hop(sid, phone, text)
+
+        async def session(sid: str, phone: str, flow: list[str]) -> None:
+            await asyncio.sleep(rng.random() * 0.05)  # dial-ins spread over 50 ms
+            for text in flow:
+                t = time.perf_counter()
+                await hop(sid, phone, text)
+                latencies.append(time.perf_counter() - t)
+                await asyncio.sleep(0)  # the user types; other sessions run
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(session(*s) for s in sessions))
+        elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    mode = "HTTP (in-process ASGI)" if args.http else "service"
+    print(f"{args.sessions:,} concurrent sessions, {len(latencies):,} hops via {mode}")
+    print(f"  throughput: {len(latencies) / elapsed:,.0f} hops/s")
+    print(f"  per hop:    p50 {_pct(latencies, 0.5):.3f} ms  p99 {_pct(latencies, 0.99):.3f} ms"
+          f"  max {latencies[-1] * 1e3:.3f} ms")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sessions", type=int, default=5000)
+    ap.add_argument("--http", action="store_true", help="go through the FastAPI route")
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
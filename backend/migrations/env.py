@@ -0,0 +1,50 @@
+from __future__ import annotations
+import os
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+from app.core.db import sync_url
+from app.models.db_models import Base
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def _url():
+    # An explicit sqlalchemy.url (e.g. set by tests) wins over DATABASE_URL
+    return config.get_main_option("sqlalchemy.url") or sync_url(
+        os.getenv("DATABASE_URL", "sqlite+pysqlite:///:memory:")
+    )
+
+
+def run_migrations_offline() -> None:
+    context.configure(
+        url=str(_url()),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connectable = create_engine(_url(), poolclass=pool.NullPool)
+    with connectable.connect() as connection:
+        # Batch mode lets SQLite emulate ALTER TABLE by copying the table
+        context.configure(
+            connection=connection, target_metadata=target_metadata, render_as_batch=True
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
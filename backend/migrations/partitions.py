@@ -0,0 +1,90 @@
+"""Partition maintenance for the PostgreSQL ledger (see revision 0004).
+
+Run from backend/ on a schedule (e.g. daily):
+
+    python -m migrations.partitions ensure --months-ahead 3
+    python -m migrations.partitions archive --before 2026-01-01
+
+`archive` detaches whole monthly partitions older than the cutoff and renames
+them to `ledger_archive_YYYY_MM`; they can then be dumped and dropped, or moved to
+cheaper storage, without touching the live table.
+"""
+from __future__ import annotations
+import argparse
+import os
+from datetime import date
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection
+
+from app.core.db import sync_url
+
+
+def _month(d: date, offset: int) -> date:
+    m = d.month - 1 + offset
+    return date(d.year + m // 12, m % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"ledger_entries_{month:%Y_%m}"
+
+
+def create_month_partitions(
+    conn: Connection, months_back: int = 0, months_ahead: int = 3, today: date | None = None
+) -> list[str]:
+    """Create monthly partitions from `months_back` ago to `months_ahead` from now."""
+    start = _month(today or date.today(), 0)
+    created = []
+    for offset in range(-months_back, months_ahead + 1):
+        lo, hi = _month(start, offset), _month(start, offset + 1)
+        name = partition_name(lo)
+        conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF ledger_entries "
+                f"FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"
+            )
+        )
+        created.append(name)
+    return created
+
+
+def archive_partitions_before(conn: Connection, cutoff: date) -> list[str]:
+    """Detach monthly partitions whose whole range ends on or before `cutoff`."""
+    rows = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'ledger_entries' "
+            "AND c.relname ~ '^ledger_entries_[0-9]{4}_[0-9]{2}$'"
+        )
+    ).scalars()
+    archived = []
+    for name in sorted(rows):
+        year, month = int(name[-7:-3]), int(name[-2:])
+        if _month(date(year, month, 1), 1) <= cutoff:
+            conn.execute(text(f"ALTER TABLE ledger_entries DETACH PARTITION {name}"))
+            conn.execute(text(f"ALTER TABLE {name} RENAME TO ledger_archive_{year}_{month:02d}"))
+            archived.append(name)
+    return archived
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ensure = sub.add_parser("ensure")
+    ensure.add_argument("--months-ahead", type=int, default=3)
+    archive = sub.add_parser("archive")
+    archive.add_argument("--before", type=date.fromisoformat, required=True)
+    args = ap.parse_args()
+
+    engine = create_engine(sync_url(os.environ["DATABASE_URL"]))
+    with engine.begin() as conn:
+        if args.cmd == "ensure":
+            print(create_month_partitions(conn, months_ahead=args.months_ahead))
+        else:
+            print(archive_partitions_before(conn, args.before))
+
+
+if __name__ == "__main__":
+    main()
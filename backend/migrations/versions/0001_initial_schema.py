@@ -0,0 +1,53 @@
+"""Baseline schema: users, wallets, single-entry ledger, liquidity pools.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("phone", sa.String(32), nullable=False),
+        sa.Column("pin_hash", sa.String(128), nullable=False),
+        sa.Column("kyc_level", sa.Integer, nullable=False),
+    )
+    op.create_index("ix_users_phone", "users", ["phone"], unique=True)
+    op.create_table(
+        "wallets",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("balance_local", sa.Float, nullable=False),
+        sa.Column("balance_usdc", sa.Float, nullable=False),
+    )
+    op.create_table(
+        "ledger_entries",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("wallet_id", sa.Integer, sa.ForeignKey("wallets.id"), nullable=False),
+        sa.Column("amount", sa.Float, nullable=False),
+        sa.Column("asset", sa.String(16), nullable=False),
+        sa.Column("note", sa.String(255), nullable=False),
+    )
+    op.create_table(
+        "liquidity_pools",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("name", sa.String(64), nullable=False, unique=True),
+        sa.Column("balance", sa.Float, nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("liquidity_pools")
+    op.drop_table("ledger_entries")
+    op.drop_table("wallets")
+    op.drop_index("ix_users_phone", table_name="users")
+    op.drop_table("users")
@@ -0,0 +1,77 @@
+"""Double-entry ledger: integer minor-unit postings per account, balance snapshots.
+
+Baseline rows become single postings to their wallet's account, each under its own
+`legacy-<id>` tx_id.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# Minor units per asset as of this revision (app/utils/money.py); the rest use 2
+_SCALE = "CASE WHEN upper(asset) IN ('USDC', 'XAUT') THEN 1000000 ELSE 100 END"
+
+
+def upgrade() -> None:
+    sqlite = op.get_bind().dialect.name == "sqlite"
+    with op.batch_alter_table("ledger_entries") as batch:
+        batch.add_column(sa.Column("tx_id", sa.String(64), nullable=True))
+        batch.add_column(sa.Column("account", sa.String(64), nullable=True))
+        batch.add_column(sa.Column("amount_minor", sa.BigInteger, nullable=True))
+    op.execute(
+        "UPDATE ledger_entries SET tx_id = 'legacy-' || id, "
+        "account = 'wallet:' || (SELECT user_id FROM wallets WHERE wallets.id = wallet_id), "
+        f"amount_minor = ROUND(amount * {_SCALE})"
+    )
+    with op.batch_alter_table("ledger_entries") as batch:
+        if not sqlite:
+            # SQLite only autoincrements an INTEGER primary key
+            batch.alter_column("id", existing_type=sa.Integer, type_=sa.BigInteger)
+        batch.alter_column("tx_id", existing_type=sa.String(64), nullable=False)
+        batch.alter_column("account", existing_type=sa.String(64), nullable=False)
+        batch.alter_column("amount_minor", existing_type=sa.BigInteger, nullable=False)
+        batch.alter_column("wallet_id", existing_type=sa.Integer, nullable=True)
+        batch.drop_column("amount")
+    op.create_index(
+        "ix_ledger_entries_account_asset_id", "ledger_entries", ["account", "asset", "id"]
+    )
+    op.create_table(
+        "balance_snapshots",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("account", sa.String(64), nullable=False),
+        sa.Column("asset", sa.String(16), nullable=False),
+        sa.Column("balance_minor", sa.BigInteger, nullable=False),
+        sa.Column("last_entry_id", sa.BigInteger, nullable=False),
+    )
+    op.create_index(
+        "ix_balance_snapshots_account_asset_entry",
+        "balance_snapshots",
+        ["account", "asset", "last_entry_id"],
+    )
+
+
+def downgrade() -> None:
+    sqlite = op.get_bind().dialect.name == "sqlite"
+    op.drop_index("ix_balance_snapshots_account_asset_entry", table_name="balance_snapshots")
+    op.drop_table("balance_snapshots")
+    op.drop_index("ix_ledger_entries_account_asset_id", table_name="ledger_entries")
+    # Pool and clearing postings have no wallet and no place in the single-entry ledger
+    op.execute("DELETE FROM ledger_entries WHERE wallet_id IS NULL")
+    with op.batch_alter_table("ledger_entries") as batch:
+        batch.add_column(sa.Column("amount", sa.Float, nullable=True))
+    op.execute(f"UPDATE ledger_entries SET amount = CAST(amount_minor AS FLOAT) / {_SCALE}")
+    with op.batch_alter_table("ledger_entries") as batch:
+        batch.alter_column("amount", existing_type=sa.Float, nullable=False)
+        batch.alter_column("wallet_id", existing_type=sa.Integer, nullable=False)
+        batch.drop_column("amount_minor")
+        batch.drop_column("account")
+        batch.drop_column("tx_id")
+        if not sqlite:
+            batch.alter_column("id", existing_type=sa.BigInteger, type_=sa.Integer)
@@ -0,0 +1,48 @@
+"""Timestamps and history indexes for ledger/wallet lookups; one wallet per user.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def _created_at() -> sa.Column:
+    return sa.Column(
+        "created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()
+    )
+
+
+def upgrade() -> None:
+    sqlite = op.get_bind().dialect.name == "sqlite"
+    for table in ("ledger_entries", "balance_snapshots"):
+        if sqlite:
+            # SQLite cannot ADD COLUMN with a non-constant default; copy the table instead
+            with op.batch_alter_table(table, recreate="always") as batch:
+                batch.add_column(_created_at())
+        else:
+            op.add_column(table, _created_at())
+    op.create_index(
+        "ix_ledger_entries_account_created", "ledger_entries", ["account", "created_at", "id"]
+    )
+    op.create_index(
+        "ix_ledger_entries_wallet_created", "ledger_entries", ["wallet_id", "created_at"]
+    )
+    op.create_index("ix_ledger_entries_tx_id", "ledger_entries", ["tx_id"])
+    op.create_index("ix_wallets_user_id", "wallets", ["user_id"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_wallets_user_id", table_name="wallets")
+    op.drop_index("ix_ledger_entries_tx_id", table_name="ledger_entries")
+    op.drop_index("ix_ledger_entries_wallet_created", table_name="ledger_entries")
+    op.drop_index("ix_ledger_entries_account_created", table_name="ledger_entries")
+    for table in ("balance_snapshots", "ledger_entries"):
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column("created_at")
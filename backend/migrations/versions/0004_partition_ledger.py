@@ -0,0 +1,83 @@
+"""Range-partition ledger_entries by created_at (PostgreSQL only).
+
+Monthly partitions keep recent history hot and let old months be detached and
+archived without a bulk DELETE. Other dialects are left unpartitioned.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+from migrations.partitions import create_month_partitions
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql":
+        return
+    op.execute("ALTER TABLE ledger_entries RENAME TO ledger_entries_unpartitioned")
+    # The partition key must be part of the primary key on a partitioned table
+    op.execute(
+        """
+        CREATE TABLE ledger_entries (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+            tx_id VARCHAR(64) NOT NULL,
+            account VARCHAR(64) NOT NULL,
+            wallet_id INTEGER REFERENCES wallets (id),
+            amount_minor BIGINT NOT NULL,
+            asset VARCHAR(16) NOT NULL,
+            note VARCHAR(255) NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute("CREATE TABLE ledger_entries_default PARTITION OF ledger_entries DEFAULT")
+    create_month_partitions(bind, months_back=1, months_ahead=3)
+    op.execute(
+        "INSERT INTO ledger_entries (id, tx_id, account, wallet_id, amount_minor, asset, note, "
+        "created_at) OVERRIDING SYSTEM VALUE SELECT id, tx_id, account, wallet_id, amount_minor, "
+        "asset, note, created_at FROM ledger_entries_unpartitioned"
+    )
+    op.execute(
+        "SELECT setval(pg_get_serial_sequence('ledger_entries', 'id'), "
+        "COALESCE((SELECT max(id) FROM ledger_entries), 0) + 1, false)"
+    )
+    op.execute("DROP TABLE ledger_entries_unpartitioned")
+    # Indexes on the parent cascade to every partition
+    op.create_index(
+        "ix_ledger_entries_account_asset_id", "ledger_entries", ["account", "asset", "id"]
+    )
+    op.create_index(
+        "ix_ledger_entries_account_created", "ledger_entries", ["account", "created_at", "id"]
+    )
+    op.create_index(
+        "ix_ledger_entries_wallet_created", "ledger_entries", ["wallet_id", "created_at"]
+    )
+    op.create_index("ix_ledger_entries_tx_id", "ledger_entries", ["tx_id"])
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE TABLE ledger_entries_flat (LIKE ledger_entries INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO ledger_entries_flat SELECT * FROM ledger_entries")
+    op.execute("DROP TABLE ledger_entries CASCADE")
+    op.execute("ALTER TABLE ledger_entries_flat RENAME TO ledger_entries")
+    op.execute("ALTER TABLE ledger_entries ADD PRIMARY KEY (id)")
+    op.create_index(
+        "ix_ledger_entries_account_asset_id", "ledger_entries", ["account", "asset", "id"]
+    )
+    op.create_index(
+        "ix_ledger_entries_account_created", "ledger_entries", ["account", "created_at", "id"]
+    )
+    op.create_index(
+        "ix_ledger_entries_wallet_created", "ledger_entries", ["wallet_id", "created_at"]
+    )
+    op.create_index("ix_ledger_entries_tx_id", "ledger_entries", ["tx_id"])
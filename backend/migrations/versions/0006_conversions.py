@@ -0,0 +1,49 @@
+"""Persisted conversion pipeline state.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "conversions",
+        sa.Column("tx_id", sa.String(64), primary_key=True),
+        sa.Column("user_id", sa.String(64), nullable=False),
+        sa.Column("from_rail", sa.String(32), nullable=False),
+        sa.Column("from_operator", sa.String(64), nullable=True),
+        sa.Column("amount", sa.Float, nullable=False),
+        sa.Column("to_token", sa.String(16), nullable=False),
+        sa.Column("to_chain", sa.String(32), nullable=True),
+        sa.Column("mode", sa.String(16), nullable=False),
+        sa.Column("state", sa.String(16), nullable=False),
+        sa.Column("attempts", sa.Integer, nullable=False),
+        sa.Column("last_error", sa.Text, nullable=True),
+        sa.Column("steps", sa.Text, nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+    )
+    op.create_index("ix_conversions_state", "conversions", ["state"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_conversions_state", table_name="conversions")
+    op.drop_table("conversions")
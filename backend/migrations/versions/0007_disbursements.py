@@ -0,0 +1,62 @@
+"""Bulk B2C disbursement jobs and their rows.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "disbursement_jobs",
+        sa.Column("id", sa.String(64), primary_key=True),
+        sa.Column("status", sa.String(16), nullable=False),
+        sa.Column("total", sa.Integer, nullable=False),
+        sa.Column("invalid", sa.Integer, nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+    )
+    op.create_index("ix_disbursement_jobs_status", "disbursement_jobs", ["status"])
+    op.create_table(
+        "disbursement_rows",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("job_id", sa.String(64), sa.ForeignKey("disbursement_jobs.id"), nullable=False),
+        sa.Column("row_no", sa.Integer, nullable=False),
+        sa.Column("phone", sa.String(32), nullable=False),
+        sa.Column("amount", sa.Float, nullable=True),
+        sa.Column("reference", sa.String(64), nullable=False),
+        sa.Column("status", sa.String(16), nullable=False),
+        sa.Column("error", sa.String(255), nullable=True),
+        sa.Column("conversation_id", sa.String(64), nullable=True),
+    )
+    op.create_index(
+        "ix_disbursement_rows_job_status_id", "disbursement_rows", ["job_id", "status", "id"]
+    )
+    op.create_index(
+        "ix_disbursement_rows_job_row", "disbursement_rows", ["job_id", "row_no"], unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_disbursement_rows_job_row", table_name="disbursement_rows")
+    op.drop_index("ix_disbursement_rows_job_status_id", table_name="disbursement_rows")
+    op.drop_table("disbursement_rows")
+    op.drop_index("ix_disbursement_jobs_status", table_name="disbursement_jobs")
+    op.drop_table("disbursement_jobs")
@@ -0,0 +1,52 @@
+"""Pool balances in minor units and the pool operation journal.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("liquidity_pools") as batch:
+        batch.add_column(sa.Column("asset", sa.String(16), nullable=False, server_default="LOCAL"))
+        batch.add_column(
+            sa.Column("balance_minor", sa.BigInteger, nullable=False, server_default="0")
+        )
+        batch.add_column(
+            sa.Column("reserved_minor", sa.BigInteger, nullable=False, server_default="0")
+        )
+        batch.add_column(
+            sa.Column("applied_seq", sa.BigInteger, nullable=False, server_default="0")
+        )
+    op.create_table(
+        "pool_journal",
+        sa.Column("id", sa.BigInteger, primary_key=True, autoincrement=False),
+        sa.Column("pool", sa.String(64), nullable=False),
+        sa.Column("op", sa.String(16), nullable=False),
+        sa.Column("reservation_id", sa.String(64), nullable=True),
+        sa.Column("amount_minor", sa.BigInteger, nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+    )
+    op.create_index("ix_pool_journal_pool_id", "pool_journal", ["pool", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_pool_journal_pool_id", table_name="pool_journal")
+    op.drop_table("pool_journal")
+    with op.batch_alter_table("liquidity_pools") as batch:
+        batch.drop_column("applied_seq")
+        batch.drop_column("reserved_minor")
+        batch.drop_column("balance_minor")
+        batch.drop_column("asset")
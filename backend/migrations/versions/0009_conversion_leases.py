@@ -0,0 +1,27 @@
+"""Conversion payer phone and per-instance leases.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("conversions") as batch:
+        batch.add_column(sa.Column("phone", sa.String(32), nullable=True))
+        batch.add_column(sa.Column("owner", sa.String(32), nullable=True))
+        batch.add_column(sa.Column("lease_until", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("conversions") as batch:
+        batch.drop_column("lease_until")
+        batch.drop_column("owner")
+        batch.drop_column("phone")
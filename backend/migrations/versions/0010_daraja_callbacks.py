@@ -0,0 +1,40 @@
+"""Raw Daraja callbacks, persisted before they are acknowledged.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "daraja_callbacks",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("kind", sa.String(8), nullable=False),
+        sa.Column("ref", sa.String(64), nullable=False),
+        sa.Column("body", sa.Text, nullable=False),
+        sa.Column("booked_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+    )
+    op.create_index(
+        "ix_daraja_callbacks_kind_ref", "daraja_callbacks", ["kind", "ref"], unique=True
+    )
+    op.create_index("ix_daraja_callbacks_booked", "daraja_callbacks", ["booked_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_daraja_callbacks_booked", table_name="daraja_callbacks")
+    op.drop_index("ix_daraja_callbacks_kind_ref", table_name="daraja_callbacks")
+    op.drop_table("daraja_callbacks")
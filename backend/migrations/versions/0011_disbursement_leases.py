@@ -0,0 +1,25 @@
+"""Per-instance leases on bulk disbursement jobs.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("disbursement_jobs") as batch:
+        batch.add_column(sa.Column("owner", sa.String(32), nullable=True))
+        batch.add_column(sa.Column("lease_until", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("disbursement_jobs") as batch:
+        batch.drop_column("lease_until")
+        batch.drop_column("owner")
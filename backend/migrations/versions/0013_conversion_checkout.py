@@ -0,0 +1,25 @@
+"""STK CheckoutRequestID on conversions waiting for the payer.
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0013"
+down_revision = "0012"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("conversions") as batch:
+        batch.add_column(sa.Column("checkout_id", sa.String(64), nullable=True))
+    op.create_index("ix_conversions_checkout_id", "conversions", ["checkout_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_conversions_checkout_id", table_name="conversions")
+    with op.batch_alter_table("conversions") as batch:
+        batch.drop_column("checkout_id")
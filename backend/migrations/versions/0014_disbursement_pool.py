@@ -0,0 +1,25 @@
+"""Operator pool each bulk disbursement job pays out of.
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0014"
+down_revision = "0013"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("disbursement_jobs") as batch:
+        batch.add_column(
+            sa.Column("pool", sa.String(64), nullable=False, server_default="safaricom")
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("disbursement_jobs") as batch:
+        batch.drop_column("pool")
@@ -1,11 +1,108 @@
-import os
-import pathlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 from fastapi.testclient import TestClient
 
+from sqlalchemy import delete, update
+
 from app.main import app
+from app.core.db import engine, get_session
+from app.models.db_models import Base, ServiceLease, utcnow
+from app.services.pools import LEASE_NAME
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    # Most tests use TestClient without entering the lifespan, so startup never runs
+    Base.metadata.create_all(bind=engine)
 
 
 @pytest.fixture(scope="session")
 def client():
     return TestClient(app)
+
+
+@pytest.fixture
+def pool_lease():
+    """Free the claim on the liquidity pools for the test's own PoolEngines, then give it
+    back to the engine (e.g. the app's) that held it. Yields `lapse`, which expires the
+    current claim as if its engine had died."""
+    with get_session() as session:
+        held = session.get(ServiceLease, LEASE_NAME)
+        saved = (held.owner, held.lease_until) if held is not None else None
+        session.execute(delete(ServiceLease).where(ServiceLease.name == LEASE_NAME))
+
+    def lapse() -> None:
+        with get_session() as session:
+            session.execute(
+                update(ServiceLease)
+                .where(ServiceLease.name == LEASE_NAME)
+                .values(lease_until=utcnow())
+            )
+
+    yield lapse
+    with get_session() as session:
+        session.execute(delete(ServiceLease).where(ServiceLease.name == LEASE_NAME))
+        if saved is not None:
+            session.add(ServiceLease(name=LEASE_NAME, owner=saved[0], lease_until=saved[1]))
+
+
+class FakeClock:
+    """Manually advanced clock for code that takes a `clock` callable."""
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeServer(ThreadingHTTPServer):
+    """Local stand-in for an external HTTP API on a free port; subclasses add state
+    (guarded by `lock`) and pass their FakeHandler subclass."""
+
+    daemon_threads = True
+    request_queue_size = 128  # many pooled connections open at once
+
+    def __init__(self, handler: type[BaseHTTPRequestHandler]):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real services
+    wbufsize = -1  # send headers and body in one segment (no Nagle/delayed-ACK stalls)
+
+    def _reply(self, code: int, body) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):  # keep test output quiet
+        pass
+
+
+@pytest.fixture
+def serve():
+    """Runs fake servers on background threads: `server = serve(FakeX())`; each is shut
+    down after the test."""
+    servers: list[FakeServer] = []
+
+    def start(server: FakeServer) -> FakeServer:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
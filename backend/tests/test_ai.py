@@ -1,22 +1,145 @@
-from app.ai.groq_client import GroqClient
+import asyncio
+import json
+import time
+
+import pytest
+from conftest import FakeHandler, FakeServer
+from fastapi.testclient import TestClient
+
+from app.ai.groq_client import COMPLETIONS_PATH, GroqClient, get_groq_client, mock_summary
+from app.core.cache import AsyncCache, MemoryStore
+from app.integrations.http_pool import close_http_clients
+from app.main import app
+
+
+class FakeLLM(FakeServer):
+    """Local stand-in for Groq's chat completions API.
+
+    Answers "summary: <prompt>" after `delay` seconds; `reply` overrides the JSON body
+    and `status` the status code. Tracks requests and the peak number in flight.
+    """
+
+    def __init__(self):
+        super().__init__(_Handler)
+        self.delay = 0.0
+        self.status = 200
+        self.reply: dict | None = None
+        self.requests: list[dict] = []
+        self.active = self.peak = 0
+
+
+class _Handler(FakeHandler):
+    server: FakeLLM
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests.append({"path": self.path, "auth": self.headers["Authorization"],
+                                         **body})
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.active -= 1
+        prompt = body["messages"][-1]["content"]
+        reply = self.server.reply or {
+            "choices": [{"message": {"role": "assistant", "content": f" summary: {prompt} "}}]
+        }
+        self._reply(self.server.status, reply)
+
+
+@pytest.fixture
+def llm(serve):
+    return serve(FakeLLM())
+
+
+def _client(llm: FakeLLM, **kw) -> GroqClient:
+    kw.setdefault("timeout", 5.0)
+    kw.setdefault("cache", AsyncCache(url=None, store=MemoryStore()))
+    return GroqClient(api_key="test-key", base_url=llm.url, **kw)
+
+
+def _run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await close_http_clients()
+
+    return asyncio.run(main())
 
 
 def test_groq_client_mock_without_key():
     client = GroqClient(api_key=None)
-    out = client.summarize("Hello world, this is a test of Groq client")
-    assert out.startswith("[mock-summary:")
+    out = asyncio.run(client.summarize("Hello world, this is a test of Groq client"))
+    assert out == mock_summary("Hello world, this is a test of Groq client")
+    assert out.startswith("[mock-summary:32]")
 
 
-def test_groq_client_with_key_branch():
-    client = GroqClient(api_key="dummy")
-    out = client.summarize("Hello again")
-    assert out.startswith("[would-call-groq]")
+def test_groq_client_raises_on_empty():
+    with pytest.raises(ValueError):
+        asyncio.run(GroqClient(api_key=None).summarize(""))
 
 
-def test_groq_client_raises_on_empty():
-    client = GroqClient(api_key=None)
-    try:
-        client.summarize("")
-        assert False, "should have raised"
-    except ValueError:
-        assert True
+def test_summaries_come_from_the_llm_and_are_cached(llm):
+    client = _client(llm)
+
+    async def run():
+        first = await client.summarize("Operator a net flow 10.00 over 4h.")
+        again = await client.summarize("Operator a net flow 10.00 over 4h.")
+        return first, again
+
+    assert _run(run()) == ("summary: Operator a net flow 10.00 over 4h.",) * 2
+    assert len(llm.requests) == 1  # the second came from the content-hash cache
+    sent = llm.requests[0]
+    assert (sent["path"], sent["auth"], sent["model"]) == (
+        COMPLETIONS_PATH, "Bearer test-key", client.model
+    )
+    assert sent["messages"][0]["role"] == "system"
+
+
+def test_identical_prompts_in_flight_share_one_call(llm):
+    llm.delay = 0.2
+    client = _client(llm, max_concurrency=2)
+    prompts = ["same prompt"] * 10 + [f"prompt {i}" for i in range(6)]
+
+    results = _run(client.summarize_many(prompts))
+    assert results == [f"summary: {p}" for p in prompts]
+    assert len(llm.requests) == 7  # one for the ten duplicates, one per distinct prompt
+    assert llm.peak == 2  # the semaphore capped calls upstream
+
+
+def test_slow_or_failing_llm_falls_back_to_the_mock(llm):
+    llm.delay = 0.5
+    cache = AsyncCache(url=None, store=MemoryStore())
+    text = "Operator b net flow -5.00 over 1h."
+    assert _run(_client(llm, timeout=0.1, cache=cache).summarize(text)) == mock_summary(text)
+
+    # The fallback was not cached: the next call reaches the LLM (with room to answer,
+    # so a busy test run cannot time it out too)
+    llm.delay = 0.0
+    client = _client(llm, cache=cache)
+    assert _run(client.summarize(text)) == f"summary: {text}"
+
+    for status, reply in [
+        (500, None),
+        (200, {"choices": []}),
+        (200, {"choices": [{"message": {"content": "   "}}]}),
+        (200, {"choices": [{"message": {"content": None}}]}),
+    ]:
+        llm.status, llm.reply = status, reply
+        assert _run(client.summarize(f"{status} {reply}")) == mock_summary(f"{status} {reply}")
+
+
+def test_operator_summary_route_awaits_the_shared_client(llm, monkeypatch):
+    assert get_groq_client() is get_groq_client()
+    groq = _client(llm)
+    monkeypatch.setattr("app.services.forecast.get_groq_client", lambda: groq)
+    client = TestClient(app)
+    for _ in range(2):
+        r = client.get("/api/operators/groq-route-op/summary", params={"window": "1h"})
+        assert r.status_code == 200
+        assert r.json()["summary"] == (
+            "summary: Operator groq-route-op predicted net flow 0.00 over 1h."
+        )
+    assert len(llm.requests) == 1  # the second came from the forecast cache
@@ -11,8 +11,8 @@ def test_ussd_session():
     )
     assert r.status_code == 200
     data = r.json()
-    assert data["nextMenuState"].endswith(":next")
-    assert data["actions"] == ["confirm"]
+    assert data["nextMenuState"] == "convert_amount"
+    assert data["actions"] == [] and not data["end"]
 
 
 def test_convert_success():
@@ -20,7 +20,8 @@ def test_convert_success():
         "/api/convert",
         json={
             "userId": "u1",
-            "from": {"rail": "m-pesa", "operator": "safaricom", "amount": 10.0},
+            "from": {"rail": "m-pesa", "operator": "safaricom", "amount": 10.0,
+                     "phone": "+254700000003"},
             "to": {"token": "USDC", "chain": "hedera"},
             "mode": "fast",
         },
@@ -0,0 +1,41 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app.core import cache as cache_module
+from app.core.cache import AsyncCache, MemoryStore, get_async_cache, get_cache
+from app.main import app
+
+
+def test_async_cache_memory_semantics():
+    async def scenario():
+        c = AsyncCache(url=None, store=MemoryStore(max_entries=3))
+        await c.set("a", "1", ex=60)
+        assert await c.get("a") == "1"
+        assert await c.incr("n") == 1
+        await c.mset({})
+        await c.mset({"b": "2", "c": "3"}, ex={"b": 60})
+        assert await c.mget(["a", "b", "c"]) == [None, "2", "3"]  # "a" evicted (LRU, 3 max)
+        assert await c.mget([]) == []
+        assert await c.incr_many(["n", "m"]) == [2, 1]
+        assert await c.incr_many([]) == []
+        assert await c.delete("c", "zz") == 1  # "b" was evicted by "m"
+        assert await c.delete() == 0
+        await c.aclose()
+
+    asyncio.run(scenario())
+    assert AsyncCache(url=None)._store is not None
+
+
+def test_shared_instance_lifecycle_and_store_sharing():
+    with TestClient(app) as client:
+        assert client.get("/healthz").status_code == 200
+        shared = get_async_cache()
+        assert shared is get_async_cache()
+        # Without Redis the async view shares the sync cache's in-memory store
+        get_cache().set("shared-key", "v")
+        assert asyncio.run(shared.get("shared-key")) == "v"
+    # Shutdown released the shared instance; it is recreated lazily on demand
+    assert cache_module._async_cache is None
+    asyncio.run(cache_module.close_async_cache())
+    assert get_async_cache() is not shared
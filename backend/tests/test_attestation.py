@@ -0,0 +1,226 @@
+import asyncio
+from collections import Counter
+
+import httpx
+import pytest
+from conftest import FakeHandler, FakeServer
+
+from app.integrations.cctp import CCTPClient as CCTPStub
+from app.integrations.cctp_live import CCTPClient as CCTPLive
+from app.services import attestation as attestation_module
+from app.services.attestation import AttestationPoller, _Watch, client_fetcher
+
+READY_AFTER = 2  # polls before the fake Circle reports an attestation as complete
+
+
+class FakeCircle(FakeServer):
+    """Local stand-in for Circle's attestation service (GET /v1/attestations/{hash})."""
+
+    def __init__(self):
+        super().__init__(_Handler)
+        self.polls: Counter[str] = Counter()
+
+
+class _Handler(FakeHandler):
+    server: FakeCircle
+
+    def do_GET(self):
+        burn = self.path.rsplit("/", 1)[-1]
+        with self.server.lock:
+            self.server.polls[burn] += 1
+            polls = self.server.polls[burn]
+        if burn.startswith("unknown"):
+            return self._reply(404, {"error": "not found"})
+        if burn.startswith("boom"):
+            return self._reply(500, {"error": "internal"})
+        if polls < READY_AFTER:
+            return self._reply(200, {"status": "pending_confirmations", "attestation": None})
+        return self._reply(200, {"status": "complete", "attestation": f"0xatt-{burn}"})
+
+
+@pytest.fixture
+def circle(serve):
+    return serve(FakeCircle())
+
+
+def _poller(fetch, **kw) -> AttestationPoller:
+    kw.setdefault("min_delay", 0.01)
+    kw.setdefault("max_delay", 0.05)
+    return AttestationPoller(fetch=fetch, **kw)
+
+
+def test_poller_resolves_many_burns_in_batches(circle):
+    live = CCTPLive(attestation_url=circle.url)
+    batches: list[int] = []
+
+    async def fetch(burn_txs):
+        batches.append(len(burn_txs))
+        return await live.fetch_attestations(burn_txs)
+
+    poller = _poller(fetch, batch_size=20)
+    burns = [f"0xburn{i}" for i in range(60)]
+    outstanding = attestation_module.ATTESTATIONS_OUTSTANDING._value.get()
+    waits = attestation_module.ATTESTATION_WAIT_SECONDS._sum.get()
+
+    async def run():
+        try:
+            return await asyncio.gather(*(poller.wait(b) for b in burns))
+        finally:
+            await poller.stop()
+
+    results = asyncio.run(run())
+    assert results == [f"0xatt-{b}" for b in burns]
+    assert poller.outstanding() == 0
+    assert all(circle.polls[b] == READY_AFTER for b in burns)
+    assert max(batches) <= 20 and len(batches) < 2 * len(burns) / 10
+    assert attestation_module.ATTESTATIONS_OUTSTANDING._value.get() == outstanding
+    assert attestation_module.ATTESTATION_WAIT_SECONDS._sum.get() > waits
+    assert poller.expected_latency is not None
+
+
+def test_waiters_share_one_watch_and_survive_cancellation(circle):
+    poller = _poller(CCTPLive(attestation_url=circle.url).fetch_attestations)
+
+    async def run():
+        impatient = asyncio.create_task(poller.wait("0xshared"))
+        patient = asyncio.create_task(poller.wait("0xshared"))
+        await asyncio.sleep(0)
+        impatient.cancel()
+        try:
+            return await patient
+        finally:
+            await poller.stop()
+
+    assert asyncio.run(run()) == "0xatt-0xshared"
+    assert circle.polls["0xshared"] == READY_AFTER
+
+
+def test_live_client_maps_missing_and_failing_burns_to_pending(circle):
+    live = CCTPLive(attestation_url=circle.url)
+    found = asyncio.run(live.fetch_attestations(["unknown-1", "boom-1"]))
+    assert found == {"unknown-1": None, "boom-1": None}
+
+    unreachable = CCTPLive(attestation_url="http://127.0.0.1:9", timeout=0.5)
+    assert asyncio.run(unreachable.fetch_attestations(["0xa"])) == {"0xa": None}
+
+
+def test_live_client_single_lookup(circle):
+    live = CCTPLive(attestation_url=circle.url)
+
+    async def run():
+        assert (await live.fetch_attestation("0xone"))["status"] == "pending"
+        return await live.fetch_attestation("0xone")
+
+    done = asyncio.run(run())
+    assert done == {"status": "attested", "burn_tx": "0xone", "attestation": "0xatt-0xone"}
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(live.fetch_attestation("boom-2"))
+
+
+def test_timeout_fails_the_future():
+    async def never(burn_txs):
+        return {tx: None for tx in burn_txs}
+
+    poller = _poller(never, timeout=0.05)
+
+    async def run():
+        try:
+            await poller.wait("0xslow")
+        finally:
+            await poller.stop()
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(run())
+    assert poller.outstanding() == 0
+
+
+def test_failed_batches_back_off_and_recover():
+    calls = []
+
+    async def flaky(burn_txs):
+        calls.append(list(burn_txs))
+        if len(calls) == 1:
+            raise httpx.ConnectError("circle down")
+        return {tx: f"att-{tx}" for tx in burn_txs}
+
+    errors = attestation_module.ATTESTATION_POLLS_TOTAL.labels(outcome="error")._value.get()
+    poller = _poller(flaky)
+
+    async def run():
+        try:
+            return await poller.wait("0xretry")
+        finally:
+            await poller.stop()
+
+    assert asyncio.run(run()) == "att-0xretry"
+    assert len(calls) == 2
+    assert attestation_module.ATTESTATION_POLLS_TOTAL.labels(outcome="error")._value.get() == (
+        errors + 1
+    )
+
+
+def test_concurrent_batches_are_bounded():
+    active = peak = 0
+
+    async def slow(burn_txs):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.02)
+        active -= 1
+        return {tx: "att" for tx in burn_txs}
+
+    poller = _poller(slow, batch_size=1, concurrency=2)
+
+    async def run():
+        try:
+            await asyncio.gather(*(poller.wait(f"0x{i}") for i in range(6)))
+        finally:
+            await poller.stop()
+
+    asyncio.run(run())
+    assert peak == 2
+
+
+def test_stop_cancels_outstanding_watches():
+    async def never(burn_txs):
+        return {tx: None for tx in burn_txs}
+
+    poller = _poller(never)
+
+    async def run():
+        future = poller.watch("0xstuck")
+        await asyncio.sleep(0.02)
+        await poller.stop()
+        return future
+
+    assert asyncio.run(run()).cancelled()
+    assert poller.outstanding() == 0
+
+
+def test_backoff_doubles_with_jitter_and_adapts_to_latency():
+    poller = AttestationPoller(fetch=client_fetcher(CCTPStub()), min_delay=1, max_delay=8)
+    w = _Watch(future=None, since=0.0)  # type: ignore[arg-type]
+    delays = [poller._next_delay(w, now=0.0) for _ in range(5)]
+    for delay, cap in zip(delays, [1, 2, 4, 8, 8]):
+        assert cap / 2 <= delay <= cap
+
+    poller.expected_latency = 30.0
+    fresh = _Watch(future=None, since=0.0)  # type: ignore[arg-type]
+    assert poller._next_delay(fresh, now=4.0) == pytest.approx(20.0)  # 0.8 * 30 - 4
+
+
+def test_client_fetcher_wraps_sync_clients():
+    class Pending(CCTPStub):
+        def fetch_attestation(self, burn_tx):
+            return {"status": "pending", "burn_tx": burn_tx}
+
+    class Broken(CCTPStub):
+        def fetch_attestation(self, burn_tx):
+            raise RuntimeError("rpc down")
+
+    assert asyncio.run(client_fetcher(CCTPStub())(["b1"])) == {"b1": "att-b1"}
+    assert asyncio.run(client_fetcher(Pending())(["b1"])) == {"b1": None}
+    assert asyncio.run(client_fetcher(Broken())(["b1"])) == {"b1": None}
+    live = CCTPLive(attestation_url="http://127.0.0.1:9")
+    assert client_fetcher(live) == live.fetch_attestations
@@ -0,0 +1,195 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.cache import Cache, CacheStatsCollector, MemoryStore
+from app.main import app
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_honored_on_get_and_incr():
+    clock = Clock()
+    s = MemoryStore(clock=clock, sweep_interval=1000)
+    s.set("a", "1", ex=10)
+    s.incr("a")  # keeps the TTL, like Redis
+    assert s.get("a") == "2"
+    clock.now = 10
+    assert s.get("a") is None
+    assert s.incr("a") == 1  # expired counter restarts without a TTL
+    clock.now = 1000
+    assert s.get("a") == "1"
+    s.set("b", "x", ex=5)
+    clock.now = 1005
+    assert s.incr("b") == 1
+    assert s.stats()["expirations"] == 2
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    s = MemoryStore(max_entries=2, max_bytes=100)
+    s.set("a", "1")
+    s.set("b", "2")
+    assert s.get("a") == "1"  # a is now most recently used
+    s.set("c", "3")
+    assert s.get("b") is None
+    assert s.get("a") == "1" and s.get("c") == "3"
+
+    s = MemoryStore(max_entries=100, max_bytes=10)
+    s.set("k1", "xxxx")
+    s.set("k2", "yyyy")
+    s.set("k3", "zzzz")  # 18 bytes > 10 -> oldest entries go
+    assert s.get("k1") is None
+    assert s.stats()["bytes"] <= 10
+    s.set("huge", "x" * 50)  # larger than the whole budget: not retained
+    assert s.get("huge") is None
+    assert s.stats()["evictions"] >= 2
+
+
+def test_overwrite_updates_size_and_clears_ttl():
+    clock = Clock()
+    s = MemoryStore(clock=clock)
+    s.set("a", "1234", ex=1)
+    s.set("a", "12")
+    assert s.stats()["bytes"] == 3
+    clock.now = 5
+    assert s.get("a") == "12"
+
+
+def test_periodic_and_explicit_sweeps():
+    clock = Clock()
+    s = MemoryStore(clock=clock, sweep_interval=10)
+    for i in range(5):
+        s.set(f"k{i}", "v", ex=1)
+    clock.now = 2
+    s.set("other", "v")  # interval not reached: expired keys still resident
+    assert s.stats()["entries"] == 6
+    clock.now = 10
+    s.set("trigger", "v")
+    assert s.stats()["entries"] == 2
+    s.set("z", "v", ex=1)
+    clock.now = 12
+    assert s.sweep() == 1
+    assert s.delete("z", "other") == 1
+
+
+def test_stats_and_budget_validation():
+    s = MemoryStore()
+    s.get("missing")
+    s.set("a", "b")
+    s.get("a")
+    stats = s.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["entries"] == 1
+    with pytest.raises(ValueError):
+        MemoryStore(max_entries=0)
+
+
+def test_cache_uses_bounded_store_and_exports_stats():
+    c = Cache(url=None, max_entries=1, max_bytes=1000, sweep_interval=0)
+    c.set("a", "1", ex=60)
+    c.set("b", "2")
+    assert c.get("a") is None
+    stats = c.stats()
+    assert stats["backend"] == "memory" and stats["evictions"] == 1
+
+    families = {m.name: m for m in CacheStatsCollector(lambda: c).collect()}
+    assert families["cache_entries"].samples[0].value == 1
+    assert families["cache_evictions"].samples[0].value == 1
+    assert {m.name for m in CacheStatsCollector().describe()} >= {"cache_bytes", "cache_hits"}
+
+    body = TestClient(app).get("/metrics").text
+    assert 'cache_entries{backend="memory"}' in body
+    assert 'cache_evictions_total{backend="memory"}' in body
+
+
+def test_batched_multi_key_operations():
+    clock = Clock()
+    s = MemoryStore(clock=clock)
+    s.mset({"a": "1", "b": "2", "c": "3"}, ex={"a": 5, "b": None})
+    s.mset({"d": "4"}, ex=5)
+    assert s.mget(["a", "b", "c", "d", "x"]) == ["1", "2", "3", "4", None]
+    assert s.incr_many(["a", "n", "n"]) == [2, 1, 2]
+    clock.now = 5
+    assert s.mget(["a", "b", "c", "d", "n"]) == [None, "2", "3", None, "2"]
+
+    c = Cache(url=None)
+    assert c.mget([]) == [] and c.incr_many([]) == []
+    c.mset({})
+    c.mset({"k1": "v1", "k2": "v2"}, ex=60)
+    assert c.mget(["k1", "k2", "k3"]) == ["v1", "v2", None]
+    assert c.incr_many(["hits:a", "hits:b", "hits:a"]) == [1, 1, 2]
+
+
+def test_compare_and_delete_or_expire():
+    clock = Clock()
+    s = MemoryStore(clock=clock)
+    s.set("lock", "mine", ex=10)
+    assert not s.delete_if("lock", "theirs") and not s.expire_if("lock", "theirs", 100)
+    clock.now += 9
+    assert s.expire_if("lock", "mine", 10)
+    clock.now += 9
+    assert s.get("lock") == "mine"  # renewed past the original deadline
+    assert s.delete_if("lock", "mine") and s.get("lock") is None
+    assert not s.delete_if("lock", "mine") and not s.expire_if("lock", "mine", 1)
+
+    c = Cache(url=None)
+    c.set("c-lock", "a")
+    assert c.expire_if("c-lock", "a", 5) and not c.delete_if("c-lock", "b")
+    assert c.delete_if("c-lock", "a") and c.get("c-lock") is None
+
+
+def test_lists_queue_items_between_threads():
+    clock = Clock()
+    s = MemoryStore(clock=clock, sweep_interval=100)
+    s.push("q", "a")
+    s.push("q", "b", ex=5)
+    assert s.pop("q", 0) == "a" and s.pop("q", 0) == "b"
+    assert s.pop("q", 0.01) is None  # drained: waits, then gives up
+    s.push("q", "late", ex=5)
+    clock.now += 6
+    assert s.pop("q", 0) is None and s.expirations == 1  # the list expired
+    s.push("q", "kept", ex=5)
+    s.push("q", "again")  # no TTL: keeps it until popped
+    clock.now += 6
+    s.push("swept", "x", ex=1)
+    clock.now += 100
+    assert s.sweep() == 1 and s.pop("q", 0) == "kept"
+
+    woken = threading.Timer(0.02, s.push, ("wait", "pushed"))
+    woken.start()
+    assert s.pop("wait", 5) == "pushed"  # a blocked pop wakes on the push
+    c = Cache(url=None)
+    c.push("c-q", "1", ex=5)
+    assert c.pop("c-q", 0) == "1" and c.pop("c-q", 0) is None
+
+
+def test_float_ttls_reach_redis_as_whole_milliseconds():
+    calls: list[dict] = []
+
+    class Redis:
+        def set(self, key, value, **kw):
+            calls.append(kw)
+            return True
+
+        def pipeline(self, transaction):
+            return Pipeline()
+
+    class Pipeline(Redis):
+        def execute(self):
+            return []
+
+    cache = Cache(url=None)
+    cache._client = Redis()  # what redis-py would be handed
+    cache.set("k", "v", ex=60.0)  # e.g. WORKER_ID_LEASE_TTL
+    cache.add("k", "v", ex=0.25)
+    cache.mset({"a": "1", "b": "2"}, ex={"a": 1.5})
+    cache.set("k", "v", ex=0)
+    assert calls == [
+        {"px": 60_000}, {"px": 250, "nx": True}, {"px": 1500}, {"px": None}, {"px": 1}
+    ]
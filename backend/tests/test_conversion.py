@@ -0,0 +1,582 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete
+
+from app.core.db import AsyncSessionLocal, async_engine, get_session
+from app.integrations.cctp import CCTPClient
+from app.integrations.daraja import DarajaClient
+from app.integrations.hedera import HederaClient
+from app.main import app
+from app.models.db_models import Conversion, DarajaCallbackRecord, User, utcnow
+from app.services.attestation import AttestationPoller
+from app.services.conversion import AWAITING_PAYMENT, ConversionPipeline
+from app.services.daraja_callbacks import DarajaCallback
+from app.services.ledger import get_ledger
+from app.services.wallet import WalletService
+from app.utils.money import to_minor
+
+client = TestClient(app)
+
+PAYLOAD = {
+    "userId": "conv-user",
+    "from": {"rail": "m-pesa", "operator": "safaricom", "amount": 50.0, "phone": "+254700000001"},
+    "to": {"token": "USDC", "chain": "hedera"},
+    "mode": "fast",
+}
+
+
+class CountingDaraja(DarajaClient):
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        self.calls = 0
+        self.phones: list[str] = []
+        self.delay = delay
+
+    async def stk_push(self, phone, amount, **kw):
+        self.calls += 1
+        self.phones.append(phone)
+        await asyncio.sleep(self.delay)
+        return await super().stk_push(phone, amount, **kw)
+
+
+class FlakyCCTP(CCTPClient):
+    """Fails the first `failures` destination mints; tracks concurrent burns."""
+
+    def __init__(self, failures: int = 0, delay: float = 0.0):
+        super().__init__()
+        self.failures = failures
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def initiate_burn(self, chain, amount):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.delay)
+            return super().initiate_burn(chain, amount)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def mint_on_destination(self, chain, attestation):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("destination RPC unavailable")
+        return super().mint_on_destination(chain, attestation)
+
+
+class BrokenHedera(HederaClient):
+    def mint(self, token, amount):
+        raise RuntimeError("hedera unavailable")
+
+
+@pytest.fixture(autouse=True)
+def _no_leftover_conversions():
+    # start() resumes every unfinished conversion in the DB, including other tests'
+    with get_session() as session:
+        session.execute(delete(Conversion))
+
+
+def _run(main):
+    async def scenario():
+        try:
+            return await main()
+        finally:
+            # The in-memory DB's single aiosqlite connection binds to the loop using it
+            await async_engine.dispose()
+
+    return asyncio.run(scenario())
+
+
+def _pipeline(daraja=None, cctp=None, hedera=None, **kw) -> ConversionPipeline:
+    clients = {
+        "daraja": daraja or CountingDaraja(),
+        "cctp": cctp or FlakyCCTP(),
+        "hedera": hedera or HederaClient(),
+    }
+    poller = AttestationPoller(client=clients["cctp"], min_delay=0.01, max_delay=0.05)
+    return ConversionPipeline(clients=clients, poller=poller, **kw)
+
+
+async def _submit(pipeline: ConversionPipeline, user: str = "conv-user", amount=50.0) -> str:
+    return await pipeline.submit(
+        user, "m-pesa", "safaricom", amount, "USDC", "hedera", "fast", phone="+254700000001"
+    )
+
+
+async def _wait_for(pipeline: ConversionPipeline, tx_id: str, state: str) -> Conversion:
+    while (conv := await pipeline.get(tx_id)).state != state:
+        await asyncio.sleep(0.01)
+    return conv
+
+
+def _stk(ref: str, amount: float = 50.0, code: int = 0) -> dict:
+    cb = {"MerchantRequestID": "m", "CheckoutRequestID": ref, "ResultCode": code}
+    if code == 0:
+        items = [{"Name": "Amount", "Value": amount}, {"Name": "MpesaReceiptNumber", "Value": "R1"}]
+        cb["CallbackMetadata"] = {"Item": items}
+    else:
+        cb["ResultDesc"] = "Request cancelled by user"
+    return {"Body": {"stkCallback": cb}}
+
+
+async def _pay(pipeline: ConversionPipeline, tx_id: str, ok: bool = True) -> None:
+    """Deliver the payer's STK result, as the CallbackIngestor would."""
+    conv = await pipeline.get(tx_id)
+    amount = conv.amount if ok else None
+    desc = None if ok else "Request cancelled by user"
+    await pipeline.reconcile([DarajaCallback("stk", conv.checkout_id, ok, amount, desc=desc)])
+
+
+async def _wait(pipeline: ConversionPipeline, tx_id: str, timeout: float = 5.0) -> Conversion:
+    """Wait for `tx_id` to finish, confirming its STK push when it waits for the payer."""
+    deadline = time.monotonic() + timeout
+    while True:
+        conv = await pipeline.get(tx_id)
+        if conv.state in ("completed", "failed") or time.monotonic() > deadline:
+            return conv
+        if conv.state == AWAITING_PAYMENT:
+            await _pay(pipeline, tx_id)
+        await asyncio.sleep(0.01)
+
+
+def test_advance_runs_every_step_and_settles_once():
+    pipeline = _pipeline(wallet=WalletService())
+
+    async def run():
+        tx_id = await _submit(pipeline, user="conv-steps")
+        assert await pipeline.advance(tx_id) == AWAITING_PAYMENT  # the payer is prompted
+        assert await pipeline.advance(tx_id) == AWAITING_PAYMENT  # nothing to run meanwhile
+        await _pay(pipeline, tx_id)
+        assert await pipeline.advance(tx_id) == "burned"  # parked on the attestation
+        await pipeline._parked[tx_id]
+        assert await pipeline.advance(tx_id) == "completed"
+        assert await pipeline.advance(tx_id) == "completed"  # terminal: nothing reruns
+        await pipeline.stop()
+        return tx_id, await pipeline.get(tx_id)
+
+    tx_id, conv = _run(run)
+    steps = json.loads(conv.steps)
+    assert list(steps) == ["debit", "payment", "burn", "attestation", "bridge", "mint", "settle"]
+    assert steps["payment"]["amount"] == 50.0
+    assert steps["bridge"]["chain"] == "hedera"
+    assert conv.attempts == 0 and conv.last_error is None
+    assert get_ledger().balance("wallet:conv-steps", "USDC") == to_minor(50 * 0.0077, "USDC")
+    assert get_ledger().posted(tx_id)
+
+
+def test_settle_skips_already_posted_transactions():
+    wallet = WalletService()
+    tx_id = wallet.convert("conv-dupe", "m-pesa", None, 10.0, "USDC", None, "fast")
+    conv = Conversion(
+        tx_id=tx_id, user_id="conv-dupe", from_rail="m-pesa", from_operator=None,
+        amount=10.0, to_token="USDC", to_chain=None, mode="fast",
+    )
+    _pipeline(wallet=wallet)._settle(conv, {})
+    assert get_ledger().balance("wallet:conv-dupe", "USDC") == to_minor(10 * 0.0077, "USDC")
+
+
+def test_wallet_convert_rejects_non_positive_amount():
+    with pytest.raises(ValueError):
+        WalletService().convert("u", "m-pesa", None, 0, "USDC", None, "fast")
+    with pytest.raises(ValueError):
+        asyncio.run(DarajaClient().stk_push("+254700000001", 0))
+
+
+def test_failed_step_retries_and_resumes_from_last_completed_step():
+    daraja, cctp = CountingDaraja(), FlakyCCTP(failures=2)
+    pipeline = _pipeline(daraja, cctp, retry_base=0.01, max_attempts=5)
+
+    async def run():
+        await pipeline.start()
+        await pipeline.start()  # idempotent
+        try:
+            tx_id = await _submit(pipeline)
+            return await _wait(pipeline, tx_id)
+        finally:
+            await pipeline.stop()
+
+    conv = _run(run)
+    assert conv.state == "completed"
+    assert conv.attempts == 0 and conv.last_error is None
+    assert daraja.calls == 1  # retries restart at the failed step, not the debit
+
+
+def test_exhausted_retries_mark_conversion_failed():
+    pipeline = _pipeline(hedera=BrokenHedera(), retry_base=0.01, max_attempts=2)
+
+    async def run():
+        await pipeline.start()
+        try:
+            return await _wait(pipeline, await _submit(pipeline))
+        finally:
+            await pipeline.stop()
+
+    conv = _run(run)
+    assert conv.state == "failed"
+    assert conv.attempts == 2
+    assert conv.last_error == "mint: hedera unavailable"
+    assert "mint" not in json.loads(conv.steps)
+
+
+def test_stop_cancels_pending_retries():
+    pipeline = _pipeline(hedera=BrokenHedera(), retry_base=60)
+
+    async def run():
+        tx_id = await _submit(pipeline)
+        assert await pipeline.advance(tx_id) == AWAITING_PAYMENT
+        await _pay(pipeline, tx_id)
+        assert await pipeline.advance(tx_id) == "burned"
+        await pipeline._parked[tx_id]
+        assert await pipeline.advance(tx_id) == "bridged"
+        assert len(pipeline._timers) == 1
+        await pipeline.stop()
+        return await pipeline.get(tx_id)
+
+    conv = _run(run)
+    assert pipeline._timers == set()
+    assert conv.attempts == 1 and conv.last_error == "mint: hedera unavailable"
+
+
+def test_start_resumes_unfinished_conversions():
+    daraja = CountingDaraja()
+    pipeline = _pipeline(daraja)
+
+    async def run():
+        async with AsyncSessionLocal() as session:
+            session.add(
+                Conversion(
+                    tx_id="cv-resume-1", user_id="conv-resume", from_rail="m-pesa",
+                    from_operator="safaricom", amount=20.0, to_token="USDC", to_chain=None,
+                    mode="fast", state="burned", attempts=0,
+                    steps=json.dumps({"debit": {}, "burn": {"tx": "burn-ethereum-0.154"}}),
+                )
+            )
+            await session.commit()
+        await pipeline.start()
+        try:
+            return await _wait(pipeline, "cv-resume-1")
+        finally:
+            await pipeline.stop()
+
+    conv = _run(run)
+    assert conv.state == "completed"
+    assert daraja.calls == 0
+    assert json.loads(conv.steps)["attestation"]["attestation"] == "att-burn-ethereum-0.154"
+
+
+def test_per_integration_concurrency_limit():
+    cctp = FlakyCCTP(delay=0.05)
+    pipeline = _pipeline(
+        cctp=cctp, workers=8, retry_base=0.01, limits={"daraja": 8, "cctp": 2, "hedera": 8}
+    )
+
+    async def run():
+        await pipeline.start()
+        try:
+            ids = [await _submit(pipeline, user=f"conv-limit-{i}") for i in range(6)]
+            convs = [await _wait_for(pipeline, t, AWAITING_PAYMENT) for t in ids]
+            # Every payer approves at once, so the burns contend for the CCTP slots
+            await pipeline.reconcile(
+                [DarajaCallback("stk", c.checkout_id, True, c.amount) for c in convs]
+            )
+            return [await _wait(pipeline, tx_id) for tx_id in ids]
+        finally:
+            await pipeline.stop()
+
+    convs = _run(run)
+    assert {c.state for c in convs} == {"completed"}
+    assert cctp.peak == 2
+
+
+def test_worker_survives_crash_and_skips_duplicates():
+    daraja = CountingDaraja(delay=0.05)
+    pipeline = _pipeline(daraja, workers=2)
+
+    async def run():
+        await pipeline.start()
+        try:
+            pipeline._enqueue("cv-does-not-exist")
+            tx_id = await _submit(pipeline)
+            pipeline._enqueue(tx_id)  # second worker must not run it concurrently
+            return await _wait(pipeline, tx_id)
+        finally:
+            await pipeline.stop()
+
+    assert _run(run).state == "completed"
+    assert daraja.calls == 1
+
+
+def test_worker_retries_conversions_that_crash_outside_a_step():
+    pipeline = _pipeline(retry_base=0.01)
+    advance = pipeline._advance
+    crashes = [RuntimeError("database is locked")]
+
+    async def flaky_advance(tx_id):
+        if crashes:
+            raise crashes.pop()
+        return await advance(tx_id)
+
+    pipeline._advance = flaky_advance
+
+    async def run():
+        await pipeline.start()
+        try:
+            return await _wait(pipeline, await _submit(pipeline))
+        finally:
+            await pipeline.stop()
+
+    assert _run(run).state == "completed"
+    assert not pipeline._crashes
+
+
+def test_stop_ends_workers_that_swallow_cancellation():
+    pipeline = _pipeline(workers=1)
+    entered = asyncio.Event()
+
+    async def stubborn_advance(tx_id):
+        entered.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            pass  # what a DB driver cleaning up its connection can do
+        return await pipeline.get(tx_id)
+
+    pipeline._advance = stubborn_advance
+
+    async def run():
+        await pipeline.start()
+        await _submit(pipeline)
+        await entered.wait()
+        await asyncio.wait_for(pipeline.stop(), 1)
+
+    _run(run)
+    assert pipeline._tasks == []
+
+
+def test_completed_submissions_update_the_estimate():
+    pipeline = _pipeline()
+
+    async def run():
+        await pipeline.start()
+        try:
+            return await _wait(pipeline, await _submit(pipeline))
+        finally:
+            await pipeline.stop()
+
+    assert _run(run).state == "completed"
+    assert pipeline.avg_seconds < 15.0  # EWMA pulled towards the sub-second run
+
+
+def test_estimated_completion_tracks_queue_depth():
+    pipeline = _pipeline(workers=2)
+    assert pipeline.estimated_completion() == "~15s"
+
+    async def run():
+        pipeline._queue = asyncio.Queue()
+        for i in range(5):
+            pipeline._queue.put_nowait(f"cv-{i}")
+        return pipeline.estimated_completion()
+
+    assert _run(run) == "~45s"  # 5 queued / 2 workers -> 3 rounds of 15s
+
+
+def test_convert_route_returns_status_endpoint():
+    r = client.post("/api/convert", json=PAYLOAD)
+    assert r.status_code == 200
+    tx_id = r.json()["txId"]
+    assert r.json()["estimatedCompletion"].startswith("~")
+
+    status = client.get(f"/api/convert/{tx_id}")
+    assert status.status_code == 200
+    body = status.json()
+    assert body["txId"] == tx_id
+    assert body["status"] == "submitted" and body["state"] == "pending"
+    assert client.get("/api/convert/cv-unknown").status_code == 404
+
+
+def test_convert_route_completes_with_running_pipeline():
+    with TestClient(app) as c:
+        tx_id = c.post("/api/convert", json=PAYLOAD).json()["txId"]
+        deadline = time.monotonic() + 5
+        while (body := c.get(f"/api/convert/{tx_id}").json())["status"] == "submitted":
+            assert time.monotonic() < deadline
+            if body["state"] == AWAITING_PAYMENT:  # the payer approves: Daraja calls back
+                ref = body["steps"]["debit"]["CheckoutRequestID"]
+                c.post("/api/daraja/callbacks/stk", json=_stk(ref))
+            time.sleep(0.02)
+    assert body["status"] == "completed" and body["state"] == "completed"
+    assert body["steps"]["settle"]["tx_id"] == tx_id
+
+
+def test_debit_prompts_the_payer_phone():
+    daraja = CountingDaraja()
+    pipeline = _pipeline(daraja)
+    with get_session() as session:
+        user = User(phone="+254700000077", pin_hash="x")
+        session.add(user)
+        session.flush()
+        user_id = str(user.id)
+
+    async def run():
+        registered = await pipeline.submit(user_id, "m-pesa", None, 10, "USDC", None, "fast")
+        explicit = await _submit(pipeline, user=user_id)
+        for tx_id in (registered, explicit):
+            assert await pipeline.advance(tx_id) == AWAITING_PAYMENT
+        for user in ("conv-nobody", "999999"):  # no phone given, none registered
+            with pytest.raises(ValueError, match="payer phone"):
+                await pipeline.submit(user, "m-pesa", None, 10, "USDC", None, "fast")
+        await pipeline.stop()
+        return await pipeline.get(registered)
+
+    conv = _run(run)
+    assert daraja.phones == ["+254700000077", "+254700000001"]
+    assert conv.phone == "+254700000077"
+    assert conv.checkout_id.startswith("ws_CO_stub_0077")
+    assert json.loads(conv.steps)["debit"]["CheckoutRequestID"] == conv.checkout_id
+
+
+def test_instances_only_run_conversions_they_lease():
+    daraja = CountingDaraja(delay=0.15)
+    first, second = _pipeline(), _pipeline(daraja, lease_ttl=0.06, retry_base=0.01)
+
+    async def lapse(tx_id, seconds):
+        async with AsyncSessionLocal() as session:
+            conv = await session.get(Conversion, tx_id)
+            conv.lease_until = utcnow() + timedelta(seconds=seconds)
+            await session.commit()
+
+    async def run():
+        held = await _submit(first)
+        assert await second.advance(held) == "pending"  # leased by `first`: left alone
+        assert daraja.calls == 0 and not second._timers
+        await lapse(held, 0.05)  # `first` dies: its lease lapses after `second` starts
+        await second.start()
+        try:
+            conv = await _wait(second, held)
+            assert conv.owner == second.owner and daraja.calls == 1
+            own = await _submit(second)  # unfinished when `second` stops
+            deadline = (await second.get(own)).lease_until
+            await asyncio.sleep(0.05)
+            assert (await second.get(own)).lease_until > deadline  # renewed
+        finally:
+            await second.stop()
+        await first.stop()
+        return conv, await second.get(own)
+
+    conv, released = _run(run)
+    assert conv.state == "completed"
+    assert released.state != "completed" and released.owner is None  # handed over at stop
+
+
+def test_lease_loop_survives_database_errors(caplog):
+    pipeline = _pipeline(lease_ttl=0.03)
+    failures = [RuntimeError("database is locked")]
+    renew = pipeline._renew_leases
+
+    async def flaky_renew():
+        if failures:
+            raise failures.pop()
+        await renew()
+
+    pipeline._renew_leases = flaky_renew
+
+    async def run():
+        await pipeline.start()
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            await pipeline.stop()
+
+    _run(run)
+    assert not failures and "conversion lease renewal failed" in caplog.text
+
+
+def test_stop_ends_lease_loop_that_swallows_cancellation():
+    pipeline = _pipeline(lease_ttl=0.03)
+    entered = asyncio.Event()
+
+    async def stubborn_renew():
+        entered.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            pass
+
+    pipeline._renew_leases = stubborn_renew
+
+    async def run():
+        await pipeline.start()
+        await entered.wait()
+        await asyncio.wait_for(pipeline.stop(), 1)
+
+    _run(run)
+    assert pipeline._lease_task is None
+
+
+def test_declined_stk_push_fails_the_conversion_and_frees_its_hold():
+    pipeline = _pipeline()
+
+    async def run():
+        tx_id = await _submit(pipeline, amount=30)
+        assert await pipeline.advance(tx_id) == AWAITING_PAYMENT
+        await _pay(pipeline, tx_id, ok=False)
+        await _pay(pipeline, tx_id)  # a late or replayed result changes nothing
+        await pipeline.reconcile([DarajaCallback("c2b", "C1", True, 5.0)])  # not an STK result
+        await pipeline.stop()
+        return await pipeline.get(tx_id)
+
+    conv = _run(run)
+    assert conv.state == "failed"
+    assert conv.last_error == "payment: Request cancelled by user"
+    assert "payment" not in json.loads(conv.steps)
+
+
+def test_stored_stk_results_and_timeouts_are_collected():
+    pipeline = _pipeline(payment_timeout=60)
+
+    async def run():
+        paid, unanswered = await _submit(pipeline), await _submit(pipeline)
+        for tx_id in (paid, unanswered):
+            assert await pipeline.advance(tx_id) == AWAITING_PAYMENT
+        # Stored, but its observer call was lost (e.g. it raced the wait's commit)
+        ref = (await pipeline.get(paid)).checkout_id
+        async with AsyncSessionLocal() as session:
+            session.add(DarajaCallbackRecord(kind="stk", ref=ref, body=json.dumps(_stk(ref))))
+            await session.commit()
+        await pipeline._collect_payments()
+        assert (await pipeline.get(paid)).state == "debited"
+        assert (await pipeline.get(unanswered)).state == AWAITING_PAYMENT
+
+        pipeline.payment_timeout = 0
+        await pipeline._collect_payments()
+        await pipeline._collect_payments()  # nothing left waiting
+        await pipeline.stop()
+        return await pipeline.get(unanswered)
+
+    conv = _run(run)
+    assert conv.state == "failed" and conv.last_error == "payment: no STK result after 0s"
+
+
+def test_fractional_shillings_are_rejected_before_prompting():
+    daraja = CountingDaraja()
+    pipeline = _pipeline(daraja)
+
+    async def run():
+        with pytest.raises(ValueError, match="whole shillings"):
+            await _submit(pipeline, amount=50.5)
+        with pytest.raises(ValueError, match="whole shillings"):
+            await DarajaClient().stk_push("+254700000001", 50.5)
+        await pipeline.stop()
+
+    _run(run)
+    assert daraja.calls == 0
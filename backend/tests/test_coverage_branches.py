@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi.testclient import TestClient
 import pytest
 
@@ -28,9 +30,9 @@ def test_db_rollback_branch():
 def test_forecast_service_invalid_inputs():
     f = ForecastService()
     with pytest.raises(ValueError):
-        f.predict("", "4h")  # operator required
+        asyncio.run(f.predict("", "4h"))  # operator required
     with pytest.raises(ValueError):
-        f.predict("safaricom", "0h")  # invalid window
+        asyncio.run(f.predict("safaricom", "0h"))  # invalid window
 
 
 def test_routes_error_paths():
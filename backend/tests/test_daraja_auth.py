@@ -0,0 +1,230 @@
+import asyncio
+import base64
+import json
+import time
+
+import httpx
+import pytest
+from conftest import FakeClock, FakeHandler, FakeServer
+
+from app.core.cache import AsyncCache
+from app.integrations.daraja_auth import DarajaTokenManager
+from app.integrations.daraja_live import DarajaClient
+from app.integrations.http_pool import ResilientClient
+
+KEY, SECRET = "consumer-key", "consumer-secret"
+
+
+class FakeDaraja(FakeServer):
+    """Local Daraja stand-in: OAuth token endpoint plus STK push."""
+
+    def __init__(self):
+        super().__init__(_Handler)
+        self.expires_in = 3599
+        self.token_fetches = 0
+        self.valid_tokens: set[str] = set()
+        self.pushes: list[dict] = []
+
+
+class _Handler(FakeHandler):
+    server: FakeDaraja
+
+    def do_GET(self):
+        basic = base64.b64encode(f"{KEY}:{SECRET}".encode()).decode()
+        if self.headers.get("Authorization") != f"Basic {basic}":
+            return self._reply(401, {"errorMessage": "Invalid Authentication passed"})
+        time.sleep(0.05)  # slow enough for concurrent callers to overlap
+        with self.server.lock:
+            self.server.token_fetches += 1
+            token = f"token-{self.server.token_fetches}"
+            self.server.valid_tokens.add(token)
+        self._reply(200, {"access_token": token, "expires_in": str(self.server.expires_in)})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        if token not in self.server.valid_tokens:
+            return self._reply(401, {"errorMessage": "Invalid Access Token"})
+        with self.server.lock:
+            self.server.pushes.append(body)
+            n = len(self.server.pushes)
+        if self.path.startswith("/mpesa/b2c/"):
+            return self._reply(200, {"ConversationID": f"AG_{n}", "ResponseCode": "0"})
+        self._reply(200, {"CheckoutRequestID": f"ws_CO_{n}", "ResponseCode": "0"})
+
+
+@pytest.fixture
+def daraja(serve):
+    return serve(FakeDaraja())
+
+
+def _tokens(server, cache=None, secret=SECRET, **kw) -> DarajaTokenManager:
+    http = ResilientClient("daraja-test", server.url, retry_backoff=0.001)
+    return DarajaTokenManager(http, KEY, secret, cache=cache or AsyncCache(), **kw)
+
+
+def test_burst_of_debits_shares_one_token(daraja):
+    client = DarajaClient(base_url=daraja.url, tokens=_tokens(daraja))
+
+    async def run():
+        burst = [client.stk_push(f"+2547000000{i:02d}", 99) for i in range(30)]
+        first = await asyncio.gather(*burst)
+        second = await asyncio.gather(*(client.stk_push("+254700000001", 10) for _ in range(30)))
+        return first + second
+
+    results = asyncio.run(run())
+    assert len({r["CheckoutRequestID"] for r in results}) == 60
+    assert daraja.token_fetches == 1  # every debit after the first fetch reused the token
+    push = daraja.pushes[0]
+    assert push["Amount"] == 99 and push["PartyA"].startswith("2547")
+    assert base64.b64decode(push["Password"]).decode().endswith(push["Timestamp"])
+
+
+def test_token_is_refreshed_in_the_background_before_expiry(daraja):
+    clock = FakeClock(1_700_000_000.0)
+    tokens = _tokens(daraja, clock=clock, refresh_margin=300)
+
+    async def run():
+        assert await tokens.token() == "token-1"
+        clock.now += 3599 - 200  # inside the refresh margin, still valid
+        assert await tokens.token() == "token-1"  # served without waiting
+        assert daraja.token_fetches == 1
+        refresh = tokens._refresh
+        assert await tokens.token() == "token-1" and tokens._refresh is refresh  # one flight
+        await refresh
+        return await tokens.token()
+
+    assert asyncio.run(run()) == "token-2"
+    assert daraja.token_fetches == 2
+
+
+def test_expired_token_waits_for_a_single_refresh(daraja):
+    clock = FakeClock(1_700_000_000.0)
+    tokens = _tokens(daraja, clock=clock)
+
+    async def run():
+        await tokens.token()
+        clock.now += 3600
+        return await asyncio.gather(*(tokens.token() for _ in range(20)))
+
+    assert set(asyncio.run(run())) == {"token-2"}
+    assert daraja.token_fetches == 2
+
+
+def test_workers_share_tokens_through_the_cache(daraja):
+    cache = AsyncCache()
+    worker_a, worker_b = _tokens(daraja, cache=cache), _tokens(daraja, cache=cache)
+
+    async def run():
+        return await worker_a.token(), await worker_b.token()
+
+    assert asyncio.run(run()) == ("token-1", "token-1")
+    assert daraja.token_fetches == 1
+    assert KEY not in worker_a.cache_key and SECRET not in worker_a.cache_key
+
+
+def test_waiting_worker_uses_the_lock_holders_token(daraja):
+    cache = AsyncCache()
+    waiter = _tokens(daraja, cache=cache, poll_interval=0.01)
+
+    async def run():
+        await cache.add(f"{waiter.cache_key}:lock", "1", ex=30)  # another worker refreshing
+        pending = asyncio.create_task(waiter.token())
+        await asyncio.sleep(0.05)
+        assert not pending.done()
+        expires_at = time.time() + 3599
+        await cache.set(
+            waiter.cache_key, json.dumps({"token": "theirs", "expires_at": expires_at})
+        )
+        return await pending
+
+    assert asyncio.run(run()) == "theirs"
+    assert daraja.token_fetches == 0
+
+
+def test_stale_lock_falls_back_to_fetching(daraja):
+    cache = AsyncCache()
+    waiter = _tokens(daraja, cache=cache, poll_interval=0.01, wait_timeout=0.05)
+
+    async def run():
+        await cache.add(f"{waiter.cache_key}:lock", "1", ex=30)  # holder crashed
+        return await waiter.token()
+
+    assert asyncio.run(run()) == "token-1"
+    assert daraja.token_fetches == 1
+
+
+def test_failed_refreshes_surface_and_release_the_lock(daraja):
+    clock = FakeClock(1_700_000_000.0)
+    bad = _tokens(daraja, secret="wrong", clock=clock)
+
+    async def run():
+        with pytest.raises(httpx.HTTPStatusError):
+            await bad.token()
+        assert await bad.cache.get(f"{bad.cache_key}:lock") is None
+        assert bad._refresh is None
+
+        # A failed background refresh keeps serving the still-valid token
+        good = _tokens(daraja, clock=clock, refresh_margin=300)
+        assert await good.token() == "token-1"
+        good.auth = (KEY, "rotated-away")
+        clock.now += 3400
+        assert await good.token() == "token-1"
+        await asyncio.gather(good._refresh, return_exceptions=True)
+        return good._token
+
+    assert asyncio.run(run()) == "token-1"
+
+
+def test_slow_refresh_leaves_a_lock_taken_after_its_own_expired(daraja):
+    tokens = _tokens(daraja)
+    lock_key = f"{tokens.cache_key}:lock"
+    fetch = tokens._fetch
+
+    async def slow_fetch():
+        await tokens.cache.delete(lock_key)  # our lock expired mid-fetch...
+        await tokens.cache.add(lock_key, "other-worker", ex=30)  # ...and was re-taken
+        return await fetch()
+
+    async def run():
+        tokens._fetch = slow_fetch  # type: ignore[method-assign]
+        assert await tokens.token() == "token-1"
+        return await tokens.cache.get(lock_key)
+
+    assert asyncio.run(run()) == "other-worker"
+
+
+def test_rejected_token_is_replaced_not_reused_from_cache(daraja):
+    client = DarajaClient(base_url=daraja.url, tokens=_tokens(daraja))
+
+    async def run():
+        await client.stk_push("+254700000001", 10)
+        daraja.valid_tokens.clear()  # Daraja revoked it early
+        return await client.stk_push("+254700000001", 10)
+
+    assert asyncio.run(run())["ResponseCode"] == "0"
+    assert daraja.token_fetches == 2
+    with pytest.raises(ValueError):
+        asyncio.run(client.stk_push("+254700000001", 0))
+    with pytest.raises(ValueError, match="whole shillings"):
+        asyncio.run(client.stk_push("+254700000001", 99.5))  # never rounded up
+
+
+def test_b2c_payment_pays_whole_shillings_to_the_msisdn(daraja):
+    client = DarajaClient(base_url=daraja.url, tokens=_tokens(daraja))
+
+    async def run():
+        tagged = await client.b2c_payment("+254711000001", 250, "payroll", "bd-1-7")
+        untagged = await client.b2c_payment("254711000002", 100)
+        return tagged, untagged
+
+    tagged, _ = asyncio.run(run())
+    assert tagged["ConversationID"] == "AG_1"
+    first, second = daraja.pushes
+    assert (first["PartyB"], first["Amount"], first["CommandID"]) == (
+        "254711000001", 250, "BusinessPayment",
+    )
+    assert first["OriginatorConversationID"] == "bd-1-7" and first["Occasion"] == "payroll"
+    assert second["OriginatorConversationID"] and second["Remarks"] == "JuaPesa payout"
+    with pytest.raises(ValueError):
+        asyncio.run(client.b2c_payment("254711000001", 0))
@@ -0,0 +1,423 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+from app.api import routes
+from app.core.cache import AsyncCache
+from app.core.db import AsyncSessionLocal, SessionLocal, async_engine
+from app.main import app
+from app.models.db_models import DarajaCallbackRecord, DisbursementJob, LedgerEntry
+from app.services.daraja_callbacks import (
+    CallbackBusy,
+    CallbackIngestor,
+    get_callback_ingestor,
+    parse_callback,
+    sign,
+)
+from app.services.disbursement import get_disbursement_service
+from app.services.ledger import LedgerEngine, get_ledger
+from app.services.wallet import LOCAL_ASSET
+from app.utils.money import to_minor
+
+client = TestClient(app)
+
+
+def stk(ref: str, amount: float = 100.0, code: int = 0) -> dict:
+    items = [
+        {"Name": "Amount", "Value": amount},
+        {"Name": "MpesaReceiptNumber", "Value": f"R{ref}"},
+        {"Name": "PhoneNumber", "Value": 254700000001},
+    ]
+    cb = {"MerchantRequestID": "m", "CheckoutRequestID": ref, "ResultCode": code}
+    if code == 0:
+        cb["CallbackMetadata"] = {"Item": items}
+    return {"Body": {"stkCallback": cb}}
+
+
+def c2b(ref: str, amount: float = 50.0) -> dict:
+    return {"TransID": ref, "TransAmount": str(amount), "MSISDN": "254700000002"}
+
+
+def b2c(ref: str, amount: float = 25.0) -> dict:
+    params = [{"Key": "TransactionAmount", "Value": amount}, {"Key": "ReceiverPartyPublicName"}]
+    return {
+        "Result": {
+            "ResultCode": 0, "ConversationID": ref, "TransactionID": f"T{ref}",
+            "OriginatorConversationID": f"bd-1-{ref}",
+            "ResultParameters": {"ResultParameter": params},
+        }
+    }
+
+
+class CountingLedger(LedgerEngine):
+    """Real ledger that counts batches and can be slowed down or failed."""
+
+    def __init__(self, delay: float = 0.0, failures: int = 0):
+        super().__init__(session_factory=self._session)
+        self.delay = delay
+        self.failures = failures
+        self.batches: list[int] = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def _session(self):
+        # Held up before the booking transaction opens, not while it holds SQLite's locks
+        self.gate.wait()
+        time.sleep(self.delay)
+        return SessionLocal()
+
+    def post_in(self, session, txs):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        super().post_in(session, txs)
+
+    def committed(self, txs):
+        super().committed(txs)
+        self.batches.append(len(txs))  # committed batches only: SQLite may refuse a write
+
+
+def _run(main):
+    async def scenario():
+        try:
+            return await main()
+        finally:
+            # The in-memory DB's single aiosqlite connection binds to the loop using it
+            await async_engine.dispose()
+
+    return asyncio.run(scenario())
+
+
+def _ref() -> str:
+    return f"ws_CO_{uuid.uuid4().hex[:12]}"
+
+
+def test_stk_callback_is_booked_once():
+    ref = _ref()
+    before = get_ledger().balance("clearing:m-pesa", LOCAL_ASSET)
+    first = client.post("/api/daraja/callbacks/stk", json=stk(ref))
+    assert first.status_code == 200
+    assert first.json() == {"ResultCode": 0, "ResultDesc": "Accepted"}
+    again = client.post("/api/daraja/callbacks/stk", json=stk(ref))
+    assert again.json()["ResultDesc"] == "Duplicate"
+    after = get_ledger().balance("clearing:m-pesa", LOCAL_ASSET)
+    assert after - before == to_minor(100.0, LOCAL_ASSET)
+    assert get_ledger().posted(f"mpesa-R{ref}")
+
+
+def test_malformed_and_unknown_callbacks_are_rejected():
+    assert client.post("/api/daraja/callbacks/stk", content=b"{not json").status_code == 400
+    assert client.post("/api/daraja/callbacks/c2b", json={"TransID": "x"}).status_code == 400
+    assert client.post("/api/daraja/callbacks/nope", json={}).status_code == 422
+    with pytest.raises(ValueError, match="unknown callback kind"):
+        parse_callback("mystery", {})
+
+
+def test_parses_every_callback_kind():
+    assert parse_callback("c2b", c2b("C1")).amount == 50.0
+    payout = parse_callback("b2c", b2c("AG_1"))
+    assert (payout.ref, payout.receipt, payout.amount) == ("AG_1", "TAG_1", 25.0)
+    assert payout.originator == "bd-1-AG_1"
+    assert payout.ledger_tx().postings[0].account == "pool:safaricom"
+    assert payout.ledger_tx("airtel").postings[0].account == "pool:airtel"
+    failed = parse_callback("stk", stk("ws_CO_fail", code=1032))
+    assert not failed.ok and failed.amount is None
+    cancelled = b2c("AG_2")
+    cancelled["Result"]["ResultCode"] = 2001
+    assert not parse_callback("b2c", cancelled).ok
+
+
+def test_signatures_are_checked(monkeypatch):
+    ingestor = CallbackIngestor(cache=AsyncCache(), secret="s3cret")
+    monkeypatch.setattr(routes, "get_callback_ingestor", lambda: ingestor)
+    body = json.dumps(c2b(_ref())).encode()
+    url, headers = "/api/daraja/callbacks/c2b", {"Content-Type": "application/json"}
+
+    assert client.post(url, content=body, headers=headers).status_code == 401
+    bad = {**headers, "X-Callback-Signature": "0" * 64}
+    assert client.post(url, content=body, headers=bad).status_code == 401
+    good = {**headers, "X-Callback-Signature": sign("s3cret", body)}
+    assert client.post(url, content=body, headers=good).status_code == 200
+
+
+def test_burst_is_batched_and_queue_stays_bounded():
+    ledger = CountingLedger(delay=0.005)
+    ingestor = CallbackIngestor(
+        ledger=ledger, cache=AsyncCache(), queue_size=50, batch_size=200, write_attempts=5,
+        enqueue_timeout=30,  # SQLite serialises the stores and the ledger writes
+    )
+    refs = [_ref() for _ in range(1000)]
+
+    async def run():
+        await ingestor.start()
+        await ingestor.start()  # idempotent
+        bodies = [json.dumps(stk(ref, amount=1.0)).encode() for ref in refs]
+        outcomes = await asyncio.gather(*(ingestor.ingest("stk", b, None) for b in bodies))
+        dupes = await asyncio.gather(*(ingestor.ingest("stk", b, None) for b in bodies[:10]))
+        await ingestor.stop()
+        return outcomes, dupes
+
+    outcomes, dupes = _run(run)
+    assert set(outcomes) == {"accepted"} and set(dupes) == {"duplicate"}
+    assert sum(ledger.batches) == 1000
+    assert len(ledger.batches) < 100  # a few large writes, not one per callback
+    assert ingestor.max_depth <= 50
+    assert all(ledger.posted(f"mpesa-R{ref}") for ref in refs[::100])
+
+
+def test_full_queue_sheds_load_and_forgets_the_reference(monkeypatch):
+    ledger = CountingLedger()
+    ledger.gate.clear()  # writer stuck on the first batch
+    ingestor = CallbackIngestor(
+        ledger=ledger, cache=AsyncCache(), queue_size=1, enqueue_timeout=0.02
+    )
+    monkeypatch.setattr(routes, "get_callback_ingestor", lambda: ingestor)
+    bodies = [json.dumps(c2b(_ref())).encode() for _ in range(3)]
+
+    async def run():
+        await ingestor.start()
+        await ingestor.ingest("c2b", bodies[0], None)  # taken by the writer
+        await asyncio.sleep(0.01)
+        await ingestor.ingest("c2b", bodies[1], None)  # fills the queue
+        with pytest.raises(CallbackBusy):
+            await ingestor.ingest("c2b", bodies[2], None)
+        ledger.gate.set()
+        retried = await ingestor.ingest("c2b", bodies[2], None)  # redelivery is not a dupe
+        await ingestor.stop()
+        return retried
+
+    assert _run(run) == "accepted"
+    assert sum(ledger.batches) == 3
+
+
+def test_route_returns_503_when_busy(monkeypatch):
+    class Busy(CallbackIngestor):
+        async def ingest(self, kind, body, signature):
+            raise CallbackBusy("callback queue is full")
+
+    monkeypatch.setattr(routes, "get_callback_ingestor", lambda: Busy(cache=AsyncCache()))
+    r = client.post("/api/daraja/callbacks/stk", json=stk(_ref()))
+    assert r.status_code == 503 and r.headers["Retry-After"] == "1"
+
+
+def test_ledger_write_failures_are_retried_then_logged():
+    flaky = CountingLedger(failures=1)
+    broken = CountingLedger(failures=10)
+    ref = _ref()
+
+    async def run():
+        await CallbackIngestor(ledger=flaky, cache=AsyncCache()).ingest(
+            "c2b", json.dumps(c2b(ref)).encode(), None
+        )
+        await CallbackIngestor(ledger=broken, cache=AsyncCache(), write_attempts=2).ingest(
+            "c2b", json.dumps(c2b(_ref())).encode(), None
+        )
+        # Failed results are acknowledged without touching the ledger
+        await CallbackIngestor(ledger=broken, cache=AsyncCache()).ingest(
+            "stk", json.dumps(stk(_ref(), code=1)).encode(), None
+        )
+
+    _run(run)
+    assert flaky.batches == [1] and flaky.posted(f"mpesa-{ref}")
+    assert broken.batches == [] and broken.failures == 8
+
+
+def test_stop_gives_up_on_a_stuck_writer():
+    ledger = CountingLedger()
+    ledger.gate.clear()
+    ingestor = CallbackIngestor(ledger=ledger, cache=AsyncCache())
+
+    async def run():
+        await ingestor.stop()  # not started: nothing to do
+        await ingestor.start()
+        await ingestor.ingest("c2b", json.dumps(c2b(_ref())).encode(), None)
+        await ingestor.stop(timeout=0.02)
+        ledger.gate.set()
+
+    _run(run)
+    assert ingestor.queue_depth() == 0
+
+
+def test_callbacks_flow_through_the_running_app():
+    ref = _ref()
+    with TestClient(app) as c:
+        assert get_callback_ingestor().queue_depth() == 0
+        assert get_disbursement_service().reconcile in get_callback_ingestor().observers
+        assert c.post("/api/daraja/callbacks/c2b", json=c2b(ref)).status_code == 200
+    # shutdown flushed the queue
+    assert get_ledger().posted(f"mpesa-{ref}")
+
+
+def test_unsigned_callbacks_are_refused_outside_development(monkeypatch):
+    ingestor = CallbackIngestor(cache=AsyncCache(), secret="")
+    ingestor.env = "production"
+    monkeypatch.setattr(routes, "get_callback_ingestor", lambda: ingestor)
+    assert client.post("/api/daraja/callbacks/c2b", json=c2b(_ref())).status_code == 401
+    with pytest.raises(RuntimeError, match="DARAJA_CALLBACK_SECRET"):
+        asyncio.run(ingestor.start())
+
+
+async def _record(ref: str) -> DarajaCallbackRecord:
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(
+            select(DarajaCallbackRecord).where(DarajaCallbackRecord.ref == ref)
+        )
+
+
+def test_acknowledged_callbacks_survive_a_failed_write():
+    broken, healthy = CountingLedger(failures=10), CountingLedger()
+    lost, raced = _ref(), _ref()
+
+    async def run():
+        failing = CallbackIngestor(ledger=broken, cache=AsyncCache(), write_attempts=1)
+        assert await failing.ingest("c2b", json.dumps(c2b(lost)).encode(), None) == "accepted"
+        assert (await _record(lost)).booked_at is None  # stored, though not booked
+        # The cache forgot the reference: the stored copy still catches the redelivery
+        again = CallbackIngestor(ledger=healthy, cache=AsyncCache(), replay_after=0)
+        assert await again.ingest("c2b", json.dumps(c2b(lost)).encode(), None) == "duplicate"
+
+        # Handed to two writers at once (a replay racing the queue): one claims it
+        await failing.ingest("c2b", json.dumps(c2b(raced)).encode(), None)
+        item = [((await _record(raced)).id, parse_callback("c2b", c2b(raced)))]
+        await asyncio.gather(again._flush(item), again._flush(item))
+
+        held = CallbackIngestor(ledger=healthy, cache=again.cache, replay_after=0)
+        await again.cache.add("daraja:cb:replay", "other-instance")
+        assert await held.replay() == 0  # another instance is replaying
+        await again.cache.delete("daraja:cb:replay")
+        replayed = await again.replay()
+        return replayed, await again.replay(), await _record(lost), await _record(raced)
+
+    replayed, second, lost_row, raced_row = _run(run)
+    assert replayed >= 1 and second == 0
+    assert lost_row.booked_at is not None and raced_row.booked_at is not None
+    assert healthy.posted(f"mpesa-{lost}")
+    with SessionLocal() as session:  # each booked exactly once: two postings per tx
+        tx_ids = [f"mpesa-{lost}", f"mpesa-{raced}"]
+        entries = session.scalar(select(func.count()).where(LedgerEntry.tx_id.in_(tx_ids)))
+    assert entries == 4
+    assert broken.batches == []
+
+
+def test_unstored_callbacks_are_refused_and_forgotten():
+    def down():
+        raise ConnectionError("db down")
+
+    ingestor = CallbackIngestor(cache=AsyncCache(), write_attempts=2, session_factory=down)
+    body = json.dumps(c2b(_ref())).encode()
+
+    async def run():
+        with pytest.raises(CallbackBusy, match="could not be stored"):
+            await ingestor.ingest("c2b", body, None)
+        ingestor.session_factory = AsyncSessionLocal
+        return await ingestor.ingest("c2b", body, None)  # the redelivery is not a dupe
+
+    assert _run(run) == "accepted"
+
+
+def test_replay_and_booking_errors_are_logged(caplog):
+    calls = []
+
+    def sessions():
+        calls.append(1)
+        if len(calls) > 1:  # the database goes away after the callback is stored
+            raise ConnectionError("db down")
+        return AsyncSessionLocal()
+
+    inline = CallbackIngestor(cache=AsyncCache(), session_factory=sessions)
+    looping = CallbackIngestor(cache=AsyncCache(), replay_after=0.01)
+    failures = [ConnectionError("db down")]
+    replay = looping.replay
+
+    async def flaky_replay():
+        if failures:
+            raise failures.pop()
+        return await replay()
+
+    looping.replay = flaky_replay
+
+    payout = b2c(_ref())
+    payout["Result"]["OriginatorConversationID"] = "bd-gone-1"  # its job cannot be read
+
+    async def run():
+        assert await inline.ingest("b2c", json.dumps(payout).encode(), None) == "accepted"
+        await looping.start()
+        await asyncio.sleep(0.03)
+        await looping.stop()
+
+    _run(run)
+    assert "failed to book Daraja callbacks" in caplog.text
+    assert "Daraja callback replay failed" in caplog.text and not failures
+
+
+def test_stop_ends_replay_loop_that_swallows_cancellation():
+    ingestor = CallbackIngestor(cache=AsyncCache(), replay_after=0.01)
+    entered = asyncio.Event()
+
+    async def stubborn_replay():
+        entered.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            pass
+        return 0
+
+    ingestor.replay = stubborn_replay
+
+    async def run():
+        await ingestor.start()
+        await entered.wait()
+        await asyncio.wait_for(ingestor.stop(), 1)
+
+    _run(run)
+    assert ingestor.queue_depth() == 0
+
+
+def test_booked_batches_reach_the_observers():
+    seen = []
+
+    async def observe(callbacks):
+        seen.extend(cb.ref for cb in callbacks)
+
+    async def broken(callbacks):
+        raise RuntimeError("disbursements unavailable")
+
+    ingestor, failing = CallbackIngestor(cache=AsyncCache()), CallbackIngestor(cache=AsyncCache())
+    ingestor.observers.append(observe)
+    failing.observers.append(broken)
+    ref, lost = _ref(), _ref()
+
+    async def run():
+        await ingestor.ingest("b2c", json.dumps(b2c(ref)).encode(), None)
+        await failing.ingest("b2c", json.dumps(b2c(lost)).encode(), None)
+        return await _record(ref), await _record(lost)
+
+    booked, unbooked = _run(run)
+    assert seen == [ref] and booked.booked_at is not None
+    assert unbooked.booked_at is None  # left for the replay to hand over again
+
+
+def test_payouts_leave_their_jobs_pool():
+    job_id = f"bd-{uuid.uuid4().hex[:12]}"
+    with SessionLocal() as session:
+        session.add(DisbursementJob(id=job_id, status="running", pool="airtel"))
+        session.commit()
+    own, stray = b2c(_ref()), b2c(_ref())
+    own["Result"]["OriginatorConversationID"] = f"{job_id}-1"
+    ledger = get_ledger()
+    before = [ledger.balance(f"pool:{p}", LOCAL_ASSET) for p in ("airtel", "safaricom")]
+
+    async def run():
+        ingestor = CallbackIngestor(cache=AsyncCache())
+        for body in (own, stray):  # stray: not from a bulk job, so the default pool
+            await ingestor.ingest("b2c", json.dumps(body).encode(), None)
+
+    _run(run)
+    after = [ledger.balance(f"pool:{p}", LOCAL_ASSET) for p in ("airtel", "safaricom")]
+    assert [b - a for a, b in zip(before, after)] == [-to_minor(25.0, LOCAL_ASSET)] * 2
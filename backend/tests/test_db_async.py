@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+
+from app.core import db as db_module
+from app.core.db import (
+    AsyncSessionLocal,
+    _engine_kwargs,
+    _make_engines,
+    async_url,
+    get_async_session,
+    get_session,
+    sync_url,
+)
+from app.models.db_models import User
+
+
+def test_url_mapping():
+    assert async_url("postgresql+psycopg2://u:p@db/app").drivername == "postgresql+asyncpg"
+    assert async_url("sqlite+pysqlite:///./app.db").drivername == "sqlite+aiosqlite"
+    assert sync_url("sqlite+pysqlite:///./app.db").database == "./app.db"
+    mem = sync_url("sqlite+pysqlite:///:memory:")
+    assert mem.query["mode"] == "memory" and mem.query["cache"] == "shared"
+    assert async_url("mysql+pymysql://u@h/d").drivername == "mysql+pymysql"
+
+
+def test_pool_tuning_kwargs():
+    kw = _engine_kwargs(make_url("postgresql+asyncpg://u:p@db/app"), True)
+    assert kw["pool_pre_ping"] is True
+    assert kw["pool_size"] == 10 and kw["max_overflow"] == 20 and kw["pool_recycle"] == 1800
+    assert _engine_kwargs(make_url("sqlite:///./file.db"), False) == {}
+
+
+def test_file_sqlite_engines(tmp_path):
+    sync_engine, async_engine = _make_engines(f"sqlite+pysqlite:///{tmp_path / 'x.db'}")
+    assert async_engine.url.drivername == "sqlite+aiosqlite"
+    sync_engine.dispose()
+    asyncio.run(async_engine.dispose())
+
+
+def test_async_session_sees_sync_writes_and_rolls_back():
+    with get_session() as s:
+        s.add(User(phone="+254799000001", pin_hash="x", kyc_level=0))
+
+    async def scenario():
+        gen = get_async_session()
+        session = await gen.__anext__()
+        phones = (await session.execute(select(User.phone))).scalars().all()
+        assert "+254799000001" in phones
+        session.add(User(phone="+254799000002", pin_hash="x", kyc_level=0))
+        with pytest.raises(StopAsyncIteration):
+            await gen.__anext__()  # commits
+
+        gen = get_async_session()
+        session = await gen.__anext__()
+        session.add(User(phone="+254799000003", pin_hash="x", kyc_level=0))
+        with pytest.raises(RuntimeError):
+            await gen.athrow(RuntimeError("handler failed"))
+
+        async with AsyncSessionLocal() as check:
+            phones = set((await check.execute(select(User.phone))).scalars().all())
+        assert "+254799000002" in phones and "+254799000003" not in phones
+
+    asyncio.run(scenario())
+    asyncio.run(db_module.check_database())
@@ -0,0 +1,442 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, select, update
+
+from app.core.db import async_engine, get_session
+from app.integrations.daraja import DarajaClient
+from app.main import app
+from app.models.db_models import DisbursementJob, DisbursementRow, utcnow
+from app.services.daraja_callbacks import DarajaCallback, parse_callback
+from app.services.disbursement import (
+    DisbursementService,
+    TokenBucket,
+    iter_lines,
+    payout_row,
+    validate_rows,
+)
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def _no_leftover_jobs():
+    # start() resumes every queued or running job in the DB, including other tests'
+    with get_session() as session:
+        session.execute(delete(DisbursementRow))
+        session.execute(delete(DisbursementJob))
+
+
+def _run(main):
+    async def scenario():
+        try:
+            return await main()
+        finally:
+            # The in-memory DB's single aiosqlite connection binds to the loop using it
+            await async_engine.dispose()
+
+    return asyncio.run(scenario())
+
+
+class RecordingDaraja(DarajaClient):
+    """Stub B2C that records payouts, tracks concurrency and can fail or stall."""
+
+    def __init__(self, fail_phones: tuple[str, ...] = (), delay: float = 0.0):
+        super().__init__()
+        self.fail_phones = fail_phones
+        self.delay = delay
+        self.payouts: list[tuple[str, float, str]] = []
+        self.active = 0
+        self.peak = 0
+
+    async def b2c_payment(self, phone, amount, reference="", originator_id=None):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if phone in self.fail_phones:
+                raise RuntimeError("The initiator information is invalid.")
+            self.payouts.append((phone, amount, originator_id))
+            return await super().b2c_payment(phone, amount, reference, originator_id)
+        finally:
+            self.active -= 1
+
+
+async def chunked(data: bytes, size: int):
+    # Chunk boundaries land mid-line (and mid-character for non-ASCII references)
+    for i in range(0, len(data), size):
+        yield data[i : i + size]
+
+
+async def finished(svc: DisbursementService) -> None:
+    await asyncio.gather(*list(svc._tasks.values()))
+
+
+def _csv(n: int) -> bytes:
+    lines = ["Phone,Amount,Reference"]
+    lines += [f"07{i:08d},{100 + i},payroll-é-{i}" for i in range(n)]
+    return ("﻿" + "\r\n".join(lines) + "\r\n").encode()
+
+
+def test_csv_batch_is_streamed_validated_and_paid_out():
+    payouts = RecordingDaraja(fail_phones=("254700000003",))
+    svc = DisbursementService(
+        client=payouts, rate=1000, burst=50, concurrency=4, chunk_size=50, page_size=40
+    )
+    bad = b"not-a-phone,100,x\n0712345678,10.5,x\n0712345678,5,x\n0712345678,abc,x\n"
+
+    async def run():
+        await svc.start()
+        await svc.start()  # idempotent
+        accepted = await svc.submit(chunked(_csv(230) + bad, 37), "csv")
+        await finished(svc)
+        status = await svc.get(accepted["jobId"])
+        invalid, _ = await svc.rows(accepted["jobId"], status="invalid")
+        failed, _ = await svc.rows(accepted["jobId"], status="failed")
+        await svc.stop()
+        return accepted, status, invalid, failed
+
+    accepted, status, invalid, failed = _run(run)
+    assert accepted["status"] == "queued" and accepted["total"] == 234
+    assert status["status"] == "completed"
+    assert (status["sent"], status["failed"], status["invalid"], status["pending"]) == (
+        229, 1, 4, 0,
+    )
+    assert [r["error"] for r in invalid] == [
+        "invalid phone number",
+        "amount must be whole shillings",
+        "amount must be between 10 and 250000",
+        "invalid amount",
+    ]
+    assert [r["row"] for r in invalid] == [231, 232, 233, 234]
+    assert failed[0]["phone"] == "254700000003" and "initiator" in failed[0]["error"]
+    assert payouts.peak <= 4
+    assert len({p[2] for p in payouts.payouts}) == 229  # one originator id per row
+    assert ("254700000000", 100.0, f"{accepted['jobId']}-1") in payouts.payouts
+
+
+def test_ndjson_upload_and_progress_endpoints():
+    body = b'{"phone": "+254711000001", "amount": 50}\n{"phone": "0711000002", "amount": 60}\n'
+    body += b'["not", "an", "object"]\n{broken\n{"phone": "0711000003"}'
+    r = client.post(
+        "/api/daraja/disbursements",
+        content=body,
+        params={"pool": "airtel"},
+        headers={"Content-Type": "application/x-ndjson; charset=utf-8"},
+    )
+    assert r.status_code == 202
+    job = r.json()
+    # The service was not started (no app startup), so the job waits in the queue
+    assert (job["status"], job["total"], job["invalid"], job["pending"]) == ("queued", 5, 3, 2)
+    assert job["pool"] == "airtel"
+
+    url = f"/api/daraja/disbursements/{job['jobId']}"
+    assert client.get(url).json()["pending"] == 2
+    page = client.get(f"{url}/rows", params={"limit": 2}).json()
+    assert [r["row"] for r in page["rows"]] == [1, 2] and page["nextCursor"] == 2
+    assert page["rows"][0]["phone"] == "254711000001"
+    rest = client.get(f"{url}/rows", params={"limit": 2, "cursor": 2}).json()
+    assert [r["error"] for r in rest["rows"]] == ["not an object", "malformed JSON"]
+    last = client.get(f"{url}/rows", params={"limit": 2, "cursor": 4}).json()
+    assert last["nextCursor"] is None and last["rows"][0]["error"] == "invalid amount"
+
+    assert client.get("/api/daraja/disbursements/bd-missing").status_code == 404
+    csv = {"Content-Type": "text/csv"}
+    r = client.post("/api/daraja/disbursements", content=b"phone,amount\n", headers=csv)
+    assert r.status_code == 400 and "no disbursement rows" in r.json()["detail"]
+    wrong = b"msisdn,value\n0711000001,50\n"
+    assert client.post("/api/daraja/disbursements", content=wrong, headers=csv).status_code == 400
+    huge = b"phone,amount\n" + b"x" * 200_000 + b",50\n"  # over the csv field size limit
+    r = client.post("/api/daraja/disbursements", content=huge, headers=csv)
+    assert r.status_code == 400 and "unreadable CSV" in r.json()["detail"]
+    r = client.post("/api/daraja/disbursements", json=[{"phone": "0711000001"}])
+    assert r.status_code == 415
+
+
+def test_token_bucket_paces_calls():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, burst=1)
+    bucket = TokenBucket(rate=200, burst=5)
+
+    async def run():
+        start = time.perf_counter()
+        await asyncio.gather(*(bucket.acquire() for _ in range(45)))
+        return time.perf_counter() - start
+
+    # 5 go at once, the other 40 are spread over 40 / 200 = 0.2s
+    assert _run(run) >= 0.18
+
+
+def b2c_result(originator: str, code: int = 0) -> DarajaCallback:
+    payload = {
+        "Result": {
+            "ResultCode": code, "ResultDesc": "The balance is insufficient.",
+            "OriginatorConversationID": originator, "ConversationID": f"AG_{originator}",
+            "ResultParameters": {"ResultParameter": [{"Key": "TransactionAmount", "Value": 20}]},
+        }
+    }
+    return parse_callback("b2c", payload)
+
+
+def test_stopped_jobs_resume_without_sending_rows_twice():
+    slow = RecordingDaraja(delay=0.05)
+    first = DisbursementService(client=slow, rate=1000, burst=10, concurrency=2, page_size=4)
+    second_client = RecordingDaraja()
+    second = DisbursementService(client=second_client, rate=1000, burst=10, page_size=4)
+    csv = b"phone,amount\n" + b"".join(b"0722%06d,20\n" % i for i in range(12))
+
+    async def run():
+        await first.start()
+        job = await first.submit(chunked(csv, 1024), "csv")
+        await asyncio.sleep(0.08)
+        await first.stop()  # mid-page: the rows being paid out are sent, left "sending"
+        mid = await first.get(job["jobId"])
+        await second.start()
+        await finished(second)
+        await second.stop()
+        done = await second.get(job["jobId"])
+        in_flight, _ = await second.rows(job["jobId"], status="sending")
+        # B2C results settle them; a failed payout is marked failed, and only once
+        await second.reconcile([b2c_result(f"{job['jobId']}-{r['row']}") for r in in_flight])
+        await second.reconcile([b2c_result(f"{job['jobId']}-1", code=1), b2c_result("AG_x")])
+        await second.reconcile([b2c_result(f"{job['jobId']}-1")])
+        failed, _ = await second.rows(job["jobId"], status="failed")
+        return mid, done, len(in_flight), await second.get(job["jobId"]), failed
+
+    mid, done, in_flight, settled, failed = _run(run)
+    assert mid["status"] == "running" and mid["pending"] > 0 and mid["sending"] > 0
+    assert done["status"] == "completed" and done["sent"] + in_flight == 12
+    assert (settled["sent"], settled["failed"], settled["sending"]) == (11, 1, 0)
+    assert failed[0]["row"] == 1 and failed[0]["error"] == "The balance is insufficient."
+    assert len(slow.payouts) + len(second_client.payouts) == 12  # none paid twice
+
+
+def test_jobs_are_leased_to_one_instance():
+    payouts = RecordingDaraja()
+    holder = DisbursementService(client=payouts, rate=1000, burst=10)
+    rival = DisbursementService(client=payouts, rate=1000, burst=10, lease_ttl=0.03)
+    csv = b"phone,amount\n" + b"".join(b"0723%06d,20\n" % i for i in range(6))
+
+    async def lease(job_id: str, seconds: float) -> None:
+        async with holder.session_factory() as session:
+            await session.execute(
+                update(DisbursementJob)
+                .where(DisbursementJob.id == job_id)
+                .values(owner=holder.owner, lease_until=utcnow() + timedelta(seconds=seconds))
+            )
+            await session.commit()
+
+    async def run():
+        job = await holder.submit(chunked(csv, 1024), "csv")  # not started: left queued
+        await lease(job["jobId"], 30)
+        await rival.start()
+        assert not rival._tasks  # leased elsewhere: not picked up
+        rival._dispatch(job["jobId"])  # e.g. raced another instance's claim
+        await finished(rival)
+        assert (await rival.get(job["jobId"]))["pending"] == 6
+        await lease(job["jobId"], -1)  # the holder died
+        for _ in range(50):  # the lease loop takes the job over
+            await asyncio.sleep(0.02)
+            await finished(rival)
+            if (await rival.get(job["jobId"]))["status"] == "completed":
+                break
+        async with rival.session_factory() as session:
+            row = await session.scalar(
+                select(DisbursementRow).where(DisbursementRow.job_id == job["jobId"])
+            )
+        assert await rival._send(job["jobId"], row) is None  # already sent: never again
+        await rival.stop()
+        await holder.stop()  # never started: only releases its (lapsed) leases
+        return await rival.get(job["jobId"])
+
+    done = _run(run)
+    assert done["status"] == "completed" and done["sent"] == 6
+    assert len(payouts.payouts) == 6
+
+
+def test_aborted_uploads_and_all_invalid_batches():
+    payouts = RecordingDaraja()
+    svc = DisbursementService(client=payouts, rate=1000, burst=10, chunk_size=2)
+
+    async def disconnects():
+        yield b"phone,amount\n0733000001,50\n0733000002,50\n0733000003,50\n"
+        raise ConnectionError("client disconnected")
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await svc.submit(disconnects(), "csv")
+        (job_id,) = [j async for j in _job_ids(svc, "aborted")]
+        rejected = await svc.submit(chunked(b"phone,amount\nnope,1\n", 8), "csv")
+        return await svc.get(job_id), rejected
+
+    aborted, rejected = _run(run)
+    assert aborted["status"] == "aborted" and aborted["pending"] == 2  # kept, never sent
+    assert rejected["status"] == "completed" and rejected["invalid"] == 1
+    assert payouts.payouts == []
+    with pytest.raises(ValueError):
+        asyncio.run(DarajaClient().b2c_payment("254733000001", 0))
+
+
+def test_uploads_left_receiving_by_a_dead_instance_are_aborted():
+    svc = DisbursementService(client=RecordingDaraja(), rate=1000, burst=10)
+    now = utcnow()
+    leases = {
+        "bd-dead": ("gone", now - timedelta(seconds=1)),
+        "bd-unowned": (None, None),
+        "bd-streaming": ("alive", now + timedelta(seconds=30)),
+        "bd-mine": (svc.owner, now - timedelta(seconds=1)),  # slow, but still ours
+    }
+    with get_session() as session:
+        for job_id, (owner, until) in leases.items():
+            session.add(
+                DisbursementJob(id=job_id, status="receiving", owner=owner, lease_until=until)
+            )
+            session.add(
+                DisbursementRow(
+                    job_id=job_id, row_no=1, phone="254700000001", amount=50, status="pending"
+                )
+            )
+
+    async def run():
+        await svc.start()
+        await finished(svc)
+        await svc.stop()
+        return {job_id: (await svc.get(job_id))["status"] for job_id in leases}
+
+    assert _run(run) == {
+        "bd-dead": "aborted",
+        "bd-unowned": "aborted",
+        "bd-streaming": "receiving",
+        "bd-mine": "receiving",
+    }
+    assert svc.client.payouts == []
+
+
+async def _job_ids(svc, status):
+    async with svc.session_factory() as session:
+        for job_id in await session.scalars(
+            select(DisbursementJob.id).where(DisbursementJob.status == status)
+        ):
+            yield job_id
+
+
+def test_dispatch_errors_leave_the_job_resumable():
+    svc = DisbursementService(client=RecordingDaraja(), rate=1000, burst=10)
+    real = svc._set_status
+    calls = []
+
+    async def flaky(job_id, status):
+        calls.append(status)
+        if status == "completed" and calls.count("completed") == 1:
+            raise RuntimeError("database is locked")
+        await real(job_id, status)
+
+    svc._set_status = flaky  # type: ignore[method-assign]
+
+    async def run():
+        await svc.start()
+        job = await svc.submit(chunked(b"phone,amount\n0744000001,50\n", 64), "csv")
+        await finished(svc)
+        stuck = await svc.get(job["jobId"])
+        await svc.stop()
+        await svc.start()
+        await finished(svc)
+        await svc.stop()
+        return stuck, await svc.get(job["jobId"])
+
+    stuck, done = _run(run)
+    assert stuck["status"] == "running" and stuck["sent"] == 1
+    assert done["status"] == "completed" and done["sent"] == 1
+
+
+def test_validation_and_line_splitting_helpers():
+    rows = validate_rows(
+        [{"phone": "254 722 000 001", "amount": "inf"}, {"phone": "+254110000001", "amount": 10}],
+        first_row_no=7,
+        min_amount=10,
+        max_amount=100,
+    )
+    assert rows[0]["error"] == "invalid amount" and rows[0]["phone"] == "254722000001"
+    assert rows[1]["status"] == "pending" and rows[1]["row_no"] == 8
+
+    async def lines(chunks):
+        return [batch async for batch in iter_lines(chunked(chunks, 4))]
+
+    assert asyncio.run(lines(b"ab\ncdefgh\nij")) == [["ab"], ["cdefgh"], ["ij"]]
+    assert payout_row("bd-1a2b-17") == ("bd-1a2b", 17)
+    assert payout_row("bd-1a2b-x") is None and payout_row("AG_1-2") is None
+    assert payout_row(None) is None
+
+
+def test_jobs_run_in_the_running_app():
+    with TestClient(app) as c:
+        r = c.post(
+            "/api/daraja/disbursements",
+            content=b"phone,amount\n0755000001,100\n0755000002,200\n",
+            headers={"Content-Type": "text/csv"},
+        )
+        url = f"/api/daraja/disbursements/{r.json()['jobId']}"
+        for _ in range(100):
+            status = c.get(url).json()
+            if status["status"] == "completed":
+                break
+            time.sleep(0.02)
+        rows = c.get(f"{url}/rows").json()["rows"]
+    assert status["sent"] == 2
+    assert rows[0]["conversationId"].startswith("AG_stub_bd-")
+
+
+def test_rows_marked_by_another_instance_are_skipped():
+    payouts = RecordingDaraja()
+    svc = DisbursementService(client=payouts, rate=1000, burst=10)
+    acquire = svc.bucket.acquire
+
+    async def raced():
+        # Another instance that took over the job marks the row between read and send
+        async with svc.session_factory() as session:
+            await session.execute(update(DisbursementRow).values(status="sending"))
+            await session.commit()
+        await acquire()
+
+    svc.bucket.acquire = raced  # type: ignore[method-assign]
+
+    async def run():
+        await svc.start()
+        job = await svc.submit(chunked(b"phone,amount\n0745000001,50\n", 64), "csv")
+        await finished(svc)
+        await svc.stop()
+        return await svc.get(job["jobId"])
+
+    done = _run(run)
+    assert done["status"] == "completed" and done["sending"] == 1
+    assert payouts.payouts == []
+
+
+def test_lease_loop_errors_are_logged_and_stop_ends_it(caplog):
+    svc = DisbursementService(client=RecordingDaraja(), rate=1000, burst=10, lease_ttl=0.03)
+    failures = [RuntimeError("database is locked")]
+    renew = svc._renew_leases
+    entered = asyncio.Event()
+
+    async def flaky_renew():
+        if failures:
+            raise failures.pop()
+        await renew()
+        entered.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            pass  # as the DB driver can during session cleanup
+
+    svc._renew_leases = flaky_renew  # type: ignore[method-assign]
+
+    async def run():
+        await svc.start()
+        await entered.wait()
+        await asyncio.wait_for(svc.stop(), 1)
+
+    _run(run)
+    assert "disbursement lease renewal failed" in caplog.text and not failures
@@ -0,0 +1,246 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+from conftest import FakeClock
+from sqlalchemy import func, insert, select
+
+from app.core.cache import AsyncCache, MemoryStore
+from app.core.db import get_session
+from app.models.db_models import LedgerEntry
+from app.services import flows
+from app.services.flows import WINDOW_HOURS, FlowStore, get_flow_store
+from app.services.forecast import ForecastService
+from app.services.forecast_cache import ForecastCache, get_model_cache
+from app.services.ledger import LedgerEngine, LedgerTransaction, Posting, get_ledger
+
+HOUR = 3600
+START = 500_000 * HOUR
+
+
+class Clock:
+    def __init__(self):
+        self.now = START + 10.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_windows_roll_forward_and_old_buckets_are_reused():
+    clock = Clock()
+    store = FlowStore(history_hours=30, clock=clock)
+    windows = list(WINDOW_HOURS)
+    assert store.record("op", 500) and store.record("op", -200)
+    assert store.record("other", 100, at=clock.now - 3 * HOUR)
+    assert store.net(["op", "other", "unknown"], windows).tolist() == [
+        [300, 300, 300], [0, 100, 100], [0, 0, 0]
+    ]
+    clock.now += 2 * HOUR
+    inflow, outflow = store.totals(["op", "other"], windows)
+    assert inflow.tolist() == [[0, 500, 500], [0, 0, 100]]
+    assert outflow.tolist() == [[0, 200, 200], [0, 0, 0]]
+    inflow, outflow = store.history(["op", "other"], 6, step=2)
+    assert inflow.tolist() == [[0, 500, 0], [100, 0, 0]]
+    assert outflow.tolist() == [[0, 200, 0], [0, 0, 0]]
+
+    # A late event still counts in the windows it falls into; one past the history does not
+    assert store.record("op", 50, at=clock.now - 5 * HOUR)
+    assert not store.record("op", 50, at=clock.now - 30 * HOUR)
+    assert store.net(["op"], windows).tolist() == [[0, 300, 350]]
+    clock.now += 28 * HOUR  # the ring wraps around: old buckets must not leak back in
+    assert store.history(["op"], 30)[0].sum() == 0
+    assert store.record("op", 7)
+    assert store.net(["op"], windows).tolist() == [[7, 7, 7]]
+    clock.now += 100 * HOUR
+    assert store.net(["op"], windows).tolist() == [[0, 0, 0]]
+    assert store.operators == ["op", "other"]
+
+    with pytest.raises(ValueError):
+        store.history(["op"], 31)
+    with pytest.raises(ValueError):
+        store.history(["op"], 5, step=2)
+    with pytest.raises(ValueError):
+        FlowStore(history_hours=24)
+
+
+def test_batches_match_single_events_and_a_full_rescan():
+    rnd = random.Random(5)
+    clock = Clock()
+    single = FlowStore(history_hours=48, clock=clock)
+    batched = FlowStore(history_hours=48, clock=clock)
+    events: list[tuple[str, int, float]] = []
+    for _ in range(12):
+        clock.now += rnd.randint(0, 2) * HOUR
+        # Led by an event at the current hour, so both stores move to it first
+        batch = [("op0", 1, clock.now)] + [
+            (f"op{rnd.randint(0, 20)}", rnd.randint(-999, 999), clock.now - h * HOUR)
+            for h in rnd.choices(range(60), k=200)
+        ]
+        kept = batched.record_many(*zip(*batch))
+        assert kept == sum(single.record(*e) for e in batch)
+        events += batch
+    assert batched.record_many([], []) == 0
+
+    names = [f"op{i}" for i in range(21)]
+    head = int(clock.now // HOUR)
+    for window, span in WINDOW_HOURS.items():
+        expected = [
+            sum(a for op, a, at in events if op == name and head - int(at // HOUR) < span)
+            for name in names
+        ]
+        assert single.net(names, [window])[:, 0].tolist() == expected
+        assert batched.net(names, [window])[:, 0].tolist() == expected
+    assert np.array_equal(single.history(names, 48)[1], batched.history(names, 48)[1])
+
+
+def test_ledger_postings_on_operator_pools_feed_the_store(caplog):
+    clock = Clock()
+    store = FlowStore(history_hours=48, clock=clock)
+    ledger = LedgerEngine()
+    ledger.observers.append(store.record_transactions)
+    ledger.post_many([
+        LedgerTransaction("flow-1", [
+            Posting("wallet:flow-user", "LOCAL", -1500), Posting("pool:flow-op", "LOCAL", 1500)
+        ]),
+        LedgerTransaction("flow-2", [
+            Posting("pool:flow-op", "LOCAL", -400), Posting("external:m-pesa", "LOCAL", 400)
+        ]),
+        LedgerTransaction("flow-3", [  # token pools get their own series, in the token
+            Posting("pool:FLOWTOK", "USDC", -10), Posting("wallet:flow-user", "USDC", 10)
+        ]),
+        LedgerTransaction("flow-5", [  # another asset than the pool's first flow: skipped
+            Posting("pool:flow-op", "USDC", -7), Posting("wallet:flow-user", "USDC", 7)
+        ]),
+    ])
+    assert store.operators == ["flow-op", "FLOWTOK"]
+    assert (store.asset("flow-op"), store.asset("FLOWTOK")) == ("LOCAL", "USDC")
+    assert store.asset("flow-none") == "LOCAL"
+    assert store.net(["FLOWTOK"], ["1h"]).tolist() == [[-10]]
+    assert store.totals(["flow-op"], ["1h"])[0].tolist() == [[1500]]
+    assert store.net(["flow-op"], ["24h"]).tolist() == [[1100]]
+
+    def broken(txs):
+        raise RuntimeError("observer down")
+
+    ledger.observers.insert(0, broken)
+    ledger.post(LedgerTransaction("flow-4", [
+        Posting("wallet:flow-user", "LOCAL", -100), Posting("pool:flow-op", "LOCAL", 100)
+    ]))
+    assert ledger.posted("flow-4")  # still booked, and later observers still ran
+    assert store.net(["flow-op"], ["1h"]).tolist() == [[1200]]
+    assert "observer" in caplog.text
+
+    assert get_ledger().observers == []  # the app's store follows ledger_entries instead
+
+
+def _entry(account: str, amount: int, **extra) -> dict:
+    return {"tx_id": "flow-sync", "account": account, "asset": "LOCAL",
+            "amount_minor": amount, **extra}
+
+
+def _insert(*entries: dict) -> None:
+    with get_session() as session, session.begin():
+        session.execute(insert(LedgerEntry), list(entries))
+
+
+def test_store_backfills_and_follows_the_ledger(monkeypatch):
+    monkeypatch.setattr(flows, "SYNC_BATCH", 2)  # several reads per sync
+    old = datetime.now(timezone.utc) - timedelta(hours=60)
+    _insert(
+        _entry("pool:sync-op", 500), _entry("wallet:sync-user", -500),
+        _entry("pool:sync-op", 9_000, created_at=old),  # older than the history
+        _entry("pool:SYNCTOK", -3, asset="USDC"),
+    )
+    clock = FakeClock(time.time())
+    store = FlowStore(history_hours=48, clock=clock, gap_grace=60)
+    assert store.sync() >= 2  # with other tests' postings
+    assert store.net(["sync-op", "SYNCTOK"], ["24h"]).tolist() == [[500], [-3]]
+    assert store.history(["sync-op"], 48)[0].sum() == 500
+    assert store.asset("SYNCTOK") == "USDC"
+
+    # Another worker's postings
+    LedgerEngine().post_many([
+        LedgerTransaction(f"flow-sync-{i}", [
+            Posting("pool:sync-op", "LOCAL", -100), Posting("external:m-pesa", "LOCAL", 100)
+        ]) for i in range(3)
+    ])
+    assert store.sync() == 6
+    assert store.net(["sync-op"], ["1h"]).tolist() == [[200]]
+    assert store.sync() == 0
+
+    # An id committed ahead of a transaction still in flight: the skipped ids are re-read
+    with get_session() as session:
+        last = session.scalar(select(func.max(LedgerEntry.id)))
+    _insert(_entry("pool:sync-op", 1, id=last + 4))
+    assert store.sync() == 1
+    _insert(_entry("pool:sync-op", 10, id=last + 2))
+    assert store.sync() == 1
+    assert store.net(["sync-op"], ["1h"]).tolist() == [[211]]
+    clock.now += 61  # past the grace: the rest were rolled back, stop looking
+    assert store.sync() == 0
+    _insert(_entry("pool:sync-op", 10_000, id=last + 1))
+    assert store.sync() == 0
+    assert store.net(["sync-op"], ["1h"]).tolist() == [[211]]
+
+
+def test_synced_operators_drop_their_cached_forecasts(caplog):
+    forecasts = ForecastCache(cache=AsyncCache(url=None, store=MemoryStore()))
+    store = FlowStore(history_hours=48)
+    store.observers.append(forecasts.invalidate)
+    seen: list[list[str]] = []
+
+    async def broken(operators):
+        seen.append(operators)
+        raise RuntimeError("observer down")
+
+    store.observers.insert(0, broken)
+
+    async def run():
+        await store.refresh()  # backfill
+        for op in ("inv-op", "inv-other"):
+            await forecasts.store("predict", op, "1h", 1.0)
+        _insert(_entry("pool:inv-op", 700), _entry("clearing:inv", -700))
+        assert await store.refresh() == 2
+        assert await forecasts.lookup("predict", "inv-op", "1h") is None  # recomputed next
+        assert await forecasts.lookup("predict", "inv-other", "1h") == 1.0
+        assert await store.refresh() == 0  # nothing new: observers are not called
+
+    asyncio.run(run())
+    assert seen[-1] == ["inv-op"] and "observer" in caplog.text
+    assert get_flow_store().observers == [get_model_cache().invalidate]
+
+
+def test_sync_loop_backfills_at_start_and_logs_failures(caplog):
+    def broken():
+        raise RuntimeError("db down")
+
+    async def run() -> None:
+        store = FlowStore(history_hours=48, session_factory=broken, sync_interval=0.01)
+        await store.start()
+        task = store._task
+        await store.start()  # already running: no second loop
+        assert store._task is task
+        await asyncio.sleep(0.05)
+        await store.stop()
+        await store.stop()  # stopping twice is harmless
+        assert task.done()
+
+    asyncio.run(run())
+    assert "flow store backfill failed" in caplog.text
+    assert "flow store sync failed" in caplog.text
+
+
+def test_forecasts_read_rolling_net_flows():
+    clock = Clock()
+    store = FlowStore(history_hours=48, clock=clock)
+    cache = ForecastCache(cache=AsyncCache(url=None, store=MemoryStore()))
+    forecast = ForecastService(cache=cache, flows=store, model="persistence")
+    store.record_many(["fc-a", "fc-b", "fc-a"], [12_345, -5_000, -2_345])
+    store.record("fc-a", 100_000, at=clock.now - 10 * HOUR)
+    assert asyncio.run(forecast.predict("fc-a", "1h")) == 100.0
+    assert asyncio.run(forecast.predict("fc-a", "24h")) == 1100.0
+    grid = forecast.predict_many(["fc-b", "fc-a", "fc-new"], ["1h", "24h"])
+    assert asyncio.run(grid) == [[-50.0, -50.0], [100.0, 1100.0], [0.0, 0.0]]
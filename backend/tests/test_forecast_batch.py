@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.forecast import ForecastService
+
+client = TestClient(app)
+
+
+def test_predict_many_matches_single_predictions():
+    f = ForecastService()
+
+    async def run():
+        grid = await f.predict_many(["safaricom", "airtel", "safaricom"], ["1h", "24h"])
+        assert len(grid) == 3
+        assert grid[0] == [await f.predict("safaricom", "1h"), await f.predict("safaricom", "24h")]
+        assert grid[1] == [await f.predict("airtel", "1h"), await f.predict("airtel", "24h")]
+        assert grid[2] == grid[0]
+
+    asyncio.run(run())
+
+
+def test_predict_many_invalid_inputs():
+    f = ForecastService()
+    with pytest.raises(ValueError):
+        asyncio.run(f.predict_many([], ["4h"]))
+    with pytest.raises(ValueError):
+        asyncio.run(f.predict_many(["safaricom", ""], ["4h"]))
+    with pytest.raises(ValueError):
+        asyncio.run(f.predict_many(["safaricom"], []))
+    with pytest.raises(ValueError):
+        asyncio.run(f.predict_many(["safaricom"], ["0h"]))  # type: ignore[list-item]
+
+
+def test_forecast_batch_endpoint():
+    r = client.post("/api/forecast/batch", json={"operators": ["safaricom", "airtel"]})
+    assert r.status_code == 200
+    data = r.json()
+    assert data["operators"] == ["safaricom", "airtel"]
+    assert data["windows"] == ["1h", "4h", "24h"]
+    assert len(data["predictedNetFlow"]) == 2
+    assert all(len(row) == 3 for row in data["predictedNetFlow"])
+
+    single = client.post("/api/forecast", json={"operator": "airtel", "window": "4h"}).json()
+    assert data["predictedNetFlow"][1][1] == single["predictedNetFlow"]
+
+
+def test_forecast_batch_endpoint_errors():
+    r = client.post("/api/forecast/batch", json={"operators": []})
+    assert r.status_code == 422
+    r = client.post("/api/forecast/batch", json={"operators": ["safaricom"], "windows": ["0h"]})
+    assert r.status_code == 422
+    r = client.post("/api/forecast/batch", json={"operators": ["safaricom", ""]})
+    assert r.status_code == 400
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.cache import AsyncCache, MemoryStore, get_async_cache
+from app.main import app
+from app.services.forecast import ForecastService
+from app.services.forecast_cache import ForecastCache, get_forecast_cache
+
+
+class RecordingCache(AsyncCache):
+    def __init__(self):
+        super().__init__(url=None, store=MemoryStore())
+        self.sets: dict[str, int | None] = {}
+
+    async def set(self, key, value, ex=None):
+        self.sets[key] = ex
+        await super().set(key, value, ex=ex)
+
+
+def _cache(**kw) -> ForecastCache:
+    return ForecastCache(cache=AsyncCache(url=None, store=MemoryStore()), **kw)
+
+
+def test_hits_misses_and_window_ttls():
+    backing = RecordingCache()
+    fc = ForecastCache(cache=backing, ttls={"1h": 10, "4h": 40, "24h": 240})
+    f = ForecastService(cache=fc)
+    calls = []
+
+    async def run():
+        first = await f.predict("safaricom", "1h")
+        assert await f.predict("safaricom", "1h") == first
+        assert await fc.lookup("predict", "safaricom", "1h") == first
+        await f.predict("safaricom", "24h")
+        assert backing.sets[fc.key("predict", "safaricom", "1h")] == 10
+        assert backing.sets[fc.key("predict", "safaricom", "24h")] == 240
+        assert await fc.get_or_compute("predict", "x", "4h", lambda: calls.append(1) or 1.5) == 1.5
+        assert await fc.get_or_compute("predict", "x", "4h", lambda: calls.append(1) or 2.5) == 1.5
+
+    asyncio.run(run())
+    assert len(calls) == 1
+
+
+def test_model_version_is_part_of_key():
+    a = _cache(model_version="a")
+    b = ForecastCache(cache=a.cache, model_version="b")
+    asyncio.run(a.store("predict", "safaricom", "4h", 1.0))
+    assert asyncio.run(b.lookup("predict", "safaricom", "4h")) is None
+    assert get_forecast_cache("hash-v1").cache is get_async_cache()
+
+
+def test_predict_many_reuses_cached_cells():
+    fc = _cache()
+    f = ForecastService(cache=fc)
+
+    async def run():
+        await fc.store("predict", "safaricom", "4h", 42.0)
+        grid = await f.predict_many(["safaricom"], ["1h", "4h"])
+        assert grid[0][1] == 42.0
+        assert await fc.lookup("predict", "safaricom", "1h") == grid[0][0]
+        # Fully cached grid: served from one batched lookup, nothing recomputed
+        await fc.store("predict", "safaricom", "1h", -1.0)
+        assert await f.predict_many(["safaricom"], ["1h", "4h"]) == [[-1.0, 42.0]]
+
+    asyncio.run(run())
+
+
+def test_summary_is_cached_and_invalidated():
+    fc = _cache()
+    f = ForecastService(cache=fc)
+
+    async def run():
+        s1 = await f.operator_summary("airtel", "4h")
+        assert await fc.lookup("summary", "airtel", "4h") == s1
+        assert await f.operator_summary("airtel", "4h") == s1
+        assert await fc.invalidate(["airtel"], windows=["4h"]) == 2
+        assert await fc.lookup("summary", "airtel", "4h") is None
+        assert await fc.invalidate(["airtel"]) == 0
+
+        # A one-shot iterable of operators clears every kind, not just the first
+        await f.operator_summary("airtel", "1h")
+        assert await fc.invalidate(op for op in ["airtel"]) == 2
+        assert await fc.lookup("summary", "airtel", "1h") is None
+
+    asyncio.run(run())
+
+
+def test_single_flight_deduplicates_concurrent_misses():
+    fc = _cache()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return 7.0
+
+    async def run():
+        callers = [asyncio.create_task(fc.get_or_compute("p", "op", "1h", slow)) for _ in range(6)]
+        await asyncio.sleep(0.05)  # the loop stays free while the model runs
+        callers[-1].cancel()  # a caller going away does not cancel the computation
+        release.set()
+        return await asyncio.gather(*callers, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert results[:5] == [7.0] * 5 and isinstance(results[5], asyncio.CancelledError)
+    assert len(calls) == 1
+    assert asyncio.run(fc.lookup("p", "op", "1h")) == 7.0
+
+
+def test_single_flight_propagates_errors_to_waiters():
+    fc = _cache()
+    release = threading.Event()
+
+    def boom():
+        release.wait(5)
+        raise RuntimeError("model down")
+
+    async def run():
+        callers = [asyncio.create_task(fc.get_or_compute("p", "op", "4h", boom)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*callers, return_exceptions=True)
+
+    assert [str(e) for e in asyncio.run(run())] == ["model down", "model down"]
+    assert asyncio.run(fc.lookup("p", "op", "4h")) is None
+    with pytest.raises(RuntimeError):
+        asyncio.run(fc.get_or_compute("p", "op", "4h", boom))  # not cached: computed again
+
+
+def test_cache_counters_on_metrics():
+    client = TestClient(app)
+    client.post("/api/forecast", json={"operator": "metrics-op", "window": "1h"})
+    client.post("/api/forecast", json={"operator": "metrics-op", "window": "1h"})
+    body = client.get("/metrics").text
+    assert 'forecast_cache_hits_total{kind="predict"}' in body
+    assert 'forecast_cache_misses_total{kind="predict"}' in body
+    assert "forecast_cache_evictions_total" in body
@@ -0,0 +1,110 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.core.cache import AsyncCache, MemoryStore
+from app.services.flows import FlowStore
+from app.services.forecast import ForecastService
+from app.services.forecast_cache import ForecastCache
+from app.services.forecast_engine import (
+    ExponentialSmoothing,
+    ForecastEngine,
+    SeasonalNaive,
+    get_forecast_engine,
+)
+
+HOUR = 3600
+START = 500_000 * HOUR
+
+
+def _daily(operators: int, hours: int, seed: int = 3) -> np.ndarray:
+    """Series that repeat every 24 hours exactly, one row per operator."""
+    pattern = np.random.default_rng(seed).integers(-5_000, 5_000, (operators, 24))
+    return np.tile(pattern, hours // 24 + 1)[:, :hours]
+
+
+@pytest.mark.parametrize("model_cls", [SeasonalNaive, ExponentialSmoothing])
+def test_models_learn_a_seasonal_pattern_and_update_incrementally(model_cls):
+    series = _daily(5, 24 * 6)
+    end = 1_000 + series.shape[1]
+    model = model_cls(season=24)
+    model.fit(series, end)
+    # The next day repeats the pattern, aligned by hour whatever the history length
+    assert np.allclose(model.forecast(30), _daily(5, 24 * 8)[:, 144:174])
+
+    noisy = series + np.random.default_rng(1).integers(-900, 900, series.shape)
+    whole, split = model_cls(season=24), model_cls(season=24)
+    whole.fit(noisy, end)
+    split.fit(noisy[:, :100], end - 44)
+    split.update(noisy[:, 100:130], end - 14)
+    split.update(noisy[:, 130:], end)
+    assert np.allclose(whole.forecast(24), split.forecast(24))
+
+    with pytest.raises(ValueError):
+        ExponentialSmoothing(season=24).fit(series[:, :10], end)
+
+
+class CountingModel(SeasonalNaive):
+    def __init__(self):
+        super().__init__(season=24)
+        self.calls: list[tuple[str, int]] = []
+
+    def fit(self, history, end_hour):
+        self.calls.append(("fit", history.shape[1]))
+        super().fit(history, end_hour)
+
+    def update(self, buckets, end_hour):
+        self.calls.append(("update", buckets.shape[1]))
+        super().update(buckets, end_hour)
+
+
+def test_engine_fits_once_then_feeds_only_closed_hours():
+    now = [START + 10.0]
+    store = FlowStore(history_hours=72, clock=lambda: now[0])
+    model = CountingModel()
+    engine = ForecastEngine(model, store)
+    for h in range(1, 49):
+        store.record("eng-a", 100 * (h % 24 + 1), at=now[0] - h * HOUR)
+    store.record("eng-a", 999_999)  # the open hour is not fed to the model
+    windows = ["1h", "4h", "24h"]
+
+    first = engine.predict(["eng-a", "eng-unknown"], windows)
+    # hour h back from now repeats as hour 24 - h ahead: next hours are h = 24, 23, 22...
+    assert first.tolist() == [[100, 100 + 2400 + 2300 + 2200, 100 * sum(range(1, 25))], [0, 0, 0]]
+    assert model.calls == [("fit", 71)]
+    engine.predict(["eng-a"], ["1h"])
+    assert model.calls == [("fit", 71)]  # nothing new
+
+    now[0] += 2 * HOUR
+    assert engine.predict(["eng-a"], ["1h"]).tolist() == [[2300]]
+    assert model.calls[-1] == ("update", 2)  # includes the hour with 999_999
+    store.record("eng-b", -50, at=now[0] - HOUR)  # a new operator: refit everything
+    assert engine.predict(["eng-b", "eng-a"], ["24h"]).tolist() == [[-50], [1_027_499]]
+    assert model.calls[-1] == ("fit", 71)
+    now[0] += 500 * HOUR  # longer than the history: nothing left to update from
+    engine.predict(["eng-a"], ["1h"])
+    assert model.calls[-1] == ("fit", 71)
+
+    with pytest.raises(ValueError):
+        ForecastEngine(SeasonalNaive(season=72), store)
+    with pytest.raises(ValueError):
+        get_forecast_engine("arima")
+
+
+def test_forecast_service_backends():
+    now = [START + 10.0]
+    store = FlowStore(history_hours=400, clock=lambda: now[0])
+    store.record_many(["svc-a", "svc-a"], [-30_000, 5_000], [now[0] - 168 * HOUR] * 2)
+    store.record("svc-a", 1_000)
+
+    def service(model):
+        cache = ForecastCache(cache=AsyncCache(url=None, store=MemoryStore()))
+        return ForecastService(cache=cache, flows=store, model=model)
+
+    naive = service("seasonal_naive").predict_many(["svc-a", "svc-b"], ["1h"])
+    assert asyncio.run(naive) == [[-250.0], [0.0]]
+    assert asyncio.run(service("persistence").predict("svc-a", "1h")) == 10.0
+    smoothed = service("smoothing")
+    assert smoothed.engine is get_forecast_engine("smoothing", store)
+    assert -250.0 < asyncio.run(smoothed.predict("svc-a", "1h")) < 0
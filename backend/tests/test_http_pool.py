@@ -0,0 +1,213 @@
+import asyncio
+
+import httpx
+import pytest
+from conftest import FakeClock, FakeHandler, FakeServer
+
+from app.integrations import http_pool
+from app.integrations import integration_factory as factory
+from app.integrations.hedera_live import HederaClient as HederaLive
+from app.integrations.http_pool import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilientClient,
+    close_http_clients,
+    get_http_client,
+)
+
+
+class Upstream(FakeServer):
+    """Local upstream that counts TCP connections and requests; `status` sets replies."""
+
+    def __init__(self):
+        super().__init__(_Handler)
+        self.status = 200
+        self.connections = 0
+        self.requests = 0
+
+
+class _Handler(FakeHandler):
+    server: Upstream
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _respond(self):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.path.startswith("/api/v1/transactions/missing"):
+            code, body = 404, {}
+        elif self.path.startswith("/api/v1/transactions/"):
+            code, body = self.server.status, {"transactions": [{"result": "SUCCESS"}]}
+        else:
+            code, body = self.server.status, {"path": self.path}
+        self._reply(code, body)
+
+    do_GET = do_POST = _respond
+
+
+@pytest.fixture
+def upstream(serve):
+    return serve(Upstream())
+
+
+def _client(url: str, **kw) -> ResilientClient:
+    kw.setdefault("retry_backoff", 0.001)
+    return ResilientClient("test", url, **kw)
+
+
+def test_connections_are_pooled_and_reused(upstream):
+    client = _client(upstream.url, max_connections=4)
+
+    async def run():
+        for _ in range(20):
+            assert (await client.get("/ping")).status_code == 200
+        await asyncio.gather(*(client.get("/ping") for _ in range(40)))
+        await client.aclose()
+
+    asyncio.run(run())
+    assert upstream.requests == 60
+    assert upstream.connections <= 4  # sequential calls rode one kept-alive connection
+
+
+def test_failing_upstream_trips_the_breaker(upstream):
+    upstream.status = 503
+    client = _client(upstream.url, retries=0, breaker=CircuitBreaker("test", 3, 60))
+
+    async def run():
+        results = [await client.get("/flaky") for _ in range(3)]
+        rejected = await asyncio.gather(
+            *(client.get("/flaky") for _ in range(50)), return_exceptions=True
+        )
+        await client.aclose()
+        return results, rejected
+
+    results, rejected = asyncio.run(run())
+    assert [r.status_code for r in results] == [503] * 3
+    assert all(isinstance(e, CircuitOpenError) for e in rejected)
+    assert upstream.requests == 3  # nothing piled up on the failing upstream
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_probe_closes_or_reopens_the_circuit():
+    clock = FakeClock()
+    breaker = CircuitBreaker("probe", failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    breaker.allow()  # one failure: still closed
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    clock.now = 10
+    breaker.allow()  # the probe
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.opened_at == 10
+
+    clock.now = 20
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+
+
+def test_cancelled_probe_reopens_the_circuit():
+    class Hang(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request):
+            await asyncio.sleep(10)
+
+    clock = FakeClock()
+    breaker = CircuitBreaker("cancel", failure_threshold=1, reset_timeout=10, clock=clock)
+    client = _client("http://upstream.test", breaker=breaker, transport=Hang())
+
+    async def cancel_call() -> None:
+        task = asyncio.create_task(client.get("/"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_call())
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0  # not a probe
+
+    breaker.record_failure()
+    clock.now = 10
+    asyncio.run(cancel_call())  # the probe is cancelled mid-call
+    assert breaker.state == CircuitBreaker.OPEN and breaker.opened_at == 10
+    clock.now = 20
+    assert breaker.allow()  # a later caller gets to probe again
+
+
+def test_transport_errors_retry_idempotent_requests_only(upstream):
+    dead = _client("http://127.0.0.1:9", retries=2, breaker=CircuitBreaker("dead", 10, 60))
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(dead.get("/"))
+    assert dead.breaker.failures == 3
+
+    upstream.status = 500
+    client = _client(upstream.url, retries=2)
+    assert asyncio.run(client.post("/debit", json={})).status_code == 500
+    assert upstream.requests == 1  # POSTs are not replayed
+    assert asyncio.run(client.request("POST", "/debit", idempotent=True)).status_code == 500
+    assert upstream.requests == 4
+
+
+def test_retry_recovers_once_upstream_answers(upstream):
+    upstream.status = 502
+    client = _client(upstream.url, retries=3, retry_backoff=0.05)
+
+    async def heal():
+        await asyncio.sleep(0.03)
+        upstream.status = 200
+
+    async def run():
+        resp, _ = await asyncio.gather(client.get("/"), heal())
+        await client.aclose()
+        return resp
+
+    assert asyncio.run(run()).status_code == 200
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_shared_clients_are_per_integration_and_closed_at_shutdown(upstream):
+    first = get_http_client("svc", upstream.url)
+    assert get_http_client("svc", upstream.url) is first
+    assert get_http_client("svc", "http://127.0.0.1:9") is not first  # reconfigured
+
+    async def use():
+        await get_http_client("svc", upstream.url).get("/")
+
+    asyncio.run(use())
+    stale = get_http_client("svc", upstream.url)
+    asyncio.run(stale.aclose())  # its pool belongs to a loop that has since finished
+    assert stale._client is None
+
+    async def run():
+        client = get_http_client("svc", upstream.url)
+        await client.get("/")
+        pool = client.client
+        await close_http_clients()
+        return client, pool
+
+    client, pool = asyncio.run(run())
+    assert pool.is_closed and client._client is None
+    assert http_pool._clients == {}
+    asyncio.run(ResilientClient("idle", upstream.url).aclose())
+
+
+def test_factory_returns_singletons():
+    assert factory.get_daraja_client() is factory.get_daraja_client()
+    assert factory.get_cctp_client() is factory.get_cctp_client()
+    assert factory.get_hedera_client() is factory.get_hedera_client()
+
+
+def test_hedera_transaction_result_from_mirror_node(upstream):
+    hedera = HederaLive(mirror_url=upstream.url)
+    assert asyncio.run(hedera.transaction_result("0.0.1-1-1")) == "SUCCESS"
+    assert asyncio.run(hedera.transaction_result("missing")) is None
+    upstream.status = 400
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(hedera.transaction_result("0.0.1-1-1"))
@@ -0,0 +1,196 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.cache import AsyncCache, Cache, MemoryStore, get_async_cache
+from app.core.db import async_engine, get_session
+from app.core.idempotency import (
+    IdempotencyConflict,
+    IdempotencyInFlight,
+    IdempotencyStore,
+    get_idempotency_store,
+)
+from app.main import app
+from app.models.db_models import IdempotencyRecord, utcnow
+
+client = TestClient(app)
+
+CONVERT = {
+    "userId": "idem-user",
+    "from": {"rail": "m-pesa", "operator": "safaricom", "amount": 25.0, "phone": "+254700000002"},
+    "to": {"token": "USDC", "chain": "hedera"},
+    "mode": "fast",
+}
+
+
+def test_cache_add_is_set_if_absent():
+    s = MemoryStore()
+    assert s.add("k", "1", ex=10) is True
+    assert s.add("k", "2") is False
+    assert s.get("k") == "1"
+    c = Cache(url=None)
+    assert c.add("lock", "a") and not c.add("lock", "b")
+
+
+def test_convert_replays_first_response():
+    h = {"Idempotency-Key": "conv-1"}
+    first = client.post("/api/convert", json=CONVERT, headers=h)
+    second = client.post("/api/convert", json=CONVERT, headers=h)
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert "Idempotent-Replayed" not in first.headers
+    assert second.headers["Idempotent-Replayed"] == "true"
+    other = client.post("/api/convert", json=CONVERT, headers={"Idempotency-Key": "conv-2"})
+    assert other.json()["txId"] != first.json()["txId"]
+
+
+def test_key_reuse_with_different_payload_and_bad_keys():
+    h = {"Idempotency-Key": "conv-3"}
+    client.post("/api/convert", json=CONVERT, headers=h)
+    changed = {**CONVERT, "userId": "someone-else"}
+    assert client.post("/api/convert", json=changed, headers=h).status_code == 422
+    long_key = {"Idempotency-Key": "x" * 129}
+    assert client.post("/api/convert", json=CONVERT, headers=long_key).status_code == 400
+
+
+def test_errors_are_not_stored():
+    h = {"Idempotency-Key": "conv-bad"}
+    bad = {**CONVERT, "from": {**CONVERT["from"], "amount": 0}}
+    assert client.post("/api/convert", json=bad, headers=h).status_code == 400
+    assert client.post("/api/convert", json=bad, headers=h).status_code == 400
+    assert asyncio.run(get_async_cache().get("idem:convert:conv-bad:lock")) is None
+
+
+def test_rebalance_and_debit_are_idempotent():
+    rb = {"sourcePool": "poolA", "destPool": "poolB", "amount": 3.0}
+    h = {"Idempotency-Key": "rb-1"}
+    a = client.post("/api/liquidity/rebalance", json=rb, headers=h).json()
+    b = client.post("/api/liquidity/rebalance", json=rb, headers=h)
+    assert b.json() == a and b.headers["Idempotent-Replayed"] == "true"
+
+    debit = {"phone": "+254700000009", "amount": 12}
+    h = {"Idempotency-Key": "debit-1"}
+    client.post("/api/daraja/debit", json=debit, headers=h)
+    r = client.post("/api/daraja/debit", json=debit, headers=h)
+    assert r.headers["Idempotent-Replayed"] == "true"
+
+
+def test_db_fallback_after_cache_loss_and_expiry():
+    h = {"Idempotency-Key": "conv-db"}
+    first = client.post("/api/convert", json=CONVERT, headers=h).json()
+    cache = get_async_cache()
+    asyncio.run(cache.delete("idem:convert:conv-db"))
+    replay = client.post("/api/convert", json=CONVERT, headers=h)
+    assert replay.json() == first
+    assert asyncio.run(cache.get("idem:convert:conv-db")) is not None  # re-warmed
+
+    asyncio.run(cache.delete("idem:convert:conv-db"))
+    with get_session() as s:
+        rec = s.get(IdempotencyRecord, "convert:conv-db")
+        rec.created_at = utcnow() - timedelta(days=2)
+    fresh = client.post("/api/convert", json=CONVERT, headers=h)
+    assert fresh.json()["txId"] != first["txId"]
+
+
+def test_concurrent_duplicates_execute_once():
+    store = IdempotencyStore(cache=AsyncCache(url=None, store=MemoryStore()), poll_interval=0.01)
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"ok": len(calls)}
+
+    async def scenario():
+        return await asyncio.gather(*[store.run("t:dup", "h", handler) for _ in range(5)])
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert [body for body, _ in results] == [{"ok": 1}] * 5
+    assert sorted(replayed for _, replayed in results) == [False] + [True] * 4
+    with pytest.raises(IdempotencyConflict):
+        asyncio.run(store.run("t:dup", "other-hash", handler))
+
+
+def test_in_flight_timeout_and_failed_leader():
+    cache = AsyncCache(url=None, store=MemoryStore())
+    store = IdempotencyStore(cache=cache, wait_timeout=0.05, poll_interval=0.01)
+
+    async def ok():
+        return {"ok": True}
+
+    async def boom():
+        raise RuntimeError("downstream failed")
+
+    async def scenario():
+        await cache.add("idem:t:busy:lock", "someone-else", ex=30)
+        with pytest.raises(IdempotencyInFlight):
+            await store.run("t:busy", "h", ok)
+        with pytest.raises(RuntimeError):
+            await store.run("t:fail", "h", boom)
+        # The failed leader released its lock, so a retry executes
+        assert await store.run("t:fail", "h", ok) == ({"ok": True}, False)
+
+    asyncio.run(scenario())
+
+
+def test_route_reports_in_flight_conflict(monkeypatch):
+    store = get_idempotency_store()
+    monkeypatch.setattr(store, "wait_timeout", 0)
+    asyncio.run(store.cache.add("idem:convert:busy-key:lock", "other", ex=30))
+    r = client.post("/api/convert", json=CONVERT, headers={"Idempotency-Key": "busy-key"})
+    assert r.status_code == 409
+
+
+def test_lock_is_renewed_for_slow_handlers_and_only_released_by_its_holder():
+    cache = AsyncCache(url=None, store=MemoryStore())
+    store = IdempotencyStore(cache=cache, lock_ttl=0.1, poll_interval=0.01)
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.35)  # several lock TTLs
+        return {"n": len(calls)}
+
+    async def duplicates():
+        await async_engine.dispose()  # a fresh pool on this loop
+        first = asyncio.create_task(store.run("t:slow", "h", slow))
+        await asyncio.sleep(0.2)  # the original TTL has long passed
+        try:
+            return await asyncio.gather(first, store.run("t:slow", "h", slow))
+        finally:
+            # Waiting on the single in-memory connection binds its pool to this loop
+            await async_engine.dispose()
+
+    assert asyncio.run(duplicates()) == [({"n": 1}, False), ({"n": 1}, True)]
+    assert calls == [1]
+
+    async def stolen():
+        # The lock expires and changes hands while this handler is still running
+        await cache.set("idem:t:stolen:lock", "other-token", ex=30)
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    async def lost_lock():
+        store.lock_ttl = 0.03
+        await store.run("t:stolen", "h", stolen)
+        return await cache.get("idem:t:stolen:lock")
+
+    # Renewal stops, and the new holder's lock survives the original request finishing
+    assert asyncio.run(lost_lock()) == "other-token"
+
+
+def test_a_stored_response_is_never_overwritten():
+    store = IdempotencyStore(cache=AsyncCache(url=None, store=MemoryStore()))
+
+    async def save_twice():
+        await store._save("t:first-wins", "h", {"n": 1})
+        await store.cache.delete("idem:t:first-wins")
+        await store._save("t:first-wins", "h", {"n": 2})  # e.g. a duplicate after lock loss
+        return await store._load("t:first-wins")
+
+    assert asyncio.run(save_twice()) == {"hash": "h", "body": {"n": 1}}
+    with get_session() as s:
+        assert s.get(IdempotencyRecord, "t:first-wins").response_body == '{"n": 1}'
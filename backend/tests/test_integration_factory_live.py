@@ -13,6 +13,12 @@ def reset_settings_cache():
         pass
 
 
+def reset_client_caches(factory):
+    # Clients are process-wide singletons; drop them so the next call re-reads flags
+    for get in (factory.get_daraja_client, factory.get_cctp_client, factory.get_hedera_client):
+        get.cache_clear()
+
+
 def test_factory_returns_live_when_flags_disabled(monkeypatch):
     # Force flags to disable stubs
     monkeypatch.setenv("USE_STUB_DARAJA", "false")
@@ -41,7 +47,6 @@ def test_factory_returns_live_when_flags_disabled(monkeypatch):
         for fn in (
             lambda: d.simulate_debit("+254700000000", 1.0),
             lambda: c.initiate_burn("ethereum", 1.0),
-            lambda: c.fetch_attestation("tx123"),
             lambda: c.mint_on_destination("hedera", "att"),
             lambda: h.mint("USDC", 1.0),
             lambda: h.burn("USDC", 1.0),
@@ -56,6 +61,7 @@ def test_factory_returns_live_when_flags_disabled(monkeypatch):
         monkeypatch.setattr(factory, "CCTPLive", None)
         monkeypatch.setattr(factory, "HederaLive", None)
         # With flags still false, factory should still return stubs if live is None
+        reset_client_caches(factory)
         from app.integrations.daraja import DarajaClient as DarajaStub
         from app.integrations.cctp import CCTPClient as CCTPStub
         from app.integrations.hedera import HederaClient as HederaStub
@@ -66,3 +72,4 @@ def test_factory_returns_live_when_flags_disabled(monkeypatch):
     finally:
         # Reset cached settings so other tests see defaults (stubs enabled)
         reset_settings_cache()
+        reset_client_caches(factory)
@@ -0,0 +1,144 @@
+import threading
+from decimal import Decimal
+
+import pytest
+
+from app.core.db import SessionLocal
+from app.models.db_models import BalanceSnapshot, LedgerEntry, User, Wallet
+from app.services.ledger import LedgerEngine, LedgerTransaction, Posting, get_ledger
+from app.services.wallet import WalletService
+from app.utils.money import from_minor, to_minor
+
+
+def transfer(tx_id, src, dst, minor, asset="LOCAL"):
+    return LedgerTransaction(tx_id, [Posting(src, asset, -minor), Posting(dst, asset, minor)])
+
+
+def test_money_minor_units():
+    assert to_minor(10.05, "LOCAL") == 1005
+    assert to_minor("0.0000005", "USDC") == 1
+    assert to_minor(Decimal("1.234"), "unknown") == 123
+    assert from_minor(1_500_000, "USDC") == Decimal("1.5")
+
+
+def test_unbalanced_transactions_rejected():
+    ledger = LedgerEngine()
+    with pytest.raises(ValueError):
+        ledger.post(LedgerTransaction("t", [Posting("a", "LOCAL", 1)]))
+    with pytest.raises(ValueError):
+        ledger.post(
+            LedgerTransaction("t", [Posting("a", "LOCAL", -5), Posting("b", "LOCAL", 4)])
+        )
+
+
+def test_balances_use_snapshots_plus_delta():
+    ledger = LedgerEngine(snapshot_every=3)
+    ledger.post_many([transfer(f"s{i}", "snap:src", "snap:dst", 100) for i in range(4)])
+    ledger.post(transfer("s4", "snap:src", "snap:dst", 50))
+    assert ledger.balance("snap:dst", "LOCAL") == 450
+    assert ledger.balance("snap:src", "LOCAL") == -450
+    with SessionLocal() as s:
+        snaps = s.query(BalanceSnapshot).filter_by(account="snap:dst").all()
+    assert [sn.balance_minor for sn in snaps] == [400]
+
+    ledger.snapshot([("snap:dst", "LOCAL"), ("snap:none", "LOCAL")])
+    assert ledger.balance("snap:dst", "LOCAL") == 450
+    assert ledger.balance("snap:none", "LOCAL") == 0
+
+
+def test_group_commit_coalesces_concurrent_posters():
+    ledger = LedgerEngine()
+    writes = []
+    original = ledger._write
+
+    def slow_write(txs):
+        writes.append(len(txs))
+        if len(writes) == 1:
+            gate.wait(5)
+        original(txs)
+
+    gate = threading.Event()
+    ledger._write = slow_write
+    first = threading.Thread(target=ledger.post, args=(transfer("g0", "gc:a", "gc:b", 1),))
+    first.start()
+    while not writes:
+        pass
+    others = [
+        threading.Thread(target=ledger.post, args=(transfer(f"g{i}", "gc:a", "gc:b", 1),))
+        for i in range(1, 6)
+    ]
+    for t in others:
+        t.start()
+    while len(ledger._pending) < 5:
+        pass
+    gate.set()
+    for t in [first, *others]:
+        t.join(5)
+    # The first writer committed alone; the five queued behind it shared one batch
+    assert writes == [1, 5]
+    assert ledger.balance("gc:b", "LOCAL") == 6
+
+
+def test_failed_batch_error_reaches_every_caller():
+    ledger = LedgerEngine()
+
+    def broken(txs):
+        raise RuntimeError("db down")
+
+    ledger._write = broken
+    with pytest.raises(RuntimeError):
+        ledger.post(transfer("f0", "x", "y", 1))
+
+
+def test_convert_writes_balanced_postings():
+    tx_id = WalletService().convert(
+        "ledger-user", "m-pesa", "safaricom", 130.0, "usdc", None, "fast"
+    )
+    with SessionLocal() as s:
+        rows = s.query(LedgerEntry).filter_by(tx_id=tx_id).all()
+    assert len(rows) == 4
+    assert sum(r.amount_minor for r in rows if r.asset == "LOCAL") == 0
+    assert sum(r.amount_minor for r in rows if r.asset == "USDC") == 0
+    assert get_ledger().balance("wallet:ledger-user", "USDC") == to_minor(130 * 0.0077, "USDC")
+    assert get_ledger().balance("pool:safaricom", "LOCAL") >= 13000
+
+
+def test_each_token_converts_at_its_own_rate():
+    w = WalletService()
+    for token, rate in [("CNGN", 11.9), ("xaut", 0.0000029), ("USDC", 0.0077)]:
+        tx_id = w.convert("fx-user", "m-pesa", "safaricom", 1000.0, token, None, "fast")
+        with SessionLocal() as s:
+            credit = s.query(LedgerEntry).filter_by(tx_id=tx_id, account="wallet:fx-user").one()
+        assert credit.asset == token.upper()
+        assert credit.amount_minor == to_minor(1000 * rate, token)
+    with pytest.raises(ValueError, match="unsupported token"):
+        w.convert("fx-user", "m-pesa", "safaricom", 10.0, "DOGE", None, "fast")
+
+
+def test_wallet_postings_carry_the_registered_users_wallet_id():
+    with SessionLocal() as s:
+        user = User(phone="+254700700707", pin_hash="x")
+        s.add(user)
+        s.commit()
+        uid = user.id
+    w = WalletService()
+    first = w.convert(str(uid), "m-pesa", "safaricom", 10.0, "USDC", None, "fast")
+    second = w.convert(str(uid), "m-pesa", "safaricom", 20.0, "USDC", None, "fast")
+    anonymous = w.convert("999999", "m-pesa", "safaricom", 20.0, "USDC", None, "fast")
+    with SessionLocal() as s:
+        wallet = s.query(Wallet).filter_by(user_id=uid).one()  # created once, on first use
+        rows = s.query(LedgerEntry).filter(LedgerEntry.tx_id.in_([first, second, anonymous]))
+        tagged = {(r.tx_id, r.account): r.wallet_id for r in rows if r.wallet_id is not None}
+    assert tagged == {(first, f"wallet:{uid}"): wallet.id, (second, f"wallet:{uid}"): wallet.id}
+
+
+def test_failed_snapshot_does_not_fail_committed_postings(caplog):
+    ledger = LedgerEngine(snapshot_every=2)
+
+    def broken(accounts):
+        raise RuntimeError("snapshot failed")
+
+    ledger.snapshot = broken
+    ledger.post_many([transfer(f"sf{i}", "sf:a", "sf:b", 5) for i in range(2)])
+    assert ledger.balance("sf:b", "LOCAL") == 10
+    assert "balance snapshot failed" in caplog.text
@@ -16,3 +16,6 @@ def test_cache_in_memory_fallback():
     assert c.get("a") == "1"
     assert c.incr("a:count") == 1
     assert c.incr("a:count") == 2
+    assert c.delete("a", "missing") == 1
+    assert c.get("a") is None
+    assert c.delete() == 0
@@ -0,0 +1,406 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, select
+
+from app.core.cache import Cache, get_cache
+from app.core.db import async_engine, get_session
+from app.integrations.cctp import CCTPClient
+from app.integrations.daraja import DarajaClient
+from app.integrations.hedera import HederaClient
+from app.main import app
+from app.models.db_models import LiquidityPoolRecord, PoolJournalEntry
+from app.services.attestation import AttestationPoller
+from app.services.conversion import AWAITING_PAYMENT, ConversionPipeline
+from app.services.daraja_callbacks import DarajaCallback
+from app.services.liquidity import LiquidityService
+from app.services.pools import FORWARD_KEY, InsufficientLiquidity, PoolEngine, PoolsLeased
+from app.services.wallet import WalletService
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def _no_leftover_pools(pool_lease):
+    # Pools that exist in the DB are tracked (and limit conversions) in every later engine
+    yield
+    with get_session() as session:
+        session.execute(delete(PoolJournalEntry))
+        session.execute(delete(LiquidityPoolRecord))
+
+
+@pytest.fixture(autouse=True)
+def _test_tokens(monkeypatch):
+    # Throwaway tokens keep each test's pools apart; they convert at the USDC rate
+    rates = {t: "FX_USDC_PER_LOCAL" for t in ("USDC", "PLTK", "PLTX", "UNTRACKED")}
+    monkeypatch.setattr("app.services.wallet.FX_RATE_SETTINGS", rates)
+
+
+def _run(main):
+    async def scenario():
+        try:
+            return await main()
+        finally:
+            # The in-memory DB's single aiosqlite connection binds to the loop using it
+            await async_engine.dispose()
+
+    return asyncio.run(scenario())
+
+
+def _row(name: str) -> dict:
+    with get_session() as session:
+        row = session.scalars(
+            select(LiquidityPoolRecord).where(LiquidityPoolRecord.name == name)
+        ).one()
+        columns = ("balance", "balance_minor", "reserved_minor", "applied_seq")
+        return {c: getattr(row, c) for c in columns}
+
+
+def _journal() -> list[tuple[str, str | None]]:
+    with get_session() as session:
+        return [
+            (e.op, e.reservation_id)
+            for e in session.scalars(select(PoolJournalEntry).order_by(PoolJournalEntry.id))
+        ]
+
+
+def test_reserve_commit_release_and_limits():
+    pools = PoolEngine()
+    pools.credit("kes-float", 1000, asset="KES")
+    pools.credit("kes-float", "500.50", asset="KES")  # existing pool: asset is ignored
+    assert pools.reserve("kes-float", 600, "cv-1") is True
+    assert pools.reserve("kes-float", 600, "cv-1") is True  # same id: held once
+    with pytest.raises(InsufficientLiquidity, match="900.50 KES available"):
+        pools.reserve("kes-float", 901, "cv-2")
+    assert pools.reserve("kes-float", 900.50, "cv-2") is True
+    assert pools.snapshot("kes-float")["available"] == Decimal("0.00")
+
+    assert pools.commit("cv-1") is True
+    assert pools.release("cv-2") is True
+    assert pools.commit("cv-1") is False and pools.release("cv-unknown") is False
+    assert pools.snapshot("kes-float") == {
+        "pool": "kes-float",
+        "asset": "KES",
+        "balance": Decimal("900.50"),
+        "reserved": Decimal("0.00"),
+        "available": Decimal("900.50"),
+    }
+    # Untracked pools are not limited and hold nothing
+    assert pools.reserve("no-such-pool", 10**9, "cv-3") is False
+    assert pools.commit("cv-3") is False
+    with pytest.raises(ValueError, match="positive"):
+        pools.reserve("kes-float", 0, "cv-4")
+
+
+def test_transfers_are_all_or_nothing():
+    pools = PoolEngine()
+    pools.credit("usdc-eth", 100, asset="USDC")
+    pools.credit("usdc-hedera", 1, asset="USDC")
+    pools.credit("kes-mpesa", 1, asset="KES")
+    pools.transfer("usdc-eth", "usdc-hedera", "40.123456")
+    with pytest.raises(InsufficientLiquidity):
+        pools.transfer("usdc-eth", "usdc-hedera", 60)
+    assert pools.snapshot("usdc-eth")["balance"] == Decimal("59.876544")
+    assert pools.snapshot("usdc-hedera")["balance"] == Decimal("41.123456")  # credit undone
+    with pytest.raises(ValueError, match="cannot move USDC into a KES pool"):
+        pools.transfer("usdc-eth", "kes-mpesa", 1)
+    with pytest.raises(KeyError):
+        pools.transfer("usdc-eth", "nowhere", 1)
+    with pytest.raises(KeyError):
+        pools.transfer("nowhere", "usdc-eth", 1)
+
+
+def test_concurrent_reservations_never_overdraw():
+    pools = PoolEngine()
+    pools.credit("hot", 500)
+
+    def hold(i: int) -> bool:
+        try:
+            return pools.reserve("hot", 10, f"hold-{i}")
+        except InsufficientLiquidity:
+            return False
+
+    with ThreadPoolExecutor(4) as ex:  # the in-memory test DB keeps 5 connections
+        held = list(ex.map(hold, range(200)))
+    assert sum(held) == 50
+    assert pools.snapshot("hot")["available"] == 0
+    # Every acknowledged hold is journaled, with unique sequence numbers
+    assert [op for op, _ in _journal()].count("reserve") == 50
+
+
+def test_journal_replays_after_a_crash_and_write_back_compacts_it(pool_lease):
+    first = PoolEngine()
+    first.credit("treasury", 300)
+    first.reserve("treasury", 100, "cv-a")
+    first.reserve("treasury", 50, "cv-b")
+    first.commit("cv-a")
+    assert _row("treasury")["balance_minor"] == 0  # nothing written back yet
+
+    # "Crash": a new engine rebuilds balances and open holds from the journal alone
+    pool_lease()
+    second = PoolEngine(forward_timeout=0.05)
+    assert second.snapshot("treasury")["balance"] == Decimal("200.00")
+    assert second.snapshot("treasury")["reserved"] == Decimal("50.00")
+    assert second.flush() == 4
+    assert second.flush() == 0
+    row = _row("treasury")
+    assert (row["balance_minor"], row["reserved_minor"], row["balance"]) == (20000, 5000, 200.0)
+    assert _journal() == [("reserve", "cv-b")]  # only the open hold is still needed
+    # The hold is rebuilt from the journal but its amount comes from the row, not a replay
+    pool_lease()
+    restarted = PoolEngine()
+    assert restarted.snapshot("treasury")["reserved"] == Decimal("50.00")
+    assert restarted._reservations == {"cv-b": ("treasury", 5000)}
+
+    # The engine it took over from can no longer write; it forwards to the new owner,
+    # which is not serving followers here
+    with pytest.raises(PoolsLeased, match="taken over"):
+        second.credit("treasury", 1)
+    with pytest.raises(PoolsLeased, match="did not answer snapshot within 0.05s"):
+        second.snapshot("treasury")
+    restarted.credit("treasury", 1)
+    assert restarted.release("cv-b") is True
+    assert restarted.flush() == 2
+    assert _journal() == []
+    restarted.relinquish()
+    third = PoolEngine()
+    third.load()
+    third.load()  # idempotent
+    assert third.snapshot("treasury")["available"] == Decimal("201.00")
+    # Journal ids keep increasing past the applied watermark after compaction
+    third.credit("treasury", 1)
+    with get_session() as session:
+        assert session.scalar(select(PoolJournalEntry.id)) > _row("treasury")["applied_seq"]
+
+
+def test_one_engine_owns_the_pools(pool_lease):
+    owner = PoolEngine()
+    owner.credit("owned", 10)
+    rival = PoolEngine(forward_timeout=0.05)
+    with pytest.raises(PoolsLeased, match="owned by another"):
+        rival.load()
+
+    async def follows():
+        await rival.start()  # no PoolsLeased: it starts as a follower
+        assert rival._flusher is not None and not rival._loaded
+        await rival.stop()
+
+    _run(follows)
+    pool_lease()  # the owner stalled past its lease
+    # Its forward goes unanswered, so the rival takes the lapsed claim over
+    assert rival.snapshot("owned")["balance"] == Decimal("10.00")
+    with pytest.raises(PoolsLeased, match="taken over"):
+        owner.flush()  # its unflushed credit is replayed by the rival instead
+    assert rival.flush() == 1 and rival.flush() == 0  # an idle write-back renews the claim
+    pool_lease()
+    PoolEngine().load()
+    with pytest.raises(PoolsLeased, match="taken over"):
+        rival.flush()
+
+
+def test_failed_journal_append_undoes_the_change(pool_lease):
+    pools = PoolEngine()
+    pools.credit("fragile", 100)
+    pools.reserve("fragile", 30, "kept")
+    real = pools._write
+
+    def broken(ops):
+        raise RuntimeError("disk I/O error")
+
+    pools._write = broken  # type: ignore[method-assign]
+    with pytest.raises(RuntimeError):
+        pools.reserve("fragile", 50, "lost")
+    with pytest.raises(RuntimeError):
+        pools.commit("kept")
+    pools._write = real  # type: ignore[method-assign]
+    assert pools.snapshot("fragile")["available"] == Decimal("70.00")
+    assert pools.commit("kept") is True and pools.commit("lost") is False
+    pool_lease()
+    assert PoolEngine().snapshot("fragile")["balance"] == Decimal("70.00")
+
+
+class FlakyCache(Cache):
+    """The shared in-memory cache, whose first blocking pop fails."""
+
+    def __init__(self):
+        super().__init__(url=None)
+        self._store = get_cache()._store
+        self.failures = 1
+
+    def pop(self, key, timeout):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("redis unavailable")
+        return super().pop(key, timeout)
+
+
+def test_followers_forward_operations_to_the_owner(pool_lease, caplog):
+    owner = PoolEngine(flush_interval=0.02, cache=FlakyCache())
+    follower = PoolEngine(flush_interval=0.02, forward_timeout=2)
+    owner.credit("shared", 100)
+    # A request its follower gave up on before the owner got to it is skipped
+    stale = {"op": "credit", "args": ["shared", "1", "LOCAL"], "reply": "gone", "until": 0}
+    get_cache().push(FORWARD_KEY, json.dumps(stale), ex=5)
+
+    async def run():
+        await owner.start()
+        await follower.start()  # a second worker starts while the owner holds the pools
+        call = asyncio.to_thread
+        assert await call(follower.reserve, "shared", Decimal("60"), "fw-1") is True
+        with pytest.raises(InsufficientLiquidity, match="40.00"):
+            await call(follower.reserve, "shared", 50, "fw-2")
+        with pytest.raises(KeyError):
+            await call(follower.transfer, "shared", "nowhere", 1)
+        with pytest.raises(ValueError, match="cannot be forwarded"):
+            await call(follower._forward, "relinquish")
+        held = await call(follower.snapshot, "shared")
+        assert await call(follower.release, "fw-1") is True
+        assert await call(follower.commit, "fw-1") is False
+        await call(follower.credit, "shared-2", 5)
+        assert await call(follower.tracked, "shared-2")
+        await call(follower.create_pool, "shared-3", "LOCAL")
+        every = await call(follower.snapshots)
+        await follower.stop()
+        await owner.stop()  # hands the pools over: the follower's next call takes them
+        return held, every, await call(follower.snapshot, "shared")
+
+    held, every, taken = _run(run)
+    assert held["available"] == Decimal("40.00") and owner.owner != follower.owner
+    assert {s["pool"]: s["balance"] for s in every} == {
+        "shared": Decimal("100.00"), "shared-2": Decimal("5.00"), "shared-3": Decimal("0.00")
+    }
+    assert follower._loaded and taken["available"] == Decimal("100.00")
+    assert "could not read forwarded pool operations" in caplog.text
+
+
+def test_write_behind_task_flushes_and_survives_errors():
+    pools = PoolEngine(flush_interval=0.01)
+    pools.credit("behind", 10)
+    real = pools.flush
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        return real()
+
+    pools.flush = flaky  # type: ignore[method-assign]
+
+    async def run():
+        await pools.start()
+        await pools.start()  # idempotent
+        for _ in range(200):
+            if len(calls) > 2:  # the retry has run; read the table only once stopped
+                break
+            await asyncio.sleep(0.01)
+        pools.credit("behind", 5)
+        await pools.stop()
+        await pools.stop()
+
+    _run(run)
+    assert len(calls) > 2
+    assert _row("behind")["balance"] == 15.0  # stop() writes back what is left
+
+
+def _pipeline(pools: PoolEngine, hedera=None, **kw) -> ConversionPipeline:
+    cctp = CCTPClient()
+    clients = {"daraja": DarajaClient(), "cctp": cctp, "hedera": hedera or HederaClient()}
+    poller = AttestationPoller(client=cctp, min_delay=0.01, max_delay=0.05)
+    return ConversionPipeline(clients=clients, poller=poller, pools=pools, **kw)
+
+
+class BrokenHedera(HederaClient):
+    def mint(self, token, amount):
+        raise RuntimeError("hedera unavailable")
+
+
+def test_conversions_hold_pool_liquidity_until_settled_or_failed():
+    pools = PoolEngine()
+    pools.credit("PLTK", 1)  # 1 PLTK covers conversions up to ~129 KES
+    ok = _pipeline(pools, wallet=WalletService())
+    broken = _pipeline(pools, hedera=BrokenHedera(), retry_base=0.01, max_attempts=1)
+
+    async def submit(pipeline, amount):
+        return await pipeline.submit(
+            "pool-user", "m-pesa", None, amount, "pltk", None, "fast", phone="+254700000004"
+        )
+
+    async def paid(pipeline, tx_id, ok=True):
+        assert await pipeline.advance(tx_id) == AWAITING_PAYMENT
+        conv = await pipeline.get(tx_id)
+        await pipeline.reconcile([DarajaCallback("stk", conv.checkout_id, ok, conv.amount)])
+
+    async def run():
+        tx_id = await submit(ok, 100)  # 0.77 PLTK held
+        with pytest.raises(InsufficientLiquidity):
+            await submit(ok, 50)
+        await paid(ok, tx_id)
+        assert await ok.advance(tx_id) == "burned"
+        await ok._parked[tx_id]
+        assert await ok.advance(tx_id) == "completed"
+        after_settle = pools.snapshot("PLTK")
+
+        declined = await submit(ok, 20)
+        await paid(ok, declined, ok=False)
+        after_decline = pools.snapshot("PLTK")
+
+        failing = await submit(broken, 20)
+        await paid(broken, failing)
+        assert await broken.advance(failing) == "burned"
+        await broken._parked[failing]
+        assert await broken.advance(failing) == "failed"
+        await ok.stop()
+        await broken.stop()
+        return after_settle, after_decline
+
+    after_settle, after_decline = _run(run)
+    assert after_settle["balance"] == Decimal("0.23") and after_settle["reserved"] == 0
+    assert after_decline["available"] == Decimal("0.23")  # a declined STK push released
+    assert pools.snapshot("PLTK")["available"] == Decimal("0.23")  # failure released
+
+
+def test_failed_insert_releases_the_hold():
+    pools = PoolEngine()
+    pools.credit("PLTX", 100)
+
+    class NoDatabase:
+        def __call__(self):
+            raise ConnectionError("database unavailable")
+
+    pipeline = _pipeline(pools)
+    pipeline.session_factory = NoDatabase()
+
+    async def run():
+        for token in ("PLTX", "UNTRACKED"):  # untracked pool: nothing to release
+            with pytest.raises(ConnectionError):
+                await pipeline.submit("pool-user", "m-pesa", None, 50, token, None, "fast", "0700")
+
+    _run(run)
+    assert pools.snapshot("PLTX")["reserved"] == 0
+
+
+def test_rebalance_moves_tracked_pools(monkeypatch):
+    pools = PoolEngine()
+    pools.credit("reb-src", 100)
+    pools.credit("reb-dst", 0.01)
+    monkeypatch.setattr("app.services.liquidity.get_pool_engine", lambda: pools)
+    body = {"sourcePool": "reb-src", "destPool": "reb-dst", "amount": 60}
+    r = client.post("/api/liquidity/rebalance", json=body)
+    assert r.status_code == 200 and r.json()["status"] == "executed"
+    r = client.post("/api/liquidity/rebalance", json=body)
+    assert r.status_code == 400 and "available" in r.json()["detail"]
+    assert pools.snapshot("reb-dst")["balance"] == Decimal("60.01")
+    # A pool outside the engine (e.g. an exchange desk) is left to the order's executor
+    _, status = LiquidityService(pools).rebalance("reb-src", "external-desk", 1, None, None)
+    assert status == "placed"
+
+
+def test_pool_engine_is_shared():
+    from app.services.pools import get_pool_engine
+
+    assert get_pool_engine() is get_pool_engine()
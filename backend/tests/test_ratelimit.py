@@ -0,0 +1,193 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.cache import AsyncCache, MemoryStore
+from app.core.ratelimit import (
+    JSON_BODY_LIMIT,
+    RATE_LIMITED_TOTAL,
+    Limit,
+    MemoryGCRA,
+    RateLimiter,
+    _read_json,
+    get_rate_limiter,
+    identify,
+)
+from app.main import app
+
+client = TestClient(app)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _limiter(**kw) -> RateLimiter:
+    kw.setdefault("period", 60)
+    return RateLimiter(cache=AsyncCache(url=None, store=MemoryStore()), **kw)
+
+
+def test_gcra_admits_a_burst_then_one_request_per_interval():
+    clock = Clock()
+    gcra = MemoryGCRA(clock=clock)
+    check = [("k", Limit("phone", 3, 60))]
+    assert [gcra.hit(check) for _ in range(3)] == [(0.0, None)] * 3
+    wait, refused = gcra.hit(check)
+    assert refused == "phone" and wait == pytest.approx(20)
+    clock.now += 19
+    assert gcra.hit(check)[1] == "phone"  # refusals did not push the key further out
+    clock.now += 1
+    assert gcra.hit(check) == (0.0, None)
+    assert gcra.hit(check)[1] == "phone"
+
+    with pytest.raises(ValueError):
+        Limit("phone", 0, 60)
+    with pytest.raises(ValueError):
+        Limit("phone", 1, 0)
+
+
+def test_a_refused_request_counts_against_none_of_its_keys():
+    clock = Clock()
+    gcra = MemoryGCRA(clock=clock)
+    phone, operator = ("p", Limit("phone", 1, 10)), ("o", Limit("operator", 2, 10))
+    assert gcra.hit([phone, operator]) == (0.0, None)
+    assert gcra.hit([phone, operator])[1] == "phone"
+    assert gcra.hit([("p2", phone[1]), operator]) == (0.0, None)  # operator still had room
+    wait, refused = gcra.hit([("p3", phone[1]), operator])
+    assert refused == "operator" and wait == pytest.approx(5)
+
+
+def test_expired_keys_are_swept_as_the_table_grows():
+    clock = Clock()
+    gcra = MemoryGCRA(clock=clock, min_sweep=4)
+    limit = Limit("api_key", 10, 1)
+    for i in range(3):
+        gcra.hit([(f"old{i}", limit)])
+    clock.now += 1
+    gcra.hit([("new0", limit)])  # the fourth key triggers a sweep of the idle ones
+    assert len(gcra) == 1
+    for i in range(1, 8):
+        gcra.hit([(f"new{i}", limit)])
+    assert len(gcra) == 8  # all live: nothing to drop, the next sweep waits for 2x
+
+
+def test_identities_are_normalized_into_keys():
+    limiter = _limiter(phone=5, operator=5, api_key=5)
+    same = {key for p in ("+254712345678", "254712345678", "0712 345 678")
+            for key, _ in limiter.checks(phone=p)}
+    assert same == {"rl:phone:712345678"}
+    [(key, limit)] = limiter.checks(api_key="secret-key")
+    assert key.startswith("rl:key:") and "secret" not in key and limit.scope == "api_key"
+    assert limiter.checks(operator="MPESA")[0][0] == "rl:operator:mpesa"
+    assert limiter.checks(phone="n/a") == []
+
+    off = _limiter(phone=0, operator=5, api_key=5)
+    assert off.phone is None and off.reads_body
+    assert off.checks(phone="0712345678") == []
+    disabled = _limiter(enabled=False)
+    assert not disabled.active and not disabled.reads_body
+
+    default = get_rate_limiter()
+    assert default is get_rate_limiter()
+    assert (default.phone.count, default.phone.period) == (30, 60)
+
+
+def test_phone_limit_on_ussd_answers_429_with_retry_after(monkeypatch):
+    limiter = _limiter(phone=2)
+    monkeypatch.setattr("app.core.ratelimit.get_rate_limiter", lambda: limiter)
+    refused = RATE_LIMITED_TOTAL.labels(scope="phone")._value.get()
+    statuses = []
+    for i, phone in enumerate(["+254711000001", "0711000001", "254711000001"]):
+        r = client.post(
+            "/api/ussd/session", json={"sessionId": f"rl-{i}", "phone": phone, "input": ""}
+        )
+        statuses.append(r.status_code)
+    assert statuses == [200, 200, 429]  # the handler still got the replayed body
+    assert r.headers["Retry-After"] == "30"
+    assert r.json() == {"detail": "Too many requests for this phone"}
+    assert "X-Request-ID" in r.headers  # refused inside the request-context middleware
+    assert RATE_LIMITED_TOTAL.labels(scope="phone")._value.get() == refused + 1
+
+    # Another phone is unaffected
+    r = client.post(
+        "/api/ussd/session", json={"sessionId": "rl-x", "phone": "+254711000002", "input": ""}
+    )
+    assert r.status_code == 200
+
+
+def test_operator_and_api_key_limits(monkeypatch):
+    limiter = _limiter(operator=2, api_key=3)
+    monkeypatch.setattr("app.core.ratelimit.get_rate_limiter", lambda: limiter)
+    # Operator from the path, then from a conversion's `from` leg
+    assert client.get("/api/operators/RL-Op/summary").status_code == 200
+    body = {"userId": "u1", "from": {"rail": "mpesa", "operator": "rl-op", "amount": 10},
+            "to": {"token": "USDC"}}
+    assert client.post("/api/convert", json=body).status_code != 429
+    r = client.post("/api/convert", json=body)
+    assert r.status_code == 429 and r.json()["detail"].endswith("operator")
+
+    headers = {"X-API-Key": "rl-key"}
+    assert [client.get("/healthz", headers=headers).status_code for _ in range(4)] == [
+        200, 200, 200, 429
+    ]
+    assert client.get("/healthz").status_code == 200  # no identity, nothing to limit
+    assert client.get("/healthz", headers={"X-API-Key": "other"}).status_code == 200
+
+
+def test_disabled_limits_and_unreadable_bodies_pass_through(monkeypatch):
+    limiter = _limiter(enabled=False)
+    monkeypatch.setattr("app.core.ratelimit.get_rate_limiter", lambda: limiter)
+    for _ in range(3):
+        assert client.get("/healthz", headers={"X-API-Key": "k"}).status_code == 200
+
+    limiter = _limiter(phone=1)
+    monkeypatch.setattr("app.core.ratelimit.get_rate_limiter", lambda: limiter)
+    # Not JSON / not an object / no phone: the request goes on to validation
+    for content in (b"not json", b"[1, 2]", json.dumps({"phone": 254711}).encode(), b""):
+        r = client.post(
+            "/api/kyc/verify", content=content, headers={"Content-Type": "application/json"}
+        )
+        assert r.status_code == 422
+    assert identify(json.dumps({"operator": "x", "from": {"operator": "y"}}).encode()) == (
+        None, "x"
+    )
+    assert identify(json.dumps({"from": {"phone": "0711", "operator": "y"}}).encode()) == (
+        "0711", "y"
+    )
+
+
+def test_read_json_replays_bodies_and_leaves_large_ones_alone():
+    def source(messages):
+        pending = list(messages)
+
+        async def receive():
+            return pending.pop(0)
+
+        return receive
+
+    async def drain(receive, n):
+        return [await receive() for _ in range(n)]
+
+    chunks = [
+        {"type": "http.request", "body": b'{"phone": ', "more_body": True},
+        {"type": "http.request", "body": b'"0711"}', "more_body": False},
+        {"type": "http.disconnect"},
+    ]
+    body, replay = asyncio.run(_read_json(source(chunks)))
+    assert body == b'{"phone": "0711"}'
+    assert asyncio.run(drain(replay, 3)) == chunks  # read ones replayed, then the source
+
+    big = [{"type": "http.request", "body": b"x" * JSON_BODY_LIMIT, "more_body": True}] * 3
+    body, replay = asyncio.run(_read_json(source(big)))
+    assert body is None
+    assert asyncio.run(drain(replay, 3)) == big
+
+    cut = [{"type": "http.request", "body": b"{", "more_body": True}, {"type": "http.disconnect"}]
+    body, replay = asyncio.run(_read_json(source(cut)))
+    assert body is None and asyncio.run(drain(replay, 2)) == cut
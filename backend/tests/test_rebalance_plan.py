@@ -0,0 +1,200 @@
+import asyncio
+import random
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete
+
+from app.core.cache import AsyncCache, MemoryStore
+from app.core.db import get_session
+from app.main import app
+from app.models.db_models import LiquidityPoolRecord, PoolJournalEntry
+from app.services.flows import FlowStore, get_flow_store
+from app.services.forecast import ForecastService
+from app.services.ledger import LedgerTransaction, Posting
+from app.services.forecast_cache import ForecastCache
+from app.services.pools import PoolEngine
+from app.services.rebalance_plan import PoolState, RebalancePlanner, Route, min_cost_flow, solve
+
+client = TestClient(app)
+
+
+def _residual_is_optimal(n, arcs, flows, s, t) -> bool:
+    """Max flow (no s-t path left) with no negative-cost cycle in the residual graph."""
+    residual = []
+    for (u, v, cap, cost), f in zip(arcs, flows):
+        assert 0 <= f <= cap
+        if f < cap:
+            residual.append((u, v, cost))
+        if f:
+            residual.append((v, u, -cost))
+    reach, stack = {s}, [s]
+    while stack:
+        u = stack.pop()
+        for a, b, _ in residual:
+            if a == u and b not in reach:
+                reach.add(b)
+                stack.append(b)
+    dist = [0] * n  # Bellman-Ford from a virtual root joined to every node
+    for _ in range(n):
+        changed = False
+        for a, b, c in residual:
+            if dist[a] + c < dist[b]:
+                dist[b] = dist[a] + c
+                changed = True
+        if not changed:
+            return t not in reach
+    return False
+
+
+def test_min_cost_flow_is_optimal_on_random_graphs():
+    rnd = random.Random(11)
+    for _ in range(40):
+        n = rnd.randint(3, 9)
+        s, t = 0, n - 1
+        arcs = [
+            (u, v, rnd.randint(0, 20), rnd.randint(0, 9))
+            for u in range(n)
+            for v in range(n)
+            if u != v and rnd.random() < 0.4
+        ]
+        flows = min_cost_flow(n, arcs, s, t)
+        balance = [0] * n
+        for (u, v, _, _), f in zip(arcs, flows):
+            balance[u] -= f
+            balance[v] += f
+        assert all(b == 0 for i, b in enumerate(balance) if i not in (s, t))
+        assert _residual_is_optimal(n, arcs, flows, s, t)
+
+
+def _pool(name, available, net_flow=0, min_balance=0, asset="USDC"):
+    return PoolState(name, asset, available, net_flow, min_balance)
+
+
+def test_solve_routes_through_cheaper_pools_and_respects_capacity():
+    pools = [
+        _pool("a", 1000),
+        _pool("hub", 0),
+        _pool("b", 500, net_flow=-900),  # 400 short
+        _pool("c", 100, net_flow=-150, min_balance=50),  # 100 short
+    ]
+    routes = [
+        Route("a", "b", 30),
+        Route("a", "hub", 5),
+        Route("hub", "b", 5, capacity=300),
+        Route("a", "c", 1),
+    ]
+    plan = solve(pools, routes, fee_bps=10)
+    moved = {(tr["source"], tr["dest"]): tr["amount"] for tr in plan["transfers"]}
+    # 300 via the hub at 10 bps, the other 100 direct at 30
+    assert moved == {("a", "b"): 100, ("a", "hub"): 300, ("hub", "b"): 300, ("a", "c"): 100}
+    assert plan["unmet"] == {"b": 0, "c": 0}
+
+
+def test_solve_reports_what_it_cannot_cover():
+    pools = [_pool("rich", 100, net_flow=500), _pool("dry", 0, net_flow=-300)]
+    plan = solve(pools, None, fee_bps=10)  # forecast inflows cannot be sent ahead
+    assert plan["transfers"] == [
+        {"source": "rich", "dest": "dry", "asset": "USDC", "amount": 100, "fee_bps": 10}
+    ]
+    assert plan["unmet"] == {"dry": 200}
+    assert solve([_pool("ok", 10)], None, fee_bps=10) == {"transfers": [], "unmet": {}}
+
+    with pytest.raises(ValueError, match="duplicate"):
+        solve([_pool("x", 1), _pool("x", 2)], None, fee_bps=10)
+    with pytest.raises(ValueError, match="unknown pool"):
+        solve(pools, [Route("rich", "nowhere", 1)], fee_bps=10)
+    with pytest.raises(ValueError, match="crosses assets"):
+        solve(pools + [_pool("kes", 5, asset="KES")], [Route("rich", "kes", 1)], fee_bps=10)
+
+
+def test_plan_endpoint_uses_forecasts():
+    forecast = ForecastService()
+    names = ["plan-op-1", "plan-op-2", "plan-op-3"]
+    # Outflows at this hour last week: the hour-of-week seasonal term predicts a repeat
+    week_ago = [time.time() - 7 * 24 * 3600] * 3
+    get_flow_store().record_many(names, [-2_000_000, -400_000, -2_500_000], week_ago)
+    flows = {n: asyncio.run(forecast.predict(n, "1h")) for n in names}
+    body = {
+        "window": "1h",
+        "minBalance": 1500,
+        "pools": [
+            {"name": n, "balance": 2000, "asset": "usdc"} for n in names
+        ] + [{"name": "plan-reserve", "balance": 5000, "asset": "USDC", "minBalance": 0}],
+        "routes": [{"source": "plan-reserve", "dest": n, "feeBps": 20} for n in names]
+        + [{"source": names[0], "dest": names[1], "feeBps": 1, "capacity": 50}],
+    }
+    r = client.post("/api/liquidity/plan", json=body)
+    assert r.status_code == 200
+    plan = r.json()
+    by_pool = {p["pool"]: p for p in plan["pools"]}
+    for n in names:
+        assert by_pool[n]["predictedNetFlow"] == pytest.approx(flows[n], abs=0.01)
+        assert by_pool[n]["projected"] == pytest.approx(2000 + flows[n], abs=0.01)
+        assert by_pool[n]["unmet"] == 0
+    assert by_pool["plan-op-1"]["deficit"] > 0 and by_pool["plan-op-3"]["deficit"] > 0
+    inbound = {n: 0.0 for n in names}
+    for tr in plan["transfers"]:
+        inbound[tr["destPool"]] += tr["amount"]
+        if tr["sourcePool"] in inbound:
+            inbound[tr["sourcePool"]] -= tr["amount"]
+    for n in names:
+        assert inbound[n] == pytest.approx(by_pool[n]["deficit"], abs=0.01)
+    assert all(tr["asset"] == "USDC" and tr["fee"] >= 0 for tr in plan["transfers"])
+
+    body["routes"] = [{"source": "plan-reserve", "dest": "elsewhere", "feeBps": 1}]
+    r = client.post("/api/liquidity/plan", json=body)
+    assert r.status_code == 400 and "unknown pool" in r.json()["detail"]
+
+
+def test_planner_defaults_to_the_pool_engine(monkeypatch, pool_lease):
+    pools = PoolEngine()
+    monkeypatch.setattr("app.services.rebalance_plan.get_pool_engine", lambda: pools)
+    try:
+        r = client.post("/api/liquidity/plan", json={})
+        assert r.status_code == 400 and "no pools" in r.json()["detail"]
+        pools.credit("plan-engine-a", 5000)
+        pools.credit("plan-engine-b", 10)
+        pools.reserve("plan-engine-a", 4000, "held")  # reserved liquidity is not free
+        plan = asyncio.run(RebalancePlanner().plan("24h", min_balance=900))
+    finally:
+        with get_session() as session:
+            session.execute(delete(PoolJournalEntry))
+            session.execute(delete(LiquidityPoolRecord))
+    a, b = plan["pools"]
+    assert (a["pool"], a["balance"], b["balance"]) == ("plan-engine-a", 1000.0, 10.0)
+    assert plan["window"] == "24h"
+
+
+def test_default_plan_forecasts_each_pool_from_its_ledger_flows(pool_lease):
+    pools = PoolEngine()
+    flows = FlowStore(history_hours=48)
+    cache = ForecastCache(cache=AsyncCache(url=None, store=MemoryStore()))
+    forecast = ForecastService(cache=cache, flows=flows, model="persistence")
+    try:
+        pools.credit("PLANTOK", 100, asset="USDC")
+        pools.credit("plan-float", 50_000)
+        pools.credit("PLANTOK-RESERVE", 900, asset="USDC")
+        # A conversion drains the token pool and fills the operator float, as booked
+        flows.record_transactions([LedgerTransaction("plan-flow-1", [
+            Posting("clearing:mpesa", "LOCAL", -3_000_000),
+            Posting("pool:plan-float", "LOCAL", 3_000_000),
+            Posting("pool:PLANTOK", "USDC", -250_000_000),
+            Posting("wallet:plan-user", "USDC", 250_000_000),
+        ])])
+        plan = asyncio.run(RebalancePlanner(pools=pools, forecast=forecast).plan(
+            "1h", routes=[{"source": "PLANTOK-RESERVE", "dest": "PLANTOK", "feeBps": 5}]
+        ))
+    finally:
+        with get_session() as session:
+            session.execute(delete(PoolJournalEntry))
+            session.execute(delete(LiquidityPoolRecord))
+    by_pool = {p["pool"]: p for p in plan["pools"]}
+    assert by_pool["PLANTOK"]["predictedNetFlow"] == -250.0
+    assert by_pool["PLANTOK"]["deficit"] == 150.0
+    assert by_pool["plan-float"]["predictedNetFlow"] == 30_000.0
+    assert by_pool["PLANTOK-RESERVE"]["predictedNetFlow"] == 0.0
+    assert [(t["sourcePool"], t["destPool"], t["amount"]) for t in plan["transfers"]] == [
+        ("PLANTOK-RESERVE", "PLANTOK", 150.0)
+    ]
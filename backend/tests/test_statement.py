@@ -0,0 +1,78 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+from fastapi.testclient import TestClient
+
+from app.core.db import SessionLocal
+from app.main import app
+from app.models.db_models import User
+from app.services.statement import decode_cursor, encode_cursor
+from app.services.wallet import WalletService
+
+client = TestClient(app)
+
+
+def _seed(phone: str, n: int) -> tuple[int, list[str]]:
+    """A registered user's wallet id and the tx ids of its n conversions."""
+    with SessionLocal() as s:
+        user = User(phone=phone, pin_hash="x")
+        s.add(user)
+        s.commit()
+        user_id = str(user.id)
+    w = WalletService()
+    tx_ids = [
+        w.convert(user_id, "m-pesa", "safaricom", 100.0 + i, "USDC", None, "fast")
+        for i in range(n)
+    ]
+    return w.wallet_id(user_id), tx_ids
+
+
+def test_keyset_pages_walk_full_history_newest_first():
+    wallet_id, tx_ids = _seed("+254700100001", 7)
+    # Unregistered callers' conversions land on no wallet's statement
+    WalletService().convert("stmt-guest", "m-pesa", "safaricom", 5.0, "USDC", None, "fast")
+    url = f"/api/wallets/{wallet_id}/statement"
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        r = client.get(url, params=params)
+        assert r.status_code == 200
+        data = r.json()
+        assert data["walletId"] == wallet_id
+        seen.extend(e["txId"] for e in data["entries"])
+        cursor = data["nextCursor"]
+        if cursor is None:
+            break
+    assert seen == list(reversed(tx_ids))
+    first = client.get(url, params={"limit": 1}).json()
+    assert first["entries"][0]["asset"] == "USDC"
+    assert first["entries"][0]["amountMinor"] > 0
+
+
+def test_statement_bad_cursor_and_empty_wallet():
+    r = client.get("/api/wallets/1/statement", params={"cursor": "not-a-cursor"})
+    assert r.status_code == 400
+    r = client.get("/api/wallets/987654/statement")
+    assert r.json() == {"walletId": 987654, "entries": [], "nextCursor": None}
+    assert client.get("/api/wallets/not-an-id/statement").status_code == 422
+
+
+def test_streaming_exports():
+    wallet_id, tx_ids = _seed("+254700100002", 3)
+    r = client.get(f"/api/wallets/{wallet_id}/statement", params={"format": "ndjson"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert [e["txId"] for e in lines] == tx_ids  # oldest first
+
+    r = client.get(f"/api/wallets/{wallet_id}/statement", params={"format": "csv"})
+    assert r.headers["content-disposition"].endswith(f'"{wallet_id}-statement.csv"')
+    rows = list(csv.DictReader(io.StringIO(r.text)))
+    assert [row["txId"] for row in rows] == tx_ids
+
+
+def test_cursor_round_trip():
+    ts = datetime(2026, 1, 2, 3, 4, 5, 678, tzinfo=timezone.utc)
+    assert decode_cursor(encode_cursor(ts, 42)) == (ts, 42)
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+from app.core.cache import AsyncCache, MemoryStore
+from app.main import app
+from app.services.flows import FlowStore
+from app.services.forecast import WINDOWS, ForecastService
+from app.services.summaries import LEADER_KEY, SummaryScheduler, get_summary_scheduler
+
+client = TestClient(app)
+
+
+def _scheduler(interval: float, **kw) -> SummaryScheduler:
+    return SummaryScheduler(
+        interval=interval, flows=FlowStore(), cache=AsyncCache(url=None, store=MemoryStore()), **kw
+    )
+
+
+def test_cycle_refreshes_every_operator_and_window_staggered(monkeypatch):
+    scheduler = _scheduler(0.6)
+    scheduler.flows.record_many(["sum-a", "sum-b"], [10_000, -2_500])
+    started: list[float] = []
+    original = ForecastService.operator_summary
+
+    async def summary(self, operator, window="4h", refresh=False):
+        assert refresh  # the scheduler never serves itself a cached summary
+        started.append(time.monotonic())
+        if operator == "sum-b" and window == "24h":
+            raise RuntimeError("model down")
+        return await original(self, operator, window, refresh)
+
+    monkeypatch.setattr(ForecastService, "operator_summary", summary)
+
+    async def run():
+        done = await scheduler.run_cycle()
+        return done, [await scheduler.get(op, w) for op in ("sum-a", "sum-b") for w in WINDOWS]
+
+    done, stored = asyncio.run(run())
+    assert done == 5  # the failing cell is logged and skipped
+    gaps = [b - a for a, b in zip(started, started[1:])]
+    assert len(started) == 6 and min(gaps) >= 0.09  # 0.6s spread over 6 cells, not a burst
+    assert stored[-1] is None
+    summary_a, computed_at = stored[0]
+    assert "sum-a" in summary_a and abs(computed_at - time.time()) < 5
+    assert asyncio.run(_scheduler(1).run_cycle()) == 0  # no operators yet
+
+
+def test_route_serves_precomputed_summaries_with_their_age():
+    scheduler = get_summary_scheduler()
+    now = time.time()
+    entry = json.dumps({"summary": "precomputed", "computedAt": now - 42})
+    asyncio.run(scheduler.cache.set(scheduler.key("sum-route", "1h"), entry))
+    r = client.get("/api/operators/sum-route/summary", params={"window": "1h"})
+    assert r.status_code == 200
+    assert r.json()["summary"] == "precomputed"
+    assert 42 <= int(r.headers["Age"]) <= 45
+
+    # Not reached by the scheduler yet: computed on the spot, then served from the cache
+    r = client.get("/api/operators/sum-fresh/summary", params={"window": "24h"})
+    assert r.status_code == 200 and r.headers["Age"] == "0"
+    assert asyncio.run(scheduler.get("sum-fresh", "24h"))[0] == r.json()["summary"]
+
+    r = client.get("/api/operators/sum-fresh/summary", params={"window": "2h"})
+    assert r.status_code == 400
+
+
+def test_scheduler_runs_in_the_app_lifespan():
+    scheduler = get_summary_scheduler()
+    with TestClient(app):
+        task = scheduler._task
+        assert task is not None and not task.done()
+        asyncio.run(scheduler.start())  # already running: no second loop
+        assert scheduler._task is task
+    assert scheduler._task is None and task.cancelled()
+    asyncio.run(scheduler.stop())  # stopping twice is harmless
+
+
+def test_loop_repeats_cycles_on_the_interval():
+    scheduler = _scheduler(0.05)
+    scheduler.flows.record("sum-loop", 1)
+    cycles = []
+
+    async def cycle():
+        cycles.append(time.monotonic())
+        return 0
+
+    scheduler.run_cycle = cycle
+
+    async def run():
+        await scheduler.start()
+        await asyncio.sleep(0.18)
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert 3 <= len(cycles) <= 5
+    assert all(b - a >= 0.04 for a, b in zip(cycles, cycles[1:]))
+
+
+def test_only_the_lease_holder_runs_cycles():
+    cache = AsyncCache(url=None, store=MemoryStore())
+    first, second = (SummaryScheduler(0.05, flows=FlowStore(), cache=cache) for _ in range(2))
+    cycles = {first: 0, second: 0}
+    for scheduler in cycles:
+
+        async def cycle(scheduler=scheduler):
+            cycles[scheduler] += 1
+            return 0
+
+        scheduler.run_cycle = cycle
+
+    async def run():
+        await first.start()
+        await asyncio.sleep(0.01)
+        await second.start()
+        await asyncio.sleep(0.2)
+        assert cycles[first] >= 3 and cycles[second] == 0
+        assert await cache.get(LEADER_KEY) == first.owner
+        await first.stop()  # releases the lease: the other takes over on its next turn
+        await asyncio.sleep(0.1)
+        assert cycles[second] >= 1
+        await second.stop()
+        assert await cache.get(LEADER_KEY) is None
+
+    asyncio.run(run())
+
+
+def test_cycles_are_skipped_while_the_lease_cannot_be_checked(caplog):
+    class Down(AsyncCache):
+        async def expire_if(self, key, value, ex):
+            raise ConnectionError("cache down")
+
+        async def delete_if(self, key, value):
+            raise ConnectionError("cache down")
+
+    scheduler = _scheduler(0.02)
+    scheduler._cache = Down(url=None, store=MemoryStore())
+
+    async def cycle():
+        raise AssertionError("ran without the lease")
+
+    scheduler.run_cycle = cycle
+
+    async def run():
+        assert not await scheduler.lead()
+        await scheduler.start()
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert "lease unavailable" in caplog.text and "lease release failed" in caplog.text
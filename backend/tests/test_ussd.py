@@ -0,0 +1,104 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.cache import AsyncCache
+from app.main import app
+from app.services.ussd import MENU, USSDService, compile_menu, get_ussd_menu
+
+client = TestClient(app)
+
+
+def _session() -> str:
+    return f"ATUid_{uuid.uuid4().hex[:12]}"
+
+
+def _hops(service: USSDService, session_id: str, inputs, phone: str = "+254700000001"):
+    async def run():
+        return [await service.hop(session_id, phone, text) for text in inputs]
+
+    return asyncio.run(run())
+
+
+def test_convert_flow_collects_the_amount_and_ends_with_an_action():
+    service = USSDService(cache=AsyncCache())
+    sid = _session()
+    dial, choice, amount, done = _hops(service, sid, ["", "1", "500", "1"])
+    assert dial.state == "start" and dial.prompt.startswith("Welcome to JuaPesa")
+    assert (choice.state, amount.state) == ("convert_amount", "convert_confirm")
+    assert amount.prompt.startswith("Convert KES 500 to USDC?")
+    assert done.end and done.actions == ["convert"] and done.data == {"amount": "500"}
+    # An ended session is forgotten: the same id starts over
+    (again,) = _hops(service, sid, [""])
+    assert again.state == "start" and again.data == {}
+
+
+def test_invalid_inputs_repeat_the_screen():
+    service = USSDService(cache=AsyncCache())
+    sid = _session()
+    bad_choice, _, bad_phone, phone, bad_amount, amount, done = _hops(
+        service, sid, ["9", "2", "12345", "0722000001", "5", "250", "1"]
+    )
+    assert bad_choice.state == "start" and bad_choice.prompt.startswith("Invalid choice.\n")
+    assert bad_phone.state == "send_phone" and bad_phone.prompt.startswith("Invalid number.")
+    assert phone.state == "send_amount"
+    assert bad_amount.prompt.startswith("Invalid amount.")
+    assert amount.prompt == "Send KES 250 to 254722000001?\n1. Confirm\n2. Cancel"
+    assert done.actions == ["debit", "confirm"]
+    assert done.data == {"phone": "254722000001", "amount": "250"}
+
+
+def test_sessions_expire_and_are_bound_to_the_phone():
+    cache = AsyncCache()
+    service = USSDService(cache=cache, ttl=60)
+    sid = _session()
+
+    async def run():
+        await service.hop(sid, "+254700000001", "1")
+        hijack = await service.hop(sid, "+254799999999", "")  # another phone, same id
+        await cache.delete(f"ussd:{sid}")  # expired
+        fresh = await service.hop(sid, "+254700000001", "500")
+        cancelled = [await service.hop(sid, "+254700000001", t) for t in ("1", "500", "2")]
+        return hijack, fresh, cancelled
+
+    hijack, fresh, cancelled = asyncio.run(run())
+    assert hijack.state == "start"
+    assert fresh.state == "start" and fresh.prompt.startswith("Invalid choice.")
+    assert cancelled[-1].state == "start" and not cancelled[-1].end
+
+
+def test_menu_is_compiled_into_an_index_table():
+    menu = get_ussd_menu()
+    assert menu is get_ussd_menu()  # compiled once
+    assert menu[0].name == "start"
+    names = [n.name for n in menu]
+    assert names[menu[0].options["1"]] == "convert_amount"
+    assert all(n.templated == ("{" in n.prompt) for n in menu)
+
+    with pytest.raises(ValueError, match="no 'start' node"):
+        compile_menu({"home": {"prompt": "x", "end": True}})
+    with pytest.raises(ValueError, match="unknown node 'nowhere'"):
+        compile_menu({**MENU, "start": {"prompt": "x", "options": {"1": "nowhere"}}})
+    with pytest.raises(ValueError, match="unknown input 'pin'"):
+        compile_menu({"start": {"prompt": "PIN:", "input": "pin", "next": "start"}})
+    with pytest.raises(ValueError, match="no way forward"):
+        compile_menu({"start": {"prompt": "stuck"}})
+
+
+def test_ussd_route_drives_a_session():
+    sid = _session()
+    body = {"sessionId": sid, "phone": "+254700000002"}
+    screens = [
+        client.post("/api/ussd/session", json={**body, "input": text}).json()
+        for text in ("", "3")
+    ]
+    assert screens[0]["nextMenuState"] == "start" and not screens[0]["end"]
+    assert screens[1] == {
+        "prompt": "Your balance will be sent by SMS.",
+        "nextMenuState": "balance",
+        "actions": [],
+        "end": True,
+        "data": {},
+    }
@@ -1,4 +1,12 @@
-from app.utils.ids import new_tx_id
+import os
+import threading
+import time
+
+import pytest
+
+from app.core.cache import Cache
+from app.utils import ids
+from app.utils.ids import SnowflakeGenerator, WorkerLease, new_tx_id, new_tx_ids, parse_tx_id
 
 
 def test_new_tx_id_format_and_uniqueness():
@@ -6,3 +14,148 @@ def test_new_tx_id_format_and_uniqueness():
     b = new_tx_id(prefix="x")
     assert a != b
     assert a.startswith("x-")
+
+
+def test_ids_are_fixed_width_and_sort_in_allocation_order():
+    batch = new_tx_ids(10_000, prefix="cv")
+    assert len(set(batch)) == 10_000
+    assert batch == sorted(batch)
+    assert {len(x) for x in batch} == {len("cv-") + 13}
+    assert new_tx_id(prefix="cv") > batch[-1]
+
+
+def test_parse_round_trips_fields():
+    gen = SnowflakeGenerator(worker_id=1023, clock=lambda: 1_800_000_000.123)
+    value = gen.next_ints(3)[2]
+    tx_id = f"tx-{ids._encode(value)}"
+    assert parse_tx_id(tx_id) == (1_800_000_000_123, 1023, 2)
+
+
+def test_sequence_overflow_borrows_next_millisecond():
+    gen = SnowflakeGenerator(worker_id=7, clock=lambda: 1_800_000_000.0)
+    values = gen.next_ints(ids.MAX_SEQUENCE + 3)
+    assert values == sorted(values) and len(set(values)) == len(values)
+    codes = [ids._encode(v) for v in values[-2:]]
+    assert [parse_tx_id(c)[0] for c in codes] == [1_800_000_000_001] * 2
+    assert [parse_tx_id(c)[2] for c in codes] == [0, 1]
+
+
+def test_clock_going_backwards_stays_monotonic():
+    now = [1_800_000_000.5]
+    gen = SnowflakeGenerator(worker_id=3, clock=lambda: now[0])
+    first = gen.next_ints(1)[0]
+    now[0] -= 5
+    second = gen.next_ints(1)[0]
+    assert second > first
+
+
+def test_concurrent_threads_never_collide():
+    gen = SnowflakeGenerator(worker_id=0)
+    results: list[list[int]] = []
+
+    def worker():
+        results.append([v for _ in range(500) for v in gen.next_ints(4)])
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    flat = [v for r in results for v in r]
+    assert len(set(flat)) == len(flat) == 8 * 2000
+
+
+def test_worker_ids_partition_the_space():
+    def clock():
+        return 1_800_000_000.0
+
+    a = SnowflakeGenerator(worker_id=1, clock=clock).next_ints(100)
+    b = SnowflakeGenerator(worker_id=2, clock=clock).next_ints(100)
+    assert not set(a) & set(b)
+
+
+def test_worker_id_validation_and_reseed(monkeypatch):
+    with pytest.raises(ValueError):
+        SnowflakeGenerator(worker_id=ids.MAX_WORKER + 1)
+    pinned = SnowflakeGenerator(worker_id=5)
+    pinned.reseed_worker()
+    assert pinned.worker_id == 5
+
+    cache = Cache(url=None)
+    parent = leased(cache, preferred=5)
+    parent.next_int()
+    parent.reseed_worker()  # as in a forked child: the parent still holds 5
+    assert parent.worker_id is None
+    parent.next_int()
+    assert parent.worker_id == 6
+
+    derived = SnowflakeGenerator()
+    derived.next_ints(1)
+    pid = os.getpid()
+    monkeypatch.setattr(ids.os, "getpid", lambda: pid + 1)
+    derived.reseed_worker()
+    assert derived.worker_id == ids._derived_worker_id()
+    assert derived._last_ms == -1
+
+
+class Ticker:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def leased(cache, preferred=None, ticker=None, clock=time.time):
+    lease = WorkerLease(preferred, ttl=60, cache_getter=lambda: cache, clock=ticker or Ticker())
+    return SnowflakeGenerator(clock=clock, lease=lease)
+
+
+def test_processes_sharing_worker_id_lease_distinct_ids():
+    cache = Cache(url=None)
+    gens = [leased(cache, preferred=1023) for _ in range(3)]
+    values = [g.next_ints(100) for g in gens]
+    assert [g.worker_id for g in gens] == [1023, 0, 1]
+    assert len({v for vs in values for v in vs}) == 300
+    assert cache.get(WorkerLease.key(1023)) is not None
+
+    with pytest.raises(ValueError):
+        leased(cache, preferred=ids.MAX_WORKER + 1)
+
+
+def test_lease_renews_and_reclaims_when_lost():
+    cache, ticker = Cache(url=None), Ticker()
+    gen = leased(cache, preferred=9, ticker=ticker, clock=lambda: 1_800_000_000.0)
+    first = gen.next_int()
+    token = cache.get(WorkerLease.key(9))
+    ticker.now = 25  # past ttl/3: renewed in place
+    gen.next_int()
+    assert gen.worker_id == 9 and gen.lease.renew_at == 45
+
+    cache.set(WorkerLease.key(9), "someone-else")  # expired during a stall, re-claimed
+    ticker.now = 50
+    after = gen.next_int()
+    assert gen.worker_id == 10 and cache.get(WorkerLease.key(10)) != token
+    assert after > first  # moved to the next millisecond, so still monotonic
+    assert parse_tx_id(f"tx-{ids._encode(after)}")[0] == 1_800_000_000_001
+
+
+def test_lease_exhaustion_and_unreachable_cache():
+    cache = Cache(url=None)
+    for n in range(ids.MAX_WORKER + 1):
+        cache.add(WorkerLease.key(n), "taken")
+    with pytest.raises(RuntimeError):
+        leased(cache).next_int()
+
+    class Down:
+        def add(self, *a, **kw):
+            raise ConnectionError("redis down")
+
+        expire_if = add
+
+    ticker = Ticker()
+    gen = leased(Down(), preferred=4, ticker=ticker)
+    gen.next_int()
+    assert gen.worker_id == 4 and not gen.lease.renew()  # unleased: retried when due
+    gen.lease._token = "t"
+    assert gen.lease.renew()  # renewal errors keep the current id